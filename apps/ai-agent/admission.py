@@ -0,0 +1,476 @@
+"""
+Quota-aware admission control for upstream API calls.
+
+Vertex AI, Speech-to-Text and Text-to-Speech enforce per-minute quotas per
+project. Each upstream (a Gemini model or a Cloud API) gets a token bucket
+refilled at its configured rate, and every call takes a token before it goes
+out. When the bucket is empty the call waits for the next token, or fails
+fast with a Retry-After hint if that wait would be too long. Bucket state can
+live in a SQLite file so every worker process on a host draws from the same
+budget.
+
+Retryable upstream errors (429 and 5xx) are retried with jittered
+exponential backoff. An upstream 429 also empties the bucket, so the other
+workers back off too. Batch traffic may not take a bucket's last tokens;
+that reserve keeps interactive chat responsive while a focus group runs.
+"""
+
+import asyncio
+import logging
+import math
+import random
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_BATCH)
+
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+# gRPC status names for errors that surface without an HTTP status
+GRPC_STATUS_CODES = {
+    "RESOURCE_EXHAUSTED": 429,
+    "INTERNAL": 500,
+    "UNAVAILABLE": 503,
+    "DEADLINE_EXCEEDED": 504,
+}
+
+
+class QuotaExceededError(Exception):
+    """
+    Raised when a call cannot be admitted within its wait budget, or the
+    upstream kept rejecting it for quota.
+
+    Args:
+        bucket: Name of the exhausted bucket
+        retry_after: Suggested number of seconds before the client retries
+    """
+
+    def __init__(self, bucket: str, retry_after: int):
+        super().__init__(f"Quota for {bucket} exhausted, retry after {retry_after}s")
+        self.bucket = bucket
+        self.retry_after = retry_after
+
+
+def error_status(error: BaseException) -> Optional[int]:
+    """
+    Extracts an HTTP-style status from an upstream exception.
+
+    Understands google.api_core exceptions (integer 'code'), gRPC errors
+    (a 'code()' method returning a StatusCode) and anything else exposing a
+    'code' attribute.
+
+    Args:
+        error: The exception raised by the upstream call
+
+    Returns:
+        The status code, or None if the error carries none
+    """
+    code = getattr(error, "code", None)
+    if callable(code):
+        try:
+            code = code()
+        except Exception:
+            return None
+    if isinstance(code, int):
+        return int(code)
+    return GRPC_STATUS_CODES.get(getattr(code, "name", None))
+
+
+@dataclass
+class BucketLimit:
+    """
+    Refill rate and size of one token bucket.
+
+    Args:
+        rate: Tokens added per second
+        capacity: Maximum tokens the bucket holds (the allowed burst)
+    """
+    rate: float
+    capacity: float
+
+    @classmethod
+    def per_minute(cls, requests_per_minute: float, burst_seconds: float) -> "BucketLimit":
+        """
+        Builds a limit from a per-minute quota.
+
+        Args:
+            requests_per_minute: Sustained requests allowed per minute
+            burst_seconds: Seconds of quota that may be spent at once
+
+        Returns:
+            BucketLimit with a capacity of at least one token
+        """
+        rate = requests_per_minute / 60.0
+        return cls(rate=rate, capacity=max(1.0, rate * burst_seconds))
+
+
+def parse_limits(spec: Optional[str], burst_seconds: float) -> Dict[str, BucketLimit]:
+    """
+    Parses per-minute limits such as 'gemini-2.5-pro=60,speech=300,tts=300'.
+
+    Args:
+        spec: Comma-separated bucket=requests_per_minute pairs, if any
+        burst_seconds: Seconds of quota each bucket may spend at once
+
+    Returns:
+        Limits keyed by bucket name
+
+    Raises:
+        ValueError: If an entry is malformed or not positive
+    """
+    limits = {}
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        name, _, value = item.partition("=")
+        try:
+            requests_per_minute = float(value)
+        except ValueError:
+            raise ValueError(f"Invalid quota limit '{item.strip()}'") from None
+        if not name.strip() or requests_per_minute <= 0:
+            raise ValueError(f"Invalid quota limit '{item.strip()}'")
+        limits[name.strip()] = BucketLimit.per_minute(requests_per_minute, burst_seconds)
+    return limits
+
+
+def refill(tokens: float, updated_at: float, now: float, limit: BucketLimit) -> float:
+    """Tokens in a bucket after refilling it from updated_at to now."""
+    return min(limit.capacity, tokens + max(0.0, now - updated_at) * limit.rate)
+
+
+def take_tokens(tokens: float, cost: float, floor: float, limit: BucketLimit) -> Tuple[float, float]:
+    """
+    Takes cost tokens if at least floor tokens would remain.
+
+    Returns:
+        Tuple of (tokens left, seconds to wait before retrying; 0 if taken)
+    """
+    if tokens - cost >= floor:
+        return tokens - cost, 0.0
+    return tokens, (cost + floor - tokens) / limit.rate
+
+
+class BucketStore:
+    """Interface for token bucket state; take() and drain() must be atomic."""
+
+    backend = "base"
+
+    def take(self, name: str, limit: BucketLimit, cost: float, floor: float) -> float:
+        """
+        Refills the bucket and takes cost tokens if floor tokens would remain.
+
+        Args:
+            name: Bucket name
+            limit: The bucket's rate and capacity
+            cost: Tokens the call needs
+            floor: Tokens that must be left in the bucket afterwards
+
+        Returns:
+            0 if the tokens were taken, else seconds until they could be
+        """
+        raise NotImplementedError
+
+    def drain(self, name: str, limit: BucketLimit) -> None:
+        """Empties the bucket, e.g. after the upstream answered 429."""
+        raise NotImplementedError
+
+    def tokens(self, name: str, limit: BucketLimit) -> float:
+        """Tokens currently available in the bucket."""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {"backend": self.backend}
+
+
+class MemoryBucketStore(BucketStore):
+    """Buckets kept in this process; limits are per worker."""
+
+    backend = "memory"
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def _current(self, name: str, limit: BucketLimit, now: float) -> float:
+        tokens, updated_at = self._buckets.get(name, (limit.capacity, now))
+        return refill(tokens, updated_at, now, limit)
+
+    def take(self, name: str, limit: BucketLimit, cost: float, floor: float) -> float:
+        with self._lock:
+            now = time.time()
+            tokens, wait = take_tokens(self._current(name, limit, now), cost, floor, limit)
+            self._buckets[name] = (tokens, now)
+            return wait
+
+    def drain(self, name: str, limit: BucketLimit) -> None:
+        with self._lock:
+            self._buckets[name] = (0.0, time.time())
+
+    def tokens(self, name: str, limit: BucketLimit) -> float:
+        with self._lock:
+            return self._current(name, limit, time.time())
+
+
+class SQLiteBucketStore(BucketStore):
+    """
+    SQLite-backed buckets shared by worker processes on one host.
+
+    Each take() is a single IMMEDIATE transaction, so concurrent workers
+    never spend the same token twice.
+
+    Args:
+        path: Database file path
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per worker thread; sqlite3 connections aren't thread-safe
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode so transactions are opened explicitly with BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _update(self, name: str, limit: BucketLimit, change: Callable[[float], Tuple[float, float]]) -> float:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE name = ?", (name,)).fetchone()
+            tokens = refill(row[0], row[1], now, limit) if row else limit.capacity
+            tokens, result = change(tokens)
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                (name, tokens, now)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+    def take(self, name: str, limit: BucketLimit, cost: float, floor: float) -> float:
+        return self._update(name, limit, lambda tokens: take_tokens(tokens, cost, floor, limit))
+
+    def drain(self, name: str, limit: BucketLimit) -> None:
+        self._update(name, limit, lambda tokens: (0.0, 0.0))
+
+    def tokens(self, name: str, limit: BucketLimit) -> float:
+        row = self._connect().execute(
+            "SELECT tokens, updated_at FROM buckets WHERE name = ?", (name,)
+        ).fetchone()
+        return refill(row[0], row[1], time.time(), limit) if row else limit.capacity
+
+    def stats(self) -> dict:
+        return dict(super().stats(), path=self.path)
+
+
+class AdmissionController:
+    """
+    Admits upstream calls against token buckets and retries transient failures.
+
+    Buckets without a configured limit admit every call; their calls still
+    get retries.
+
+    Args:
+        store: Where bucket state is kept
+        limits: Limits keyed by bucket name
+        max_wait: Longest an interactive call waits for a token, in seconds
+        batch_max_wait: Longest a batch call waits for a token, in seconds
+        batch_reserve: Fraction of each bucket that batch calls may not spend
+        max_attempts: Attempts per call, including the first
+        backoff_base: Backoff ceiling for the first retry, in seconds
+        backoff_cap: Largest backoff ceiling, in seconds
+        observer: Optional callback invoked with (bucket, event) for metrics
+        rng: Random source for backoff jitter
+    """
+
+    def __init__(
+        self,
+        store: BucketStore,
+        limits: Dict[str, BucketLimit],
+        max_wait: float = 10.0,
+        batch_max_wait: float = 120.0,
+        batch_reserve: float = 0.2,
+        max_attempts: int = 4,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 8.0,
+        observer: Optional[Callable[[str, str], None]] = None,
+        rng: Optional[random.Random] = None
+    ):
+        if not 0 <= batch_reserve < 1:
+            raise ValueError("batch_reserve must be in [0, 1)")
+        self.store = store
+        self.limits = limits
+        self.max_wait = max_wait
+        self.batch_max_wait = batch_max_wait
+        self.batch_reserve = batch_reserve
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._observer = observer
+        self._rng = rng or random.Random()
+        self._stats: Dict[str, dict] = {}
+
+    def _record(self, bucket: str, event: str) -> None:
+        stats = self._stats.setdefault(bucket, {
+            "admitted": 0, "throttled": 0, "rejected": 0, "retries": 0, "upstream_429": 0,
+        })
+        stats[event] += 1
+        if self._observer is not None:
+            self._observer(bucket, event)
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Delay before retry number attempt + 1.
+
+        Uses "full jitter": a uniform draw up to an exponentially growing
+        ceiling, so workers that failed together do not retry together.
+
+        Args:
+            attempt: Zero-based index of the attempt that just failed
+
+        Returns:
+            Seconds to sleep
+        """
+        return self._rng.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    async def admit(self, bucket: str, priority: str = PRIORITY_INTERACTIVE, cost: float = 1.0) -> float:
+        """
+        Waits until the bucket can pay for a call.
+
+        Args:
+            bucket: Bucket name (e.g., a Gemini model name or 'speech')
+            priority: PRIORITY_INTERACTIVE or PRIORITY_BATCH
+            cost: Tokens the call needs
+
+        Returns:
+            Seconds spent waiting
+
+        Raises:
+            QuotaExceededError: If the wait would exceed the priority's budget
+        """
+        limit = self.limits.get(bucket)
+        if limit is None:
+            self._record(bucket, "admitted")
+            return 0.0
+
+        batch = priority == PRIORITY_BATCH
+        floor = min(limit.capacity * self.batch_reserve, limit.capacity - cost) if batch else 0.0
+        max_wait = self.batch_max_wait if batch else self.max_wait
+        started = time.monotonic()
+        throttled = False
+        while True:
+            wait = await asyncio.to_thread(self.store.take, bucket, limit, cost, floor)
+            waited = time.monotonic() - started
+            if wait <= 0:
+                self._record(bucket, "admitted")
+                return waited
+            if waited + wait > max_wait:
+                self._record(bucket, "rejected")
+                raise QuotaExceededError(bucket, max(1, math.ceil(wait)))
+            if not throttled:
+                throttled = True
+                self._record(bucket, "throttled")
+            # Spread wake-ups so waiters across workers don't race for one token
+            await asyncio.sleep(wait * self._rng.uniform(1.0, 1.2))
+
+    async def call(
+        self,
+        bucket: str,
+        function: Callable[[], Awaitable[Any]],
+        priority: str = PRIORITY_INTERACTIVE,
+        cost: float = 1.0
+    ) -> Any:
+        """
+        Admits and runs an upstream call, retrying retryable failures.
+
+        Every attempt is admitted separately, so retries are paid for from
+        the same bucket as first attempts.
+
+        Args:
+            bucket: Bucket name
+            function: Zero-argument coroutine function making the call
+            priority: PRIORITY_INTERACTIVE or PRIORITY_BATCH
+            cost: Tokens each attempt needs
+
+        Returns:
+            Whatever function returns
+
+        Raises:
+            QuotaExceededError: If admission timed out, or the upstream still
+                                answered 429 after the last attempt
+            Exception: The last error, if it was not retryable or attempts ran out
+        """
+        limit = self.limits.get(bucket)
+        attempt = 0
+        while True:
+            await self.admit(bucket, priority, cost)
+            try:
+                return await function()
+            except Exception as e:
+                status = error_status(e)
+                if status == 429:
+                    self._record(bucket, "upstream_429")
+                    if limit is not None:
+                        await asyncio.to_thread(self.store.drain, bucket, limit)
+                attempt += 1
+                if status not in RETRYABLE_STATUS_CODES or attempt >= self.max_attempts:
+                    if status == 429:
+                        retry_after = math.ceil(cost / limit.rate) if limit else self.backoff_cap
+                        raise QuotaExceededError(bucket, max(1, int(retry_after))) from e
+                    raise
+                delay = self.backoff(attempt - 1)
+                self._record(bucket, "retries")
+                logger.info(
+                    "Retrying %s call after %s (attempt %d/%d, backoff %.2fs)",
+                    bucket, status, attempt + 1, self.max_attempts, delay
+                )
+                await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        """
+        Snapshot of limits, available tokens and counters per bucket.
+
+        Returns:
+            Dictionary with the store backend and per-bucket details
+        """
+        buckets = {}
+        for name in sorted(set(self.limits) | set(self._stats)):
+            limit = self.limits.get(name)
+            details = dict(self._stats.get(name, {}))
+            if limit is not None:
+                details["requests_per_minute"] = round(limit.rate * 60, 2)
+                details["capacity"] = round(limit.capacity, 2)
+                try:
+                    details["tokens"] = round(self.store.tokens(name, limit), 2)
+                except sqlite3.Error as e:
+                    details["tokens"] = None
+                    logger.warning("Failed to read %s bucket: %s", name, e)
+            buckets[name] = details
+        return {
+            "store": self.store.stats(),
+            "max_attempts": self.max_attempts,
+            "batch_reserve": self.batch_reserve,
+            "buckets": buckets,
+        }
@@ -0,0 +1,261 @@
+"""
+Local audio header probe for Speech-to-Text.
+
+Reads just enough of a WebM/Matroska, Ogg, WAV, FLAC or MP3 file to learn
+its codec, sample rate and channel count, so the first recognize call can
+use the right RecognitionConfig instead of guessing and retrying.
+"""
+
+import logging
+import struct
+from dataclasses import dataclass
+from typing import Iterator, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+# Sample rates Speech-to-Text accepts for Opus audio
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+
+# Matroska element ids the probe needs
+MKV_SEGMENT = 0x18538067
+MKV_TRACKS = 0x1654AE6B
+MKV_TRACK_ENTRY = 0xAE
+MKV_CODEC_ID = 0x86
+MKV_AUDIO = 0xE1
+MKV_SAMPLING_FREQUENCY = 0xB5
+MKV_CHANNELS = 0x9F
+MKV_CLUSTER = 0x1F43B675
+
+MP3_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),  # MPEG-1
+    2: (22050, 24000, 16000),  # MPEG-2
+    0: (11025, 12000, 8000),   # MPEG-2.5
+}
+
+
+@dataclass
+class AudioFormat:
+    """
+    What the probe learned about an audio file.
+
+    Args:
+        container: 'webm', 'ogg', 'wav', 'flac', 'mp3' or 'unknown'
+        codec: Codec name (e.g., 'opus', 'pcm_s16le', 'mp3'), if known
+        encoding: Speech-to-Text AudioEncoding name, or None if unsupported/unknown
+        sample_rate: Sample rate in Hz, if known
+        channels: Channel count, if known
+    """
+    container: str = "unknown"
+    codec: Optional[str] = None
+    encoding: Optional[str] = None
+    sample_rate: Optional[int] = None
+    channels: Optional[int] = None
+
+    @property
+    def confident(self) -> bool:
+        """Whether a single recognize call with this format should succeed."""
+        if self.encoding in ("FLAC", "MP3"):
+            # Speech-to-Text reads these rates from the stream header
+            return True
+        return self.encoding is not None and self.sample_rate is not None
+
+
+def read_vint(data: bytes, pos: int, keep_marker: bool) -> Tuple[Optional[int], int]:
+    """Reads an EBML variable-length integer, returning (value, new position)."""
+    if pos >= len(data):
+        raise ValueError("truncated EBML data")
+    first = data[pos]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 8 or pos + length > len(data):
+        raise ValueError("invalid EBML length")
+    value = first if keep_marker else first & (mask - 1)
+    all_ones = (first & (mask - 1)) == mask - 1
+    for byte in data[pos + 1:pos + length]:
+        value = (value << 8) | byte
+        all_ones = all_ones and byte == 0xFF
+    if not keep_marker and all_ones:
+        # Unknown size, as written by live encoders such as MediaRecorder
+        return None, pos + length
+    return value, pos + length
+
+
+def ebml_elements(data: bytes, start: int, end: int) -> Iterator[Tuple[int, int, int]]:
+    """Yields (element id, payload start, payload end) for elements in data[start:end]."""
+    pos = start
+    while pos < end:
+        element_id, pos = read_vint(data, pos, keep_marker=True)
+        size, pos = read_vint(data, pos, keep_marker=False)
+        payload_end = end if size is None else min(pos + size, end)
+        yield element_id, pos, payload_end
+        pos = payload_end
+
+
+def _matroska_audio(data: bytes, start: int, end: int) -> dict:
+    """Reads the sample rate and channel count from a track's Audio element."""
+    audio = {}
+    for element_id, payload_start, payload_end in ebml_elements(data, start, end):
+        payload = data[payload_start:payload_end]
+        if element_id == MKV_SAMPLING_FREQUENCY and len(payload) in (4, 8):
+            audio["rate"] = struct.unpack(">f" if len(payload) == 4 else ">d", payload)[0]
+        elif element_id == MKV_CHANNELS:
+            audio["channels"] = int.from_bytes(payload, "big")
+    return audio
+
+
+def _matroska_track(data: bytes, start: int, end: int) -> Optional[dict]:
+    """Returns the settings of the first audio track in data[start:end], if any."""
+    for element_id, payload_start, payload_end in ebml_elements(data, start, end):
+        if element_id == MKV_CLUSTER:
+            # Media data starts here; the headers are over
+            return None
+        if element_id in (MKV_SEGMENT, MKV_TRACKS):
+            track = _matroska_track(data, payload_start, payload_end)
+            if track is not None:
+                return track
+        elif element_id == MKV_TRACK_ENTRY:
+            track = {}
+            for child_id, child_start, child_end in ebml_elements(data, payload_start, payload_end):
+                if child_id == MKV_CODEC_ID:
+                    track["codec"] = data[child_start:child_end].rstrip(b"\0").decode("ascii", "replace")
+                elif child_id == MKV_AUDIO:
+                    track.update(_matroska_audio(data, child_start, child_end))
+            if track.get("codec", "").startswith("A_"):
+                return track
+    return None
+
+
+def _probe_matroska(data: bytes) -> AudioFormat:
+    result = AudioFormat(container="webm")
+    track = _matroska_track(data, 0, len(data))
+    if track is None:
+        return result
+    result.codec = track["codec"][2:].lower()
+    result.sample_rate = int(track["rate"]) if track.get("rate") else None
+    result.channels = track.get("channels")
+    if track["codec"] == "A_OPUS":
+        result.encoding = "WEBM_OPUS"
+        if result.sample_rate not in OPUS_SAMPLE_RATES:
+            result.sample_rate = None
+    return result
+
+
+def _probe_ogg(data: bytes) -> AudioFormat:
+    result = AudioFormat(container="ogg")
+    if len(data) < 27:
+        return result
+    segments = data[26]
+    payload = data[27 + segments:]
+    if payload.startswith(b"OpusHead") and len(payload) >= 16:
+        channels = payload[9]
+        input_rate = struct.unpack_from("<I", payload, 12)[0]
+        result.codec = "opus"
+        result.encoding = "OGG_OPUS"
+        result.channels = channels
+        # Opus always decodes at 48kHz; the header only records the source rate
+        result.sample_rate = input_rate if input_rate in OPUS_SAMPLE_RATES else 48000
+    elif payload.startswith(b"\x7fFLAC"):
+        result.codec = "flac"
+        result.encoding = "FLAC"
+    elif payload.startswith(b"\x01vorbis") and len(payload) >= 16:
+        # Vorbis is not supported by Speech-to-Text; report what it is anyway
+        result.codec = "vorbis"
+        result.channels = payload[11]
+        result.sample_rate = struct.unpack_from("<I", payload, 12)[0]
+    return result
+
+
+def _probe_wav(data: bytes) -> AudioFormat:
+    result = AudioFormat(container="wav")
+    pos = 12
+    while pos + 8 <= len(data):
+        chunk_id = data[pos:pos + 4]
+        chunk_size = struct.unpack_from("<I", data, pos + 4)[0]
+        if chunk_id == b"fmt " and pos + 24 <= len(data):
+            audio_format, channels, sample_rate = struct.unpack_from("<HHI", data, pos + 8)
+            bits = struct.unpack_from("<H", data, pos + 22)[0]
+            result.channels = channels
+            result.sample_rate = sample_rate
+            if audio_format == 0xFFFE and pos + 34 <= len(data):
+                # WAVE_FORMAT_EXTENSIBLE: the real format leads the sub-format GUID
+                audio_format = struct.unpack_from("<H", data, pos + 32)[0]
+            if audio_format == 1 and bits == 16:
+                result.codec = "pcm_s16le"
+                result.encoding = "LINEAR16"
+            elif audio_format == 7:
+                result.codec = "mulaw"
+                result.encoding = "MULAW"
+            else:
+                result.codec = f"wav_format_{audio_format}_{bits}bit"
+            return result
+        pos += 8 + chunk_size + (chunk_size & 1)
+    return result
+
+
+def _probe_flac(data: bytes) -> AudioFormat:
+    result = AudioFormat(container="flac", codec="flac", encoding="FLAC")
+    # STREAMINFO follows the 4-byte marker and 4-byte block header
+    if len(data) >= 8 + 18:
+        info = int.from_bytes(data[18:21], "big")
+        result.sample_rate = info >> 4
+        result.channels = ((info & 0x0E) >> 1) + 1
+    return result
+
+
+def _probe_mp3(data: bytes) -> AudioFormat:
+    result = AudioFormat(container="mp3")
+    pos = 0
+    if data.startswith(b"ID3") and len(data) >= 10:
+        # Skip the ID3v2 tag; its size is a 28-bit syncsafe integer
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        pos = 10 + size
+    # Look for the first frame header within the next few KB
+    limit = min(len(data) - 4, pos + 4096)
+    while pos <= limit:
+        if data[pos] == 0xFF and data[pos + 1] & 0xE0 == 0xE0:
+            version = (data[pos + 1] >> 3) & 0x03
+            layer = (data[pos + 1] >> 1) & 0x03
+            rate_index = (data[pos + 2] >> 2) & 0x03
+            if version in MP3_SAMPLE_RATES and layer == 1 and rate_index < 3:
+                result.codec = "mp3"
+                result.encoding = "MP3"
+                result.sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+                result.channels = 1 if (data[pos + 3] >> 6) == 3 else 2
+                return result
+        pos += 1
+    return result
+
+
+def probe_audio(data: bytes) -> AudioFormat:
+    """
+    Identifies the codec, sample rate and channel count of an audio file.
+
+    Only the headers are parsed; malformed or unrecognised files return an
+    AudioFormat whose confident property is False.
+
+    Args:
+        data: Audio file bytes (the first 64KB is enough)
+
+    Returns:
+        AudioFormat describing the file
+    """
+    head = data[:65536]
+    try:
+        if head.startswith(b"\x1a\x45\xdf\xa3"):
+            return _probe_matroska(head)
+        if head.startswith(b"OggS"):
+            return _probe_ogg(head)
+        if head.startswith(b"RIFF") and head[8:12] == b"WAVE":
+            return _probe_wav(head)
+        if head.startswith(b"fLaC"):
+            return _probe_flac(head)
+        if head.startswith(b"ID3") or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+            return _probe_mp3(head)
+    except (ValueError, struct.error, IndexError) as e:
+        logger.info("Audio probe failed: %s", e)
+    return AudioFormat()
@@ -0,0 +1,471 @@
+"""
+In-process stand-ins for Gemini, Speech-to-Text, Text-to-Speech and Cloud Storage.
+
+Each fake exposes the subset of its client's interface that the service
+calls and waits for a latency drawn from a configurable distribution,
+failing at a configurable rate, so the whole API can be load tested
+offline without spending quota. Select them with BACKENDS=fake.
+"""
+
+import asyncio
+import io
+import math
+import random
+import threading
+import time
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, List, Mapping, Optional, Tuple
+
+
+# z-score of the 95th percentile of a standard normal distribution
+Z_95 = 1.6449
+
+# Words the fake model strings together into replies
+REPLY_WORDS = (
+    "honestly the design catches my eye but I would want to know more about the price "
+    "and whether it lasts my friends would probably ask where I got it which matters to me "
+    "I usually compare a few options online before I decide and reviews make a big difference"
+).split()
+
+# MPEG-1 Layer III frame header (128kbps, 44.1kHz) so fake audio probes as MP3
+MP3_FRAME_HEADER = b"\xff\xfb\x90\x64"
+
+
+class FakeBackendError(Exception):
+    """
+    Simulated upstream failure raised according to a profile's failure rate.
+
+    Carries a 503 status, like a transient Google API error, so it takes the
+    same retry path as a real one.
+    """
+
+    code = 503
+
+
+@dataclass
+class LatencyProfile:
+    """
+    Latency distribution and failure rate of a fake backend.
+
+    Latencies are log-normal, the usual shape for network services: most
+    calls land near the median with a long tail towards p95 and beyond.
+
+    Args:
+        median_ms: Median latency in milliseconds
+        p95_ms: 95th percentile latency in milliseconds (>= median_ms)
+        failure_rate: Fraction of calls that raise FakeBackendError (0-1)
+    """
+    median_ms: float = 50.0
+    p95_ms: float = 150.0
+    failure_rate: float = 0.0
+
+    @classmethod
+    def parse(cls, spec: Optional[str], default: "LatencyProfile") -> "LatencyProfile":
+        """
+        Parses a profile such as 'median_ms=800,p95_ms=2500,failure_rate=0.01'.
+
+        Args:
+            spec: Comma-separated key=value settings; missing keys keep the default
+            default: Profile to start from
+
+        Returns:
+            The resulting LatencyProfile
+
+        Raises:
+            ValueError: If a key is unknown or a value is not a number
+        """
+        values = {
+            "median_ms": default.median_ms,
+            "p95_ms": default.p95_ms,
+            "failure_rate": default.failure_rate,
+        }
+        for item in (spec or "").split(","):
+            if not item.strip():
+                continue
+            key, _, value = item.partition("=")
+            key = key.strip()
+            if key not in values:
+                raise ValueError(f"Unknown latency profile setting '{key}'")
+            values[key] = float(value)
+        return cls(**values)
+
+    def sample(self, rng: random.Random) -> float:
+        """
+        Draws one latency.
+
+        Args:
+            rng: Random source
+
+        Returns:
+            Latency in seconds
+        """
+        if self.median_ms <= 0:
+            return 0.0
+        sigma = math.log(max(self.p95_ms, self.median_ms) / self.median_ms) / Z_95
+        return rng.lognormvariate(math.log(self.median_ms), sigma) / 1000
+
+    def fails(self, rng: random.Random) -> bool:
+        """Decides whether this call should fail."""
+        return self.failure_rate > 0 and rng.random() < self.failure_rate
+
+
+class FakeBackend:
+    """
+    Shared latency/failure behaviour for the fakes.
+
+    Args:
+        name: Backend name used in error messages
+        profile: Latency distribution and failure rate
+        rng: Random source (seed it for reproducible runs)
+    """
+
+    def __init__(self, name: str, profile: LatencyProfile, rng: random.Random):
+        self.name = name
+        self.profile = profile
+        self.rng = rng
+        self.calls = 0
+        self.failures = 0
+        # Blocking fakes run in worker threads
+        self._lock = threading.Lock()
+
+    def _draw(self) -> Tuple[float, bool]:
+        with self._lock:
+            self.calls += 1
+            latency = self.profile.sample(self.rng)
+            failed = self.profile.fails(self.rng)
+            if failed:
+                self.failures += 1
+        return latency, failed
+
+    async def wait(self) -> None:
+        """Sleeps for one sampled latency, then maybe raises FakeBackendError."""
+        latency, failed = self._draw()
+        await asyncio.sleep(latency)
+        if failed:
+            raise FakeBackendError(f"Simulated {self.name} failure")
+
+    def wait_blocking(self) -> None:
+        """Blocking variant of wait() for clients called from worker threads."""
+        latency, failed = self._draw()
+        time.sleep(latency)
+        if failed:
+            raise FakeBackendError(f"Simulated {self.name} failure")
+
+    def stats(self) -> dict:
+        """Call and failure counts."""
+        return {"calls": self.calls, "failures": self.failures}
+
+
+def _estimate_tokens(contents: Any) -> int:
+    """Roughly 4 characters per token for text parts; a flat cost for media parts."""
+    if isinstance(contents, str):
+        return max(1, len(contents) // 4)
+    if isinstance(contents, (list, tuple)):
+        return sum(_estimate_tokens(part) for part in contents)
+    return 258  # Gemini's per-image token cost
+
+
+@dataclass
+class FakeUsage:
+    """Token usage in the shape of Gemini's usage_metadata."""
+    prompt_token_count: int
+    candidates_token_count: int
+    total_token_count: int
+
+
+@dataclass
+class FakeGenerationResponse:
+    """A (possibly partial) Gemini response with text and optional usage."""
+    text: str
+    usage_metadata: Optional[FakeUsage] = None
+
+
+class FakeGenerativeModel:
+    """
+    Stand-in for vertexai GenerativeModel.
+
+    The profile sets the time to the first token; a streamed reply then
+    arrives chunk by chunk. A non-streamed call takes as long as the whole
+    stream would.
+
+    Args:
+        backend: Latency/failure behaviour for calls
+        system_instruction: Persona preamble (counted as input tokens)
+        reply_words: Words in each reply
+        chunk_words: Words per streamed chunk
+        chunk_interval: Seconds between streamed chunks
+    """
+
+    def __init__(
+        self,
+        backend: FakeBackend,
+        system_instruction: Optional[str] = None,
+        reply_words: int = 60,
+        chunk_words: int = 8,
+        chunk_interval: float = 0.03
+    ):
+        self.backend = backend
+        self.system_instruction = system_instruction
+        self.reply_words = reply_words
+        self.chunk_words = max(1, chunk_words)
+        self.chunk_interval = chunk_interval
+
+    def _reply(self) -> List[str]:
+        start = self.backend.rng.randrange(len(REPLY_WORDS))
+        words = [REPLY_WORDS[(start + i) % len(REPLY_WORDS)] for i in range(self.reply_words)]
+        words[0] = words[0].capitalize()
+        return words
+
+    def _usage(self, contents: Any, words: List[str]) -> FakeUsage:
+        prompt_tokens = _estimate_tokens(contents) + _estimate_tokens(self.system_instruction or "")
+        output_tokens = math.ceil(len(words) * 1.3)
+        return FakeUsage(prompt_tokens, output_tokens, prompt_tokens + output_tokens)
+
+    async def generate_content_async(self, contents: Any, stream: bool = False, **kwargs):
+        """
+        Generates a canned reply after a sampled latency.
+
+        Args:
+            contents: Prompt text and parts
+            stream: Whether to return an async iterator of chunks
+
+        Returns:
+            FakeGenerationResponse, or an async iterator of them when streaming
+
+        Raises:
+            FakeBackendError: At the profile's failure rate
+        """
+        await self.backend.wait()
+        words = self._reply()
+        chunks = [
+            " ".join(words[i:i + self.chunk_words]) + " "
+            for i in range(0, len(words), self.chunk_words)
+        ]
+        usage = self._usage(contents, words)
+        if not stream:
+            await asyncio.sleep(self.chunk_interval * (len(chunks) - 1))
+            return FakeGenerationResponse(text="".join(chunks).strip() + ".", usage_metadata=usage)
+
+        async def stream_chunks() -> AsyncIterator[FakeGenerationResponse]:
+            for index, chunk in enumerate(chunks):
+                if index:
+                    await asyncio.sleep(self.chunk_interval)
+                yield FakeGenerationResponse(text=chunk)
+            # Gemini reports usage on a final chunk without text
+            yield FakeGenerationResponse(text="", usage_metadata=usage)
+
+        return stream_chunks()
+
+
+class FakeCachedContent:
+    """Stand-in for a Vertex AI CachedContent handle."""
+
+    def __init__(self, system_instruction: str):
+        self.system_instruction = system_instruction
+        self.deleted = False
+
+    def delete(self) -> None:
+        self.deleted = True
+
+
+class FakeSpeechClient:
+    """
+    Stand-in for SpeechAsyncClient.recognize.
+
+    Args:
+        backend: Latency/failure behaviour for calls
+        transcript: Transcript returned for every recognized audio file
+    """
+
+    def __init__(self, backend: FakeBackend, transcript: str):
+        self.backend = backend
+        self.transcript = transcript
+
+    async def recognize(self, config: Any = None, audio: Any = None, **kwargs):
+        """Returns the canned transcript in RecognizeResponse shape after a sampled latency."""
+        await self.backend.wait()
+        alternative = SimpleNamespace(transcript=self.transcript, confidence=0.95)
+        return SimpleNamespace(results=[SimpleNamespace(alternatives=[alternative])])
+
+
+class FakeTextToSpeechClient:
+    """
+    Stand-in for TextToSpeechAsyncClient.synthesize_speech.
+
+    Args:
+        backend: Latency/failure behaviour for calls
+        bytes_per_char: Audio bytes produced per input character (about
+                        270 for 32kbps MP3 at a normal speaking rate)
+    """
+
+    def __init__(self, backend: FakeBackend, bytes_per_char: int = 270):
+        self.backend = backend
+        self.bytes_per_char = bytes_per_char
+
+    async def synthesize_speech(self, input: Any = None, voice: Any = None, audio_config: Any = None, **kwargs):
+        """Returns MP3-shaped bytes sized to the text after a sampled latency."""
+        await self.backend.wait()
+        size = max(len(MP3_FRAME_HEADER), len(input.text) * self.bytes_per_char)
+        return SimpleNamespace(audio_content=MP3_FRAME_HEADER + b"\0" * (size - len(MP3_FRAME_HEADER)))
+
+
+class FakeBlob:
+    """In-memory stand-in for google.cloud.storage.Blob."""
+
+    def __init__(self, bucket: "FakeBucket", name: str):
+        self.bucket = bucket
+        self.name = name
+        self.content_type: Optional[str] = None
+        self.size: Optional[int] = None
+
+    def exists(self) -> bool:
+        self.bucket.backend.wait_blocking()
+        return self.name in self.bucket.objects
+
+    def upload_from_file(self, fileobj, size: Optional[int] = None, content_type: Optional[str] = None, **kwargs) -> None:
+        self.bucket.backend.wait_blocking()
+        data = fileobj.read() if size is None else fileobj.read(size)
+        self.bucket.objects[self.name] = (data, content_type)
+        self.size = len(data)
+        self.content_type = content_type
+
+    def download_as_bytes(self, **kwargs) -> bytes:
+        self.bucket.backend.wait_blocking()
+        return self.bucket.objects[self.name][0]
+
+    def open(self, mode: str = "rb", **kwargs) -> io.BytesIO:
+        self.bucket.backend.wait_blocking()
+        return io.BytesIO(self.bucket.objects[self.name][0])
+
+    def delete(self, **kwargs) -> None:
+        self.bucket.backend.wait_blocking()
+        self.bucket.objects.pop(self.name, None)
+
+
+class FakeBucket:
+    """In-memory stand-in for google.cloud.storage.Bucket."""
+
+    def __init__(self, backend: FakeBackend, name: str):
+        self.backend = backend
+        self.name = name
+        self.objects: Dict[str, Tuple[bytes, Optional[str]]] = {}
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self, name)
+
+    def get_blob(self, name: str) -> Optional[FakeBlob]:
+        self.backend.wait_blocking()
+        if name not in self.objects:
+            return None
+        blob = FakeBlob(self, name)
+        data, blob.content_type = self.objects[name]
+        blob.size = len(data)
+        return blob
+
+
+class FakeStorageClient:
+    """
+    In-memory stand-in for google.cloud.storage.Client.
+
+    Args:
+        backend: Latency/failure behaviour for object operations
+    """
+
+    def __init__(self, backend: FakeBackend):
+        self.backend = backend
+        self._buckets: Dict[str, FakeBucket] = {}
+
+    def bucket(self, name: str) -> FakeBucket:
+        if name not in self._buckets:
+            self._buckets[name] = FakeBucket(self.backend, name)
+        return self._buckets[name]
+
+    def close(self) -> None:
+        pass
+
+
+class FakeBackends:
+    """
+    Builds the fakes from one set of latency profiles.
+
+    Args:
+        gemini: Time-to-first-token profile for Gemini calls
+        speech: Profile for Speech-to-Text recognize calls
+        tts: Profile for Text-to-Speech calls
+        storage: Profile for Cloud Storage object operations
+        chunk_interval: Seconds between streamed Gemini chunks
+        reply_words: Words in each Gemini reply
+        transcript: Transcript the fake Speech-to-Text returns
+        seed: Optional seed for reproducible latencies and failures
+    """
+
+    def __init__(
+        self,
+        gemini: LatencyProfile,
+        speech: LatencyProfile,
+        tts: LatencyProfile,
+        storage: LatencyProfile,
+        chunk_interval: float = 0.03,
+        reply_words: int = 60,
+        transcript: str = "I like the colours but the price feels a bit high for me",
+        seed: Optional[int] = None
+    ):
+        rng = random.Random(seed)
+        self.gemini = FakeBackend("gemini", gemini, rng)
+        self.speech = FakeBackend("speech", speech, rng)
+        self.tts = FakeBackend("tts", tts, rng)
+        self.storage = FakeBackend("storage", storage, rng)
+        self.chunk_interval = chunk_interval
+        self.reply_words = reply_words
+        self.transcript = transcript
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str]) -> "FakeBackends":
+        """
+        Reads profiles from FAKE_GEMINI_LATENCY, FAKE_SPEECH_LATENCY,
+        FAKE_TTS_LATENCY and FAKE_STORAGE_LATENCY plus the FAKE_* settings.
+
+        Args:
+            env: Environment mapping (usually os.environ)
+
+        Returns:
+            Configured FakeBackends
+        """
+        seed = env.get("FAKE_BACKEND_SEED")
+        return cls(
+            gemini=LatencyProfile.parse(env.get("FAKE_GEMINI_LATENCY"), LatencyProfile(800, 2500)),
+            speech=LatencyProfile.parse(env.get("FAKE_SPEECH_LATENCY"), LatencyProfile(400, 1200)),
+            tts=LatencyProfile.parse(env.get("FAKE_TTS_LATENCY"), LatencyProfile(150, 400)),
+            storage=LatencyProfile.parse(env.get("FAKE_STORAGE_LATENCY"), LatencyProfile(40, 120)),
+            chunk_interval=float(env.get("FAKE_GEMINI_CHUNK_MS", "30")) / 1000,
+            reply_words=int(env.get("FAKE_GEMINI_REPLY_WORDS", "60")),
+            transcript=env.get("STT_FAKE_TRANSCRIPT", "I like the colours but the price feels a bit high for me"),
+            seed=int(seed) if seed else None
+        )
+
+    def model(self, system_instruction: Optional[str] = None) -> FakeGenerativeModel:
+        """Builds a fake Gemini model, optionally carrying a persona preamble."""
+        return FakeGenerativeModel(
+            self.gemini, system_instruction, reply_words=self.reply_words, chunk_interval=self.chunk_interval
+        )
+
+    def cached_model(self, system_instruction: str) -> Tuple[FakeGenerativeModel, FakeCachedContent]:
+        """Builds a fake model bound to a fake cached context."""
+        return self.model(system_instruction), FakeCachedContent(system_instruction)
+
+    def speech_client(self) -> FakeSpeechClient:
+        return FakeSpeechClient(self.speech, self.transcript)
+
+    def tts_client(self) -> FakeTextToSpeechClient:
+        return FakeTextToSpeechClient(self.tts)
+
+    def storage_client(self) -> FakeStorageClient:
+        return FakeStorageClient(self.storage)
+
+    def stats(self) -> dict:
+        """Per-backend call and failure counts."""
+        return {
+            backend.name: backend.stats()
+            for backend in (self.gemini, self.speech, self.tts, self.storage)
+        }
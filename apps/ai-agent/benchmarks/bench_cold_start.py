@@ -0,0 +1,124 @@
+"""
+Cold-start benchmark: time from process start to the first ready response.
+
+Starts the server in a fresh process several times (as a scale-from-zero
+instance would), polls /health until it answers, then optionally sends one
+first request (e.g., /chat) and reports both times along with the import
+and warm-up timings the server reports in /health. Run with BACKENDS=fake to
+exercise the first request without credentials.
+
+Usage:
+    python benchmarks/bench_cold_start.py [--runs 5] [--first-request chat] [--port 8765]
+        [--env WARMUP=gemini] [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_REQUESTS = {
+    "chat": ("POST", "/chat", {
+        "user_prompt": "What do you think of the new colourway?",
+        "brand_context": "A trail running shoe made from recycled materials.",
+        "audience_summary": "Gen Z urban runners who buy gear online",
+    }),
+    "health": ("GET", "/health", None),
+}
+
+
+def measure_once(args, env: dict) -> dict:
+    """Starts one server process and times readiness and the first request."""
+    command = [
+        sys.executable, "-m", "uvicorn", "main:app",
+        "--host", "127.0.0.1", "--port", str(args.port), "--log-level", "warning",
+    ]
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        with httpx.Client(base_url=base_url, timeout=args.timeout) as client:
+            health = None
+            while time.perf_counter() - started < args.timeout:
+                if process.poll() is not None:
+                    raise RuntimeError(f"Server exited with code {process.returncode}")
+                try:
+                    response = client.get("/health")
+                    if response.status_code == 200:
+                        health = response.json()
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.01)
+            if health is None:
+                raise RuntimeError("Server did not become ready in time")
+            ready_ms = (time.perf_counter() - started) * 1000
+
+            result = {
+                "ready_ms": round(ready_ms, 1),
+                "server_startup": health.get("startup"),
+                "server_imports_ms": health.get("imports_ms"),
+            }
+            if args.first_request:
+                method, path, body = FIRST_REQUESTS[args.first_request]
+                request_started = time.perf_counter()
+                response = client.request(method, path, json=body)
+                result["first_request_ms"] = round((time.perf_counter() - request_started) * 1000, 1)
+                result["first_request_status"] = response.status_code
+                result["start_to_first_response_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            return result
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def summarize(values: list) -> dict:
+    return {
+        "median": round(statistics.median(values), 1),
+        "min": round(min(values), 1),
+        "max": round(max(values), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Number of cold starts")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the server under test")
+    parser.add_argument("--first-request", choices=sorted(FIRST_REQUESTS), help="Request to time after readiness")
+    parser.add_argument("--env", action="append", default=[], help="Extra KEY=VALUE for the server (repeatable)")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds to wait for readiness")
+    parser.add_argument("--json", help="Optional path to write results as JSON")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.update(item.split("=", 1) for item in args.env)
+
+    runs = []
+    for index in range(args.runs):
+        run = measure_once(args, env)
+        runs.append(run)
+        line = f"run {index + 1}: ready {run['ready_ms']} ms"
+        if "first_request_ms" in run:
+            line += f", first {args.first_request} {run['first_request_ms']} ms (status {run['first_request_status']})"
+        print(line)
+
+    result = {"runs": runs, "ready_ms": summarize([run["ready_ms"] for run in runs])}
+    if args.first_request:
+        result["start_to_first_response_ms"] = summarize([run["start_to_first_response_ms"] for run in runs])
+    print(f"\nready: {result['ready_ms']}")
+    if args.first_request:
+        print(f"start to first {args.first_request} response: {result['start_to_first_response_ms']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
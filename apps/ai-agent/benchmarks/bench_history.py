@@ -0,0 +1,108 @@
+"""
+Microbenchmark: conversation prompt assembly time and size vs. history length.
+
+Compares the original unbounded builder (repeated string +=) with the
+token-budgeted HistoryBuilder as a conversation grows turn by turn.
+
+Usage:
+    python benchmarks/bench_history.py [--turns 500] [--repeat 200] [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history import HistoryBuilder, estimate_tokens  # noqa: E402
+
+
+WORDS = (
+    "brand price value quality packaging taste feel colour trust family budget "
+    "weekend store online review friend habit routine premium discount loyal"
+).split()
+
+
+def make_message(rng: random.Random, sender: str) -> SimpleNamespace:
+    """Builds a synthetic message of 60-200 words."""
+    words = [rng.choice(WORDS) for _ in range(rng.randint(60, 200))]
+    text = ". ".join(" ".join(words[i:i + 12]) for i in range(0, len(words), 12)) + "."
+    return SimpleNamespace(sender=sender, text=text)
+
+
+def legacy_build(user_prompt: str, history) -> str:
+    """The original unbounded builder, kept here as the baseline."""
+    full_prompt = "--- Begin Conversation History ---\n"
+    for message in history:
+        if message.sender == 'user':
+            full_prompt += f"User: {message.text}\n"
+        else:
+            full_prompt += f"Agent: {message.text}\n"
+    full_prompt += f"User: {user_prompt}\n"
+    full_prompt += "Agent: "
+    return full_prompt
+
+
+def time_call(fn, repeat: int) -> float:
+    """Median wall time of fn() in microseconds."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1e6)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=500, help="Messages in the longest conversation")
+    parser.add_argument("--repeat", type=int, default=200, help="Timing repetitions per checkpoint")
+    parser.add_argument("--budget", type=int, default=24000, help="History token budget")
+    parser.add_argument("--json", help="Optional path to write results as JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    history = [make_message(rng, "user" if i % 2 == 0 else "agent") for i in range(args.turns)]
+    builder = HistoryBuilder(token_budget=args.budget)
+    checkpoints = sorted({n for n in (10, 50, 100, 200, 300, 400, 500, args.turns) if n <= args.turns})
+
+    results = []
+    print(f"{'turns':>6} | {'legacy us':>10} {'legacy tok':>11} | {'budgeted us':>12} {'budgeted tok':>13}")
+    print("-" * 62)
+    for turn in range(1, args.turns + 1):
+        # Grow the conversation one turn at a time, as a live session would
+        builder.build("What do you think?", history[:turn], conversation_id="bench")
+        if turn not in checkpoints:
+            continue
+
+        prefix = history[:turn]
+        legacy_us = time_call(lambda: legacy_build("What do you think?", prefix), args.repeat)
+        budgeted_us = time_call(
+            lambda: builder.build("What do you think?", prefix, conversation_id="bench"), args.repeat
+        )
+        row = {
+            "turns": turn,
+            "legacy_us": round(legacy_us, 1),
+            "legacy_tokens": estimate_tokens(legacy_build("What do you think?", prefix)),
+            "budgeted_us": round(budgeted_us, 1),
+            "budgeted_tokens": estimate_tokens(builder.build("What do you think?", prefix, conversation_id="bench")),
+        }
+        results.append(row)
+        print(
+            f"{row['turns']:>6} | {row['legacy_us']:>10} {row['legacy_tokens']:>11} | "
+            f"{row['budgeted_us']:>12} {row['budgeted_tokens']:>13}"
+        )
+
+    print(f"\nsummary cache: {builder.stats()}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"budget": args.budget, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Benchmark: persona/brand preamble size and latency with and without retrieval.
+
+Builds synthetic brand briefs of growing size, each made of sections on a
+handful of topics, and asks topic questions against them. For each size it
+reports the preamble tokens sent verbatim vs. with retrieval, the one-off
+index build time, the per-turn lookup time, and how many selected chunks
+are on the question's topic.
+
+With --url it also times /chat end to end against a running server using
+the largest brief. Run it once against a server started with
+RETRIEVAL_ENABLED=false and once with retrieval on to compare model latency.
+
+Usage:
+    python benchmarks/bench_retrieval.py [--sizes 8,16,32,64,128] [--repeat 50] [--json out.json]
+        [--url http://localhost:8080 --requests 20]
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history import estimate_tokens  # noqa: E402
+from retrieval import DocumentRetriever  # noqa: E402
+
+
+TOPICS = {
+    "pricing": "price discount budget value cost premium promotion bundle",
+    "sustainability": "recycled materials carbon packaging eco footprint repair",
+    "social": "tiktok instagram influencer creator campaign video community",
+    "retail": "store shelf online delivery checkout returns stock",
+    "product": "cushioning grip fit weight durability sole upper",
+    "brand": "heritage story logo tone trust founder mission",
+}
+FILLER = "customers often say the team noticed research shows many people feel".split()
+QUESTIONS = {
+    "pricing": "Would you pay full price, or wait for a discount?",
+    "sustainability": "Does the recycled packaging change how you see them?",
+    "social": "Would a TikTok creator campaign make you try the shoe?",
+    "retail": "Would you rather buy these online or in a store?",
+    "product": "How important is the grip and the weight of the sole?",
+    "brand": "Do you trust the founder's story and mission?",
+}
+
+
+def make_brief(rng: random.Random, target_chars: int) -> str:
+    """Builds a brand brief of about target_chars, cycling through the topics."""
+    sections = ["Acme Trail makes running shoes for city and trail runners."]
+    size = len(sections[0])
+    index = 0
+    while size < target_chars:
+        topic = list(TOPICS)[index % len(TOPICS)]
+        words = TOPICS[topic].split() + FILLER
+        sentences = [" ".join(rng.choice(words) for _ in range(rng.randint(10, 20))).capitalize() + "."
+                     for _ in range(rng.randint(4, 8))]
+        section = f"[{topic}] " + " ".join(sentences)
+        sections.append(section)
+        size += len(section) + 2
+        index += 1
+    return "\n\n".join(sections)
+
+
+def preamble(brief: str, audience: str) -> str:
+    """The persona/brand part of the system instruction."""
+    return f"Your persona is defined by: {audience}\n\nThe brand context is: {brief}\n"
+
+
+def median_us(fn, repeat: int) -> float:
+    """Median wall time of fn() in microseconds."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1e6)
+    return statistics.median(samples)
+
+
+def bench_size(rng: random.Random, kilobytes: int, repeat: int) -> dict:
+    brief = make_brief(rng, kilobytes * 1024)
+    audience = "Gen Z urban runners who buy gear online"
+    full_tokens = estimate_tokens(preamble(brief, audience))
+
+    build_us = median_us(lambda: DocumentRetriever(min_chars=0).index_for(brief), max(1, repeat // 5))
+    retriever = DocumentRetriever(min_chars=0)
+    retriever.index_for(brief)
+
+    tokens = []
+    on_topic = []
+    for topic, question in QUESTIONS.items():
+        selected = retriever.select(brief, question).text
+        tokens.append(estimate_tokens(preamble(selected, audience)))
+        tags = re.findall(r"^\[(\w+)\]", selected, re.MULTILINE)
+        on_topic.append(sum(tag == topic for tag in tags) / max(1, len(tags)))
+    lookup_us = median_us(lambda: retriever.select(brief, QUESTIONS["social"]), repeat)
+
+    return {
+        "kb": kilobytes,
+        "chunks": len(retriever.index_for(brief)),
+        "full_tokens": full_tokens,
+        "retrieval_tokens": round(statistics.mean(tokens)),
+        "build_ms": round(build_us / 1000, 2),
+        "lookup_us": round(lookup_us, 1),
+        "on_topic": round(statistics.mean(on_topic), 2),
+    }
+
+
+def bench_endpoint(url: str, brief: str, requests: int) -> dict:
+    """Times /chat end to end against a running server."""
+    import httpx
+
+    latencies = []
+    questions = list(QUESTIONS.values())
+    with httpx.Client(base_url=url, timeout=120) as client:
+        for index in range(requests):
+            body = {
+                "user_prompt": f"{questions[index % len(questions)]} ({index})",
+                "brand_context": brief,
+                "audience_summary": "Gen Z urban runners who buy gear online",
+                "cache_control": "no-store",
+            }
+            started = time.perf_counter()
+            response = client.post("/chat", json=body)
+            response.raise_for_status()
+            latencies.append((time.perf_counter() - started) * 1000)
+        retrieval = client.get("/health").json().get("retrieval")
+    latencies.sort()
+    return {
+        "requests": requests,
+        "p50_ms": round(latencies[len(latencies) // 2], 1),
+        "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1),
+        "server_retrieval": retrieval,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="8,16,32,64,128", help="Comma-separated brief sizes in KB")
+    parser.add_argument("--repeat", type=int, default=50, help="Timing repetitions per size")
+    parser.add_argument("--url", help="Base URL of a running server to time /chat against")
+    parser.add_argument("--requests", type=int, default=20, help="Requests sent with --url")
+    parser.add_argument("--json", help="Optional path to write results as JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = []
+    print(f"{'KB':>5} {'chunks':>7} | {'full tok':>9} {'retr. tok':>10} | {'build ms':>9} {'lookup us':>10} | {'on topic':>8}")
+    print("-" * 72)
+    for kilobytes in sizes:
+        row = bench_size(rng, kilobytes, args.repeat)
+        results.append(row)
+        print(
+            f"{row['kb']:>5} {row['chunks']:>7} | {row['full_tokens']:>9} {row['retrieval_tokens']:>10} | "
+            f"{row['build_ms']:>9} {row['lookup_us']:>10} | {row['on_topic']:>8}"
+        )
+
+    output = {"results": results}
+    if args.url:
+        output["endpoint"] = bench_endpoint(args.url, make_brief(rng, max(sizes) * 1024), args.requests)
+        print(f"\n/chat with a {max(sizes)} KB brief: {output['endpoint']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(output, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
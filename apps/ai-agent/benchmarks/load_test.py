@@ -0,0 +1,395 @@
+"""
+Load test: drives the HTTP endpoints at fixed concurrency levels.
+
+By default the app runs in-process with BACKENDS=fake (see backends.py)
+behind httpx's ASGI transport, so no quota is spent and the numbers reflect
+this service's own overhead: event-loop scheduling, request parsing,
+caching and memory. Upstream latencies and failure rates come from the
+FAKE_*_LATENCY settings. Pass --url to load test a running server instead
+(start it with BACKENDS=fake for offline runs).
+
+Each scenario is run at each concurrency level, and the report covers:
+- throughput
+- p50/p95/p99 latency, plus time to first byte for streamed responses
+  (only meaningful with --url: httpx's ASGI transport delivers a streamed
+  body once it completes)
+- error counts
+- event-loop lag (in-process only)
+- peak RSS
+
+The report is written as JSON. With --baseline, p95 latency and throughput
+are compared against an earlier report, and the run exits non-zero if any
+of them regress by more than --tolerance. The WebSocket endpoints are
+exercised by replay_stt_stream.py.
+
+Usage:
+    python benchmarks/load_test.py [--concurrency 1,8,32] [--requests 200]
+        [--scenarios chat,chat_stream,...] [--url http://localhost:8080]
+        [--json report.json] [--baseline previous.json] [--tolerance 0.25]
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import random
+import resource
+import struct
+import sys
+import tempfile
+import time
+from typing import Awaitable, Callable, List, Optional
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 1x1 PNG, enough for the image pipeline to decode
+TINY_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=="
+)
+
+SENTENCES = [
+    "The packaging feels premium but I am not sure it is worth the price.",
+    "I would probably buy it if a friend recommended it to me first.",
+    "The colours are bright and fun, which makes it stand out on the shelf.",
+    "Honestly, I would wait for a discount before trying something new.",
+    "I like that the brand talks about sustainability without overdoing it.",
+]
+
+AUDIENCES = [
+    "Gen Z urban runners who buy gear online",
+    "Parents of young children shopping on a budget",
+    "Retired couples who value durability over style",
+    "Young professionals who follow design trends",
+]
+
+BRAND_CONTEXT = "A mid-priced trail running shoe with recycled materials and a bold colourway."
+
+
+def wav_header(data_bytes: int, sample_rate: int = 16000) -> bytes:
+    """Builds a 16-bit mono PCM WAV header so the audio probe is confident."""
+    return (
+        b"RIFF" + struct.pack("<I", 36 + data_bytes) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16)
+        + b"data" + struct.pack("<I", data_bytes)
+    )
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of values, or None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return round(ordered[index], 2)
+
+
+def rss_mb() -> Optional[float]:
+    """Current resident set size in MB (Linux only)."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2, 1)
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return round(peak / 1024 ** (2 if platform.system() == "Darwin" else 1), 1)
+
+
+class Scenarios:
+    """
+    One request per endpoint, each returning (status code, time to first byte in ms).
+
+    Args:
+        rng: Random source for varying payloads
+    """
+
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self.session_id = None
+
+    async def setup(self, client: httpx.AsyncClient, names: List[str]) -> None:
+        """Creates state that scenarios depend on (e.g., the session)."""
+        if "session_message" in names:
+            response = await client.post("/sessions", json={
+                "audience_summary": AUDIENCES[0], "brand_context": BRAND_CONTEXT
+            })
+            response.raise_for_status()
+            self.session_id = response.json()["session_id"]
+
+    def _chat_body(self, **extra) -> dict:
+        return {
+            "user_prompt": self.rng.choice(SENTENCES),
+            "brand_context": BRAND_CONTEXT,
+            "audience_summary": self.rng.choice(AUDIENCES),
+            **extra,
+        }
+
+    @staticmethod
+    async def _streamed(client: httpx.AsyncClient, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        first_byte_ms = None
+        async with client.stream(method, url, **kwargs) as response:
+            async for _ in response.aiter_raw():
+                if first_byte_ms is None:
+                    first_byte_ms = (time.perf_counter() - started) * 1000
+        return response.status_code, first_byte_ms
+
+    async def health(self, client):
+        return (await client.get("/health")).status_code, None
+
+    async def chat(self, client):
+        return (await client.post("/chat", json=self._chat_body())).status_code, None
+
+    async def chat_stream(self, client):
+        return await self._streamed(client, "POST", "/chat", json=self._chat_body(stream=True))
+
+    async def multimodal_image(self, client):
+        body = self._chat_body()
+        files = {"image": ("pixel.png", TINY_PNG, "image/png")}
+        return (await client.post("/chat/multimodal", data=body, files=files)).status_code, None
+
+    async def session_message(self, client):
+        response = await client.post(
+            f"/sessions/{self.session_id}/messages", json={"user_prompt": self.rng.choice(SENTENCES)}
+        )
+        return response.status_code, None
+
+    async def focus_group(self, client):
+        body = {
+            "user_prompt": self.rng.choice(SENTENCES),
+            "brand_context": BRAND_CONTEXT,
+            "audiences": [{"audience_summary": audience} for audience in AUDIENCES],
+        }
+        return await self._streamed(client, "POST", "/focus-group", json=body)
+
+    async def media_upload(self, client):
+        # Unique bytes so every upload is stored rather than deduplicated
+        data = TINY_PNG + self.rng.randbytes(64 * 1024)
+        files = {"file": ("upload.png", data, "image/png")}
+        return (await client.post("/media", files=files)).status_code, None
+
+    async def speech_to_text(self, client):
+        audio = wav_header(32000) + bytes(32000)
+        files = {"audio": ("speech.wav", audio, "audio/wav")}
+        return (await client.post("/speech-to-text", files=files)).status_code, None
+
+    async def text_to_speech(self, client):
+        # A small set of sentences, so the speech cache sees hits as well as misses
+        data = {"text": self.rng.choice(SENTENCES)}
+        return (await client.post("/text-to-speech", data=data)).status_code, None
+
+    async def text_to_speech_stream(self, client):
+        data = {"text": " ".join(self.rng.sample(SENTENCES, 3)) + f" Request {self.rng.random():.6f}."}
+        return await self._streamed(client, "POST", "/text-to-speech/stream", data=data)
+
+    async def upload_url(self, client):
+        body = {"filename": "creative.mp4", "content_type": "video/mp4"}
+        return (await client.post("/generate-upload-url", json=body)).status_code, None
+
+
+SCENARIOS = [
+    "health", "chat", "chat_stream", "multimodal_image", "session_message", "focus_group",
+    "media_upload", "speech_to_text", "text_to_speech", "text_to_speech_stream", "upload_url",
+]
+
+
+async def monitor_loop_lag(samples: List[float], interval: float = 0.005) -> None:
+    """Records how late the event loop wakes a sleeping task, in ms."""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append((time.perf_counter() - started - interval) * 1000)
+
+
+async def run_level(
+    client: httpx.AsyncClient,
+    request: Callable[[httpx.AsyncClient], Awaitable[tuple]],
+    concurrency: int,
+    total: int,
+    measure_loop: bool
+) -> dict:
+    """Sends total requests with concurrency workers and summarizes the results."""
+    latencies, first_bytes, statuses = [], [], {}
+    errors = 0
+    remaining = total
+    lag_samples: List[float] = []
+
+    async def worker() -> None:
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                status, first_byte_ms = await request(client)
+            except Exception as e:
+                status, first_byte_ms = type(e).__name__, None
+            latencies.append((time.perf_counter() - started) * 1000)
+            if first_byte_ms is not None:
+                first_bytes.append(first_byte_ms)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if not isinstance(status, int) or status >= 400:
+                errors += 1
+
+    monitor = asyncio.create_task(monitor_loop_lag(lag_samples)) if measure_loop else None
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    if monitor:
+        monitor.cancel()
+
+    result = {
+        "concurrency": concurrency,
+        "requests": total,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 2),
+        "errors": errors,
+        "statuses": statuses,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": round(max(latencies), 2),
+        },
+        "rss_mb": rss_mb(),
+    }
+    if first_bytes:
+        result["first_byte_ms"] = {
+            "p50": percentile(first_bytes, 0.50),
+            "p95": percentile(first_bytes, 0.95),
+            "p99": percentile(first_bytes, 0.99),
+        }
+    if measure_loop:
+        result["loop_lag_ms"] = {
+            "p99": percentile(lag_samples, 0.99),
+            "max": round(max(lag_samples), 2) if lag_samples else None,
+        }
+    return result
+
+
+async def run(args) -> dict:
+    """Runs every selected scenario at every concurrency level."""
+    names = args.scenarios.split(",") if args.scenarios else SCENARIOS
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    levels = [int(level) for level in args.concurrency.split(",")]
+    scenarios = Scenarios(random.Random(args.seed))
+    report = {
+        "target": args.url or "in-process (BACKENDS=fake)",
+        "python": platform.python_version(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "settings": {
+            key: value for key, value in os.environ.items()
+            if key.startswith("FAKE_") or key in ("GEMINI_MAX_CONCURRENCY", "GEMINI_MAX_QUEUE")
+        },
+        "results": {},
+    }
+
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+            await run_scenarios(client, scenarios, names, levels, args, report, measure_loop=False)
+    else:
+        import main
+        transport = httpx.ASGITransport(app=main.app)
+        async with main.app.router.lifespan_context(main.app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=args.timeout) as client:
+                await run_scenarios(client, scenarios, names, levels, args, report, measure_loop=True)
+            report["fake_backends"] = main.fake_backends.stats()
+
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+
+async def run_scenarios(client, scenarios: Scenarios, names, levels, args, report, measure_loop: bool) -> None:
+    await scenarios.setup(client, names)
+    for name in names:
+        request = getattr(scenarios, name)
+        # Warm caches, clients and lazily built state before measuring
+        await request(client)
+        report["results"][name] = []
+        for level in levels:
+            result = await run_level(client, request, level, max(args.requests, level), measure_loop)
+            report["results"][name].append(result)
+            latency = result["latency_ms"]
+            print(
+                f"{name:<22} c={level:<4} {result['throughput_rps']:>8} req/s  "
+                f"p50 {latency['p50']:>8} ms  p95 {latency['p95']:>8} ms  p99 {latency['p99']:>8} ms  "
+                f"errors {result['errors']}"
+            )
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    Lists p95 latency and throughput regressions against a baseline report.
+
+    Args:
+        report: This run's report
+        baseline: Earlier report to compare with
+        tolerance: Allowed relative change (0.25 = 25%)
+
+    Returns:
+        Human-readable regression descriptions (empty if none)
+    """
+    regressions = []
+    for name, results in report["results"].items():
+        previous = {result["concurrency"]: result for result in baseline.get("results", {}).get(name, [])}
+        for result in results:
+            before = previous.get(result["concurrency"])
+            if before is None:
+                continue
+            label = f"{name} c={result['concurrency']}"
+            p95, p95_before = result["latency_ms"]["p95"], before["latency_ms"]["p95"]
+            if p95_before and p95 > p95_before * (1 + tolerance):
+                regressions.append(f"{label}: p95 {p95_before} -> {p95} ms")
+            rps, rps_before = result["throughput_rps"], before["throughput_rps"]
+            if rps < rps_before * (1 - tolerance):
+                regressions.append(f"{label}: throughput {rps_before} -> {rps} req/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario and level")
+    parser.add_argument("--scenarios", help=f"Comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--url", help="Base URL of a running server (default: run the app in-process)")
+    parser.add_argument("--timeout", type=float, default=60, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=7, help="Seed for payloads and fake backend latencies")
+    parser.add_argument("--json", help="Optional path to write the report as JSON")
+    parser.add_argument("--baseline", help="Earlier JSON report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    if not args.url:
+        # Must be set before main is imported
+        os.environ["BACKENDS"] = "fake"
+        os.environ.setdefault("FAKE_BACKEND_SEED", str(args.seed))
+        os.environ.setdefault("MEDIA_STORE_DIR", tempfile.mkdtemp(prefix="persona-load-test-"))
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    report = asyncio.run(run(args))
+    print(f"\npeak RSS: {report['peak_rss_mb']} MB")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
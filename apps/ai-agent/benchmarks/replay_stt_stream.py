@@ -0,0 +1,87 @@
+"""
+Replays a recorded audio file over the streaming speech WebSocket.
+
+Sends the file in fixed-duration frames at real-time pace (as a browser's
+MediaRecorder would) and reports when the first interim result, the final
+transcript and the end of utterance arrive relative to the end of speech.
+Run the server with STT_BACKEND=fake to exercise the flow without credentials.
+
+Usage:
+    python benchmarks/replay_stt_stream.py --file sample.webm [--url ws://localhost:8080/speech-to-text/stream]
+        [--frame-ms 250] [--bitrate 32000] [--speed 1.0] [--json out.json]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+import websockets
+
+
+async def replay(args) -> dict:
+    """Streams the file and collects transcript events with timestamps."""
+    with open(args.file, "rb") as f:
+        audio = f.read()
+    frame_bytes = max(1, int(args.bitrate / 8 * args.frame_ms / 1000))
+    frame_delay = args.frame_ms / 1000 / args.speed
+    events = []
+
+    async with websockets.connect(args.url, max_size=None) as ws:
+        ready = json.loads(await ws.recv())
+        print(f"connected: {ready}")
+        started = time.perf_counter()
+
+        async def send_audio():
+            await ws.send(json.dumps({"type": "start"}))
+            for offset in range(0, len(audio), frame_bytes):
+                await ws.send(audio[offset:offset + frame_bytes])
+                await asyncio.sleep(frame_delay)
+            await ws.send(json.dumps({"type": "stop"}))
+            return time.perf_counter() - started
+
+        sender = asyncio.create_task(send_audio())
+        while True:
+            message = json.loads(await ws.recv())
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+            events.append({"at_ms": elapsed_ms, **message})
+            print(f"{elapsed_ms:>9} ms  {message['type']:<16} {message.get('transcript', '')}")
+            if message["type"] in ("end_of_utterance", "error"):
+                break
+        speech_ended_ms = round(await sender * 1000, 1)
+
+    first_interim = next((e["at_ms"] for e in events if e["type"] == "interim"), None)
+    final = next((e["at_ms"] for e in events if e["type"] == "final"), None)
+    return {
+        "audio_bytes": len(audio),
+        "frames": -(-len(audio) // frame_bytes),
+        "audio_sent_ms": speech_ended_ms,
+        "first_interim_ms": first_interim,
+        "final_ms": final,
+        "final_after_stop_ms": round(final - speech_ended_ms, 1) if final is not None else None,
+        "events": events,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", required=True, help="Recorded audio file to replay")
+    parser.add_argument("--url", default="ws://localhost:8080/speech-to-text/stream", help="WebSocket URL")
+    parser.add_argument("--frame-ms", type=float, default=250, help="Audio duration per frame")
+    parser.add_argument("--bitrate", type=float, default=32000, help="Audio bitrate in bits/s, used to size frames")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed multiplier")
+    parser.add_argument("--json", help="Optional path to write results as JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(replay(args))
+    print(
+        f"\nfirst interim: {result['first_interim_ms']} ms | audio sent: {result['audio_sent_ms']} ms | "
+        f"final: {result['final_ms']} ms ({result['final_after_stop_ms']} ms after stop)"
+    )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
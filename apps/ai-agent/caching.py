@@ -0,0 +1,220 @@
+"""
+Generic caching building blocks shared by the response and media caches.
+
+TTLCache is an in-memory LRU with per-entry expiry, DiskCache is a
+file-per-key store for values that should survive restarts, and
+SingleFlight collapses concurrent identical computations into one call.
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+class TTLCache:
+    """
+    In-memory LRU cache whose entries also expire after a fixed time.
+
+    Args:
+        max_entries: Maximum number of entries before the least recently used is evicted
+        ttl: Seconds an entry stays valid; 0 disables expiry
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Looks up a key and marks it as recently used.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            The cached value, or None if missing or expired
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at and expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Stores a value, evicting the least recently used entries if full.
+
+        Args:
+            key: Cache key
+            value: Value to store
+        """
+        expires_at = time.monotonic() + self.ttl if self.ttl else 0.0
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: str) -> Optional[Any]:
+        """Removes a key and returns its value, if present."""
+        entry = self._entries.pop(key, None)
+        return entry[1] if entry else None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """Hit, miss and size counters."""
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class DiskCache:
+    """
+    File-per-key byte store with mtime-based expiry.
+
+    Methods are blocking; async callers should run them in a worker thread.
+
+    Args:
+        directory: Directory holding the cache files (created if missing)
+        ttl: Seconds an entry stays valid; 0 disables expiry
+    """
+
+    def __init__(self, directory: str, ttl: float):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> str:
+        # Keys are hex digests, so they are safe to use as filenames
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Reads a cached value from disk.
+
+        Args:
+            key: Cache key (hex digest)
+
+        Returns:
+            The cached bytes, or None if missing or expired
+        """
+        path = self._path(key)
+        try:
+            if self.ttl and os.path.getmtime(path) + self.ttl <= time.time():
+                os.remove(path)
+                self.misses += 1
+                return None
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def set(self, key: str, data: bytes) -> None:
+        """
+        Writes a value atomically so readers never see a partial file.
+
+        Args:
+            key: Cache key (hex digest)
+            data: Bytes to store
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def stats(self) -> dict:
+        """Hit and miss counters."""
+        return {"directory": self.directory, "hits": self.hits, "misses": self.misses}
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into a single execution.
+
+    The first caller for a key starts the work; callers arriving while it is
+    in flight await the same result (or exception) instead of repeating it.
+    The work runs in its own task, so a caller that is cancelled (e.g., its
+    client disconnected) only stops waiting; the work is cancelled once no
+    caller is waiting for it any more.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self.coalesced = 0
+
+    def _finished(self, key: str, task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        self._waiters.pop(task, None)
+        # Mark retrieved so a failure nobody waited for isn't logged as an error
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Runs fn once per key among concurrent callers.
+
+        Args:
+            key: Identity of the work
+            fn: Zero-argument coroutine function performing the work
+
+        Returns:
+            The result of fn, shared by every concurrent caller
+        """
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.coalesced += 1
+
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            # Shield so one caller's cancellation doesn't cancel the shared work
+            return await asyncio.shield(task)
+        finally:
+            if not task.done():
+                self._waiters[task] -= 1
+                if not self._waiters[task]:
+                    # Later callers start afresh rather than join work being cancelled
+                    if self._in_flight.get(key) is task:
+                        del self._in_flight[key]
+                    task.cancel()
+
+    def stats(self) -> dict:
+        """Coalescing counters."""
+        return {"in_flight": len(self._in_flight), "coalesced": self.coalesced}
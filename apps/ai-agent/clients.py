@@ -0,0 +1,207 @@
+"""
+Process-wide registry for Google Cloud clients and credentials.
+
+Clients are expensive to build (gRPC channel setup, TLS handshakes, auth
+token fetches), so each one is created once, shared by every request and
+closed when the application shuts down.
+"""
+
+import asyncio
+import inspect
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+async def close_async_transport(client: Any) -> None:
+    """
+    Closes the gRPC channel behind a generated async GAPIC client.
+
+    Args:
+        client: An async client such as SpeechAsyncClient
+    """
+    await client.transport.close()
+
+
+class ClientRegistry:
+    """
+    Lazily creates named clients once and hands out the shared instance.
+
+    Each client is registered with a zero-argument factory and an optional
+    closer (sync or async) that is invoked on shutdown. Creation is
+    serialized so a warm-up thread and a request never build the same
+    client twice.
+
+    gRPC asyncio clients bind to the running event loop when they are
+    built, so they cannot be created in a worker thread. They are
+    registered with on_loop=True and a prepare step (importing the SDK,
+    fetching credentials) that runs in a thread; only the cheap factory
+    then runs on the loop.
+    """
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._prepares: Dict[str, Optional[Callable[[], Any]]] = {}
+        self._on_loop: Dict[str, bool] = {}
+        self._closers: Dict[str, Optional[Callable[[Any], Any]]] = {}
+        self._clients: Dict[str, Any] = {}
+        self._stats: Dict[str, dict] = {}
+        # Reentrant: factories may get() the clients they depend on
+        self._lock = threading.RLock()
+
+    def register(
+        self,
+        name: str,
+        factory: Callable[[], Any],
+        closer: Optional[Callable[[Any], Any]] = None,
+        prepare: Optional[Callable[[], Any]] = None,
+        on_loop: bool = False
+    ) -> None:
+        """
+        Registers a client factory under a name.
+
+        Args:
+            name: Key used to look the client up (e.g., 'speech')
+            factory: Zero-argument callable that builds the client
+            closer: Optional callable invoked with the client on shutdown
+            prepare: Optional blocking setup run before the factory, in a
+                     worker thread when called through aget() or warm()
+            on_loop: Whether the factory must run on the event loop (e.g.,
+                     gRPC asyncio clients); warm() then only runs prepare
+        """
+        self._factories[name] = factory
+        self._prepares[name] = prepare
+        self._on_loop[name] = on_loop
+        self._closers[name] = closer
+        self._stats[name] = {"created": 0, "reused": 0, "init_ms": None}
+
+    def get(self, name: str) -> Any:
+        """
+        Returns the shared client, creating it on first use.
+
+        Args:
+            name: Registered client name
+
+        Returns:
+            The shared client instance
+
+        Raises:
+            KeyError: If no factory is registered under the name
+        """
+        stats = self._stats[name]
+        client = self._clients.get(name)
+        if client is not None:
+            stats["reused"] += 1
+            return client
+
+        with self._lock:
+            client = self._clients.get(name)
+            if client is not None:
+                stats["reused"] += 1
+                return client
+            prepare = self._prepares[name]
+            if prepare is not None:
+                prepare()
+            return self._create(name)
+
+    def _create(self, name: str) -> Any:
+        stats = self._stats[name]
+        started = time.perf_counter()
+        client = self._factories[name]()
+        stats["init_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        stats["created"] += 1
+        self._clients[name] = client
+        return client
+
+    async def aget(self, name: str) -> Any:
+        """
+        Returns the shared client without blocking the event loop.
+
+        A client that already exists is returned directly. Otherwise it is
+        created (or, if warm-up is building it, waited for) in a worker
+        thread, since factories import SDKs, initialize them and fetch
+        credentials, and the registry lock may be held by the warm-up thread.
+        For on_loop clients only the prepare step runs in a thread; the
+        factory then runs here, without the lock, since the loop is the
+        only place they are built.
+
+        Args:
+            name: Registered client name
+
+        Returns:
+            The shared client instance
+
+        Raises:
+            KeyError: If no factory is registered under the name
+        """
+        client = self._clients.get(name)
+        if client is not None:
+            self._stats[name]["reused"] += 1
+            return client
+        if not self._on_loop[name]:
+            return await asyncio.to_thread(self.get, name)
+
+        prepare = self._prepares[name]
+        if prepare is not None:
+            await asyncio.to_thread(prepare)
+        # Another request may have built it while this one was preparing
+        client = self._clients.get(name)
+        if client is not None:
+            self._stats[name]["reused"] += 1
+            return client
+        return self._create(name)
+
+    def warm(self, names: Optional[Iterable[str]] = None) -> None:
+        """
+        Creates clients ahead of the first request.
+
+        Failures are logged rather than raised so a missing credential for one
+        client does not stop the application from starting. on_loop clients
+        are only prepared (SDK imported, credentials fetched); the first
+        request builds them on the loop.
+
+        Args:
+            names: Client names to create; defaults to every registered client
+        """
+        for name in names if names is not None else list(self._factories):
+            if name in self._clients:
+                continue
+            try:
+                if self._on_loop[name]:
+                    prepare = self._prepares[name]
+                    if prepare is not None:
+                        prepare()
+                    continue
+                self.get(name)
+            except Exception as e:
+                logger.warning("Failed to initialize %s client: %s", name, e)
+
+    async def aclose(self) -> None:
+        """Closes every created client and forgets it."""
+        for name, client in list(self._clients.items()):
+            closer = self._closers.get(name)
+            if closer is None:
+                continue
+            try:
+                result = closer(client)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.warning("Failed to close %s client: %s", name, e)
+        self._clients.clear()
+
+    def stats(self) -> dict:
+        """
+        Per-client creation and reuse counters.
+
+        Returns:
+            Dictionary keyed by client name
+        """
+        return {
+            name: dict(stats, open=name in self._clients)
+            for name, stats in self._stats.items()
+        }
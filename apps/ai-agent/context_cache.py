@@ -0,0 +1,265 @@
+"""
+Reusable persona/brand prefix contexts.
+
+The persona and brand preamble is sent as a system instruction rather than
+pasted into every prompt. Preambles above a size threshold are registered
+once with Vertex AI context caching, keyed by a hash of (model, preamble),
+and shared across turns and across users testing the same audience. Leases
+are ref-counted so a cached context is never deleted while a request is
+still using it.
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+
+from caching import SingleFlight, TTLCache
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ContextEntry:
+    """
+    A registered cached context and its bookkeeping.
+
+    Args:
+        model: Model bound to the cached context
+        handle: Backend handle used to delete the cached context
+        expires_at: Monotonic time after which no new leases are handed out
+        refcount: Number of requests currently using the context
+    """
+    model: Any
+    handle: Any
+    expires_at: float
+    refcount: int = 0
+
+
+@dataclass
+class ContextLease:
+    """
+    A request's hold on a persona model.
+
+    Args:
+        model: Model to call for this request
+        key: Context key, or None for uncached system-instruction models
+        cached: Whether the model is backed by a server-side cached context
+    """
+    model: Any
+    key: Optional[str] = None
+    cached: bool = False
+
+
+def context_key(model_name: str, system_instruction: str) -> str:
+    """
+    Hashes a model name and persona/brand preamble into a context key.
+
+    Args:
+        model_name: Model the context is created for
+        system_instruction: Persona and brand preamble
+
+    Returns:
+        Hex digest identifying the context
+    """
+    return hashlib.sha256(f"{model_name}\0{system_instruction}".encode()).hexdigest()
+
+
+class PersonaContextCache:
+    """
+    Hands out persona models, registering large preambles as cached contexts.
+
+    Args:
+        model_factory: Builds a model with a system instruction (blocking): (model_name, text) -> model
+        cached_model_factory: Registers a cached context (blocking):
+                              (model_name, text, ttl_seconds) -> (model, handle)
+        delete_handle: Deletes a cached context (blocking): (handle) -> None
+        enabled: Whether server-side context caching is used at all
+        min_chars: Preambles shorter than this are sent as plain system instructions
+        ttl: Lifetime of a cached context in seconds
+        refresh_margin: Seconds before expiry at which a context stops taking new leases
+        max_models: Number of system-instruction models kept for reuse
+    """
+
+    def __init__(
+        self,
+        model_factory: Callable[[str, str], Any],
+        cached_model_factory: Callable[[str, str, int], Tuple[Any, Any]],
+        delete_handle: Callable[[Any], None],
+        enabled: bool,
+        min_chars: int,
+        ttl: int,
+        refresh_margin: int = 120,
+        max_models: int = 256
+    ):
+        self._model_factory = model_factory
+        self._cached_model_factory = cached_model_factory
+        self._delete_handle = delete_handle
+        self.enabled = enabled
+        self.min_chars = min_chars
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self._entries: Dict[str, ContextEntry] = {}
+        self._retiring: list = []
+        self._failed = TTLCache(max_entries=1024, ttl=ttl)
+        self._models = TTLCache(max_entries=max_models, ttl=0)
+        self._flights = SingleFlight()
+        self._last_sweep = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+        self.fallbacks = 0
+        self.deleted = 0
+
+    async def _system_model(self, model_name: str, system_instruction: str, key: str) -> Any:
+        model = self._models.get(key)
+        if model is None:
+            # The factory may import and initialize the SDK on first use
+            model = await asyncio.to_thread(self._model_factory, model_name, system_instruction)
+            self._models.set(key, model)
+        return model
+
+    def cacheable(self, system_instruction: str) -> bool:
+        """
+        Checks whether a preamble is large enough to be registered as a cached context.
+
+        Args:
+            system_instruction: Persona and brand preamble
+
+        Returns:
+            True if caching is enabled and the preamble meets min_chars
+        """
+        return self.enabled and len(system_instruction) >= self.min_chars
+
+    async def acquire(self, model_name: str, system_instruction: str) -> ContextLease:
+        """
+        Returns a model for the preamble, creating a cached context if worthwhile.
+
+        Args:
+            model_name: Model to use
+            system_instruction: Persona and brand preamble
+
+        Returns:
+            ContextLease that must be passed to release()
+        """
+        self._sweep()
+        key = context_key(model_name, system_instruction)
+        if not self.cacheable(system_instruction) or self._failed.get(key):
+            return ContextLease(model=await self._system_model(model_name, system_instruction, key))
+
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at > time.monotonic():
+            self.hits += 1
+        else:
+            self.misses += 1
+            if entry is not None:
+                self._retire(key)
+            entry = await self._flights.do(key, lambda: self._create(key, model_name, system_instruction))
+            if entry is None:
+                return ContextLease(model=await self._system_model(model_name, system_instruction, key))
+
+        entry.refcount += 1
+        return ContextLease(model=entry.model, key=key, cached=True)
+
+    async def _create(self, key: str, model_name: str, system_instruction: str) -> Optional[ContextEntry]:
+        try:
+            model, handle = await asyncio.to_thread(
+                self._cached_model_factory, model_name, system_instruction, self.ttl
+            )
+        except Exception as e:
+            # e.g., preamble below the service's minimum cacheable size
+            logger.warning("Context cache creation failed, using system instruction: %s", e)
+            self.fallbacks += 1
+            self._failed.set(key, True)
+            return None
+
+        entry = ContextEntry(
+            model=model,
+            handle=handle,
+            expires_at=time.monotonic() + self.ttl - self.refresh_margin
+        )
+        self._entries[key] = entry
+        self.created += 1
+        return entry
+
+    def _sweep(self, interval: float = 60.0) -> None:
+        # Retire expired contexts nobody has asked for since they lapsed
+        now = time.monotonic()
+        if now - self._last_sweep < interval:
+            return
+        self._last_sweep = now
+        for key in [k for k, e in self._entries.items() if e.expires_at <= now]:
+            self._retire(key)
+
+    def _retire(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._retiring.append(entry)
+        self._reap()
+
+    def _reap(self) -> None:
+        # Delete retired contexts once no request holds a lease on them
+        for entry in [e for e in self._retiring if e.refcount == 0]:
+            self._retiring.remove(entry)
+            asyncio.get_running_loop().run_in_executor(None, self._delete_quietly, entry.handle)
+
+    def _delete_quietly(self, handle: Any) -> None:
+        try:
+            self._delete_handle(handle)
+            self.deleted += 1
+        except Exception as e:
+            logger.warning("Failed to delete cached context: %s", e)
+
+    def release(self, lease: ContextLease) -> None:
+        """
+        Drops a request's hold on a cached context.
+
+        Args:
+            lease: Lease returned by acquire(); uncached leases are a no-op
+        """
+        if not lease.cached:
+            return
+        entry = self._entries.get(lease.key)
+        if entry is not None and entry.model is lease.model:
+            entry.refcount -= 1
+            return
+        for entry in self._retiring:
+            if entry.model is lease.model:
+                entry.refcount -= 1
+                break
+        self._reap()
+
+    @asynccontextmanager
+    async def lease(self, model_name: str, system_instruction: str) -> AsyncIterator[Any]:
+        """Context manager wrapper around acquire() and release() yielding the model."""
+        lease = await self.acquire(model_name, system_instruction)
+        try:
+            yield lease.model
+        finally:
+            self.release(lease)
+
+    async def aclose(self) -> None:
+        """Deletes every cached context this process created."""
+        entries = list(self._entries.values()) + self._retiring
+        self._entries.clear()
+        self._retiring.clear()
+        for entry in entries:
+            await asyncio.to_thread(self._delete_quietly, entry.handle)
+
+    def stats(self) -> dict:
+        """Hit/miss and lifecycle counters."""
+        return {
+            "enabled": self.enabled,
+            "min_chars": self.min_chars,
+            "hits": self.hits,
+            "misses": self.misses,
+            "created": self.created,
+            "fallbacks": self.fallbacks,
+            "deleted": self.deleted,
+            "active": len(self._entries),
+            "leased": sum(entry.refcount for entry in self._entries.values()),
+            "system_instruction_models": len(self._models),
+        }
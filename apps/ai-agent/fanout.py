@@ -0,0 +1,179 @@
+"""
+Concurrent fan-out of work items under a parallelism limit.
+
+run_fanout asks one question across many (audience, creative) cells and
+yields results as each cell finishes, so callers can stream them back. A
+failing cell is reported as a failed result instead of aborting the rest
+of the batch. run_ordered is for pipelines whose output must stay in input
+order, such as sentence-by-sentence speech synthesis, and run_ordered_stream
+does the same for items that are still being produced.
+"""
+
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, Optional, Sequence
+
+
+@dataclass
+class CellResult:
+    """
+    Outcome of one fan-out cell.
+
+    Args:
+        index: Position of the cell in the submitted list
+        cell: The cell that was run
+        value: Worker result on success
+        error: Error message on failure
+        elapsed_ms: Wall time from the cell starting to finishing
+    """
+    index: int
+    cell: Any
+    value: Any = None
+    error: Optional[str] = None
+    elapsed_ms: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        """Whether the cell completed successfully."""
+        return self.error is None
+
+
+async def run_fanout(
+    cells: Sequence[Any],
+    worker: Callable[[Any], Awaitable[Any]],
+    parallelism: int
+) -> AsyncIterator[CellResult]:
+    """
+    Runs worker over every cell concurrently, yielding results in completion order.
+
+    If the consumer stops iterating (e.g., the client disconnects), cells
+    that have not finished are cancelled.
+
+    Args:
+        cells: Work items to process
+        worker: Coroutine function run once per cell
+        parallelism: Maximum number of cells running at once
+
+    Yields:
+        CellResult for each cell as it finishes
+    """
+    semaphore = asyncio.Semaphore(max(1, parallelism))
+
+    async def run_cell(index: int, cell: Any) -> CellResult:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                value = await worker(cell)
+                return CellResult(index=index, cell=cell, value=value,
+                                  elapsed_ms=(time.perf_counter() - started) * 1000)
+            except Exception as e:
+                return CellResult(index=index, cell=cell, error=f"{type(e).__name__}: {e}",
+                                  elapsed_ms=(time.perf_counter() - started) * 1000)
+
+    tasks = [asyncio.create_task(run_cell(index, cell)) for index, cell in enumerate(cells)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+# Marks the end of run_ordered's input
+_DONE = object()
+
+
+async def run_ordered(
+    items: Iterable[Any],
+    worker: Callable[[Any], Awaitable[Any]],
+    parallelism: int
+) -> AsyncIterator[Any]:
+    """
+    Runs worker over items concurrently, yielding results in input order.
+
+    At most parallelism items are in flight, counted from the oldest result
+    not yet yielded, so the first result is available as soon as possible
+    and work never runs far ahead of the consumer. An exception from any
+    item is raised when its turn comes; remaining items are then cancelled.
+
+    Args:
+        items: Work items to process, in output order
+        worker: Coroutine function run once per item
+        parallelism: Maximum number of items running at once
+
+    Yields:
+        Worker results, in the order of items
+    """
+    remaining = iter(items)
+    window = max(1, parallelism)
+    pending: deque = deque()
+
+    def refill() -> None:
+        while len(pending) < window:
+            item = next(remaining, _DONE)
+            if item is _DONE:
+                return
+            pending.append(asyncio.create_task(worker(item)))
+
+    try:
+        refill()
+        while pending:
+            result = await pending.popleft()
+            refill()
+            yield result
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def run_ordered_stream(
+    items: AsyncIterable[Any],
+    worker: Callable[[Any], Awaitable[Any]],
+    parallelism: int
+) -> AsyncIterator[Any]:
+    """
+    Like run_ordered, for items that arrive over time (e.g., generated sentences).
+
+    Each item starts as soon as it arrives and a slot is free, so work on
+    early items overlaps with production of later ones. Errors from items or
+    from the producer are raised in order; pending work is then cancelled.
+
+    Args:
+        items: Asynchronous source of work items, in output order
+        worker: Coroutine function run once per item
+        parallelism: Maximum number of items running at once
+
+    Yields:
+        Worker results, in the order of items
+    """
+    semaphore = asyncio.Semaphore(max(1, parallelism))
+    started: asyncio.Queue = asyncio.Queue()
+
+    async def run(item: Any) -> Any:
+        async with semaphore:
+            return await worker(item)
+
+    async def feed() -> None:
+        try:
+            async for item in items:
+                await started.put(asyncio.create_task(run(item)))
+        finally:
+            await started.put(_DONE)
+
+    feeder = asyncio.create_task(feed())
+    try:
+        while True:
+            task = await started.get()
+            if task is _DONE:
+                break
+            yield await task
+        # Surface a producer failure once everything it produced is delivered
+        await feeder
+    finally:
+        feeder.cancel()
+        while not started.empty():
+            task = started.get_nowait()
+            if task is not _DONE:
+                task.cancel()
@@ -0,0 +1,243 @@
+"""
+Token-budgeted conversation history for persona prompts.
+
+The most recent turns are always kept verbatim. Older turns that no longer
+fit the budget are compacted into a rolling summary that is cached per
+conversation and extended incrementally as more turns fall out of the
+window, so prompt size and assembly time stay flat as a conversation grows.
+Summaries of stateless conversations, which resend their whole history,
+are only reused when every message they cover matches the request's
+history, so conversations that merely share an opening message never see
+each other's turns.
+"""
+
+import hashlib
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Optional, Sequence
+
+from caching import TTLCache
+
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (about four characters per token for English text).
+
+    Args:
+        text: Text to measure
+
+    Returns:
+        Estimated token count
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def format_message(message: Any) -> str:
+    """
+    Formats one chat message as a transcript line.
+
+    Args:
+        message: Object with 'sender' and 'text' attributes
+
+    Returns:
+        "User: ..." or "Agent: ..." line ending in a newline
+    """
+    speaker = "User" if message.sender == 'user' else "Agent"
+    return f"{speaker}: {message.text}\n"
+
+
+def compact_message(message: Any, max_chars: int) -> str:
+    """
+    Compacts a message into a one-line summary entry.
+
+    Keeps the first sentence (or the first max_chars characters) and drops
+    line breaks, which preserves the gist of each turn at a fraction of its size.
+
+    Args:
+        message: Object with 'sender' and 'text' attributes
+        max_chars: Maximum characters of message text to keep
+
+    Returns:
+        Summary line ending in a newline
+    """
+    text = " ".join(message.text.split())
+    for terminator in (". ", "? ", "! "):
+        end = text.find(terminator)
+        if 0 < end < max_chars:
+            text = text[:end + 1]
+            break
+    if len(text) > max_chars:
+        text = text[:max_chars].rstrip() + "..."
+    speaker = "User" if message.sender == 'user' else "Agent"
+    return f"- {speaker}: {text}\n"
+
+
+def message_digest(message: Any) -> str:
+    """Short digest identifying a message's sender and text."""
+    return hashlib.sha1(f"{message.sender}\0{message.text}".encode()).hexdigest()
+
+
+def prefix_digest(messages: Sequence[Any]) -> str:
+    """Digest identifying a run of messages: every sender and text, in order."""
+    digest = hashlib.sha1()
+    for message in messages:
+        digest.update(f"{message.sender}\0{len(message.text)}\0{message.text}".encode())
+    return digest.hexdigest()
+
+
+@dataclass
+class RollingSummary:
+    """
+    Compacted form of a conversation's older turns.
+
+    Args:
+        covered: Number of leading messages folded into the summary
+        prefix: Digest identifying the covered messages, used to validate reuse
+        lines: Summary lines, oldest first
+        tokens: Estimated token count of all lines
+    """
+    covered: int = 0
+    prefix: Optional[str] = None
+    lines: Deque[str] = field(default_factory=deque)
+    tokens: int = 0
+
+
+class HistoryBuilder:
+    """
+    Builds conversation prompts within a token budget.
+
+    Args:
+        token_budget: Target size of the conversation prompt in tokens
+        min_recent_messages: Messages always kept verbatim, even over budget
+        summary_token_budget: Maximum size of the rolling summary; the oldest
+                              summary lines are dropped beyond it
+        summary_line_chars: Characters of each message kept in its summary line
+        max_conversations: Number of conversation summaries kept in memory
+    """
+
+    def __init__(
+        self,
+        token_budget: int,
+        min_recent_messages: int = 6,
+        summary_token_budget: int = 1500,
+        summary_line_chars: int = 200,
+        max_conversations: int = 1024
+    ):
+        self.token_budget = token_budget
+        self.min_recent_messages = min_recent_messages
+        self.summary_token_budget = summary_token_budget
+        self.summary_line_chars = summary_line_chars
+        self._summaries = TTLCache(max_entries=max_conversations, ttl=0)
+        self.summary_reuses = 0
+        self.summary_rebuilds = 0
+
+    def _split_point(self, history: Sequence[Any], reserved_tokens: int) -> int:
+        """Index of the first message kept verbatim, walking back from the newest."""
+        budget = self.token_budget - reserved_tokens
+        used = 0
+        index = len(history)
+        while index > 0:
+            cost = estimate_tokens(history[index - 1].text) + 2
+            kept = len(history) - index
+            if kept >= self.min_recent_messages and used + cost > budget:
+                break
+            used += cost
+            index -= 1
+        return index
+
+    def _extend(self, summary: RollingSummary, messages: Sequence[Any]) -> None:
+        for message in messages:
+            line = compact_message(message, self.summary_line_chars)
+            summary.lines.append(line)
+            summary.tokens += estimate_tokens(line)
+        # Roll the window: the oldest summary lines go first
+        while summary.tokens > self.summary_token_budget and len(summary.lines) > 1:
+            summary.tokens -= estimate_tokens(summary.lines.popleft())
+
+    def _summary_for(
+        self,
+        history: Sequence[Any],
+        split: int,
+        conversation_id: Optional[str]
+    ) -> RollingSummary:
+        """Returns a summary covering history[:split], reusing cached work where valid."""
+        if conversation_id is not None:
+            # Session histories are kept server-side and only appended to, so
+            # the last covered message identifies the covered prefix
+            cache_key = conversation_id
+            covered_digest = lambda covered: message_digest(history[covered - 1])
+        else:
+            # Clients may send any history; check every covered message
+            cache_key = message_digest(history[0])
+            covered_digest = lambda covered: prefix_digest(history[:covered])
+        cached = self._summaries.get(cache_key)
+
+        if (
+            cached is not None
+            and 0 < cached.covered <= split
+            and covered_digest(cached.covered) == cached.prefix
+        ):
+            self.summary_reuses += 1
+            summary = cached
+            self._extend(summary, history[cached.covered:split])
+        else:
+            self.summary_rebuilds += 1
+            summary = RollingSummary()
+            # Only the tail can survive the summary budget, so skip compacting the rest
+            start = max(0, split - self.summary_token_budget)
+            self._extend(summary, history[start:split])
+
+        summary.covered = split
+        summary.prefix = covered_digest(split)
+        self._summaries.set(cache_key, summary)
+        return summary
+
+    def build(
+        self,
+        user_prompt: str,
+        history: Optional[Sequence[Any]] = None,
+        conversation_id: Optional[str] = None
+    ) -> str:
+        """
+        Builds the conversation prompt for a new turn.
+
+        Args:
+            user_prompt: User's current question
+            history: Previous messages (objects with 'sender' and 'text'), oldest first
+            conversation_id: Optional stable id of a server-side, append-only
+                             history (e.g., a session id) for summary caching
+
+        Returns:
+            Prompt with an optional summary of earlier turns, the recent
+            transcript and the new user message
+        """
+        history = history or []
+        parts = []
+
+        split = self._split_point(history, estimate_tokens(user_prompt) + self.summary_token_budget)
+        if split > 0:
+            summary = self._summary_for(history, split, conversation_id)
+            parts.append("--- Summary of Earlier Conversation ---\n")
+            parts.extend(summary.lines)
+
+        parts.append("--- Begin Conversation History ---\n")
+        parts.extend(format_message(message) for message in history[split:])
+
+        # Add the current user message
+        parts.append(f"User: {user_prompt}\n")
+        parts.append("Agent: ")  # Prompt the agent to respond
+        return "".join(parts)
+
+    def stats(self) -> dict:
+        """Budget settings and summary cache counters."""
+        return {
+            "token_budget": self.token_budget,
+            "min_recent_messages": self.min_recent_messages,
+            "summary_token_budget": self.summary_token_budget,
+            "cached_summaries": len(self._summaries),
+            "summary_reuses": self.summary_reuses,
+            "summary_rebuilds": self.summary_rebuilds,
+        }
@@ -0,0 +1,218 @@
+"""
+Image normalization before images are sent to Gemini.
+
+Uploaded images are decoded once, downsized to a maximum dimension,
+re-encoded in a target format and quality, and stripped of metadata (EXIF,
+GPS, ICC, comments). Results are cached by content hash, so re-sending the
+same creative costs nothing. Decoding and encoding run in a dedicated
+thread pool so large photos never block the event loop.
+
+Requires the optional 'Pillow' package; without it images pass through unchanged.
+"""
+
+import asyncio
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+from caching import SingleFlight, TTLCache
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional
+    Image = None
+    ImageOps = None
+
+
+logger = logging.getLogger(__name__)
+
+
+FORMAT_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+@dataclass
+class NormalizedImage:
+    """
+    Result of normalizing one image.
+
+    Args:
+        data: Image bytes to send to the model
+        mime_type: MIME type of data
+        original_size: Size of the uploaded image in bytes
+        width: Width of data in pixels (0 if unknown)
+        height: Height of data in pixels (0 if unknown)
+        changed: Whether data differs from the upload
+    """
+    data: bytes
+    mime_type: str
+    original_size: int
+    width: int = 0
+    height: int = 0
+    changed: bool = False
+
+    @property
+    def bytes_saved(self) -> int:
+        """Bytes removed compared with the upload."""
+        return self.original_size - len(self.data)
+
+
+class ImagePipeline:
+    """
+    Resizes, recompresses and strips images, caching results by content hash.
+
+    Args:
+        enabled: Whether images are normalized at all
+        max_dimension: Longest side in pixels after resizing
+        output_format: 'JPEG', 'WEBP' or 'PNG'
+        quality: Encoder quality for JPEG and WEBP (1-95)
+        max_entries: Number of normalized images kept in the cache
+        workers: Threads used for decoding and encoding
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        max_dimension: int = 1536,
+        output_format: str = "JPEG",
+        quality: int = 85,
+        max_entries: int = 256,
+        workers: int = 2
+    ):
+        output_format = output_format.upper()
+        if output_format not in FORMAT_MIME_TYPES:
+            raise ValueError(f"Unsupported image format: {output_format}")
+        self.available = Image is not None
+        self.enabled = enabled and self.available
+        if enabled and not self.available:
+            logger.warning("Image normalization disabled: the 'Pillow' package is not installed")
+        self.max_dimension = max_dimension
+        self.output_format = output_format
+        self.quality = quality
+        self._workers = max(1, workers)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._cache = TTLCache(max_entries=max_entries, ttl=0)
+        self._flights = SingleFlight()
+        self.processed = 0
+        self.cache_hits = 0
+        self.passed_through = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _settings_key(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        return f"{digest}:{self.max_dimension}:{self.output_format}:{self.quality}"
+
+    def _process(self, data: bytes, mime_type: str) -> NormalizedImage:
+        """Decodes, resizes and re-encodes one image (runs in the worker pool)."""
+        with Image.open(io.BytesIO(data)) as image:
+            if getattr(image, "n_frames", 1) > 1:
+                # Animated images would lose their frames; leave them alone
+                return NormalizedImage(data, mime_type, len(data), image.width, image.height)
+
+            had_metadata = bool(image.info.get("exif") or image.info.get("icc_profile"))
+            bounds = (self.max_dimension, self.max_dimension)
+            # JPEG can decode straight to a reduced scale, skipping most of the work
+            image.draft("RGB", bounds)
+            image = ImageOps.exif_transpose(image)
+            resized = max(image.size) > self.max_dimension
+            if resized:
+                image.thumbnail(bounds, Image.Resampling.LANCZOS)
+
+            if self.output_format == "JPEG" and image.mode != "RGB":
+                if image.mode in ("RGBA", "LA", "P"):
+                    # JPEG has no alpha channel: flatten onto white
+                    image = image.convert("RGBA")
+                    background = Image.new("RGB", image.size, (255, 255, 255))
+                    background.paste(image, mask=image.getchannel("A"))
+                    image = background
+                else:
+                    image = image.convert("RGB")
+
+            out = io.BytesIO()
+            options = {"optimize": True}
+            if self.output_format in ("JPEG", "WEBP"):
+                options["quality"] = self.quality
+            # No exif/icc arguments are passed, so metadata is dropped
+            image.save(out, format=self.output_format, **options)
+            encoded = out.getvalue()
+            width, height = image.size
+
+        if len(encoded) >= len(data) and not resized and not had_metadata:
+            # Already compact and clean; re-encoding would only cost quality
+            return NormalizedImage(data, mime_type, len(data), width, height)
+        return NormalizedImage(
+            encoded, FORMAT_MIME_TYPES[self.output_format], len(data), width, height, changed=True
+        )
+
+    async def normalize(self, data: bytes, mime_type: str) -> NormalizedImage:
+        """
+        Normalizes an image, reusing the cached result for identical bytes.
+
+        Images that cannot be decoded are passed through unchanged so the
+        model can still try them.
+
+        Args:
+            data: Uploaded image bytes
+            mime_type: MIME type the image was uploaded with
+
+        Returns:
+            NormalizedImage to send to the model
+        """
+        if not self.enabled:
+            return NormalizedImage(data, mime_type, len(data))
+
+        loop = asyncio.get_running_loop()
+        key = await loop.run_in_executor(self._pool(), self._settings_key, data)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self.cache_hits += 1
+            return NormalizedImage(
+                cached.data, cached.mime_type, len(data), cached.width, cached.height, cached.changed
+            )
+
+        async def process() -> NormalizedImage:
+            try:
+                result = await loop.run_in_executor(self._pool(), self._process, data, mime_type)
+            except Exception as e:
+                logger.info("Image normalization failed, sending original: %s", e)
+                self.passed_through += 1
+                return NormalizedImage(data, mime_type, len(data))
+            self.processed += 1
+            self.bytes_in += len(data)
+            self.bytes_out += len(result.data)
+            self._cache.set(key, result)
+            return result
+
+        return await self._flights.do(key, process)
+
+    def _pool(self) -> ThreadPoolExecutor:
+        """The worker pool, started on first use (and again after close)."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="image")
+        return self._executor
+
+    def close(self) -> None:
+        """Shuts down the worker pool; a later call starts a fresh one."""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        """Settings and processing counters."""
+        return {
+            "enabled": self.enabled,
+            "available": self.available,
+            "max_dimension": self.max_dimension,
+            "format": self.output_format,
+            "quality": self.quality,
+            "cached": len(self._cache),
+            "processed": self.processed,
+            "cache_hits": self.cache_hits,
+            "passed_through": self.passed_through,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+        }
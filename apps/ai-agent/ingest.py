@@ -0,0 +1,301 @@
+"""
+Memory-bounded ingestion of multipart uploads.
+
+Uploads are read in fixed-size chunks rather than with a single read(), so
+size limits are enforced before the whole file is held in memory. Files are
+kept in memory up to a spool threshold and written to a temporary file
+beyond it, and the SHA-256 is computed on the fly so the media store never
+has to hash the bytes again. Memory held by ingestion is tracked per upload
+and process-wide so it can be reported.
+
+Starlette parses (and spools) the whole multipart body before a handler sees
+the first file, so RequestBodyLimit caps the request body of each upload
+route while it is still being received.
+"""
+
+import asyncio
+import hashlib
+import io
+import tempfile
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Callable, Dict, Optional, Union
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the size limit for its kind."""
+
+    def __init__(self, kind: str, max_bytes: int):
+        super().__init__(f"{kind} upload exceeds the {max_bytes} byte limit")
+        self.kind = kind
+        self.max_bytes = max_bytes
+
+
+class UploadTooSmallError(Exception):
+    """Raised when an upload is below the minimum size for its kind."""
+
+    def __init__(self, kind: str, size: int, min_bytes: int):
+        super().__init__(f"{kind} upload is {size} bytes; at least {min_bytes} are required")
+        self.kind = kind
+        self.size = size
+        self.min_bytes = min_bytes
+
+
+@dataclass
+class UploadLimit:
+    """
+    Size limits and defaults for one kind of upload.
+
+    Args:
+        kind: Name used in error messages (e.g., "image")
+        max_bytes: Largest accepted upload
+        min_bytes: Smallest accepted upload
+        default_mime_type: MIME type used when the client sends none
+    """
+    kind: str
+    max_bytes: int
+    min_bytes: int = 0
+    default_mime_type: str = "application/octet-stream"
+
+
+class IngestedUpload:
+    """
+    An upload read into memory or a spool file.
+
+    Args:
+        ingestor: Ingestor that accounts for the upload's memory
+        filename: Client-supplied filename
+        mime_type: MIME type of the upload
+    """
+
+    def __init__(self, ingestor: "Ingestor", filename: str, mime_type: str):
+        self._ingestor = ingestor
+        self.filename = filename
+        self.mime_type = mime_type
+        self.size = 0
+        self.media_id = ""
+        self.peak_memory = 0
+        self._buffer: Optional[Union[bytearray, bytes]] = bytearray()
+        self._file: Optional[BinaryIO] = None
+        self._held = 0
+
+    @property
+    def on_disk(self) -> bool:
+        """Whether the upload was spooled to a temporary file."""
+        return self._file is not None
+
+    def _hold(self, nbytes: int) -> None:
+        # Adjust the memory this upload holds and record the high-water mark
+        self._held += nbytes
+        self._ingestor._account(nbytes)
+        self.peak_memory = max(self.peak_memory, self._held)
+
+    def _release(self) -> None:
+        self._ingestor._account(-self._held)
+        self._held = 0
+
+    async def read(self) -> bytes:
+        """
+        Returns the whole upload as bytes.
+
+        Only call this for uploads that are meant to be sent inline; the
+        bytes count towards the upload's peak memory.
+
+        Returns:
+            Upload bytes
+        """
+        if self._buffer is not None:
+            if isinstance(self._buffer, bytearray):
+                # Swap the growable buffer for an immutable copy that can be handed out
+                self._buffer = bytes(self._buffer)
+            return self._buffer
+
+        def read_file() -> bytes:
+            self._file.seek(0)
+            return self._file.read()
+
+        data = await asyncio.to_thread(read_file)
+        self._hold(len(data))
+        return data
+
+    def open(self) -> BinaryIO:
+        """
+        Returns a binary file object positioned at the start of the upload.
+
+        Used to stream spooled uploads to object storage without loading them.
+        """
+        if self._buffer is not None:
+            return io.BytesIO(self._buffer)
+        self._file.seek(0)
+        return self._file
+
+    async def aclose(self) -> None:
+        """Frees the upload's buffer or spool file."""
+        self._buffer = None
+        if self._file is not None:
+            await asyncio.to_thread(self._file.close)
+            self._file = None
+        self._release()
+
+
+class Ingestor:
+    """
+    Reads uploads in chunks under per-kind size limits.
+
+    Args:
+        chunk_size: Bytes read from the request per step
+        spool_threshold: Uploads larger than this are written to a temporary file
+        spool_dir: Directory for spool files (system default if None)
+    """
+
+    def __init__(self, chunk_size: int, spool_threshold: int, spool_dir: Optional[str] = None):
+        self.chunk_size = chunk_size
+        self.spool_threshold = spool_threshold
+        self.spool_dir = spool_dir
+        self.memory_in_use = 0
+        self.peak_memory_in_use = 0
+        self.ingested = 0
+        self.spooled = 0
+        self.rejected = 0
+        self.bytes_ingested = 0
+
+    def _account(self, nbytes: int) -> None:
+        self.memory_in_use += nbytes
+        self.peak_memory_in_use = max(self.peak_memory_in_use, self.memory_in_use)
+
+    async def ingest(self, upload: Any, limit: UploadLimit) -> IngestedUpload:
+        """
+        Reads an upload chunk by chunk, enforcing the limit as it goes.
+
+        Args:
+            upload: FastAPI UploadFile
+            limit: Limits for this kind of upload
+
+        Returns:
+            IngestedUpload; the caller must aclose() it
+
+        Raises:
+            UploadTooLargeError: If the upload exceeds limit.max_bytes
+            UploadTooSmallError: If the upload is below limit.min_bytes
+        """
+        # Starlette reports the size when it is known, so reject early
+        declared_size = getattr(upload, "size", None)
+        if declared_size is not None and declared_size > limit.max_bytes:
+            self.rejected += 1
+            raise UploadTooLargeError(limit.kind, limit.max_bytes)
+
+        result = IngestedUpload(
+            self,
+            filename=upload.filename or "",
+            mime_type=upload.content_type or limit.default_mime_type
+        )
+        digest = hashlib.sha256()
+        try:
+            while True:
+                chunk = await upload.read(self.chunk_size)
+                if not chunk:
+                    break
+                result.size += len(chunk)
+                if result.size > limit.max_bytes:
+                    raise UploadTooLargeError(limit.kind, limit.max_bytes)
+                digest.update(chunk)
+
+                if result._buffer is not None and len(result._buffer) + len(chunk) <= self.spool_threshold:
+                    result._buffer.extend(chunk)
+                    result._hold(len(chunk))
+                    continue
+
+                result._hold(len(chunk))
+                if result._buffer is not None:
+                    # Crossed the threshold: move what is buffered to disk
+                    buffered = result._buffer
+                    result._buffer = None
+                    result._file = await asyncio.to_thread(
+                        tempfile.TemporaryFile, dir=self.spool_dir
+                    )
+                    await asyncio.to_thread(result._file.write, buffered)
+                    result._hold(-len(buffered))
+                    self.spooled += 1
+                await asyncio.to_thread(result._file.write, chunk)
+                result._hold(-len(chunk))
+
+            if result.size < limit.min_bytes:
+                raise UploadTooSmallError(limit.kind, result.size, limit.min_bytes)
+        except (UploadTooLargeError, UploadTooSmallError):
+            self.rejected += 1
+            await result.aclose()
+            raise
+        except BaseException:
+            await result.aclose()
+            raise
+
+        result.media_id = digest.hexdigest()
+        self.ingested += 1
+        self.bytes_ingested += result.size
+        return result
+
+    def stats(self) -> dict:
+        """Memory use and ingestion counters."""
+        return {
+            "chunk_size": self.chunk_size,
+            "spool_threshold": self.spool_threshold,
+            "memory_in_use": self.memory_in_use,
+            "peak_memory_in_use": self.peak_memory_in_use,
+            "ingested": self.ingested,
+            "spooled": self.spooled,
+            "rejected": self.rejected,
+            "bytes_ingested": self.bytes_ingested,
+        }
+
+
+class RequestBodyLimit:
+    """
+    ASGI middleware capping the request body of upload routes.
+
+    A request whose Content-Length exceeds its route's limit is rejected on
+    the first read, before any of the body is received. Bodies sent without
+    a Content-Length (chunked) are counted as they arrive and cut off as
+    soon as they pass the limit. The exception from reject is raised inside
+    the app's body parsing, so the app's own error handling (and CORS)
+    produce the response.
+
+    Args:
+        app: ASGI application
+        limits: Largest accepted body in bytes, by POST path
+        reject: Builds the exception raised for an oversized body, given the limit
+    """
+
+    def __init__(self, app: Any, limits: Dict[str, int], reject: Callable[[int], Exception]):
+        self.app = app
+        self.limits = limits
+        self.reject = reject
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        limit = None
+        if scope["type"] == "http" and scope["method"] == "POST":
+            limit = self.limits.get(scope["path"])
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        declared = None
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    declared = int(value)
+                except ValueError:
+                    pass
+                break
+        received = 0
+
+        async def limited_receive() -> dict:
+            nonlocal received
+            if declared is not None and declared > limit:
+                raise self.reject(limit)
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise self.reject(limit)
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,685 @@
+"""
+Persistent background jobs for long-running generations.
+
+Video analyses can outlast browser and proxy timeouts, so they are submitted
+as jobs. Submission returns a job id at once, and a bounded pool of worker
+tasks processes queued jobs from a SQLite file that survives restarts.
+Clients poll, long-poll, or name a callback URL that receives the finished
+job. An idempotency key makes a resubmission return the original job
+instead of starting a second generation.
+
+Several worker processes on one host can share the file. Each job is
+claimed with a lease, and a job whose lease expires (because its process
+died) is claimed again, up to a maximum number of attempts.
+
+Callbacks go to caller-supplied URLs, so they only connect to public
+addresses (checked on the resolved IP at connect time, which also covers
+DNS rebinding), never follow redirects and ignore proxy settings.
+"""
+
+import asyncio
+import hashlib
+import http.client
+import ipaddress
+import json
+import logging
+import socket
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from dataclasses import asdict, dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+FINISHED_STATUSES = (STATUS_SUCCEEDED, STATUS_FAILED)
+
+
+class IdempotencyConflictError(Exception):
+    """
+    Raised when an idempotency key is reused with a different request.
+
+    Args:
+        job_id: The job already registered under the key
+    """
+
+    def __init__(self, job_id: str):
+        super().__init__(f"Idempotency key already used for job {job_id} with a different request")
+        self.job_id = job_id
+
+
+class CallbackAddressError(OSError):
+    """Raised when a callback host resolves to an address callbacks may not reach."""
+
+    def __init__(self, host: str, address: str):
+        super().__init__(f"Callback host {host} resolves to non-public address {address}")
+        self.host = host
+        self.address = address
+
+
+@dataclass
+class Job:
+    """
+    A queued, running or finished job.
+
+    Args:
+        job_id: Unique identifier handed to the client
+        kind: Handler name (e.g., 'chat')
+        status: One of queued, running, succeeded, failed
+        payload: Handler input
+        result: Handler output, once succeeded
+        error: Error message, once failed
+        idempotency_key: Client-supplied deduplication key, if any
+        callback_url: URL the finished job is POSTed to, if any
+        attempts: Number of times a worker has claimed the job
+        created_at: Unix time the job was submitted
+        started_at: Unix time the current or last attempt started
+        finished_at: Unix time the job finished
+    """
+    job_id: str
+    kind: str
+    status: str
+    payload: dict
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    idempotency_key: Optional[str] = None
+    callback_url: Optional[str] = None
+    attempts: int = 0
+    created_at: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def to_dict(self) -> dict:
+        """Public view of the job, without its payload."""
+        data = asdict(self)
+        data.pop("payload")
+        return data
+
+
+def payload_digest(kind: str, payload: dict) -> str:
+    """Hashes a job's kind and payload to detect reused idempotency keys."""
+    encoded = json.dumps([kind, payload], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+_COLUMNS = (
+    "job_id, kind, status, payload, result, error, idempotency_key, callback_url, "
+    "attempts, created_at, started_at, finished_at"
+)
+
+
+class JobStore:
+    """
+    SQLite-backed job table shared by worker processes on one host.
+
+    Args:
+        path: Database file path
+        ttl: Seconds finished jobs are kept before they are purged
+        purge_interval: Seconds between sweeps of expired jobs
+    """
+
+    def __init__(self, path: str, ttl: float = 86400.0, purge_interval: float = 300.0):
+        self.path = path
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._last_purge = 0.0
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, "
+            "payload TEXT NOT NULL, digest TEXT NOT NULL, result TEXT, error TEXT, "
+            "idempotency_key TEXT UNIQUE, callback_url TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+            "lease_expires_at REAL, created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per worker thread; sqlite3 connections aren't thread-safe
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode so transactions are opened explicitly with BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _job(row: tuple) -> Job:
+        return Job(
+            job_id=row[0],
+            kind=row[1],
+            status=row[2],
+            payload=json.loads(row[3]),
+            result=json.loads(row[4]) if row[4] is not None else None,
+            error=row[5],
+            idempotency_key=row[6],
+            callback_url=row[7],
+            attempts=row[8],
+            created_at=row[9],
+            started_at=row[10],
+            finished_at=row[11],
+        )
+
+    def create(
+        self,
+        kind: str,
+        payload: dict,
+        idempotency_key: Optional[str] = None,
+        callback_url: Optional[str] = None
+    ) -> Tuple[Job, bool]:
+        """
+        Queues a job, or returns the job already registered under the key.
+
+        Args:
+            kind: Handler name
+            payload: JSON-serializable handler input
+            idempotency_key: Optional client-supplied deduplication key
+            callback_url: Optional URL to POST the finished job to
+
+        Returns:
+            Tuple of (job, whether it was created by this call)
+
+        Raises:
+            IdempotencyConflictError: If the key was used for a different request
+        """
+        digest = payload_digest(kind, payload)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if idempotency_key:
+                row = conn.execute(
+                    f"SELECT {_COLUMNS}, digest FROM jobs WHERE idempotency_key = ?", (idempotency_key,)
+                ).fetchone()
+                if row is not None:
+                    conn.execute("COMMIT")
+                    if row[-1] != digest:
+                        raise IdempotencyConflictError(row[0])
+                    return self._job(row[:-1]), False
+            job = Job(
+                job_id=uuid.uuid4().hex,
+                kind=kind,
+                status=STATUS_QUEUED,
+                payload=payload,
+                idempotency_key=idempotency_key or None,
+                callback_url=callback_url,
+                created_at=time.time(),
+            )
+            conn.execute(
+                "INSERT INTO jobs (job_id, kind, status, payload, digest, idempotency_key, callback_url, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.job_id, kind, job.status, json.dumps(payload), digest, job.idempotency_key,
+                 callback_url, job.created_at)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        return job, True
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Returns a job by id, or None if it is unknown or purged."""
+        row = self._connect().execute(f"SELECT {_COLUMNS} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+    def claim(self, kinds: List[str], lease: float, max_attempts: int) -> Optional[Job]:
+        """
+        Claims the oldest runnable job for one of the given kinds.
+
+        Runnable means queued, or running with an expired lease (its worker
+        died). Jobs that have used up their attempts are failed instead.
+
+        Args:
+            kinds: Handler names this worker can run
+            lease: Seconds the claim is valid for
+            max_attempts: Claims allowed per job before it is failed
+
+        Returns:
+            The claimed job, or None if nothing is runnable
+        """
+        if not kinds:
+            return None
+        placeholders = ",".join("?" for _ in kinds)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ?, lease_expires_at = NULL "
+                "WHERE status = ? AND lease_expires_at < ? AND attempts >= ?",
+                (STATUS_FAILED, "Job was interrupted too many times", now, STATUS_RUNNING, now, max_attempts)
+            )
+            row = conn.execute(
+                f"SELECT {_COLUMNS} FROM jobs WHERE kind IN ({placeholders}) AND "
+                "(status = ? OR (status = ? AND lease_expires_at < ?)) "
+                "ORDER BY created_at LIMIT 1",
+                (*kinds, STATUS_QUEUED, STATUS_RUNNING, now)
+            ).fetchone()
+            job = None
+            if row is not None:
+                job = self._job(row)
+                job.status = STATUS_RUNNING
+                job.attempts += 1
+                job.started_at = now
+                conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = ?, started_at = ?, lease_expires_at = ? WHERE job_id = ?",
+                    (job.status, job.attempts, now, now + lease, job.job_id)
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return job
+
+    def finish(self, job_id: str, result: Optional[dict] = None, error: Optional[str] = None) -> Optional[Job]:
+        """
+        Records a job's outcome.
+
+        Args:
+            job_id: The job
+            result: Handler output, if it succeeded
+            error: Error message, if it failed
+
+        Returns:
+            The updated job, or None if it no longer exists
+        """
+        now = time.time()
+        status = STATUS_FAILED if error is not None else STATUS_SUCCEEDED
+        conn = self._connect()
+        conn.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_expires_at = NULL "
+            "WHERE job_id = ?",
+            (status, json.dumps(result) if result is not None else None, error, now, job_id)
+        )
+        if now - self._last_purge >= self.purge_interval:
+            self._last_purge = now
+            conn.execute(
+                "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at <= ?", (now - self.ttl,)
+            )
+        return self.get(job_id)
+
+    def release(self, job_id: str) -> None:
+        """Puts a running job back in the queue (e.g., on shutdown) without using up an attempt."""
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, attempts = MAX(attempts - 1, 0), lease_expires_at = NULL "
+            "WHERE job_id = ? AND status = ?",
+            (STATUS_QUEUED, job_id, STATUS_RUNNING)
+        )
+
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs per status."""
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+def is_public_address(address: str) -> bool:
+    """
+    Checks whether an IP address is publicly routable.
+
+    Args:
+        address: IPv4 or IPv6 address
+
+    Returns:
+        False for private, loopback, link-local, shared, reserved and
+        multicast addresses (including IPv4-mapped IPv6 forms of them)
+    """
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def resolve_public(host: str, port: int) -> List[tuple]:
+    """
+    Resolves a host, refusing it unless every address is public (blocking).
+
+    Args:
+        host: Host name or IP literal
+        port: TCP port
+
+    Returns:
+        getaddrinfo() entries for the host
+
+    Raises:
+        CallbackAddressError: If any address is not public
+        OSError: If the host does not resolve
+    """
+    infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    for info in infos:
+        if not is_public_address(info[4][0]):
+            raise CallbackAddressError(host, info[4][0])
+    return infos
+
+
+def _connect_public(
+    address: tuple,
+    timeout: Any = socket._GLOBAL_DEFAULT_TIMEOUT,
+    source_address: Any = None
+) -> socket.socket:
+    # Replaces socket.create_connection so the address checked is the one connected to
+    host, port = address
+    error = None
+    for family, type_, proto, _, sockaddr in resolve_public(host, port):
+        sock = socket.socket(family, type_, proto)
+        try:
+            if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+            return sock
+        except OSError as e:
+            error = e
+            sock.close()
+    raise error or OSError(f"No addresses for {host}")
+
+
+class _PublicHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_public
+
+
+class _PublicHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_public
+
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_PublicHTTPConnection, req)
+
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_PublicHTTPSConnection, req, context=self._context)
+
+
+class _NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        # A redirect could point anywhere; report the 3xx as the delivery status
+        return None
+
+
+_public_opener = urllib.request.build_opener(
+    urllib.request.ProxyHandler({}), _PublicHTTPHandler, _PublicHTTPSHandler, _NoRedirectHandler
+)
+_any_address_opener = urllib.request.build_opener(urllib.request.ProxyHandler({}), _NoRedirectHandler)
+
+
+def post_callback(url: str, body: dict, timeout: float, allow_private: bool = False) -> int:
+    """
+    POSTs a finished job as JSON (blocking).
+
+    Redirects are not followed, and unless allow_private is set the
+    request is only sent to public addresses.
+
+    Args:
+        url: Callback URL
+        body: JSON-serializable job
+        timeout: Request timeout in seconds
+        allow_private: Whether private and loopback addresses may be reached
+
+    Returns:
+        The HTTP status code (a 3xx is returned, not followed)
+
+    Raises:
+        CallbackAddressError: If the host resolves to a non-public address
+    """
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(body).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST"
+    )
+    opener = _any_address_opener if allow_private else _public_opener
+    try:
+        with opener.open(request, timeout=timeout) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        e.close()
+        return e.code
+    except urllib.error.URLError as e:
+        if isinstance(e.reason, CallbackAddressError):
+            raise e.reason
+        raise
+
+
+class JobQueue:
+    """
+    Bounded pool of worker tasks that runs jobs from a JobStore.
+
+    Workers wake as soon as a job is submitted in this process, and poll the
+    store for jobs submitted by other processes or left behind by a restart.
+
+    Args:
+        store: Persistent job store
+        handlers: Coroutine functions keyed by job kind; each takes the
+                  payload and returns a JSON-serializable result dict
+        workers: Number of jobs run at once in this process
+        timeout: Seconds a job may run before it is failed
+        max_attempts: Claims allowed per job, counting restarts
+        poll_interval: Seconds between store polls while idle
+        callback_timeout: Seconds allowed for each callback request
+        callback_attempts: Callback deliveries tried before giving up
+        callback_allow_private: Whether callbacks may reach private and
+                                loopback addresses
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        handlers: Dict[str, Callable[[dict], Awaitable[dict]]],
+        workers: int = 2,
+        timeout: float = 900.0,
+        max_attempts: int = 3,
+        poll_interval: float = 2.0,
+        callback_timeout: float = 10.0,
+        callback_attempts: int = 3,
+        callback_allow_private: bool = False
+    ):
+        self.store = store
+        self.handlers = handlers
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.max_attempts = max(1, max_attempts)
+        self.poll_interval = poll_interval
+        self.callback_timeout = callback_timeout
+        self.callback_attempts = max(1, callback_attempts)
+        self.callback_allow_private = callback_allow_private
+        self._tasks: List[asyncio.Task] = []
+        self._callbacks: Set[asyncio.Task] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        # Long-poll waiters per job id: [event, number of waiters]
+        self._waiters: Dict[str, list] = {}
+        self._running = 0
+        self._stats = {"submitted": 0, "deduplicated": 0, "succeeded": 0, "failed": 0, "callbacks_failed": 0}
+
+    def start(self) -> None:
+        """Starts the worker tasks on the running event loop."""
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """Cancels the workers; their running jobs go back to the queue."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._callbacks:
+            await asyncio.wait(self._callbacks, timeout=self.callback_timeout)
+
+    async def submit(
+        self,
+        kind: str,
+        payload: dict,
+        idempotency_key: Optional[str] = None,
+        callback_url: Optional[str] = None
+    ) -> Tuple[Job, bool]:
+        """
+        Queues a job unless its idempotency key has been seen.
+
+        Args:
+            kind: Handler name
+            payload: JSON-serializable handler input
+            idempotency_key: Optional client-supplied deduplication key
+            callback_url: Optional URL to POST the finished job to
+
+        Returns:
+            Tuple of (job, whether it was created by this call)
+
+        Raises:
+            KeyError: If no handler is registered for the kind
+            IdempotencyConflictError: If the key was used for a different request
+        """
+        if kind not in self.handlers:
+            raise KeyError(kind)
+        job, created = await asyncio.to_thread(self.store.create, kind, payload, idempotency_key, callback_url)
+        if created:
+            self._stats["submitted"] += 1
+            if self._wakeup is not None:
+                self._wakeup.set()
+        else:
+            self._stats["deduplicated"] += 1
+        return job, created
+
+    async def get(self, job_id: str, wait: float = 0.0) -> Optional[Job]:
+        """
+        Returns a job, waiting up to wait seconds for it to finish.
+
+        Args:
+            job_id: The job
+            wait: Long-poll timeout in seconds; 0 returns immediately
+
+        Returns:
+            The job (finished or not), or None if it is unknown
+        """
+        deadline = time.monotonic() + wait
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is None or job.finished or wait <= 0:
+            return job
+
+        waiter = self._waiters.setdefault(job_id, [asyncio.Event(), 0])
+        waiter[1] += 1
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return job
+                # Woken by a local worker; jobs run by other processes are polled
+                try:
+                    await asyncio.wait_for(waiter[0].wait(), min(remaining, self.poll_interval))
+                except asyncio.TimeoutError:
+                    pass
+                job = await asyncio.to_thread(self.store.get, job_id)
+                if job is None or job.finished:
+                    return job
+        finally:
+            waiter[1] -= 1
+            if not waiter[1]:
+                self._waiters.pop(job_id, None)
+
+    async def _worker(self) -> None:
+        kinds = list(self.handlers)
+        lease = self.timeout + 60
+        while True:
+            job = await asyncio.to_thread(self.store.claim, kinds, lease, self.max_attempts)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _run(self, job: Job) -> None:
+        self._running += 1
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(self.handlers[job.kind](job.payload), self.timeout)
+        except asyncio.CancelledError:
+            await asyncio.shield(asyncio.to_thread(self.store.release, job.job_id))
+            raise
+        except asyncio.TimeoutError:
+            finished = await asyncio.to_thread(
+                self.store.finish, job.job_id, None, f"Job timed out after {self.timeout:.0f}s"
+            )
+        except Exception as e:
+            logger.warning("Job %s (%s) failed: %s: %s", job.job_id, job.kind, type(e).__name__, e)
+            finished = await asyncio.to_thread(self.store.finish, job.job_id, None, f"{type(e).__name__}: {e}")
+        else:
+            finished = await asyncio.to_thread(self.store.finish, job.job_id, result)
+        finally:
+            self._running -= 1
+
+        self._stats["succeeded" if finished and finished.status == STATUS_SUCCEEDED else "failed"] += 1
+        logger.info(
+            "Job %s (%s) %s in %.1fs", job.job_id, job.kind,
+            finished.status if finished else "vanished", time.perf_counter() - started
+        )
+        waiter = self._waiters.get(job.job_id)
+        if waiter is not None:
+            waiter[0].set()
+        if finished is not None and finished.callback_url:
+            task = asyncio.create_task(self._deliver(finished))
+            self._callbacks.add(task)
+            task.add_done_callback(self._callbacks.discard)
+
+    async def _deliver(self, job: Job) -> None:
+        for attempt in range(self.callback_attempts):
+            try:
+                status = await asyncio.to_thread(
+                    post_callback, job.callback_url, job.to_dict(), self.callback_timeout,
+                    self.callback_allow_private
+                )
+                if status < 300:
+                    return
+                logger.info("Callback for job %s returned %d", job.job_id, status)
+            except CallbackAddressError as e:
+                # Retrying will not make the address public
+                logger.warning("Callback for job %s refused: %s", job.job_id, e)
+                break
+            except Exception as e:
+                logger.info("Callback for job %s failed: %s", job.job_id, e)
+            if attempt + 1 < self.callback_attempts:
+                await asyncio.sleep(2 ** attempt)
+        self._stats["callbacks_failed"] += 1
+        logger.warning("Giving up on callback for job %s", job.job_id)
+
+    def stats(self) -> dict:
+        """
+        Worker pool state, counters and job counts per status.
+
+        Returns:
+            Dictionary for health reporting
+        """
+        try:
+            counts = self.store.counts()
+        except sqlite3.Error as e:
+            logger.warning("Failed to count jobs: %s", e)
+            counts = None
+        return dict(
+            self._stats,
+            workers=self.workers,
+            running=self._running,
+            started=bool(self._tasks),
+            jobs=counts,
+            path=self.store.path,
+        )
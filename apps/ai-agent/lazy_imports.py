@@ -0,0 +1,95 @@
+"""
+Deferred imports for heavy SDKs.
+
+The Vertex AI and Google Cloud client libraries take seconds to import
+(gRPC, protobuf descriptors, generated service stubs). Binding them through
+lazy_import() keeps them out of process start-up: the real module is
+imported the first time one of its attributes is used, and how long that
+took is recorded for the health endpoint. Code on the event loop awaits
+load_in_thread() before its first use of a module, so the import does
+not stall other requests.
+"""
+
+import asyncio
+import importlib
+import threading
+import time
+from types import ModuleType
+from typing import Dict, Optional
+
+
+_timings: Dict[str, Optional[float]] = {}
+_lock = threading.Lock()
+
+
+class LazyModule:
+    """
+    Stand-in for a module that imports it on first attribute access.
+
+    Args:
+        name: Dotted module name (e.g., 'google.cloud.speech')
+    """
+
+    def __init__(self, name: str):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_module", None)
+
+    def _load(self) -> ModuleType:
+        module = self._module
+        if module is not None:
+            return module
+        with _lock:
+            if self._module is None:
+                started = time.perf_counter()
+                module = importlib.import_module(self._name)
+                _timings[self._name] = round((time.perf_counter() - started) * 1000, 1)
+                object.__setattr__(self, "_module", module)
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        """Whether the real module has been imported."""
+        return self._module is not None
+
+    def __getattr__(self, attribute: str):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    """
+    Returns a proxy that imports the named module when first used.
+
+    Args:
+        name: Dotted module name
+
+    Returns:
+        LazyModule proxy
+    """
+    _timings.setdefault(name, None)
+    return LazyModule(name)
+
+
+async def load_in_thread(*modules: LazyModule) -> None:
+    """
+    Imports lazy modules in a worker thread if they are not loaded yet.
+
+    Args:
+        modules: LazyModule proxies about to be used on the event loop
+    """
+    for module in modules:
+        if not module.loaded:
+            await asyncio.to_thread(module._load)
+
+
+def import_timings() -> Dict[str, Optional[float]]:
+    """
+    Reports how long each lazily imported module took to import.
+
+    Returns:
+        Milliseconds per module name, or None for modules not imported yet
+    """
+    return dict(_timings)
@@ -6,27 +6,137 @@ Supports text, images, and video inputs for rich brand feedback.
 """
 
 import os
+import asyncio
+import atexit
 import base64
+import io
+import json
+import logging
+import mimetypes
+import time
+
+# Measured from here so /health can report how long this module took to load
+MODULE_IMPORT_STARTED = time.perf_counter()
+
 import uuid
+from contextlib import ExitStack, aclosing, asynccontextmanager
+from dataclasses import dataclass, field
 from datetime import timedelta, datetime
-from typing import Optional, List
-from fastapi import FastAPI, File, Form, UploadFile, HTTPException
+from urllib.parse import urlparse
+from typing import TYPE_CHECKING, Any, AsyncIterator, Awaitable, Callable, Optional, List, Tuple, Union
+from fastapi import FastAPI, File, Form, Header, UploadFile, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-import vertexai
-from vertexai.generative_models import GenerativeModel, Part
-from google.cloud import storage
-from google.cloud import speech
-from google.cloud import texttospeech
-from google.auth import impersonated_credentials
-from google.auth.transport import requests as auth_requests
-import google.auth
 from dotenv import load_dotenv
+from lazy_imports import import_timings, lazy_import, load_in_thread
+from clients import ClientRegistry, close_async_transport
+from signing import ImpersonatedUrlSigner, LocalFakeSigner
+from scheduler import ConcurrencyScheduler, QueueFullError
+from admission import (
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    AdmissionController,
+    MemoryBucketStore,
+    QuotaExceededError,
+    SQLiteBucketStore,
+    parse_limits,
+)
+from streaming import SSE_HEADERS, ClosingStreamingResponse, chunk_text, format_sse, usage_to_dict
+from response_cache import (
+    CACHE_DEFAULT,
+    CACHE_DIRECTIVES,
+    CACHE_NO_CACHE,
+    CACHE_NO_STORE,
+    CACHE_ONLY_IF_CACHED,
+    CacheMissError,
+    ResponseCache,
+)
+from sessions import Session, create_session_store
+from context_cache import ContextLease, PersonaContextCache
+from history import HistoryBuilder
+from retrieval import DocumentRetriever
+from fanout import run_fanout, run_ordered, run_ordered_stream
+from routing import KIND_GENERATE, KIND_STREAM, ModelRouter, RouteDecision, race_with_hedge
+from jobs import CallbackAddressError, IdempotencyConflictError, Job, JobQueue, JobStore, resolve_public
+from sentences import SentenceAccumulator, split_sentences
+from media_store import GCSMediaBackend, LocalMediaBackend, MediaRecord, MediaStore
+from ingest import (
+    IngestedUpload, Ingestor, RequestBodyLimit, UploadLimit, UploadTooLargeError, UploadTooSmallError
+)
+from image_pipeline import ImagePipeline
+from caching import TTLCache
+from video_probe import VideoFormat, probe_video
+from video_segments import MODE_COPY, SegmentCutter, VideoSegment, segment_from_request
+from audio_probe import AudioFormat, probe_audio
+from tts_cache import SpeechCache, etag_for, etag_matches, speech_key
+from backends import FakeBackends
+from telemetry import LabelLimiter, MetricsRegistry, UpstreamTracker, audience_label, configure_logging
+from speech_stream import (
+    SPEECH_END,
+    TRANSCRIPT_FINAL,
+    FakeStreamingRecognizer,
+    GoogleStreamingRecognizer,
+)
+
+if TYPE_CHECKING:
+    from google.cloud.speech import RecognitionConfig
+    from vertexai.generative_models import GenerativeModel, Part
+
+# The Google SDKs take seconds to import; they load on first use (or during
+# warm-up) instead of on every cold start
+vertexai = lazy_import("vertexai")
+generative_models = lazy_import("vertexai.generative_models")
+vertex_caching = lazy_import("vertexai.preview.caching")
+preview_generative_models = lazy_import("vertexai.preview.generative_models")
+storage = lazy_import("google.cloud.storage")
+speech = lazy_import("google.cloud.speech")
+texttospeech = lazy_import("google.cloud.texttospeech")
+google_auth = lazy_import("google.auth")
 
 # Load environment variables
 load_dotenv()
 
+# --- Telemetry ---
+# Log records are written by a background thread; metrics are kept in memory
+# and rendered for Prometheus at /metrics.
+log_listener = configure_logging(os.environ.get("LOG_LEVEL", "INFO"))
+atexit.register(log_listener.stop)
+logger = logging.getLogger("persona_agent")
+
+metrics = MetricsRegistry()
+upstream = UpstreamTracker(metrics, "persona")
+STAGE_SECONDS = metrics.histogram(
+    "persona_stage_duration_seconds", "Time spent in each request stage", ["stage"]
+)
+GEMINI_FIRST_TOKEN_SECONDS = metrics.histogram(
+    "persona_gemini_first_token_seconds", "Time from starting a streamed generation to its first text"
+)
+GENERATION_QUEUE_SECONDS = metrics.histogram(
+    "persona_generation_queue_seconds", "Time generations wait for a scheduler slot"
+)
+GEMINI_TOKENS = metrics.counter(
+    "persona_gemini_tokens_total", "Gemini tokens by audience and direction (input/output)",
+    ["audience", "direction"]
+)
+# Audience descriptions are free text; cap how many distinct labels they produce
+audience_labels = LabelLimiter(int(os.environ.get("METRICS_MAX_AUDIENCES", "200")))
+
+
+def record_usage(audience_summary: Optional[str], usage: Optional[dict]) -> None:
+    """
+    Adds a generation's token usage to the per-audience counters.
+
+    Args:
+        audience_summary: Persona description the generation was for, if any
+        usage: Token counts from usage_to_dict(), if Gemini reported any
+    """
+    if not usage:
+        return
+    audience = audience_labels.get(audience_label(audience_summary))
+    GEMINI_TOKENS.inc(usage.get("prompt_token_count") or 0, audience=audience, direction="input")
+    GEMINI_TOKENS.inc(usage.get("candidates_token_count") or 0, audience=audience, direction="output")
+
 # --- Pydantic Models for API ---
 class ChatMessage(BaseModel):
     """
@@ -50,12 +160,19 @@ class ChatRequest(BaseModel):
         audience_summary: Description of the persona to embody
         history: Optional list of previous chat messages for session memory
         image_data: Optional Base64-encoded image data for multimodal analysis
+        stream: If true, stream the reply as Server-Sent Events
+        cache_control: Optional response cache directive ('default', 'no-cache',
+                       'no-store' or 'only-if-cached')
+        media_ids: Optional ids of media previously stored via /media
     """
     user_prompt: str
     brand_context: str
     audience_summary: str
     history: Optional[List[ChatMessage]] = None
     image_data: Optional[str] = None
+    stream: bool = False
+    cache_control: Optional[str] = None
+    media_ids: Optional[List[str]] = None
 
 
 class ChatResponse(BaseModel):
@@ -64,15 +181,50 @@ class ChatResponse(BaseModel):
 
     Args:
         agent_response: The persona's response to the user's prompt
+        media_ids: Ids of media stored from this request, reusable in later turns
+        video_uri: GCS URI a large uploaded video was forwarded to, reusable in later turns
     """
     agent_response: str
+    media_ids: Optional[List[str]] = None
+    video_uri: Optional[str] = None
 
 
 # --- FastAPI App Initialization ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Starts the configured warm-up and the job workers, and closes shared
+    clients on shutdown.
+
+    Args:
+        app: The FastAPI application
+    """
+    startup_timings["ready_ms"] = round((time.perf_counter() - MODULE_IMPORT_STARTED) * 1000, 1)
+    warmup_task = None
+    if PROJECT_ID and WARMUP_CLIENTS:
+        if WARMUP_IN_BACKGROUND:
+            # Serve requests (and health checks) while the SDKs load
+            warmup_task = asyncio.create_task(asyncio.to_thread(warm_up, WARMUP_CLIENTS))
+        else:
+            await asyncio.to_thread(warm_up, WARMUP_CLIENTS)
+    if MODEL_CONFIGURED and JOB_WORKERS:
+        job_queue.start()
+    yield
+    await job_queue.stop()
+    if warmup_task is not None:
+        await warmup_task
+    await clients.aclose()
+    await session_store.close()
+    await persona_contexts.aclose()
+    image_pipeline.close()
+    segment_cutter.close()
+
+
 app = FastAPI(
     title="Synthetic Persona Agent",
     description="AI agent for multimodal persona simulation using Google Gemini",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -87,411 +239,3055 @@ app.add_middleware(
 # --- Vertex AI Initialization ---
 PROJECT_ID = os.environ.get("GCLOUD_PROJECT")
 LOCATION = os.environ.get("GCLOUD_LOCATION", "us-central1")
+# Default model; see Model Routing for the optional fast and hedge models.
+# Any model may be pinned to a region as 'model@region'.
+GEMINI_MODEL_NAME = os.environ.get("GEMINI_MODEL", "gemini-2.5-pro")
+GEMINI_FAST_MODEL = os.environ.get("GEMINI_FAST_MODEL") or None
+GEMINI_HEDGE_MODEL = os.environ.get("GEMINI_HEDGE_MODEL") or None
+
+# BACKENDS=fake swaps Gemini, Speech, TTS, Storage and URL signing for
+# in-process fakes with configurable latency and failure rates (see
+# backends.py), so the API can be load tested without spending quota.
+fake_backends = FakeBackends.from_env(os.environ) if os.environ.get("BACKENDS", "google").lower() == "fake" else None
 
-# Initialize Vertex AI
-if PROJECT_ID:
+if fake_backends:
+    PROJECT_ID = PROJECT_ID or "offline"
+elif not PROJECT_ID:
+    logger.warning("GCLOUD_PROJECT not set. API calls will fail.")
+
+# Whether Gemini calls can be made; the model itself is built on first use
+MODEL_CONFIGURED = bool(PROJECT_ID)
+
+
+def init_vertexai() -> bool:
+    """Initializes the Vertex AI SDK (imports it on first call)."""
     vertexai.init(project=PROJECT_ID, location=LOCATION)
-    # Use Gemini 2.5 Pro for multimodal capabilities (latest model)
-    model = GenerativeModel("gemini-2.5-pro")
-else:
-    print("WARNING: GCLOUD_PROJECT not set. API calls will fail.")
-    model = None
+    return True
 
 
-def construct_prompt(user_prompt: str, brand_context: str, audience_summary: str) -> str:
+def model_resource_name(model_name: str) -> str:
     """
-    Constructs the system prompt for the Gemini model (legacy function for backward compatibility).
+    Resolves 'model@region' to a full Vertex AI resource name.
+
+    The SDK sends each model's requests to the region in its resource name,
+    so one process can call the same model in several regions.
 
     Args:
-        user_prompt: User's question
-        brand_context: Brand information
-        audience_summary: Persona description
+        model_name: Model name, optionally suffixed with '@region'
 
     Returns:
-        Formatted prompt string
+        The name to pass to GenerativeModel
     """
-    prompt_template = '''You are a creative testing and surveying chatbot acting as a specific consumer persona.
-Your persona is defined by the following summary:
----
-**Audience Persona:**
-{audience_summary}
----
-
-You are being asked for feedback on a brand. Here is the context for the brand:
----
-**Brand Context:**
-{brand_context}
----
-
-Now, please respond to the following question or statement from the user, keeping your persona and the brand context in mind at all times. Be authentic, detailed, and stay in character.
+    name, _, region = model_name.partition("@")
+    if not region:
+        return name
+    return f"projects/{PROJECT_ID}/locations/{region}/publishers/google/models/{name}"
 
-**User's Question:** "{user_prompt}"
-'''
 
-    return prompt_template.format(
-        audience_summary=audience_summary,
-        brand_context=brand_context,
-        user_prompt=user_prompt
-    )
+def gemini_client_name(model_name: str) -> str:
+    """Name of the shared client for a model ('gemini' for the default model)."""
+    return "gemini" if model_name == GEMINI_MODEL_NAME else f"gemini:{model_name}"
 
 
-def construct_prompt_with_history(
-    user_prompt: str,
-    brand_context: str,
-    audience_summary: str,
-    history: Optional[List[ChatMessage]] = None
-) -> str:
+def create_gemini_model(model_name: str = GEMINI_MODEL_NAME):
     """
-    Constructs a prompt with conversation history for session memory.
+    Builds a shared Gemini model used when no persona preamble is given.
 
     Args:
-        user_prompt: User's current question
-        brand_context: Brand information
-        audience_summary: Persona description
-        history: Optional list of previous chat messages
+        model_name: Model to build, optionally suffixed with '@region'
 
     Returns:
-        Formatted prompt string with conversation history
+        GenerativeModel (or its fake under BACKENDS=fake)
     """
-    # Start with the system instructions
-    full_prompt = f"""You are a creative testing and surveying chatbot acting as a specific consumer persona.
-Your persona is defined by: {audience_summary}
+    if fake_backends:
+        return fake_backends.model()
+    clients.get("vertexai")
+    return generative_models.GenerativeModel(model_resource_name(model_name))
 
-You are being asked for feedback on a brand. The brand context is: {brand_context}
 
-Keep your persona and the brand context in mind at all times. Be authentic, detailed, and stay in character.
+# --- Shared Google Cloud Clients ---
+# Built once per process, on first use or during warm-up, so requests reuse
+# gRPC channels and auth tokens instead of paying connection setup on every call.
+clients = ClientRegistry()
+clients.register("vertexai", init_vertexai)
+for routed_model in (GEMINI_MODEL_NAME, GEMINI_FAST_MODEL, GEMINI_HEDGE_MODEL):
+    if routed_model:
+        clients.register(gemini_client_name(routed_model), lambda name=routed_model: create_gemini_model(name))
+if fake_backends:
+    clients.register("speech", fake_backends.speech_client)
+    clients.register("tts", fake_backends.tts_client)
+    clients.register("storage", fake_backends.storage_client, lambda client: client.close())
+else:
+    # The async gRPC clients bind to the event loop, so only their SDK import
+    # and credential lookup run in a thread (see ClientRegistry.aget)
+    clients.register(
+        "speech",
+        lambda: speech.SpeechAsyncClient(credentials=clients.get("credentials")[0]),
+        close_async_transport,
+        prepare=lambda: (speech.SpeechAsyncClient, clients.get("credentials")),
+        on_loop=True
+    )
+    clients.register(
+        "tts",
+        lambda: texttospeech.TextToSpeechAsyncClient(credentials=clients.get("credentials")[0]),
+        close_async_transport,
+        prepare=lambda: (texttospeech.TextToSpeechAsyncClient, clients.get("credentials")),
+        on_loop=True
+    )
+    clients.register("storage", lambda: storage.Client(project=PROJECT_ID), lambda client: client.close())
+    clients.register("credentials", lambda: google_auth.default())
 
---- Begin Conversation History ---
-"""
 
-    # Add conversation history if provided
-    if history:
-        for message in history:
-            if message.sender == 'user':
-                full_prompt += f"User: {message.text}\n"
-            else:
-                full_prompt += f"Agent: {message.text}\n"
+# BACKENDS=fake implies the fake recognizer
+STT_STREAM_BACKEND = "fake" if fake_backends or os.environ.get("STT_BACKEND", "google").lower() == "fake" else "google"
 
-    # Add the current user message
-    full_prompt += f"User: {user_prompt}\n"
-    full_prompt += "Agent: "  # Prompt the agent to respond
 
-    return full_prompt
+def create_streaming_recognizer():
+    """
+    Builds the streaming recognizer selected by STT_BACKEND ('google' or 'fake').
 
+    Returns:
+        GoogleStreamingRecognizer or FakeStreamingRecognizer
+    """
+    if STT_STREAM_BACKEND == "fake":
+        return FakeStreamingRecognizer(
+            transcript=os.environ.get(
+                "STT_FAKE_TRANSCRIPT", "I like the colours but the price feels a bit high for me"
+            ),
+            bytes_per_word=int(os.environ.get("STT_FAKE_BYTES_PER_WORD", "4000")),
+            latency=float(os.environ.get("STT_FAKE_LATENCY", "0"))
+        )
+    return GoogleStreamingRecognizer(lambda: clients.aget("speech"))
 
-@app.get("/")
-def read_root():
-    """Health check endpoint."""
-    return {
-        "status": "Synthetic Persona Agent is running",
-        "version": "1.0.0",
-        "multimodal": True
-    }
 
+clients.register("speech_stream", create_streaming_recognizer)
 
-@app.get("/health")
-def health_check():
+# --- Signed Upload URLs ---
+UPLOAD_BUCKET = os.environ.get("UPLOAD_BUCKET", "synthetic-personas-videos")
+UPLOAD_URL_TTL = timedelta(minutes=15)
+MAX_BATCH_UPLOAD_URLS = int(os.environ.get("MAX_BATCH_UPLOAD_URLS", "50"))
+
+
+def create_upload_signer():
     """
-    Health check endpoint for monitoring.
+    Builds the URL signer selected by the UPLOAD_SIGNER environment variable.
+
+    'fake' (or BACKENDS=fake) selects an offline HMAC signer for local
+    development; anything else signs through IAM with cached impersonated
+    credentials.
 
     Returns:
-        Health status and configuration info
+        A UrlSigner instance
     """
-    return {
-        "status": "healthy",
-        "project_id": PROJECT_ID,
-        "location": LOCATION,
-        "model_configured": model is not None
-    }
+    if fake_backends or os.environ.get("UPLOAD_SIGNER") == "fake":
+        return LocalFakeSigner(
+            bucket_name=UPLOAD_BUCKET,
+            secret=os.environ.get("FAKE_SIGNER_SECRET", "local-dev-secret"),
+            base_url=os.environ.get("FAKE_SIGNER_BASE_URL", "http://localhost:8080/fake-gcs")
+        )
+
+    # Service account used for IAM-based signing
+    service_account_email = f"{os.getenv('GCLOUD_PROJECT_NUMBER', '179579890817')}-compute@developer.gserviceaccount.com"
+    return ImpersonatedUrlSigner(
+        bucket_name=UPLOAD_BUCKET,
+        service_account_email=service_account_email,
+        credentials_provider=lambda: clients.get("credentials"),
+        storage_client_provider=lambda: clients.get("storage")
+    )
 
 
-class SignedUrlRequest(BaseModel):
+clients.register("signer", create_upload_signer)
+
+# --- Cold Start ---
+# Nothing heavy is built at import time. WARMUP names the registered clients
+# to preload at startup (e.g. "gemini" for a chat-only instance, or
+# "gemini,speech,tts"); by default they load in a worker thread once the
+# server is accepting requests, so warm-up never delays readiness. Speech and
+# TTS clients bind to the event loop, so warm-up imports their SDKs and
+# fetches credentials, and the first request builds them.
+WARMUP_CLIENTS = [name.strip() for name in os.environ.get("WARMUP", "").split(",") if name.strip()]
+WARMUP_IN_BACKGROUND = os.environ.get("WARMUP_IN_BACKGROUND", "true").lower() == "true"
+
+startup_timings = {"import_ms": None, "ready_ms": None, "warmup_ms": None}
+
+
+def warm_up(names: List[str]) -> None:
     """
-    Request model for generating signed upload URLs.
+    Imports SDKs and builds the named clients ahead of the first request (blocking).
 
     Args:
-        filename: Original filename of the video to upload
-        content_type: MIME type of the video (e.g., 'video/mp4')
+        names: Registered client names
     """
-    filename: str
-    content_type: str
+    started = time.perf_counter()
+    clients.warm(names)
+    startup_timings["warmup_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info("Warmed up %s in %.0f ms", ", ".join(names), startup_timings["warmup_ms"])
 
+# --- Media Store ---
+# Images and videos are stored once by content hash; later turns reference
+# the media id instead of re-uploading the same bytes.
+def create_media_backend():
+    """
+    Builds the media backend selected by MEDIA_STORE_BACKEND ('local' or 'gcs').
 
-class SignedUrlResponse(BaseModel):
+    Returns:
+        LocalMediaBackend or GCSMediaBackend
     """
-    Response model containing signed URL and GCS URI.
+    if os.environ.get("MEDIA_STORE_BACKEND", "local").lower() == "gcs":
+        return GCSMediaBackend(
+            storage_client_provider=lambda: clients.get("storage"),
+            bucket_name=os.environ.get("MEDIA_STORE_BUCKET", UPLOAD_BUCKET)
+        )
+    return LocalMediaBackend(os.environ.get("MEDIA_STORE_DIR", "/tmp/persona-media"))
 
-    Args:
-        upload_url: Signed URL for uploading the video
-        gcs_uri: GCS URI to use when referencing the uploaded file
-        blob_name: Name of the blob in GCS
+
+media_store = MediaStore(
+    backend=create_media_backend(),
+    ttl=float(os.environ.get("MEDIA_STORE_TTL", "86400")),
+    max_entries=int(os.environ.get("MEDIA_STORE_MAX_ENTRIES", "1000")),
+    max_bytes=int(os.environ.get("MEDIA_STORE_MAX_BYTES", str(2 * 1024 ** 3)))
+)
+
+
+async def media_part(
+    record: MediaRecord,
+    read: Optional[Callable[[], Awaitable[bytes]]] = None
+) -> "Part":
     """
-    upload_url: str
-    gcs_uri: str
-    blob_name: str
+    Builds the Gemini part for a stored asset.
 
+    Remote (GCS) assets are referenced by URI so their bytes never pass
+    through this service again; local assets are sent inline.
 
-@app.post("/generate-upload-url", response_model=SignedUrlResponse)
-async def generate_upload_url(request: SignedUrlRequest):
+    Args:
+        record: Stored asset
+        read: Returns the asset's bytes without going back to the store, if
+              the caller still has them (e.g., a just-ingested upload)
+
+    Returns:
+        Gemini Part referencing or embedding the asset
     """
-    Generates a signed URL for uploading large videos directly to GCS.
+    await load_in_thread(generative_models)
+    if media_store.backend.remote:
+        return generative_models.Part.from_uri(uri=record.uri, mime_type=record.mime_type)
+    data = await read() if read else await media_store.read(record)
+    return generative_models.Part.from_data(data=data, mime_type=record.mime_type)
 
-    This endpoint creates a unique blob name and generates a signed URL
-    that allows the frontend to upload files directly to Google Cloud Storage.
-    The signed URL is valid for 15 minutes.
 
-    Uses IAM-based signing which works with Cloud Run's default credentials
-    without requiring a service account key file.
+@STAGE_SECONDS.timed(stage="media_resolve")
+async def media_parts_for_ids(media_ids: Optional[List[str]]) -> list:
+    """
+    Resolves stored media ids into Gemini parts.
 
     Args:
-        request: SignedUrlRequest with filename and content type
+        media_ids: Ids returned by /media or a previous chat response
 
     Returns:
-        SignedUrlResponse with upload URL, GCS URI, and blob name
+        List of Gemini parts, in the given order
 
     Raises:
-        HTTPException: If URL generation fails
+        HTTPException: If any id is unknown or has expired
     """
-    try:
-        # Get the default credentials
-        source_credentials, project = google.auth.default()
+    parts = []
+    for media_id in media_ids or []:
+        record = await media_store.get(media_id)
+        if record is None:
+            raise HTTPException(status_code=404, detail=f"Unknown or expired media id: {media_id}")
+        parts.append(await media_part(record))
+    return parts
 
-        # Get service account email
-        service_account_email = f"{os.getenv('GCLOUD_PROJECT_NUMBER', '179579890817')}-compute@developer.gserviceaccount.com"
 
-        # Create impersonated credentials that can sign
-        # This uses the IAM SignBlob API under the hood
-        signing_credentials = impersonated_credentials.Credentials(
-            source_credentials=source_credentials,
-            target_principal=service_account_email,
-            target_scopes=["https://www.googleapis.com/auth/devstorage.read_write"],
-            lifetime=900  # 15 minutes
-        )
+def parse_media_ids(media_ids: Optional[str]) -> List[str]:
+    """Splits a comma-separated form field of media ids."""
+    return [media_id.strip() for media_id in (media_ids or "").split(",") if media_id.strip()]
 
-        # Initialize GCS client with default credentials
-        storage_client = storage.Client(project=PROJECT_ID)
-        bucket = storage_client.bucket("synthetic-personas-videos")
 
-        # Generate unique blob name using UUID
-        file_extension = request.filename.split('.')[-1] if '.' in request.filename else 'mp4'
-        blob_name = f"{uuid.uuid4()}.{file_extension}"
-        blob = bucket.blob(blob_name)
+# --- Upload Ingestion ---
+# Uploads are read in chunks under per-type limits and spooled to disk past a
+# threshold, so a few concurrent videos cannot exhaust a small instance's memory.
+ingestor = Ingestor(
+    chunk_size=int(os.environ.get("INGEST_CHUNK_SIZE", str(1024 * 1024))),
+    spool_threshold=int(os.environ.get("INGEST_SPOOL_THRESHOLD", str(4 * 1024 * 1024))),
+    spool_dir=os.environ.get("INGEST_SPOOL_DIR") or None
+)
+IMAGE_UPLOAD_LIMIT = UploadLimit(
+    kind="image",
+    max_bytes=int(os.environ.get("INGEST_MAX_IMAGE_BYTES", str(20 * 1024 * 1024))),
+    default_mime_type="image/jpeg"
+)
+VIDEO_UPLOAD_LIMIT = UploadLimit(
+    kind="video",
+    max_bytes=int(os.environ.get("INGEST_MAX_VIDEO_BYTES", str(512 * 1024 * 1024))),
+    default_mime_type="video/mp4"
+)
+AUDIO_UPLOAD_LIMIT = UploadLimit(
+    kind="audio",
+    max_bytes=int(os.environ.get("INGEST_MAX_AUDIO_BYTES", str(10 * 1024 * 1024))),
+    min_bytes=1000,
+    default_mime_type="audio/webm"
+)
+MEDIA_UPLOAD_LIMIT = UploadLimit(kind="media", max_bytes=VIDEO_UPLOAD_LIMIT.max_bytes)
+# Videos above this size are forwarded to object storage instead of being sent inline
+MAX_INLINE_VIDEO_BYTES = int(os.environ.get("MAX_INLINE_VIDEO_BYTES", str(30 * 1024 * 1024)))
+video_forwarder = GCSMediaBackend(
+    storage_client_provider=lambda: clients.get("storage"),
+    bucket_name=UPLOAD_BUCKET,
+    prefix="uploads/"
+)
 
-        # Generate signed URL using impersonated credentials (valid for 15 minutes)
-        upload_url = blob.generate_signed_url(
-            version="v4",
-            expiration=timedelta(minutes=15),
-            method="PUT",
-            content_type=request.content_type,
-            credentials=signing_credentials
-        )
 
-        # Construct GCS URI for Gemini
-        gcs_uri = f"gs://synthetic-personas-videos/{blob_name}"
+def upload_rejected_exception(error: Exception) -> HTTPException:
+    """
+    Maps an ingestion error to an HTTP error.
 
-        return SignedUrlResponse(
-            upload_url=upload_url,
-            gcs_uri=gcs_uri,
-            blob_name=blob_name
-        )
+    Args:
+        error: UploadTooLargeError or UploadTooSmallError
 
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to generate upload URL: {str(e)}"
+    Returns:
+        HTTPException with status 413 for oversized uploads, otherwise 400
+    """
+    if isinstance(error, UploadTooLargeError):
+        return HTTPException(
+            status_code=413,
+            detail=f"The {error.kind} file is larger than the {error.max_bytes} byte limit."
         )
+    return HTTPException(status_code=400, detail=str(error))
 
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat_handler(request: ChatRequest):
+# Multipart bodies are capped while they are received, before Starlette spools
+# them; the per-file limits above then apply to each part. The allowance
+# covers the text fields and multipart framing sent alongside the files.
+FORM_OVERHEAD_BYTES = int(os.environ.get("INGEST_FORM_OVERHEAD_BYTES", str(2 * 1024 * 1024)))
+app.add_middleware(
+    RequestBodyLimit,
+    limits={
+        "/chat/multimodal": IMAGE_UPLOAD_LIMIT.max_bytes + VIDEO_UPLOAD_LIMIT.max_bytes + FORM_OVERHEAD_BYTES,
+        "/media": MEDIA_UPLOAD_LIMIT.max_bytes + FORM_OVERHEAD_BYTES,
+        "/speech-to-text": AUDIO_UPLOAD_LIMIT.max_bytes + FORM_OVERHEAD_BYTES,
+    },
+    reject=lambda max_bytes: HTTPException(
+        status_code=413,
+        detail=f"The request body is larger than the {max_bytes} byte limit."
+    )
+)
+
+
+@STAGE_SECONDS.timed(stage="media_store")
+async def store_upload(upload: IngestedUpload) -> Tuple[MediaRecord, bool]:
     """
-    Handles chat requests with optional session memory and multimodal image support.
+    Stores an ingested upload in the media store without loading it into memory.
 
     Args:
-        request: ChatRequest with user prompt, brand context, audience summary,
-                optional conversation history, and optional image data
+        upload: Ingested upload
+
+    Returns:
+        Tuple of (MediaRecord, deduplicated)
+    """
+    return await media_store.put_stream(upload.open, upload.size, upload.mime_type, upload.media_id)
+
+
+async def forward_video(upload: IngestedUpload) -> str:
+    """
+    Streams a video that is too large to send inline to object storage.
+
+    With the GCS media backend the video is simply stored there; otherwise it
+    goes to UPLOAD_BUCKET, keyed by content hash so repeats are not re-uploaded.
+
+    Args:
+        upload: Ingested video
 
     Returns:
-        ChatResponse with the agent's persona-based reply
+        gs:// URI of the stored video
 
     Raises:
-        HTTPException: If the model is not configured or generation fails
+        HTTPException: If object storage is not configured
     """
-    if not model:
+    if media_store.backend.remote:
+        record, _ = await store_upload(upload)
+        return record.uri
+    if not PROJECT_ID:
         raise HTTPException(
-            status_code=500,
-            detail="Model not configured. Set GCLOUD_PROJECT environment variable."
+            status_code=413,
+            detail=f"Videos over {MAX_INLINE_VIDEO_BYTES} bytes need object storage. "
+                   "Set GCLOUD_PROJECT or upload via /generate-upload-url and pass video_uri."
         )
-
-    try:
-        # Construct the text prompt with conversation history
-        text_prompt = construct_prompt_with_history(
-            request.user_prompt,
-            request.brand_context,
-            request.audience_summary,
-            request.history
+    with upstream.track("storage"):
+        return await asyncio.to_thread(
+            video_forwarder.put, upload.media_id, upload.open(), upload.size, upload.mime_type
         )
 
-        # Start with the text prompt
-        prompt_parts = [text_prompt]
 
-        # Add image if provided (Base64 encoded)
-        if request.image_data:
-            try:
-                # The Base64 string is prefixed with "data:image/[type];base64,"
-                # We need to strip that prefix before decoding
-                if "," in request.image_data:
-                    header, base64_data = request.image_data.split(",", 1)
-                    # Extract mime type from header (e.g., "data:image/jpeg;base64")
-                    if ":" in header and ";" in header:
-                        mime_type = header.split(":")[1].split(";")[0]
-                    else:
-                        mime_type = "image/jpeg"  # Default
-                else:
-                    # No header, assume raw base64
-                    base64_data = request.image_data
-                    mime_type = "image/jpeg"
-
-                # Decode and create image part
-                image_bytes = base64.b64decode(base64_data)
-                image_part = Part.from_data(
-                    mime_type=mime_type,
-                    data=image_bytes
-                )
-                prompt_parts.append(image_part)
+# --- Video Segments ---
+# Videos are probed locally for their container and duration, so Gemini gets
+# the right MIME type and segment offsets are checked before any tokens are
+# spent. Uploads are cut to the requested segment when ffmpeg is available and
+# the clip is stored by (source hash, range); other videos carry the offsets
+# and frame rate as video metadata.
+segment_cutter = SegmentCutter(
+    store=media_store,
+    enabled=os.environ.get("VIDEO_SEGMENT_CUT", "true").lower() == "true",
+    ffmpeg_path=os.environ.get("FFMPEG_PATH") or None,
+    mode=os.environ.get("VIDEO_SEGMENT_MODE", MODE_COPY),
+    workers=int(os.environ.get("VIDEO_SEGMENT_WORKERS", "2")),
+    timeout=float(os.environ.get("VIDEO_SEGMENT_TIMEOUT", "120")),
+    spool_dir=ingestor.spool_dir
+)
+# Probe results for videos referenced by URI, so later turns skip the ranged reads
+video_uri_formats = TTLCache(max_entries=1024, ttl=float(os.environ.get("VIDEO_PROBE_TTL", "3600")))
+# Object storage reads per probe request; MP4 headers fit in one or two
+VIDEO_PROBE_CHUNK_SIZE = 256 * 1024
+# Whether the installed SDK can pass a sampling frame rate (None until first checked)
+video_fps_supported: Optional[bool] = None
 
-            except Exception as e:
-                print(f"Error processing image data: {e}")
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Invalid image data: {str(e)}"
-                )
 
-        # Generate content (text-only or multimodal)
-        response = model.generate_content(prompt_parts)
+@dataclass
+class VideoInput:
+    """
+    A video prepared for a generation.
 
-        return ChatResponse(agent_response=response.text)
+    Args:
+        part: Gemini part referencing or embedding the video (or its clip)
+        media_id: Media store id of the stored video or clip, if stored
+        forwarded_uri: Object storage URI a large upload was forwarded to, if any
+        segment: Segment as sent to Gemini, if one was requested
+        clip: 'cut' or 'reused' if a clip of the segment is sent instead of the whole video
+    """
+    part: Any
+    media_id: Optional[str] = None
+    forwarded_uri: Optional[str] = None
+    segment: Optional[VideoSegment] = None
+    clip: Optional[str] = None
 
-    except HTTPException:
-        # Re-raise HTTP exceptions
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Generation failed: {str(e)}")
+    def set_headers(self, headers) -> None:
+        """Reports the segment and clip in X-Video-Segment and X-Video-Clip."""
+        if self.segment is not None:
+            headers["X-Video-Segment"] = self.segment.describe()
+        if self.clip is not None:
+            headers["X-Video-Clip"] = self.clip
 
 
-@app.options("/chat/multimodal")
-async def multimodal_options():
-    """Handle CORS preflight for multimodal endpoint."""
-    from fastapi.responses import Response
-    return Response(
-        status_code=200,
-        headers={
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "POST, OPTIONS",
-            "Access-Control-Allow-Headers": "*",
-        }
-    )
+def parse_video_segment(start: Any, end: Any, fps: Any) -> Optional[VideoSegment]:
+    """
+    Builds a VideoSegment from request fields.
 
+    Args:
+        start: Start offset in seconds or [hh:]mm:ss, if any
+        end: End offset in seconds or [hh:]mm:ss, if any
+        fps: Sampling frame rate, if any
 
-@app.post("/chat/multimodal", response_model=ChatResponse)
-async def multimodal_chat_handler(
-    user_prompt: str = Form(...),
-    brand_context: str = Form(...),
-    audience_summary: str = Form(...),
-    history: Optional[str] = Form(None),  # JSON string of chat history
-    image: Optional[UploadFile] = File(None),
-    video: Optional[UploadFile] = File(None),
-    video_uri: Optional[str] = Form(None)  # GCS URI for large videos
-):
+    Returns:
+        VideoSegment, or None if no field was set
+
+    Raises:
+        HTTPException: If a field is invalid
     """
-    Handles multimodal chat requests with text, images, and/or videos.
+    try:
+        return segment_from_request(start, end, fps)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    This endpoint supports the full multimodal capabilities of Gemini,
-    allowing users to upload visual content alongside their text prompts.
-    For videos larger than 30MB, use the video_uri parameter with a GCS URI
-    obtained from /generate-upload-url endpoint.
+
+def fit_segment(segment: Optional[VideoSegment], video_format: VideoFormat) -> Optional[VideoSegment]:
+    """
+    Fits a segment to a probed video's duration.
 
     Args:
-        user_prompt: The user's question or statement
-        brand_context: Context about the brand
-        audience_summary: Description of the persona
-        history: Optional JSON string of conversation history
-        image: Optional image file
-        video: Optional video file (for videos < 30MB)
-        video_uri: Optional GCS URI for large videos (for videos >= 30MB)
+        segment: Requested segment, if any
+        video_format: Probed format of the video
 
     Returns:
-        ChatResponse with the agent's persona-based reply
+        The segment, with an end past the video dropped
 
     Raises:
-        HTTPException: If the model is not configured or generation fails
+        HTTPException: If the segment starts after the video ends
     """
-    if not model:
-        raise HTTPException(
-            status_code=500,
-            detail="Model not configured. Set GCLOUD_PROJECT environment variable."
-        )
-
+    if segment is None:
+        return None
     try:
-        # Parse history if provided
-        history_list = None
-        if history:
-            import json
-            try:
-                history_data = json.loads(history)
-                # Convert to ChatMessage objects
-                history_list = [ChatMessage(**msg) for msg in history_data]
+        return segment.within(video_format.duration)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def with_video_segment(part: "Part", segment: Optional[VideoSegment], offsets: bool = True) -> Optional[VideoSegment]:
+    """
+    Adds a segment's offsets and frame rate to a video part as video metadata.
+
+    The frame rate needs a google-cloud-aiplatform release whose
+    VideoMetadata has an fps field; with older releases it is left out.
+
+    Args:
+        part: Gemini part referencing or embedding the video
+        segment: Segment to apply, if any
+        offsets: Whether to send the offsets; False for a clip already cut to the segment
+
+    Returns:
+        The segment as sent to Gemini, or None if there was none
+    """
+    global video_fps_supported
+    if segment is None:
+        return None
+    metadata_type = type(part._raw_part).meta.fields["video_metadata"].message
+    fields = {}
+    if offsets and segment.trimmed:
+        fields["start_offset"] = timedelta(seconds=segment.start)
+        if segment.end is not None:
+            fields["end_offset"] = timedelta(seconds=segment.end)
+    if segment.fps is not None:
+        if video_fps_supported is None:
+            video_fps_supported = "fps" in metadata_type.meta.fields
+            if not video_fps_supported:
+                logger.warning("The installed Vertex AI SDK cannot set a video frame rate; video_fps is ignored")
+        if video_fps_supported:
+            fields["fps"] = segment.fps
+        else:
+            segment = VideoSegment(segment.start, segment.end)
+    if fields:
+        part._raw_part.video_metadata = metadata_type(**fields)
+    return segment
+
+
+async def probe_video_uri(uri: str) -> VideoFormat:
+    """
+    Probes a gs:// video with a few ranged reads, caching the result by URI.
+
+    Args:
+        uri: gs:// URI of the video
+
+    Returns:
+        VideoFormat; its container is 'unknown' if the video could not be read
+    """
+    cached = video_uri_formats.get(uri)
+    if cached is not None:
+        return cached
+    parsed = urlparse(uri)
+    if parsed.scheme != "gs" or not parsed.netloc:
+        return VideoFormat()
+
+    def probe() -> VideoFormat:
+        blob = clients.get("storage").bucket(parsed.netloc).blob(parsed.path.lstrip("/"))
+        with blob.open("rb", chunk_size=VIDEO_PROBE_CHUNK_SIZE) as reader:
+            return probe_video(reader)
+
+    try:
+        with upstream.track("storage"):
+            video_format = await asyncio.to_thread(probe)
+    except Exception as e:
+        # Remembered too, so an unreadable URI does not slow every later turn
+        logger.info("Could not probe video %s: %s", uri, e)
+        video_format = VideoFormat()
+    video_uri_formats.set(uri, video_format)
+    return video_format
+
+
+async def video_input_for_uri(uri: str, segment: Optional[VideoSegment] = None) -> VideoInput:
+    """
+    Prepares a video that is already in object storage.
+
+    The video is not downloaded: its header is probed with ranged reads and
+    a segment is sent to Gemini as offsets.
+
+    Args:
+        uri: gs:// URI of the video
+        segment: Part of the video the request is about, if any
+
+    Returns:
+        VideoInput
+
+    Raises:
+        HTTPException: If the segment starts after the video ends
+    """
+    video_format = await probe_video_uri(uri)
+    await load_in_thread(generative_models)
+    mime_type = video_format.mime_type
+    if mime_type is None:
+        guessed, _ = mimetypes.guess_type(urlparse(uri).path)
+        mime_type = guessed if guessed and guessed.startswith("video/") else "video/mp4"
+    part = generative_models.Part.from_uri(uri=uri, mime_type=mime_type)
+    return VideoInput(part, segment=with_video_segment(part, fit_segment(segment, video_format)))
+
+
+async def video_input_for_upload(upload: IngestedUpload, segment: Optional[VideoSegment] = None) -> VideoInput:
+    """
+    Prepares an uploaded video, cutting it to the segment when possible.
+
+    A clip of the segment is stored under an id derived from the upload's
+    hash and the range, so asking about the same scene again reuses it.
+    Without a clip the whole video is stored (or forwarded, if too large to
+    send inline) and the segment is sent as offsets.
+
+    Args:
+        upload: Ingested video
+        segment: Part of the video the request is about, if any
+
+    Returns:
+        VideoInput
+
+    Raises:
+        HTTPException: If the segment starts after the video ends, or a large
+                       video cannot be forwarded
+    """
+    video_format = await asyncio.to_thread(probe_video, upload.open())
+    upload.mime_type = video_format.mime_type or upload.mime_type
+    segment = fit_segment(segment, video_format)
+
+    if segment is not None and segment_cutter.can_cut(video_format, segment):
+        max_bytes = None if media_store.backend.remote else MAX_INLINE_VIDEO_BYTES
+        with STAGE_SECONDS.time(stage="video_segment"):
+            derived = await segment_cutter.derive(
+                upload.media_id, upload.open, upload.size, video_format, segment, max_bytes
+            )
+        if derived is not None:
+            record, reused = derived
+            part = await media_part(record)
+            return VideoInput(
+                part, media_id=record.media_id, segment=with_video_segment(part, segment, offsets=False),
+                clip="reused" if reused else "cut"
+            )
+
+    if upload.size > MAX_INLINE_VIDEO_BYTES:
+        # Too large to send inline: hand Gemini an object storage URI
+        forwarded_uri = await forward_video(upload)
+        await load_in_thread(generative_models)
+        part = generative_models.Part.from_uri(uri=forwarded_uri, mime_type=upload.mime_type)
+        return VideoInput(part, forwarded_uri=forwarded_uri, segment=with_video_segment(part, segment))
+    record, _ = await store_upload(upload)
+    part = await media_part(record, upload.read)
+    return VideoInput(part, media_id=record.media_id, segment=with_video_segment(part, segment))
+
+
+# --- Image Normalization ---
+# Images are downsized, recompressed and stripped of metadata before they reach
+# Gemini; large photos cost upload time and image tokens without better feedback.
+image_pipeline = ImagePipeline(
+    enabled=os.environ.get("IMAGE_PIPELINE_ENABLED", "true").lower() == "true",
+    max_dimension=int(os.environ.get("IMAGE_MAX_DIMENSION", "1536")),
+    output_format=os.environ.get("IMAGE_FORMAT", "JPEG"),
+    quality=int(os.environ.get("IMAGE_QUALITY", "85")),
+    max_entries=int(os.environ.get("IMAGE_CACHE_MAX_ENTRIES", "256")),
+    workers=int(os.environ.get("IMAGE_WORKERS", "2"))
+)
+
+
+async def store_image_upload(upload: IngestedUpload) -> Tuple[MediaRecord, bool, int]:
+    """
+    Normalizes an ingested image and stores the result in the media store.
+
+    Args:
+        upload: Ingested image
+
+    Returns:
+        Tuple of (MediaRecord, deduplicated, bytes_saved)
+    """
+    if not image_pipeline.enabled:
+        record, deduplicated = await store_upload(upload)
+        return record, deduplicated, 0
+    data = await upload.read()
+    with STAGE_SECONDS.time(stage="image_normalize"):
+        normalized = await image_pipeline.normalize(data, upload.mime_type)
+    record, deduplicated = await media_store.put(normalized.data, normalized.mime_type)
+    return record, deduplicated, normalized.bytes_saved
+
+# --- Persona Prefix Contexts ---
+# The persona/brand preamble is sent as a system instruction. Preambles large
+# enough to benefit are registered once as Vertex AI cached contexts and reused
+# across turns and users testing the same audience.
+def create_persona_model(model_name: str, system_instruction: str) -> "GenerativeModel":
+    """Builds a model that carries the persona preamble as its system instruction."""
+    if fake_backends:
+        return fake_backends.model(system_instruction)
+    clients.get("vertexai")
+    return generative_models.GenerativeModel(model_resource_name(model_name), system_instruction=system_instruction)
+
+
+def create_cached_persona_model(model_name: str, system_instruction: str, ttl: int):
+    """
+    Registers the persona preamble as a cached context (blocking).
+
+    Args:
+        model_name: Model the context is created for
+        system_instruction: Persona and brand preamble
+        ttl: Lifetime of the cached context in seconds
+
+    Returns:
+        Tuple of (model bound to the cached context, CachedContent handle)
+    """
+    if fake_backends:
+        return fake_backends.cached_model(system_instruction)
+    clients.get("vertexai")
+    cached_content = vertex_caching.CachedContent.create(
+        model_name=model_resource_name(model_name),
+        system_instruction=system_instruction,
+        ttl=timedelta(seconds=ttl)
+    )
+    model = preview_generative_models.GenerativeModel.from_cached_content(cached_content=cached_content)
+    return model, cached_content
+
+
+persona_contexts = PersonaContextCache(
+    model_factory=create_persona_model,
+    cached_model_factory=create_cached_persona_model,
+    delete_handle=lambda cached_content: cached_content.delete(),
+    enabled=os.environ.get("CONTEXT_CACHE_ENABLED", "false").lower() == "true",
+    # Roughly 4 chars per token; Vertex only caches contexts above a minimum size
+    min_chars=int(os.environ.get("CONTEXT_CACHE_MIN_CHARS", "16000")),
+    ttl=int(os.environ.get("CONTEXT_CACHE_TTL", "3600"))
+)
+
+
+async def acquire_persona_model(
+    system_instruction: Optional[str],
+    model_name: str = GEMINI_MODEL_NAME
+) -> ContextLease:
+    """
+    Leases the model to use for a persona, falling back to the shared model.
+
+    Args:
+        system_instruction: Persona and brand preamble, if any
+        model_name: Model chosen by the router
+
+    Returns:
+        ContextLease to release with persona_contexts.release()
+    """
+    if not system_instruction:
+        return ContextLease(model=await clients.aget(gemini_client_name(model_name)))
+    return await persona_contexts.acquire(model_name, system_instruction)
+
+
+# --- Generation Scheduling ---
+# Gemini calls run on the event loop via the async SDK; the scheduler caps how
+# many are in flight per instance and how many may wait behind them.
+MAX_CONCURRENT_GENERATIONS = int(os.environ.get("GEMINI_MAX_CONCURRENCY", "32"))
+MAX_QUEUED_GENERATIONS = int(os.environ.get("GEMINI_MAX_QUEUE", "64"))
+
+generation_scheduler = ConcurrencyScheduler(
+    max_concurrency=MAX_CONCURRENT_GENERATIONS,
+    max_queue=MAX_QUEUED_GENERATIONS
+)
+metrics.gauge(
+    "persona_generations_active", "Generations holding a scheduler slot"
+).set_function(lambda: generation_scheduler.active)
+metrics.gauge(
+    "persona_generations_waiting", "Generations waiting for a scheduler slot"
+).set_function(lambda: generation_scheduler.waiting)
+
+
+# --- Upstream Quotas ---
+# Per-minute quotas for each Gemini model and the Speech/TTS APIs are enforced
+# with token buckets kept in a SQLite file, so every worker process on the host
+# shares one budget. Calls answered with 429 or 5xx are retried with jittered
+# backoff. Upstreams missing from QUOTA_RPM are not throttled, only retried.
+QUOTA_STATE_PATH = os.environ.get("QUOTA_STATE_PATH", "/tmp/persona-quota.db")
+
+ADMISSION_EVENTS = metrics.counter(
+    "persona_admission_events_total",
+    "Upstream admission events (admitted, throttled, rejected, retries, upstream_429)",
+    ["bucket", "event"]
+)
+admission = AdmissionController(
+    store=SQLiteBucketStore(QUOTA_STATE_PATH) if QUOTA_STATE_PATH else MemoryBucketStore(),
+    limits=parse_limits(os.environ.get("QUOTA_RPM"), float(os.environ.get("QUOTA_BURST_SECONDS", "10"))),
+    max_wait=float(os.environ.get("QUOTA_MAX_WAIT", "10")),
+    batch_max_wait=float(os.environ.get("QUOTA_BATCH_MAX_WAIT", "120")),
+    batch_reserve=float(os.environ.get("QUOTA_BATCH_RESERVE", "0.2")),
+    max_attempts=int(os.environ.get("UPSTREAM_MAX_ATTEMPTS", "4")),
+    observer=lambda bucket, event: ADMISSION_EVENTS.inc(bucket=bucket, event=event)
+)
+
+
+# --- Model Routing ---
+# Short text-only turns go to GEMINI_FAST_MODEL when one is set; multimodal
+# and long-context turns go to GEMINI_MODEL. With GEMINI_HEDGE_MODEL set, a
+# request still unanswered after its model's HEDGE_PERCENTILE latency is
+# also sent there, and the first answer wins. Rolling latencies per model
+# drive both decisions and are reported in /health.
+model_router = ModelRouter(
+    default_model=GEMINI_MODEL_NAME,
+    fast_model=GEMINI_FAST_MODEL,
+    hedge_model=GEMINI_HEDGE_MODEL,
+    fast_max_chars=int(os.environ.get("ROUTE_FAST_MAX_CHARS", "4000")),
+    hedge_percentile=float(os.environ.get("HEDGE_PERCENTILE", "95")),
+    min_samples=int(os.environ.get("ROUTE_MIN_SAMPLES", "20")),
+    window_size=int(os.environ.get("ROUTE_LATENCY_WINDOW", "200"))
+)
+
+
+def route_generation(content_parts: list, system_instruction: Optional[str], kind: str) -> RouteDecision:
+    """
+    Routes a generation, dropping the hedge while generations are queueing.
+
+    Hedges add load, so they are only sent when the scheduler has room.
+
+    Args:
+        content_parts: Prompt text and media parts
+        system_instruction: Persona/brand preamble, if any
+        kind: KIND_GENERATE or KIND_STREAM
+
+    Returns:
+        RouteDecision
+    """
+    decision = model_router.route(content_parts, system_instruction, kind)
+    if generation_scheduler.waiting:
+        decision.hedge_model = decision.hedge_after = None
+    return decision
+
+
+@dataclass
+class GenerationStream:
+    """
+    A started streamed generation.
+
+    Args:
+        model_name: Model producing the stream
+        chunks: Iterator over every chunk, starting with the first
+        close: Releases the scheduler slot and model lease and ends the
+               upstream stream; safe to call twice
+        queue_time: Seconds the stream waited for its scheduler slot
+        hedged: Whether a hedge request produced the stream
+    """
+    model_name: str
+    chunks: AsyncIterator
+    close: Callable[[], None]
+    queue_time: float = 0.0
+    hedged: bool = False
+
+
+async def open_model_stream(
+    model_name: str,
+    content_parts: list,
+    system_instruction: Optional[str] = None,
+    priority: str = PRIORITY_INTERACTIVE
+) -> GenerationStream:
+    """
+    Starts a streamed generation on one model and waits for its first chunk.
+
+    The call is admitted against the model's quota and takes a scheduler
+    slot. Failures before the first chunk, quota 429s included, are retried
+    and otherwise raised here, while the caller can still answer with an
+    HTTP error.
+
+    Args:
+        model_name: Model to call
+        content_parts: Prompt text and media parts to send to the model
+        system_instruction: Optional persona/brand preamble for the model
+        priority: PRIORITY_INTERACTIVE or PRIORITY_BATCH
+
+    Returns:
+        GenerationStream, to be closed once consumed
+
+    Raises:
+        QueueFullError: If the wait queue is at capacity
+        QuotaExceededError: If the model's quota is exhausted
+    """
+    lease = await acquire_persona_model(system_instruction, model_name)
+
+    async def attempt() -> tuple:
+        ticket = await generation_scheduler.acquire()
+        GENERATION_QUEUE_SECONDS.observe(ticket.queue_time)
+        # Tracks the whole stream; closed by relay() once it has been consumed
+        tracking = ExitStack()
+        tracking.enter_context(upstream.track("gemini_stream"))
+        try:
+            started = time.perf_counter()
+            stream = await lease.model.generate_content_async(content_parts, stream=True)
+            chunks = aiter(stream)
+            first = await anext(chunks, None)
+        except BaseException as e:
+            tracking.__exit__(type(e), e, e.__traceback__)
+            generation_scheduler.release(ticket)
+            if isinstance(e, Exception):
+                model_router.observe(model_name, KIND_STREAM, None)
+            raise
+        GEMINI_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - started)
+        model_router.observe(model_name, KIND_STREAM, time.perf_counter() - started)
+        return ticket, tracking, first, chunks
+
+    try:
+        ticket, tracking, first, chunks = await admission.call(model_name, attempt, priority)
+    except BaseException:
+        persona_contexts.release(lease)
+        raise
+
+    async def relay():
+        with tracking:
+            if first is not None:
+                yield first
+            async for chunk in chunks:
+                yield chunk
+
+    closed = False
+
+    def close() -> None:
+        nonlocal closed
+        if closed:
+            return
+        closed = True
+        tracking.close()
+        generation_scheduler.release(ticket)
+        persona_contexts.release(lease)
+        # Ends the upstream stream if it was abandoned before its last chunk
+        if hasattr(chunks, "aclose"):
+            closing = asyncio.get_running_loop().create_task(chunks.aclose())
+            closing.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    return GenerationStream(model_name=model_name, chunks=relay(), close=close, queue_time=ticket.queue_time)
+
+
+async def open_generation_stream(
+    decision: RouteDecision,
+    content_parts: list,
+    system_instruction: Optional[str] = None,
+    priority: str = PRIORITY_INTERACTIVE
+) -> GenerationStream:
+    """
+    Starts a routed streamed generation, hedging if the model is slow.
+
+    Args:
+        decision: Route from route_generation(..., KIND_STREAM)
+        content_parts: Prompt text and media parts to send to the model
+        system_instruction: Optional persona/brand preamble for the model
+        priority: PRIORITY_INTERACTIVE or PRIORITY_BATCH
+
+    Returns:
+        GenerationStream from whichever request produced a first chunk first
+
+    Raises:
+        QueueFullError: If the wait queue is at capacity
+        QuotaExceededError: If the model's quota is exhausted
+    """
+    hedge = None
+    if decision.hedge_model:
+        hedge = lambda: open_model_stream(decision.hedge_model, content_parts, system_instruction, priority)
+    stream, hedge_sent, hedged = await race_with_hedge(
+        lambda: open_model_stream(decision.model, content_parts, system_instruction, priority),
+        hedge,
+        decision.hedge_after,
+        discard=lambda loser: loser.close()
+    )
+    if hedge_sent:
+        model_router.record_hedge(hedged)
+    stream.hedged = hedged
+    return stream
+
+
+# --- Response Cache ---
+# Opt-in: identical (persona, brand, history, prompt, media) requests share
+# one cached answer, and concurrent identical misses share one model call.
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "512")),
+    ttl=float(os.environ.get("RESPONSE_CACHE_TTL", "3600")),
+    directory=os.environ.get("RESPONSE_CACHE_DIR") or None
+) if RESPONSE_CACHE_ENABLED else None
+
+
+async def response_cache_key(content_parts: list, system_instruction: Optional[str]) -> str:
+    """
+    Computes a generation's response cache key.
+
+    The key names the configured model, not the routed one: probe and
+    latency routing and hedges pick a different model per request, and
+    keying on that choice would split identical requests across keys,
+    defeat coalescing and file a hedge's answer under the primary's key.
+
+    Args:
+        content_parts: Prompt text and media parts
+        system_instruction: Persona/brand preamble, if any
+
+    Returns:
+        Cache key
+    """
+    return await response_cache.key_for(model_router.default_model, [system_instruction or ""] + content_parts)
+
+
+def parse_cache_control(cache_control: Optional[str]) -> str:
+    """
+    Validates a request-level cache directive.
+
+    Args:
+        cache_control: Directive supplied by the client, if any
+
+    Returns:
+        The normalized directive
+
+    Raises:
+        HTTPException: If the directive is not recognized
+    """
+    directive = (cache_control or CACHE_DEFAULT).strip().lower()
+    if directive not in CACHE_DIRECTIVES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid cache_control '{cache_control}'. Use one of: {', '.join(sorted(CACHE_DIRECTIVES))}."
+        )
+    return directive
+
+
+@dataclass
+class GenerationOutcome:
+    """
+    Result of a single (possibly cached or coalesced) generation.
+
+    Args:
+        text: The generated response text
+        usage: Token usage reported by Gemini, if any
+        queue_time_ms: Time spent waiting for a scheduler slot, if the model was called
+        cache_status: Response cache outcome ('HIT', 'MISS', 'COALESCED', 'BYPASS'), if enabled
+        model_name: Model that produced the text, if known
+        hedged: Whether a hedge request produced the text
+    """
+    text: str
+    usage: Optional[dict] = None
+    queue_time_ms: Optional[float] = None
+    cache_status: Optional[str] = None
+    model_name: Optional[str] = None
+    hedged: bool = False
+
+
+async def run_generation(
+    content_parts: list,
+    cache_control: Optional[str] = None,
+    system_instruction: Optional[str] = None,
+    audience: Optional[str] = None,
+    priority: str = PRIORITY_INTERACTIVE
+) -> GenerationOutcome:
+    """
+    Runs a Gemini generation under the concurrency scheduler without blocking the event loop.
+
+    The model router picks the model and may hedge a slow call to a second
+    model. Each call is admitted against its model's quota and retried on
+    transient upstream errors. When the response cache is enabled, cached
+    answers are served directly and concurrent identical requests share a
+    single model call.
+
+    Args:
+        content_parts: Prompt text and media parts to send to the model
+        cache_control: Optional cache directive for this request
+        system_instruction: Optional persona/brand preamble for the model
+        audience: Persona description, used to attribute token usage
+        priority: PRIORITY_INTERACTIVE, or PRIORITY_BATCH for fan-out work
+
+    Returns:
+        GenerationOutcome with the text and scheduling/cache details
+
+    Raises:
+        QueueFullError: If the wait queue is at capacity
+        QuotaExceededError: If the model's quota is exhausted
+        CacheMissError: If an only-if-cached request has no cached answer
+    """
+    decision = route_generation(content_parts, system_instruction, KIND_GENERATE)
+    queue_time_ms = None
+    hedged = False
+
+    async def call_on(model_name: str) -> tuple:
+        lease = await acquire_persona_model(system_instruction, model_name)
+
+        async def attempt() -> tuple:
+            async with generation_scheduler.slot() as ticket:
+                GENERATION_QUEUE_SECONDS.observe(ticket.queue_time)
+                with upstream.track("gemini"):
+                    started = time.perf_counter()
+                    try:
+                        result = await lease.model.generate_content_async(content_parts)
+                    except Exception:
+                        model_router.observe(model_name, KIND_GENERATE, None)
+                        raise
+                    model_router.observe(model_name, KIND_GENERATE, time.perf_counter() - started)
+                    return ticket, result
+
+        try:
+            return await admission.call(model_name, attempt, priority)
+        finally:
+            persona_contexts.release(lease)
+
+    async def call_model() -> dict:
+        nonlocal queue_time_ms, hedged
+        hedge = (lambda: call_on(decision.hedge_model)) if decision.hedge_model else None
+        (ticket, result), hedge_sent, hedged = await race_with_hedge(
+            lambda: call_on(decision.model), hedge, decision.hedge_after
+        )
+        if hedge_sent:
+            model_router.record_hedge(hedged)
+
+        queue_time_ms = ticket.queue_time * 1000
+        usage = usage_to_dict(result.usage_metadata)
+        record_usage(audience, usage)
+        model_name = decision.hedge_model if hedged else decision.model
+        return {"text": result.text, "usage": usage, "model": model_name}
+
+    directive = parse_cache_control(cache_control)
+    if response_cache is None:
+        value = await call_model()
+        return GenerationOutcome(
+            text=value["text"],
+            usage=value["usage"],
+            queue_time_ms=queue_time_ms,
+            model_name=value["model"],
+            hedged=hedged
+        )
+
+    key = await response_cache_key(content_parts, system_instruction)
+    value, status = await response_cache.get_or_generate(key, call_model, directive)
+    return GenerationOutcome(
+        text=value["text"],
+        usage=value.get("usage"),
+        queue_time_ms=queue_time_ms,
+        cache_status=status,
+        model_name=value.get("model"),
+        hedged=hedged
+    )
+
+
+async def generate_content(
+    content_parts: list,
+    response: Response,
+    cache_control: Optional[str] = None,
+    system_instruction: Optional[str] = None,
+    audience: Optional[str] = None
+) -> str:
+    """
+    Runs a generation for an HTTP handler, reporting details in response headers.
+
+    Queue time is reported in X-Queue-Time-Ms, the answering model in X-Model
+    (with X-Hedged if a hedge request won) and, when the response cache is
+    enabled, the cache outcome in X-Cache.
+
+    Args:
+        content_parts: Prompt text and media parts to send to the model
+        response: Outgoing response, used to report queue time and cache status
+        cache_control: Optional cache directive for this request
+        system_instruction: Optional persona/brand preamble for the model
+        audience: Persona description, used to attribute token usage
+
+    Returns:
+        The generated response text
+
+    Raises:
+        QueueFullError: If the wait queue is at capacity
+        QuotaExceededError: If the model's quota is exhausted
+        CacheMissError: If an only-if-cached request has no cached answer
+    """
+    outcome = await run_generation(content_parts, cache_control, system_instruction, audience)
+    if outcome.queue_time_ms is not None:
+        response.headers["X-Queue-Time-Ms"] = f"{outcome.queue_time_ms:.1f}"
+    if outcome.cache_status:
+        response.headers["X-Cache"] = outcome.cache_status
+    if outcome.model_name:
+        response.headers["X-Model"] = outcome.model_name
+    if outcome.hedged:
+        response.headers["X-Hedged"] = "true"
+    return outcome.text
+
+
+async def stream_generation(
+    content_parts: list,
+    cache_control: Optional[str] = None,
+    on_complete: Optional[Callable[[str], Awaitable[None]]] = None,
+    system_instruction: Optional[str] = None,
+    audience: Optional[str] = None
+) -> StreamingResponse:
+    """
+    Starts a streaming Gemini generation and relays it as Server-Sent Events.
+
+    The generation is routed, admitted, holds a scheduler slot and delivers
+    its first chunk before the response starts, so a full queue still
+    surfaces as a 503 and an exhausted quota as a 429. The slot is held
+    until the stream finishes or the client disconnects, including a client
+    that disconnects before the first frame is sent. Each partial text
+    chunk is sent as a 'chunk' event; the stream ends with a 'done' event
+    carrying the full text and token usage, or an 'error' event if
+    generation fails mid-stream. The answering model is reported in X-Model.
+
+    With the response cache enabled, a cached answer is replayed as a single
+    chunk and completed streams are stored. Streams are not coalesced.
+
+    Args:
+        content_parts: Prompt text and media parts to send to the model
+        cache_control: Optional cache directive for this request
+        on_complete: Optional coroutine called with the full text before the
+                     'done' event is sent (e.g., to record a session turn)
+        system_instruction: Optional persona/brand preamble for the model
+        audience: Persona description, used to attribute token usage
+
+    Returns:
+        StreamingResponse producing text/event-stream frames
+
+    Raises:
+        QueueFullError: If the wait queue is at capacity
+        QuotaExceededError: If the model's quota is exhausted
+        CacheMissError: If an only-if-cached request has no cached answer
+    """
+    directive = parse_cache_control(cache_control)
+    decision = route_generation(content_parts, system_instruction, KIND_STREAM)
+    cache_key = None
+    if response_cache is not None and directive != CACHE_NO_STORE:
+        cache_key = await response_cache_key(content_parts, system_instruction)
+        cached = None
+        if directive != CACHE_NO_CACHE:
+            cached = await response_cache.get(cache_key)
+        if cached is not None:
+            return replay_cached_stream(cached, on_complete)
+        if directive == CACHE_ONLY_IF_CACHED:
+            raise CacheMissError(cache_key)
+
+    stream = await open_generation_stream(decision, content_parts, system_instruction)
+
+    async def event_stream():
+        text_chunks = []
+        usage_metadata = None
+        try:
+            async for chunk in stream.chunks:
+                text = chunk_text(chunk)
+                if text:
+                    text_chunks.append(text)
+                    yield format_sse("chunk", {"text": text})
+                if getattr(chunk, "usage_metadata", None):
+                    usage_metadata = chunk.usage_metadata
+
+            full_text = "".join(text_chunks)
+            usage = usage_to_dict(usage_metadata)
+            record_usage(audience, usage)
+            if on_complete is not None:
+                await on_complete(full_text)
+            yield format_sse("done", {"agent_response": full_text, "usage": usage})
+
+            if cache_key and full_text:
+                await response_cache.set(cache_key, {"text": full_text, "usage": usage, "model": stream.model_name})
+        except Exception as e:
+            logger.warning("Streaming generation error: %s", e)
+            yield format_sse("error", {"detail": f"Generation failed: {str(e)}"})
+        finally:
+            stream.close()
+
+    headers = dict(SSE_HEADERS)
+    headers["X-Queue-Time-Ms"] = f"{stream.queue_time * 1000:.1f}"
+    headers["X-Model"] = stream.model_name
+    if stream.hedged:
+        headers["X-Hedged"] = "true"
+    if cache_key:
+        headers["X-Cache"] = "MISS"
+    return ClosingStreamingResponse(
+        event_stream(), on_close=stream.close, media_type="text/event-stream", headers=headers
+    )
+
+
+async def generate_text_stream(
+    content_parts: list,
+    system_instruction: Optional[str] = None,
+    audience: Optional[str] = None
+) -> AsyncIterator[str]:
+    """
+    Streams generated text for server-side consumers such as the voice pipeline.
+
+    Holds a scheduler slot and persona model lease for the length of the
+    stream. Consume it inside contextlib.aclosing() so they are released as
+    soon as the consumer stops, not when the generator is garbage collected.
+
+    Args:
+        content_parts: Prompt text and media parts to send to the model
+        system_instruction: Optional persona/brand preamble for the model
+        audience: Persona description, used to attribute token usage
+
+    Yields:
+        Partial text chunks as Gemini produces them
+
+    Raises:
+        QueueFullError: If the wait queue is at capacity
+        QuotaExceededError: If the model's quota is exhausted
+    """
+    decision = route_generation(content_parts, system_instruction, KIND_STREAM)
+    stream = await open_generation_stream(decision, content_parts, system_instruction)
+    try:
+        usage_metadata = None
+        async for chunk in stream.chunks:
+            if getattr(chunk, "usage_metadata", None):
+                usage_metadata = chunk.usage_metadata
+            text = chunk_text(chunk)
+            if text:
+                yield text
+        record_usage(audience, usage_to_dict(usage_metadata))
+    finally:
+        stream.close()
+
+
+def replay_cached_stream(
+    cached: dict,
+    on_complete: Optional[Callable[[str], Awaitable[None]]] = None
+) -> StreamingResponse:
+    """
+    Replays a cached answer in the same SSE format as a live stream.
+
+    Args:
+        cached: Cached response dict with 'text' and 'usage'
+        on_complete: Optional coroutine called with the text before 'done'
+
+    Returns:
+        StreamingResponse with one 'chunk' event and a 'done' event
+    """
+    async def event_stream():
+        yield format_sse("chunk", {"text": cached["text"]})
+        if on_complete is not None:
+            await on_complete(cached["text"])
+        yield format_sse("done", {"agent_response": cached["text"], "usage": cached.get("usage")})
+
+    headers = dict(SSE_HEADERS)
+    headers["X-Cache"] = "HIT"
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=headers)
+
+
+# --- Conversation Sessions ---
+# History lives server-side so clients only post the new turn.
+session_store = create_session_store()
+
+
+def cache_miss_exception() -> HTTPException:
+    """
+    Builds the error returned when an only-if-cached request misses.
+
+    Returns:
+        HTTPException with status 504, mirroring HTTP only-if-cached semantics
+    """
+    return HTTPException(
+        status_code=504,
+        detail="No cached response is available for this request."
+    )
+
+
+def queue_full_exception(error: QueueFullError) -> HTTPException:
+    """
+    Converts a scheduler rejection into a 503 with a Retry-After header.
+
+    Args:
+        error: The QueueFullError raised by the scheduler
+
+    Returns:
+        HTTPException ready to be raised from a handler
+    """
+    return HTTPException(
+        status_code=503,
+        detail="Server is at capacity. Please retry shortly.",
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+
+def quota_exceeded_exception(error: QuotaExceededError) -> HTTPException:
+    """
+    Converts an exhausted upstream quota into a 429 with a Retry-After header.
+
+    Args:
+        error: The QuotaExceededError raised by admission control
+
+    Returns:
+        HTTPException ready to be raised from a handler
+    """
+    return HTTPException(
+        status_code=429,
+        detail="Upstream quota exhausted. Please retry shortly.",
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+
+def construct_prompt(user_prompt: str, brand_context: str, audience_summary: str) -> str:
+    """
+    Constructs the system prompt for the Gemini model (legacy function for backward compatibility).
+
+    Args:
+        user_prompt: User's question
+        brand_context: Brand information
+        audience_summary: Persona description
+
+    Returns:
+        Formatted prompt string
+    """
+    prompt_template = '''You are a creative testing and surveying chatbot acting as a specific consumer persona.
+Your persona is defined by the following summary:
+---
+**Audience Persona:**
+{audience_summary}
+---
+
+You are being asked for feedback on a brand. Here is the context for the brand:
+---
+**Brand Context:**
+{brand_context}
+---
+
+Now, please respond to the following question or statement from the user, keeping your persona and the brand context in mind at all times. Be authentic, detailed, and stay in character.
+
+**User's Question:** "{user_prompt}"
+'''
+
+    return prompt_template.format(
+        audience_summary=audience_summary,
+        brand_context=brand_context,
+        user_prompt=user_prompt
+    )
+
+
+# --- Document Retrieval ---
+# Long brand briefs and audience research are chunked and BM25-indexed once,
+# keyed by content hash; each turn keeps only the chunks relevant to its
+# question, within a per-document character budget.
+document_retriever = DocumentRetriever(
+    enabled=os.environ.get("RETRIEVAL_ENABLED", "true").lower() == "true",
+    min_chars=int(os.environ.get("RETRIEVAL_MIN_CHARS", "8000")),
+    chunk_chars=int(os.environ.get("RETRIEVAL_CHUNK_CHARS", "800")),
+    budget_chars=int(os.environ.get("RETRIEVAL_BUDGET_CHARS", "4000")),
+    top_k=int(os.environ.get("RETRIEVAL_TOP_K", "6")),
+    max_entries=int(os.environ.get("RETRIEVAL_MAX_INDEXES", "256"))
+)
+
+
+def retrieval_query(user_prompt: str, history: Optional[list] = None) -> str:
+    """
+    Builds the retrieval query for a turn.
+
+    The previous message is included so that follow-ups such as "and the
+    price?" still find the chunks about what is being discussed.
+
+    Args:
+        user_prompt: User's current question
+        history: Optional list of previous chat messages
+
+    Returns:
+        Query text
+    """
+    if history:
+        return f"{history[-1].text}\n{user_prompt}"
+    return user_prompt
+
+
+def persona_preamble(audience_summary: str, brand_context: str) -> str:
+    """Formats the persona and brand into the system instruction text."""
+    return f"""You are a creative testing and surveying chatbot acting as a specific consumer persona.
+Your persona is defined by: {audience_summary}
+
+You are being asked for feedback on a brand. The brand context is: {brand_context}
+
+Keep your persona and the brand context in mind at all times. Be authentic, detailed, and stay in character.
+"""
+
+
+def build_system_instruction(audience_summary: str, brand_context: str, query: Optional[str] = None) -> str:
+    """
+    Builds the persona and brand preamble sent as the model's system instruction.
+
+    The preamble is identical for every turn with the same persona and brand,
+    which lets it be reused (and context-cached) instead of re-sent in each prompt.
+    With a query, a persona or brand document longer than RETRIEVAL_MIN_CHARS
+    is cut down to its chunks relevant to the query, so the preamble then
+    varies per question. Retrieval is skipped when the full preamble is large
+    enough to be context-cached: its tokens are then billed at the cached
+    rate, and keeping it stable keeps both the cached context and the
+    response cache key the same from turn to turn.
+
+    Args:
+        audience_summary: Persona description
+        brand_context: Brand information
+        query: Optional retrieval query for the turn (see retrieval_query())
+
+    Returns:
+        System instruction text
+    """
+    preamble = persona_preamble(audience_summary, brand_context)
+    if not query or persona_contexts.cacheable(preamble):
+        return preamble
+    with STAGE_SECONDS.time(stage="retrieval"):
+        audience_summary = document_retriever.select(audience_summary, query).text
+        brand_context = document_retriever.select(brand_context, query).text
+    return persona_preamble(audience_summary, brand_context)
+
+
+# Conversation prompts are kept within a token budget: recent turns stay
+# verbatim and older ones are folded into a cached rolling summary.
+history_builder = HistoryBuilder(
+    token_budget=int(os.environ.get("HISTORY_TOKEN_BUDGET", "24000")),
+    min_recent_messages=int(os.environ.get("HISTORY_MIN_RECENT_MESSAGES", "6")),
+    summary_token_budget=int(os.environ.get("HISTORY_SUMMARY_TOKEN_BUDGET", "1500"))
+)
+
+
+@STAGE_SECONDS.timed(stage="prompt_build")
+def construct_conversation_prompt(
+    user_prompt: str,
+    history: Optional[List[ChatMessage]] = None,
+    conversation_id: Optional[str] = None
+) -> str:
+    """
+    Constructs the per-turn prompt: conversation history plus the new message.
+
+    Args:
+        user_prompt: User's current question
+        history: Optional list of previous chat messages
+        conversation_id: Optional stable id (e.g., session id) for summary caching
+
+    Returns:
+        Formatted conversation prompt string
+    """
+    return history_builder.build(user_prompt, history, conversation_id)
+
+
+def construct_prompt_with_history(
+    user_prompt: str,
+    brand_context: str,
+    audience_summary: str,
+    history: Optional[List[ChatMessage]] = None
+) -> str:
+    """
+    Constructs a single prompt with persona, brand and conversation history.
+
+    Kept for callers that need one self-contained prompt; the chat endpoints
+    send build_system_instruction() and construct_conversation_prompt() separately.
+
+    Args:
+        user_prompt: User's current question
+        brand_context: Brand information
+        audience_summary: Persona description
+        history: Optional list of previous chat messages
+
+    Returns:
+        Formatted prompt string with conversation history
+    """
+    return (
+        build_system_instruction(audience_summary, brand_context, retrieval_query(user_prompt, history))
+        + "\n"
+        + construct_conversation_prompt(user_prompt, history)
+    )
+
+
+@app.get("/")
+def read_root():
+    """Health check endpoint."""
+    return {
+        "status": "Synthetic Persona Agent is running",
+        "version": "1.0.0",
+        "multimodal": True
+    }
+
+
+@app.get("/health")
+def health_check():
+    """
+    Health check endpoint for monitoring.
+
+    Returns:
+        Health status and configuration info
+    """
+    return {
+        "status": "healthy",
+        "project_id": PROJECT_ID,
+        "location": LOCATION,
+        "model_configured": MODEL_CONFIGURED,
+        "generation_scheduler": generation_scheduler.stats(),
+        "admission": admission.stats(),
+        "model_routing": model_router.stats(),
+        "jobs": job_queue.stats(),
+        "clients": clients.stats(),
+        "startup": startup_timings,
+        "imports_ms": import_timings(),
+        "response_cache": response_cache.stats() if response_cache else None,
+        "sessions": session_store.stats(),
+        "persona_contexts": persona_contexts.stats(),
+        "history": history_builder.stats(),
+        "retrieval": document_retriever.stats(),
+        "media_store": media_store.stats(),
+        "ingest": ingestor.stats(),
+        "image_pipeline": image_pipeline.stats(),
+        "video_segments": {**segment_cutter.stats(), "fps_supported": video_fps_supported},
+        # From config: resolving the recognizer here would build it during a liveness probe
+        "speech_stream_backend": STT_STREAM_BACKEND,
+        "fake_backends": fake_backends.stats() if fake_backends else None,
+        "speech_cache": speech_cache.stats()
+    }
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """
+    Prometheus scrape endpoint.
+
+    Returns:
+        Stage and upstream latency histograms, in-flight gauges, upstream
+        error counts and token usage in the Prometheus text format
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class SignedUrlRequest(BaseModel):
+    """
+    Request model for generating signed upload URLs.
+
+    Args:
+        filename: Original filename of the video to upload
+        content_type: MIME type of the video (e.g., 'video/mp4')
+    """
+    filename: str
+    content_type: str
+
+
+class SignedUrlResponse(BaseModel):
+    """
+    Response model containing signed URL and GCS URI.
+
+    Args:
+        upload_url: Signed URL for uploading the video
+        gcs_uri: GCS URI to use when referencing the uploaded file
+        blob_name: Name of the blob in GCS
+    """
+    upload_url: str
+    gcs_uri: str
+    blob_name: str
+
+
+def sign_upload(filename: str, content_type: str) -> SignedUrlResponse:
+    """
+    Generates a unique blob name and a signed PUT URL for it.
+
+    Runs synchronously (IAM signing is a blocking HTTP call), so async
+    callers should run it in a worker thread.
+
+    Args:
+        filename: Original filename, used to pick the blob extension
+        content_type: MIME type the upload must declare
+
+    Returns:
+        SignedUrlResponse with upload URL, GCS URI, and blob name
+    """
+    signer = clients.get("signer")
+
+    # Generate unique blob name using UUID
+    file_extension = filename.split('.')[-1] if '.' in filename else 'mp4'
+    blob_name = f"{uuid.uuid4()}.{file_extension}"
+
+    upload_url = signer.sign_upload_url(blob_name, content_type, UPLOAD_URL_TTL)
+
+    return SignedUrlResponse(
+        upload_url=upload_url,
+        gcs_uri=signer.gcs_uri(blob_name),
+        blob_name=blob_name
+    )
+
+
+@app.post("/generate-upload-url", response_model=SignedUrlResponse)
+async def generate_upload_url(request: SignedUrlRequest):
+    """
+    Generates a signed URL for uploading large videos directly to GCS.
+
+    This endpoint creates a unique blob name and generates a signed URL
+    that allows the frontend to upload files directly to Google Cloud Storage.
+    The signed URL is valid for 15 minutes.
+
+    Uses IAM-based signing which works with Cloud Run's default credentials
+    without requiring a service account key file. The impersonated signing
+    credentials are cached and refreshed before they expire.
+
+    Args:
+        request: SignedUrlRequest with filename and content type
+
+    Returns:
+        SignedUrlResponse with upload URL, GCS URI, and blob name
+
+    Raises:
+        HTTPException: If URL generation fails
+    """
+    try:
+        return await asyncio.to_thread(sign_upload, request.filename, request.content_type)
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to generate upload URL: {str(e)}"
+        )
+
+
+class BatchSignedUrlRequest(BaseModel):
+    """
+    Request model for generating several signed upload URLs at once.
+
+    Args:
+        files: Filename and content type for each upload
+    """
+    files: List[SignedUrlRequest]
+
+
+class BatchSignedUrlResponse(BaseModel):
+    """
+    Response model containing one signed URL per requested file, in request order.
+
+    Args:
+        uploads: Signed URL, GCS URI and blob name for each file
+    """
+    uploads: List[SignedUrlResponse]
+
+
+@app.post("/generate-upload-urls", response_model=BatchSignedUrlResponse)
+async def generate_upload_urls(request: BatchSignedUrlRequest):
+    """
+    Generates signed upload URLs for a batch of files in one request.
+
+    Signing runs concurrently in worker threads and shares the cached
+    impersonated credentials, so N URLs cost roughly one SignBlob round trip
+    of wall time instead of N sequential ones.
+
+    Args:
+        request: BatchSignedUrlRequest listing the files to upload
+
+    Returns:
+        BatchSignedUrlResponse with one entry per file, in request order
+
+    Raises:
+        HTTPException: If the batch is empty or too large, or signing fails
+    """
+    if not request.files:
+        raise HTTPException(status_code=400, detail="At least one file is required.")
+    if len(request.files) > MAX_BATCH_UPLOAD_URLS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many files ({len(request.files)}). Maximum is {MAX_BATCH_UPLOAD_URLS}."
+        )
+
+    try:
+        uploads = await asyncio.gather(*[
+            asyncio.to_thread(sign_upload, file.filename, file.content_type)
+            for file in request.files
+        ])
+        return BatchSignedUrlResponse(uploads=list(uploads))
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to generate upload URLs: {str(e)}"
+        )
+
+
+@app.put("/fake-gcs/{bucket_name}/{blob_name:path}", include_in_schema=False)
+async def fake_gcs_upload(bucket_name: str, blob_name: str, request: Request):
+    """
+    Accepts a PUT to a URL signed by LocalFakeSigner, under BACKENDS=fake only.
+
+    The upload lands in the fake storage client, so the gs:// URI returned
+    with the URL can be used in chat requests as after a real upload. A
+    FAKE_SIGNER_BASE_URL pointing elsewhere must serve its own uploads.
+
+    Args:
+        bucket_name: Bucket in the signed URL
+        blob_name: Blob name in the signed URL
+        request: The upload request; its Content-Type must match the signed one
+
+    Returns:
+        Empty 200 response once the object is stored
+
+    Raises:
+        HTTPException: 404 unless fake backends and the fake signer are in use,
+                       403 if the signature is invalid or expired
+    """
+    signer = await clients.aget("signer")
+    if not fake_backends or not isinstance(signer, LocalFakeSigner):
+        raise HTTPException(status_code=404, detail="Not Found")
+    content_type = request.headers.get("content-type", "")
+    if not signer.verify(str(request.url), content_type):
+        raise HTTPException(status_code=403, detail="Invalid or expired upload signature.")
+
+    body = await request.body()
+    blob = clients.get("storage").bucket(bucket_name).blob(blob_name)
+    await asyncio.to_thread(blob.upload_from_file, io.BytesIO(body), size=len(body), content_type=content_type)
+    return Response(status_code=200)
+
+
+def decode_base64_image(image_data: str) -> Tuple[bytes, str]:
+    """
+    Decodes a Base64 image (optionally a data URL).
+
+    Args:
+        image_data: Base64 string, optionally prefixed with "data:image/[type];base64,"
+
+    Returns:
+        Tuple of (image bytes, MIME type)
+
+    Raises:
+        HTTPException: If the data cannot be decoded
+    """
+    try:
+        # The Base64 string is prefixed with "data:image/[type];base64,"
+        # We need to strip that prefix before decoding
+        if "," in image_data:
+            header, base64_data = image_data.split(",", 1)
+            # Extract mime type from header (e.g., "data:image/jpeg;base64")
+            if ":" in header and ";" in header:
+                mime_type = header.split(":")[1].split(";")[0]
+            else:
+                mime_type = "image/jpeg"  # Default
+        else:
+            # No header, assume raw base64
+            base64_data = image_data
+            mime_type = "image/jpeg"
+
+        return base64.b64decode(base64_data), mime_type
+
+    except Exception as e:
+        logger.info("Invalid image data: %s", e)
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid image data: {str(e)}"
+        )
+
+
+async def image_part_from_base64(image_data: str) -> Tuple["Part", int]:
+    """
+    Decodes and normalizes a Base64 image into a Gemini Part.
+
+    Args:
+        image_data: Base64 string, optionally prefixed with "data:image/[type];base64,"
+
+    Returns:
+        Tuple of (image Part for the prompt, bytes saved by normalization)
+
+    Raises:
+        HTTPException: If the data cannot be decoded
+    """
+    with STAGE_SECONDS.time(stage="image_decode"):
+        image_bytes, mime_type = decode_base64_image(image_data)
+    with STAGE_SECONDS.time(stage="image_normalize"):
+        normalized = await image_pipeline.normalize(image_bytes, mime_type)
+    await load_in_thread(generative_models)
+    return generative_models.Part.from_data(mime_type=normalized.mime_type, data=normalized.data), normalized.bytes_saved
+
+
+async def shared_image_part_from_base64(image_data: str) -> "Part":
+    """
+    Builds the part for a Base64 image that many requests will send.
+
+    With a remote media store the normalized image is stored once and
+    referenced by URI, so each request carries a reference instead of the
+    bytes. Local stores cannot be read by the model, so the image is sent
+    inline as image_part_from_base64 does.
+
+    Args:
+        image_data: Base64 string, optionally prefixed with "data:image/[type];base64,"
+
+    Returns:
+        Image Part for the prompt
+
+    Raises:
+        HTTPException: If the data cannot be decoded
+    """
+    if not media_store.backend.remote:
+        image_part, _ = await image_part_from_base64(image_data)
+        return image_part
+    with STAGE_SECONDS.time(stage="image_decode"):
+        image_bytes, mime_type = decode_base64_image(image_data)
+    with STAGE_SECONDS.time(stage="image_normalize"):
+        normalized = await image_pipeline.normalize(image_bytes, mime_type)
+    record, _ = await media_store.put(normalized.data, normalized.mime_type)
+    return await media_part(record)
+
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat_handler(request: ChatRequest, response: Response):
+    """
+    Handles chat requests with optional session memory and multimodal image support.
+
+    Args:
+        request: ChatRequest with user prompt, brand context, audience summary,
+                optional conversation history, and optional image data
+        response: Outgoing response, used to report queue time
+
+    Returns:
+        ChatResponse with the agent's persona-based reply, or an SSE stream
+        of partial replies when request.stream is set
+
+    Raises:
+        HTTPException: If the model is not configured or generation fails
+    """
+    if not MODEL_CONFIGURED:
+        raise HTTPException(
+            status_code=500,
+            detail="Model not configured. Set GCLOUD_PROJECT environment variable."
+        )
+
+    try:
+        # Persona and brand go in the system instruction; the prompt carries the conversation
+        system_instruction = build_system_instruction(
+            request.audience_summary, request.brand_context,
+            retrieval_query(request.user_prompt, request.history)
+        )
+        text_prompt = construct_conversation_prompt(request.user_prompt, request.history)
+
+        # Start with the text prompt
+        prompt_parts = [text_prompt]
+
+        # Add image if provided (Base64 encoded)
+        image_bytes_saved = 0
+        if request.image_data:
+            image_part, image_bytes_saved = await image_part_from_base64(request.image_data)
+            prompt_parts.append(image_part)
+
+        # Add previously stored media
+        prompt_parts.extend(await media_parts_for_ids(request.media_ids))
+
+        if request.stream:
+            streaming_response = await stream_generation(
+                prompt_parts, request.cache_control, system_instruction=system_instruction,
+                audience=request.audience_summary
+            )
+            streaming_response.headers["X-Image-Bytes-Saved"] = str(image_bytes_saved)
+            return streaming_response
+
+        # Generate content (text-only or multimodal)
+        agent_response = await generate_content(
+            prompt_parts, response, request.cache_control, system_instruction, request.audience_summary
+        )
+        response.headers["X-Image-Bytes-Saved"] = str(image_bytes_saved)
+
+        return ChatResponse(agent_response=agent_response)
+
+    except QueueFullError as e:
+        raise queue_full_exception(e)
+    except QuotaExceededError as e:
+        raise quota_exceeded_exception(e)
+    except CacheMissError:
+        raise cache_miss_exception()
+    except HTTPException:
+        # Re-raise HTTP exceptions
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Generation failed: {str(e)}")
+
+
+@app.options("/chat/multimodal")
+async def multimodal_options():
+    """Handle CORS preflight for multimodal endpoint."""
+    from fastapi.responses import Response
+    return Response(
+        status_code=200,
+        headers={
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "POST, OPTIONS",
+            "Access-Control-Allow-Headers": "*",
+        }
+    )
+
+
+@app.post("/chat/multimodal", response_model=ChatResponse)
+async def multimodal_chat_handler(
+    response: Response,
+    user_prompt: str = Form(...),
+    brand_context: str = Form(...),
+    audience_summary: str = Form(...),
+    history: Optional[str] = Form(None),  # JSON string of chat history
+    image: Optional[UploadFile] = File(None),
+    video: Optional[UploadFile] = File(None),
+    video_uri: Optional[str] = Form(None),  # GCS URI for large videos
+    video_start: Optional[str] = Form(None),  # Seconds or [hh:]mm:ss
+    video_end: Optional[str] = Form(None),
+    video_fps: Optional[float] = Form(None),
+    stream: bool = Form(False),
+    cache_control: Optional[str] = Form(None),
+    media_ids: Optional[str] = Form(None)  # Comma-separated ids from /media
+):
+    """
+    Handles multimodal chat requests with text, images, and/or videos.
+
+    This endpoint supports the full multimodal capabilities of Gemini,
+    allowing users to upload visual content alongside their text prompts.
+    Uploads are read in chunks under per-type size limits. Videos larger
+    than MAX_INLINE_VIDEO_BYTES are forwarded to object storage and returned
+    as video_uri; a video_uri from /generate-upload-url can also be passed
+    directly. For videos long enough to outlast client or proxy timeouts,
+    submit the analysis to /chat/jobs instead.
+
+    video_start and video_end limit the analysis to one segment of the
+    video, and video_fps sets the frame rate Gemini samples it at. Uploads
+    are cut to the segment when ffmpeg is available, and the clip is reused
+    by later questions about the same range; otherwise the offsets are sent
+    with the video. The segment as sent is reported in the X-Video-Segment
+    header, and X-Video-Clip says whether a clip was cut or reused.
+
+    Uploaded images and videos are stored in the media store and their ids
+    are returned, so later turns can pass media_ids instead of re-uploading.
+    Images are normalized before they are stored. The memory held while
+    ingesting the uploads and the bytes saved by image normalization are
+    reported in the X-Ingest-Peak-Bytes and X-Image-Bytes-Saved headers.
+
+    Args:
+        response: Outgoing response, used to report queue time
+        user_prompt: The user's question or statement
+        brand_context: Context about the brand
+        audience_summary: Description of the persona
+        history: Optional JSON string of conversation history
+        image: Optional image file
+        video: Optional video file
+        video_uri: Optional GCS URI of an already uploaded video
+        video_start: Optional start of the video segment to analyze
+        video_end: Optional end of the video segment to analyze
+        video_fps: Optional frame rate to sample the video at
+        stream: If true, stream the reply as Server-Sent Events
+        cache_control: Optional response cache directive
+        media_ids: Optional comma-separated ids of previously stored media
+
+    Returns:
+        ChatResponse with the agent's persona-based reply and the ids of any
+        stored uploads, or an SSE stream of partial replies when stream is set
+        (ids are then reported in the X-Media-Ids header)
+
+    Raises:
+        HTTPException: If the model is not configured, an upload is too large,
+                       the video segment is invalid or generation fails
+    """
+    if not MODEL_CONFIGURED:
+        raise HTTPException(
+            status_code=500,
+            detail="Model not configured. Set GCLOUD_PROJECT environment variable."
+        )
+    segment = parse_video_segment(video_start, video_end, video_fps)
+    if segment is not None and not (video or video_uri):
+        raise HTTPException(status_code=400, detail="video_start, video_end and video_fps need a video or video_uri.")
+
+    ingested = []
+    try:
+        # Parse history if provided
+        history_list = None
+        if history:
+            try:
+                history_data = json.loads(history)
+                # Convert to ChatMessage objects
+                history_list = [ChatMessage(**msg) for msg in history_data]
             except Exception as e:
-                print(f"Error parsing history: {e}")
+                logger.info("Ignoring unparseable history: %s", e)
                 # Continue without history if parsing fails
 
-        # Construct the text prompt with history support
-        prompt_text = construct_prompt_with_history(
-            user_prompt,
-            brand_context,
-            audience_summary,
-            history_list
-        )
+        # Persona and brand go in the system instruction; the prompt carries the conversation
+        system_instruction = build_system_instruction(
+            audience_summary, brand_context, retrieval_query(user_prompt, history_list)
+        )
+        prompt_text = construct_conversation_prompt(user_prompt, history_list)
+
+        # Build the content list for Gemini
+        content_parts = [prompt_text]
+
+        stored_media_ids = []
+        video_input = None
+        image_bytes_saved = 0
+
+        # Add image if provided
+        if image:
+            upload = await ingestor.ingest(image, IMAGE_UPLOAD_LIMIT)
+            ingested.append(upload)
+            record, _, image_bytes_saved = await store_image_upload(upload)
+            stored_media_ids.append(record.media_id)
+            content_parts.append(await media_part(record))
+
+        # Add video if provided (either as file upload or GCS URI)
+        if video_uri:
+            # Use the GCS URI of a video uploaded through a signed URL
+            video_input = await video_input_for_uri(video_uri, segment)
+        elif video:
+            upload = await ingestor.ingest(video, VIDEO_UPLOAD_LIMIT)
+            ingested.append(upload)
+            video_input = await video_input_for_upload(upload, segment)
+        if video_input is not None:
+            content_parts.append(video_input.part)
+            if video_input.media_id:
+                stored_media_ids.append(video_input.media_id)
+        forwarded_video_uri = video_input.forwarded_uri if video_input else None
+
+        # Add previously stored media
+        content_parts.extend(await media_parts_for_ids(parse_media_ids(media_ids)))
+        ingest_peak = str(sum(upload.peak_memory for upload in ingested))
+
+        if stream:
+            streaming_response = await stream_generation(
+                content_parts, cache_control, system_instruction=system_instruction,
+                audience=audience_summary
+            )
+            streaming_response.headers["X-Ingest-Peak-Bytes"] = ingest_peak
+            streaming_response.headers["X-Image-Bytes-Saved"] = str(image_bytes_saved)
+            if stored_media_ids:
+                streaming_response.headers["X-Media-Ids"] = ",".join(stored_media_ids)
+            if forwarded_video_uri:
+                streaming_response.headers["X-Video-Uri"] = forwarded_video_uri
+            if video_input is not None:
+                video_input.set_headers(streaming_response.headers)
+            return streaming_response
+
+        # Generate content with multimodal input
+        agent_response = await generate_content(
+            content_parts, response, cache_control, system_instruction, audience_summary
+        )
+        response.headers["X-Ingest-Peak-Bytes"] = ingest_peak
+        response.headers["X-Image-Bytes-Saved"] = str(image_bytes_saved)
+        if video_input is not None:
+            video_input.set_headers(response.headers)
+
+        return ChatResponse(
+            agent_response=agent_response,
+            media_ids=stored_media_ids or None,
+            video_uri=forwarded_video_uri
+        )
+
+    except (UploadTooLargeError, UploadTooSmallError) as e:
+        raise upload_rejected_exception(e)
+    except QueueFullError as e:
+        raise queue_full_exception(e)
+    except QuotaExceededError as e:
+        raise quota_exceeded_exception(e)
+    except CacheMissError:
+        raise cache_miss_exception()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Multimodal generation failed: {str(e)}"
+        )
+    finally:
+        for upload in ingested:
+            await upload.aclose()
+
+
+# --- Background Jobs ---
+# Video analyses can take longer than browsers and proxies keep a request
+# open, so they can run as jobs instead. Jobs are kept in SQLite
+# (JOB_STORE_PATH; mount a volume there to keep them across container
+# restarts) and run JOB_WORKERS at a time per process, off the request path.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+# Longest a GET /jobs/{id}?wait= long-poll is held open
+JOB_MAX_WAIT = float(os.environ.get("JOB_MAX_WAIT", "60"))
+# Hosts callback URLs may point at; callbacks are refused when none are listed
+JOB_CALLBACK_HOSTS = {
+    host.strip().lower() for host in os.environ.get("JOB_CALLBACK_HOSTS", "").split(",") if host.strip()
+}
+# Callbacks only reach public addresses unless this is set (e.g., for internal receivers)
+JOB_CALLBACK_ALLOW_PRIVATE = os.environ.get("JOB_CALLBACK_ALLOW_PRIVATE", "false").lower() == "true"
+
+
+class ChatJobRequest(BaseModel):
+    """
+    Request model for a chat turn run as a background job.
+
+    Args:
+        user_prompt: The user's question or statement
+        brand_context: Context about the brand being discussed
+        audience_summary: Description of the persona to embody
+        history: Optional list of previous chat messages
+        video_uri: Optional GCS URI of a video to analyze
+        video_start: Optional start of the video segment, in seconds or [hh:]mm:ss
+        video_end: Optional end of the video segment, in seconds or [hh:]mm:ss
+        video_fps: Optional frame rate to sample the video at
+        media_ids: Optional ids of media previously stored via /media
+        cache_control: Optional response cache directive
+        callback_url: Optional http(s) URL the finished job is POSTed to;
+                      its host must be listed in JOB_CALLBACK_HOSTS
+    """
+    user_prompt: str
+    brand_context: str
+    audience_summary: str
+    history: Optional[List[ChatMessage]] = None
+    video_uri: Optional[str] = None
+    video_start: Optional[Union[float, str]] = None
+    video_end: Optional[Union[float, str]] = None
+    video_fps: Optional[float] = None
+    media_ids: Optional[List[str]] = None
+    cache_control: Optional[str] = None
+    callback_url: Optional[str] = None
+
+
+class JobResponse(BaseModel):
+    """
+    Response model describing a job.
+
+    Args:
+        job_id: Identifier to poll at /jobs/{job_id}
+        status: One of queued, running, succeeded, failed
+        result: The job's output once it has succeeded
+        error: Why the job failed, if it did
+        attempts: Number of times a worker has started the job
+        created_at: Unix time the job was submitted
+        started_at: Unix time the latest attempt started
+        finished_at: Unix time the job finished
+        deduplicated: True if an earlier job with the same Idempotency-Key was returned
+    """
+    job_id: str
+    status: str
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    deduplicated: bool = False
+
+
+async def run_chat_job(payload: dict) -> dict:
+    """
+    Runs a chat job submitted through /chat/jobs.
+
+    A job has no client waiting on an open connection, so when the
+    generation queue or the model quota is full it waits for capacity rather
+    than failing. It runs as batch traffic. The job timeout still applies.
+
+    Args:
+        payload: ChatJobRequest fields, without the callback URL
+
+    Returns:
+        Dictionary with the agent's response, token usage and model
+    """
+    history = [ChatMessage(**message) for message in payload.get("history") or []]
+    system_instruction = build_system_instruction(
+        payload["audience_summary"], payload["brand_context"], retrieval_query(payload["user_prompt"], history)
+    )
+    content_parts = [construct_conversation_prompt(payload["user_prompt"], history or None)]
+    if payload.get("video_uri"):
+        segment = parse_video_segment(payload.get("video_start"), payload.get("video_end"), payload.get("video_fps"))
+        content_parts.append((await video_input_for_uri(payload["video_uri"], segment)).part)
+    content_parts.extend(await media_parts_for_ids(payload.get("media_ids")))
+
+    while True:
+        try:
+            outcome = await run_generation(
+                content_parts, payload.get("cache_control"), system_instruction,
+                payload["audience_summary"], PRIORITY_BATCH
+            )
+            break
+        except (QueueFullError, QuotaExceededError) as e:
+            await asyncio.sleep(e.retry_after)
+    return {"agent_response": outcome.text, "usage": outcome.usage, "model": outcome.model_name}
+
+
+job_queue = JobQueue(
+    store=JobStore(
+        os.environ.get("JOB_STORE_PATH", "/tmp/persona-jobs.db"),
+        ttl=float(os.environ.get("JOB_TTL", "86400"))
+    ),
+    handlers={"chat": run_chat_job},
+    workers=JOB_WORKERS,
+    timeout=float(os.environ.get("JOB_TIMEOUT", "900")),
+    max_attempts=int(os.environ.get("JOB_MAX_ATTEMPTS", "3")),
+    callback_allow_private=JOB_CALLBACK_ALLOW_PRIVATE
+)
+
+
+def job_response(job: Job, deduplicated: bool = False) -> JobResponse:
+    """Builds the JobResponse for a job."""
+    return JobResponse(**job.to_dict(), deduplicated=deduplicated)
+
+
+async def validate_callback_url(url: str) -> None:
+    """
+    Checks that a callback URL is http(s), on an allowed host and public.
+
+    Callbacks are refused unless JOB_CALLBACK_HOSTS lists the host. The
+    host must also resolve only to public addresses, unless
+    JOB_CALLBACK_ALLOW_PRIVATE is set; delivery checks the address again
+    when it connects.
+
+    Args:
+        url: The callback URL
+
+    Raises:
+        HTTPException: If the URL is not acceptable
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise HTTPException(status_code=400, detail="callback_url must be an http(s) URL.")
+    if not JOB_CALLBACK_HOSTS:
+        raise HTTPException(status_code=400, detail="Callbacks are disabled. Set JOB_CALLBACK_HOSTS to enable them.")
+    if parsed.hostname.lower() not in JOB_CALLBACK_HOSTS:
+        raise HTTPException(status_code=400, detail=f"Callbacks to {parsed.hostname} are not allowed.")
+    if JOB_CALLBACK_ALLOW_PRIVATE:
+        return
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        await asyncio.to_thread(resolve_public, parsed.hostname, port)
+    except CallbackAddressError:
+        raise HTTPException(status_code=400, detail=f"Callbacks to {parsed.hostname} are not allowed.")
+    except (OSError, ValueError):
+        raise HTTPException(status_code=400, detail=f"callback_url host {parsed.hostname} does not resolve.")
+
+
+@app.post("/chat/jobs", response_model=JobResponse, status_code=202)
+async def submit_chat_job(
+    request: ChatJobRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None)
+):
+    """
+    Queues a chat turn, typically a long video analysis, as a background job.
+
+    Returns at once with the job id; the job's URL is in the Location header.
+    Fetch the result from /jobs/{job_id} (optionally long-polling with
+    ?wait=seconds), or pass callback_url to have the finished job POSTed
+    there. Resubmitting with the same Idempotency-Key header returns the
+    original job (200) instead of queueing another one.
+
+    Args:
+        request: ChatJobRequest with the prompt, persona, media and optional callback
+        response: Outgoing response, used for the status code and Location header
+        idempotency_key: Optional Idempotency-Key header
+
+    Returns:
+        JobResponse for the new or deduplicated job
+
+    Raises:
+        HTTPException: If the model is not configured, the request is
+                       invalid or the key was used for a different request
+    """
+    if not MODEL_CONFIGURED:
+        raise HTTPException(
+            status_code=500,
+            detail="Model not configured. Set GCLOUD_PROJECT environment variable."
+        )
+    parse_cache_control(request.cache_control)
+    if parse_video_segment(request.video_start, request.video_end, request.video_fps) and not request.video_uri:
+        raise HTTPException(status_code=400, detail="video_start, video_end and video_fps need a video_uri.")
+    if request.callback_url:
+        await validate_callback_url(request.callback_url)
+
+    payload = request.model_dump(exclude={"callback_url"})
+    try:
+        job, created = await job_queue.submit("chat", payload, idempotency_key, request.callback_url)
+    except IdempotencyConflictError as e:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Idempotency-Key was already used for a different request (job {e.job_id})."
+        )
+    response.headers["Location"] = f"/jobs/{job.job_id}"
+    if not created:
+        response.status_code = 200
+    return job_response(job, deduplicated=not created)
+
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str, response: Response, wait: float = 0):
+    """
+    Returns a job's status, and its result once finished.
+
+    Args:
+        job_id: The job
+        response: Outgoing response, used to suggest a polling interval
+        wait: Seconds to wait for the job to finish (long-poll), capped at JOB_MAX_WAIT
+
+    Returns:
+        JobResponse; unfinished jobs carry a Retry-After hint
+
+    Raises:
+        HTTPException: If the job is unknown or has expired
+    """
+    job = await job_queue.get(job_id, min(max(wait, 0.0), JOB_MAX_WAIT))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired.")
+    if not job.finished:
+        response.headers["Retry-After"] = "2"
+    return job_response(job)
+
+
+class CreateSessionRequest(BaseModel):
+    """
+    Request model for starting a server-side conversation session.
+
+    Args:
+        audience_summary: Description of the persona to embody
+        brand_context: Context about the brand being discussed
+        image_data: Optional Base64-encoded image included with every turn
+        video_uri: Optional GCS URI of a video included with every turn
+        history: Optional prior messages to seed the session with
+        media_ids: Optional ids of stored media included with every turn
+    """
+    audience_summary: str
+    brand_context: str
+    image_data: Optional[str] = None
+    video_uri: Optional[str] = None
+    history: Optional[List[ChatMessage]] = None
+    media_ids: Optional[List[str]] = None
+
+
+class SessionResponse(BaseModel):
+    """
+    Response model describing a session.
+
+    Args:
+        session_id: Identifier to post new turns to
+        turns: Number of messages in the session history
+        expires_in: Seconds of inactivity before the session expires
+    """
+    session_id: str
+    turns: int
+    expires_in: int
+
+
+class SessionDetailResponse(SessionResponse):
+    """
+    Response model with a session's full state.
+
+    Args:
+        audience_summary: Description of the persona
+        brand_context: Context about the brand
+        video_uri: GCS URI of the session video, if any
+        has_image: Whether an image is attached to every turn
+        media_ids: Ids of stored media attached to every turn
+        history: Messages exchanged so far
+    """
+    audience_summary: str
+    brand_context: str
+    video_uri: Optional[str] = None
+    has_image: bool
+    media_ids: List[str]
+    history: List[ChatMessage]
+
+
+class SessionMessageRequest(BaseModel):
+    """
+    Request model for a new turn in an existing session.
+
+    Args:
+        user_prompt: The user's question or statement
+        stream: If true, stream the reply as Server-Sent Events
+        cache_control: Optional response cache directive
+    """
+    user_prompt: str
+    stream: bool = False
+    cache_control: Optional[str] = None
+
+
+def session_summary(session: Session) -> SessionResponse:
+    """Builds the SessionResponse for a session."""
+    return SessionResponse(
+        session_id=session.session_id,
+        turns=len(session.history),
+        expires_in=int(session_store.ttl)
+    )
+
+
+async def load_session(session_id: str) -> Session:
+    """
+    Loads a session or raises a 404.
+
+    Args:
+        session_id: Session identifier
+
+    Returns:
+        The stored Session
+
+    Raises:
+        HTTPException: If the session does not exist or has expired
+    """
+    session = await session_store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found or expired.")
+    return session
+
+
+async def record_session_turn(session_id: str, user_prompt: str, agent_response: str) -> None:
+    """
+    Appends a completed user/agent exchange to a session's history.
+
+    The store appends atomically, so overlapping turns, even on other
+    workers or instances, don't overwrite each other's messages.
+
+    Args:
+        session_id: Session identifier
+        user_prompt: The user's message for this turn
+        agent_response: The persona's reply
+    """
+    await session_store.append(
+        session_id,
+        [{"sender": "user", "text": user_prompt}, {"sender": "agent", "text": agent_response}],
+        datetime.now().timestamp()
+    )
+
+
+async def session_media_parts(session: Session) -> Tuple[list, int]:
+    """
+    Builds the Gemini parts for the media a session attaches to every turn.
+
+    Args:
+        session: Stored session
+
+    Returns:
+        Tuple of (parts for the image, video and stored media ids, bytes
+        saved by image normalization)
+
+    Raises:
+        HTTPException: If the image is invalid or a media id has expired
+    """
+    parts = []
+    image_bytes_saved = 0
+    if session.image_data:
+        # Normalized once; later turns hit the image cache
+        image_part, image_bytes_saved = await image_part_from_base64(session.image_data)
+        parts.append(image_part)
+    if session.video_uri:
+        parts.append((await video_input_for_uri(session.video_uri)).part)
+    parts.extend(await media_parts_for_ids(session.media_ids))
+    return parts, image_bytes_saved
+
+
+@app.post("/sessions", response_model=SessionResponse)
+async def create_session(request: CreateSessionRequest):
+    """
+    Starts a conversation session holding the persona, brand and media.
+
+    Args:
+        request: CreateSessionRequest with persona, brand and optional media/history
+
+    Returns:
+        SessionResponse with the new session id
+    """
+    # Validate media once up front instead of failing on the first turn
+    if request.image_data:
+        decode_base64_image(request.image_data)
+    await media_parts_for_ids(request.media_ids)
+
+    session = Session.new(
+        audience_summary=request.audience_summary,
+        brand_context=request.brand_context,
+        image_data=request.image_data,
+        video_uri=request.video_uri,
+        media_ids=list(request.media_ids or []),
+        history=[message.model_dump() for message in request.history or []]
+    )
+    await session_store.put(session)
+    return session_summary(session)
+
+
+@app.get("/sessions/{session_id}", response_model=SessionDetailResponse)
+async def get_session(session_id: str):
+    """
+    Returns a session's persona, brand and history.
+
+    Args:
+        session_id: Session identifier
+
+    Returns:
+        SessionDetailResponse with the full session state
+
+    Raises:
+        HTTPException: If the session does not exist or has expired
+    """
+    session = await load_session(session_id)
+    return SessionDetailResponse(
+        **session_summary(session).model_dump(),
+        audience_summary=session.audience_summary,
+        brand_context=session.brand_context,
+        video_uri=session.video_uri,
+        has_image=session.image_data is not None,
+        media_ids=session.media_ids,
+        history=[ChatMessage(**message) for message in session.history]
+    )
+
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """
+    Ends a session and discards its history.
+
+    Args:
+        session_id: Session identifier
+
+    Returns:
+        JSON confirming deletion
+
+    Raises:
+        HTTPException: If the session does not exist
+    """
+    if not await session_store.delete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found or expired.")
+    return {"deleted": True, "session_id": session_id}
+
+
+@app.post("/sessions/{session_id}/messages", response_model=ChatResponse)
+async def session_message_handler(session_id: str, request: SessionMessageRequest, response: Response):
+    """
+    Handles a new turn in a server-side session.
+
+    Only the new user prompt is sent; persona, brand, media and history come
+    from the session, and the exchange is appended once the reply completes.
+
+    Args:
+        session_id: Session identifier
+        request: SessionMessageRequest with the new user prompt
+        response: Outgoing response, used to report queue time
+
+    Returns:
+        ChatResponse with the agent's reply, or an SSE stream when request.stream is set
+
+    Raises:
+        HTTPException: If the session is missing, the model is not configured
+                       or generation fails
+    """
+    if not MODEL_CONFIGURED:
+        raise HTTPException(
+            status_code=500,
+            detail="Model not configured. Set GCLOUD_PROJECT environment variable."
+        )
+
+    session = await load_session(session_id)
+
+    try:
+        # Stored messages were validated when they were recorded
+        history = [ChatMessage.model_construct(**message) for message in session.history]
+        system_instruction = build_system_instruction(
+            session.audience_summary, session.brand_context, retrieval_query(request.user_prompt, history)
+        )
+        prompt_parts = [construct_conversation_prompt(request.user_prompt, history, session_id)]
+        media_parts, image_bytes_saved = await session_media_parts(session)
+        prompt_parts.extend(media_parts)
+
+        async def record(agent_response: str) -> None:
+            await record_session_turn(session_id, request.user_prompt, agent_response)
+
+        if request.stream:
+            streaming_response = await stream_generation(
+                prompt_parts, request.cache_control, on_complete=record,
+                system_instruction=system_instruction, audience=session.audience_summary
+            )
+            streaming_response.headers["X-Image-Bytes-Saved"] = str(image_bytes_saved)
+            return streaming_response
+
+        agent_response = await generate_content(
+            prompt_parts, response, request.cache_control, system_instruction, session.audience_summary
+        )
+        response.headers["X-Image-Bytes-Saved"] = str(image_bytes_saved)
+        await record(agent_response)
+
+        return ChatResponse(agent_response=agent_response)
+
+    except QueueFullError as e:
+        raise queue_full_exception(e)
+    except QuotaExceededError as e:
+        raise quota_exceeded_exception(e)
+    except CacheMissError:
+        raise cache_miss_exception()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Generation failed: {str(e)}")
+
+
+# --- Synthetic Focus Groups ---
+FANOUT_DEFAULT_PARALLELISM = int(os.environ.get("FANOUT_PARALLELISM", "8"))
+FANOUT_MAX_PARALLELISM = int(os.environ.get("FANOUT_MAX_PARALLELISM", "32"))
+FANOUT_MAX_CELLS = int(os.environ.get("FANOUT_MAX_CELLS", "200"))
+
+
+class FocusGroupAudience(BaseModel):
+    """
+    One audience in a focus group.
+
+    Args:
+        audience_summary: Description of the persona to embody
+        id: Optional caller-supplied identifier echoed back in results
+    """
+    audience_summary: str
+    id: Optional[str] = None
+
+
+class FocusGroupCreative(BaseModel):
+    """
+    One creative variant shown to every audience.
+
+    Args:
+        id: Optional caller-supplied identifier echoed back in results
+        text: Optional copy or description of the creative
+        image_data: Optional Base64-encoded image
+        video_uri: Optional GCS URI of a video
+        media_ids: Optional ids of stored media
+    """
+    id: Optional[str] = None
+    text: Optional[str] = None
+    image_data: Optional[str] = None
+    video_uri: Optional[str] = None
+    media_ids: Optional[List[str]] = None
+
+
+class FocusGroupRequest(BaseModel):
+    """
+    Request model for asking one question across audiences and creatives.
+
+    Args:
+        user_prompt: The question asked in every cell
+        brand_context: Context about the brand being discussed
+        audiences: Audiences to ask
+        creatives: Optional creative variants; each audience sees each creative
+        parallelism: Optional limit on concurrently running cells
+        cache_control: Optional response cache directive applied to every cell
+    """
+    user_prompt: str
+    brand_context: str
+    audiences: List[FocusGroupAudience]
+    creatives: Optional[List[FocusGroupCreative]] = None
+    parallelism: Optional[int] = None
+    cache_control: Optional[str] = None
+
+
+@dataclass
+class FocusGroupCell:
+    """
+    One (audience, creative) pair with its prepared media parts.
+
+    Args:
+        audience_index: Position of the audience in the request
+        audience: The audience
+        creative_index: Position of the creative in the request, if any
+        creative: The creative, if any
+        media_parts: Gemini parts shared by every cell showing this creative
+    """
+    audience_index: int
+    audience: FocusGroupAudience
+    creative_index: Optional[int]
+    creative: Optional[FocusGroupCreative]
+    media_parts: list
+
+
+def creative_prompt(user_prompt: str, creative: Optional[FocusGroupCreative]) -> str:
+    """
+    Prefixes the user's question with the creative's copy, if it has any.
+
+    Args:
+        user_prompt: The question asked in every cell
+        creative: The creative shown in this cell
+
+    Returns:
+        The user message for the cell
+    """
+    if creative is None or not creative.text:
+        return user_prompt
+    return f"Here is the creative to evaluate:\n---\n{creative.text}\n---\n\n{user_prompt}"
+
+
+async def creative_media_parts(creative: FocusGroupCreative) -> list:
+    """
+    Builds a creative's media parts once so all of its cells share them.
+
+    Args:
+        creative: The creative
+
+    Returns:
+        List of Gemini parts (image and/or video)
+
+    Raises:
+        HTTPException: If the image data is invalid or a media id is unknown
+    """
+    parts = []
+    if creative.image_data:
+        # Every audience cell sends this image: upload it once, not per cell
+        parts.append(await shared_image_part_from_base64(creative.image_data))
+    if creative.video_uri:
+        parts.append((await video_input_for_uri(creative.video_uri)).part)
+    parts.extend(await media_parts_for_ids(creative.media_ids))
+    return parts
+
+
+@app.post("/focus-group")
+async def focus_group_handler(request: FocusGroupRequest):
+    """
+    Asks one question across every audience × creative pair concurrently.
+
+    Cells run under a parallelism limit and each result is streamed back as
+    a Server-Sent 'cell' event as soon as it finishes, in completion order.
+    Creative media is decoded once and shared by all cells showing it. A
+    failed cell produces a 'cell' event with status 'error' and does not stop
+    the batch; a final 'done' event reports totals.
+
+    Args:
+        request: FocusGroupRequest with the question, brand, audiences and creatives
+
+    Returns:
+        StreamingResponse producing text/event-stream frames
+
+    Raises:
+        HTTPException: If the model is not configured or the batch is invalid
+    """
+    if not MODEL_CONFIGURED:
+        raise HTTPException(
+            status_code=500,
+            detail="Model not configured. Set GCLOUD_PROJECT environment variable."
+        )
+    if not request.audiences:
+        raise HTTPException(status_code=400, detail="At least one audience is required.")
+
+    creatives = request.creatives or [None]
+    total_cells = len(request.audiences) * len(creatives)
+    if total_cells > FANOUT_MAX_CELLS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many cells ({total_cells}). Maximum is {FANOUT_MAX_CELLS}."
+        )
+    parse_cache_control(request.cache_control)
+    parallelism = min(request.parallelism or FANOUT_DEFAULT_PARALLELISM, FANOUT_MAX_PARALLELISM)
+
+    # Prepare each creative's media once, up front, so bad input fails the request
+    media_by_creative = [await creative_media_parts(c) if c else [] for c in creatives]
+    cells = [
+        FocusGroupCell(
+            audience_index=audience_index,
+            audience=audience,
+            creative_index=creative_index if creative is not None else None,
+            creative=creative,
+            media_parts=media_by_creative[creative_index]
+        )
+        for audience_index, audience in enumerate(request.audiences)
+        for creative_index, creative in enumerate(creatives)
+    ]
+
+    async def run_cell(cell: FocusGroupCell) -> GenerationOutcome:
+        system_instruction = build_system_instruction(
+            cell.audience.audience_summary, request.brand_context, request.user_prompt
+        )
+        prompt = construct_conversation_prompt(creative_prompt(request.user_prompt, cell.creative))
+        return await run_generation(
+            [prompt] + cell.media_parts, request.cache_control, system_instruction,
+            cell.audience.audience_summary, PRIORITY_BATCH
+        )
+
+    async def event_stream():
+        started = time.perf_counter()
+        succeeded = 0
+        async for result in run_fanout(cells, run_cell, parallelism):
+            cell = result.cell
+            event = {
+                "audience_index": cell.audience_index,
+                "audience_id": cell.audience.id,
+                "creative_index": cell.creative_index,
+                "creative_id": cell.creative.id if cell.creative else None,
+                "status": "ok" if result.ok else "error",
+                "elapsed_ms": round(result.elapsed_ms, 1),
+            }
+            if result.ok:
+                succeeded += 1
+                event["agent_response"] = result.value.text
+                event["cache"] = result.value.cache_status
+            else:
+                event["error"] = result.error
+            yield format_sse("cell", event)
+
+        yield format_sse("done", {
+            "cells": len(cells),
+            "succeeded": succeeded,
+            "failed": len(cells) - succeeded,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        })
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+class MediaResponse(BaseModel):
+    """
+    Response model describing a stored media asset.
+
+    Args:
+        media_id: Content hash identifying the asset; pass it as media_ids later
+        mime_type: MIME type of the asset
+        size: Size in bytes
+        uri: Storage URI of the asset
+        deduplicated: True if an identical asset was already stored
+        bytes_saved: Bytes removed by image normalization
+    """
+    media_id: str
+    mime_type: str
+    size: int
+    uri: str
+    deduplicated: bool = False
+    bytes_saved: int = 0
+
+
+@app.post("/media", response_model=MediaResponse)
+async def upload_media(file: UploadFile = File(...)):
+    """
+    Stores an image or video once and returns a reusable media id.
+
+    Identical files (by content hash) are stored only once. Images are
+    normalized first; other files are streamed into the store without being
+    held in memory.
+
+    Args:
+        file: Image or video file
+
+    Returns:
+        MediaResponse with the media id and storage details
+
+    Raises:
+        HTTPException: If the file is too large or storing it fails
+    """
+    try:
+        upload = await ingestor.ingest(file, MEDIA_UPLOAD_LIMIT)
+    except UploadTooLargeError as e:
+        raise upload_rejected_exception(e)
+    try:
+        bytes_saved = 0
+        if upload.mime_type.startswith("image/"):
+            record, deduplicated, bytes_saved = await store_image_upload(upload)
+        else:
+            record, deduplicated = await store_upload(upload)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to store media: {str(e)}")
+    finally:
+        await upload.aclose()
+
+    return MediaResponse(
+        media_id=record.media_id,
+        mime_type=record.mime_type,
+        size=record.size,
+        uri=record.uri,
+        deduplicated=deduplicated,
+        bytes_saved=bytes_saved
+    )
+
+
+@app.get("/media/{media_id}", response_model=MediaResponse)
+async def get_media(media_id: str):
+    """
+    Returns metadata for a stored media asset.
+
+    Args:
+        media_id: Media id returned by /media
+
+    Returns:
+        MediaResponse with storage details
+
+    Raises:
+        HTTPException: If the media id is unknown or has expired
+    """
+    record = await media_store.get(media_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired media id: {media_id}")
+    return MediaResponse(media_id=record.media_id, mime_type=record.mime_type, size=record.size, uri=record.uri)
+
+
+STT_ATTEMPTS = metrics.counter(
+    "persona_stt_attempts_total", "Speech-to-Text recognize calls by config and outcome", ["config", "outcome"]
+)
+
+
+def recognition_config(
+    encoding: str,
+    sample_rate: Optional[int] = None,
+    channels: Optional[int] = None
+) -> "RecognitionConfig":
+    """
+    Builds a Speech-to-Text RecognitionConfig.
+
+    Args:
+        encoding: AudioEncoding name (e.g., "WEBM_OPUS")
+        sample_rate: Sample rate in Hz, or None to let the service read it
+        channels: Channel count, or None for mono
+
+    Returns:
+        RecognitionConfig for en-US with automatic punctuation
+    """
+    config = speech.RecognitionConfig(
+        encoding=speech.RecognitionConfig.AudioEncoding[encoding],
+        language_code="en-US",
+        enable_automatic_punctuation=True,
+    )
+    if sample_rate:
+        config.sample_rate_hertz = sample_rate
+    if channels and channels > 1:
+        config.audio_channel_count = channels
+    return config
+
+
+def candidate_recognition_configs(
+    audio_format: AudioFormat,
+    content_type: str,
+    filename: str
+) -> List[tuple]:
+    """
+    Lists the RecognitionConfigs to try for an audio file, best guess first.
+
+    When the probe identified the format, its config comes first. The rest
+    are fallbacks for files the probe could not read or that yield nothing.
 
-        # Build the content list for Gemini
-        content_parts = [prompt_text]
+    Args:
+        audio_format: Result of probing the audio headers
+        content_type: Content type sent by the client
+        filename: Filename sent by the client
 
-        # Add image if provided
-        if image:
-            image_data = await image.read()
-            image_part = Part.from_data(
-                data=image_data,
-                mime_type=image.content_type or "image/jpeg"
-            )
-            content_parts.append(image_part)
+    Returns:
+        List of (name, RecognitionConfig) tuples
+    """
+    candidates = []
+    if audio_format.confident:
+        rate = f" @ {audio_format.sample_rate}Hz" if audio_format.sample_rate else ""
+        candidates.append((
+            f"{audio_format.encoding}{rate} (probed)",
+            recognition_config(audio_format.encoding, audio_format.sample_rate, audio_format.channels)
+        ))
 
-        # Add video if provided (either as file upload or GCS URI)
-        if video_uri:
-            # Use GCS URI for large videos (>30MB)
-            video_part = Part.from_uri(
-                uri=video_uri,
-                mime_type="video/mp4"  # Default to mp4, adjust if needed
-            )
-            content_parts.append(video_part)
-        elif video:
-            # Use direct upload for smaller videos (<30MB)
-            video_data = await video.read()
-            video_part = Part.from_data(
-                data=video_data,
-                mime_type=video.content_type or "video/mp4"
-            )
-            content_parts.append(video_part)
+    if audio_format.encoding == "WEBM_OPUS" or "webm" in content_type or filename.endswith(".webm"):
+        # WEBM format - try the common Opus sample rates
+        for sample_rate in (48000, 16000):
+            if audio_format.confident and sample_rate == audio_format.sample_rate:
+                continue
+            candidates.append((
+                f"WEBM_OPUS @ {sample_rate // 1000}kHz",
+                recognition_config("WEBM_OPUS", sample_rate, audio_format.channels)
+            ))
 
-        # Generate content with multimodal input
-        response = model.generate_content(content_parts)
+    # Always add auto-detect as fallback
+    candidates.append(("AUTO-DETECT", recognition_config("ENCODING_UNSPECIFIED")))
+    return candidates
 
-        return ChatResponse(agent_response=response.text)
 
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Multimodal generation failed: {str(e)}"
-        )
+async def recognize_with(speech_client, audio_config, config_name: str, config) -> str:
+    """
+    Runs one recognize call and joins the transcript.
+
+    Returns:
+        Transcript, or "" if nothing was recognized
+    """
+    logger.debug("Recognizing with config %s", config_name)
+    async def recognize():
+        with upstream.track("speech"):
+            return await speech_client.recognize(config=config, audio=audio_config)
+
+    try:
+        recognize_response = await admission.call("speech", recognize)
+    except Exception:
+        STT_ATTEMPTS.inc(config=config_name, outcome="error")
+        raise
+    transcript = "".join(result.alternatives[0].transcript for result in recognize_response.results)
+    STT_ATTEMPTS.inc(config=config_name, outcome="transcript" if transcript else "empty")
+    return transcript
+
+
+async def recognize_first(speech_client, audio_config, candidates: List[tuple]) -> tuple:
+    """
+    Runs candidate configs concurrently and returns the first non-empty transcript.
+
+    The remaining calls are cancelled as soon as one succeeds.
+
+    Args:
+        speech_client: Async Speech-to-Text client
+        audio_config: RecognitionAudio to transcribe
+        candidates: List of (name, RecognitionConfig) tuples
+
+    Returns:
+        Tuple of (transcript, config name, last error); transcript is "" if
+        no candidate recognized any speech
+    """
+    async def attempt(config_name: str, config) -> tuple:
+        try:
+            return await recognize_with(speech_client, audio_config, config_name, config), config_name, None
+        except Exception as e:
+            logger.info("Speech config %s failed: %s", config_name, e)
+            return "", config_name, e
+
+    tasks = [asyncio.create_task(attempt(name, config)) for name, config in candidates]
+    last_error = None
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            transcript, config_name, error = await next_done
+            if transcript:
+                return transcript, config_name, None
+            if error is not None:
+                last_error = error
+            else:
+                logger.debug("Speech config %s returned no results", config_name)
+        return "", None, last_error
+    finally:
+        for task in tasks:
+            task.cancel()
 
 
 @app.options("/speech-to-text")
@@ -508,12 +3304,20 @@ async def speech_to_text_options():
 
 
 @app.post("/speech-to-text")
-async def speech_to_text_handler(audio: UploadFile = File(...)):
+async def speech_to_text_handler(response: Response, audio: UploadFile = File(...)):
     """
     Converts audio input to text using Google Cloud Speech-to-Text.
 
+    The audio headers are probed locally so the first recognize call uses
+    the right encoding, sample rate and channel count. If the probe is
+    uncertain or the probed config finds no speech, the remaining candidate
+    configs run concurrently and the first non-empty transcript wins. The
+    config used and the number of recognize calls are reported in the
+    X-Speech-Config and X-Speech-Attempts headers.
+
     Args:
-        audio: Audio file (WAV, MP3, WEBM, etc.)
+        response: Outgoing response, used to report ingestion memory and recognition details
+        audio: Audio file (WAV, MP3, WEBM, OGG, FLAC)
 
     Returns:
         JSON with transcribed text
@@ -527,83 +3331,66 @@ async def speech_to_text_handler(audio: UploadFile = File(...)):
             detail="Model not configured. Set GCLOUD_PROJECT environment variable."
         )
 
+    upload = None
     try:
-        # Read audio file
-        audio_content = await audio.read()
+        # Read audio file in chunks, rejecting oversized or near-empty recordings
+        try:
+            upload = await ingestor.ingest(audio, AUDIO_UPLOAD_LIMIT)
+        except UploadTooSmallError as e:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Audio file is too small ({e.size} bytes). Please speak for at least 2 seconds."
+            )
+        except UploadTooLargeError as e:
+            raise upload_rejected_exception(e)
+        audio_content = await upload.read()
         audio_size = len(audio_content)
+        response.headers["X-Ingest-Peak-Bytes"] = str(upload.peak_memory)
 
-        # Log audio details
         content_type = audio.content_type or ""
         filename = audio.filename or ""
-        print(f"📥 Received audio:")
-        print(f"   Size: {audio_size} bytes ({audio_size / 1024:.2f} KB)")
-        print(f"   Content-Type: {content_type}")
-        print(f"   Filename: {filename}")
-
-        # Validate audio size
-        if audio_size < 1000:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Audio file is too small ({audio_size} bytes). Please speak for at least 2 seconds."
-            )
 
-        # Initialize Speech-to-Text client
-        speech_client = speech.SpeechClient()
+        # Reuse the shared async Speech-to-Text client; the SDK (also needed for
+        # the request types below) is imported off the event loop
+        speech_client = await clients.aget("speech")
+        await load_in_thread(speech)
 
         # Configure recognition
         audio_config = speech.RecognitionAudio(content=audio_content)
 
-        # Try different configurations based on content type
-        configs_to_try = []
-
-        if "webm" in content_type or filename.endswith(".webm"):
-            # WEBM format - try multiple sample rates
-            configs_to_try.extend([
-                ("WEBM_OPUS @ 48kHz", speech.RecognitionConfig(
-                    encoding=speech.RecognitionConfig.AudioEncoding.WEBM_OPUS,
-                    sample_rate_hertz=48000,
-                    language_code="en-US",
-                    enable_automatic_punctuation=True,
-                )),
-                ("WEBM_OPUS @ 16kHz", speech.RecognitionConfig(
-                    encoding=speech.RecognitionConfig.AudioEncoding.WEBM_OPUS,
-                    sample_rate_hertz=16000,
-                    language_code="en-US",
-                    enable_automatic_punctuation=True,
-                )),
-            ])
-
-        # Always add auto-detect as fallback
-        configs_to_try.append(
-            ("AUTO-DETECT", speech.RecognitionConfig(
-                encoding=speech.RecognitionConfig.AudioEncoding.ENCODING_UNSPECIFIED,
-                language_code="en-US",
-                enable_automatic_punctuation=True,
-            ))
+        # Read the headers locally instead of guessing the format
+        with STAGE_SECONDS.time(stage="audio_probe"):
+            audio_format = probe_audio(audio_content)
+        logger.debug(
+            "Received %d bytes of audio (%s, %s), probed as %s",
+            audio_size, content_type, filename, audio_format
         )
+        candidates = candidate_recognition_configs(audio_format, content_type, filename)
 
-        # Try each configuration
-        last_error = None
-        for config_name, config in configs_to_try:
+        # One round trip when the probe is sure; otherwise race the candidates
+        attempts = 0
+        transcript, config_name, last_error = "", None, None
+        if audio_format.confident:
+            config_name, config = candidates.pop(0)
+            attempts += 1
             try:
-                print(f"🔄 Trying config: {config_name}")
-                response = speech_client.recognize(config=config, audio=audio_config)
-
-                # Extract transcript
-                transcript = ""
-                for result in response.results:
-                    transcript += result.alternatives[0].transcript
-
-                if transcript:
-                    print(f"✅ Success with {config_name}: '{transcript}'")
-                    return {"transcript": transcript}
-                else:
-                    print(f"⚠️ {config_name} returned no results")
-
+                transcript = await recognize_with(speech_client, audio_config, config_name, config)
             except Exception as e:
-                print(f"❌ {config_name} failed: {e}")
+                logger.info("Speech config %s failed: %s", config_name, e)
                 last_error = e
-                continue
+        if not transcript:
+            attempts += len(candidates)
+            transcript, config_name, error = await recognize_first(speech_client, audio_config, candidates)
+            last_error = error or last_error
+
+        response.headers["X-Speech-Attempts"] = str(attempts)
+        if transcript:
+            logger.debug("Recognized speech with %s after %d attempt(s)", config_name, attempts)
+            response.headers["X-Speech-Config"] = config_name
+            return {"transcript": transcript}
+
+        if isinstance(last_error, QuotaExceededError):
+            raise quota_exceeded_exception(last_error)
 
         # If we get here, all configs failed
         raise HTTPException(
@@ -614,13 +3401,223 @@ async def speech_to_text_handler(audio: UploadFile = File(...)):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"💥 Speech-to-Text error: {type(e).__name__}: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Speech-to-Text error: %s: %s", type(e).__name__, e)
         raise HTTPException(
             status_code=500,
             detail=f"Speech-to-Text failed: {str(e)}"
         )
+    finally:
+        if upload is not None:
+            await upload.aclose()
+
+
+# Seconds without audio after which an utterance is treated as finished
+STT_STREAM_IDLE_TIMEOUT = float(os.environ.get("STT_STREAM_IDLE_TIMEOUT", "10"))
+# Frames buffered ahead of the recognizer before the socket stops being read
+STT_STREAM_MAX_BUFFERED_FRAMES = int(os.environ.get("STT_STREAM_MAX_BUFFERED_FRAMES", "64"))
+
+
+@dataclass
+class UtteranceResult:
+    """
+    Outcome of one streamed utterance.
+
+    Args:
+        transcript: Final transcript ("" if no speech was recognized)
+        disconnected: Whether the client disconnected
+        failed: Whether recognition failed (an error was sent to the client)
+        audio_ended_at: perf_counter() time the user stopped speaking
+        final_at: perf_counter() time the final transcript was known
+    """
+    transcript: str = ""
+    disconnected: bool = False
+    failed: bool = False
+    audio_ended_at: Optional[float] = None
+    final_at: Optional[float] = None
+
+
+async def stream_utterance(
+    websocket: WebSocket,
+    recognizer,
+    options: dict,
+    first_frame: Optional[bytes] = None,
+    wait_for_stop: bool = True,
+    send_json: Optional[Callable[[dict], Awaitable[None]]] = None
+) -> UtteranceResult:
+    """
+    Streams one utterance from the socket to the recognizer and sends transcripts back.
+
+    Audio frames are queued while the recognizer consumes them. The utterance
+    ends when the client sends {"type": "stop"}, disconnects or goes quiet
+    for STT_STREAM_IDLE_TIMEOUT seconds. Frames arriving after the recognizer
+    reports the end of speech are discarded until the client stops.
+
+    Args:
+        websocket: Accepted WebSocket
+        recognizer: Streaming recognizer
+        options: Settings from the client's start message
+        first_frame: Audio frame that implicitly started the utterance, if any
+        wait_for_stop: Whether to wait for the client's stop message after the
+                       recognizer finishes; if False, a later stop is left unread
+        send_json: Optional sender to use instead of websocket.send_json
+                   (e.g., one that serializes sends from several tasks)
+
+    Returns:
+        UtteranceResult with the transcript and timing
+    """
+    send_json = send_json or websocket.send_json
+    audio = asyncio.Queue(maxsize=STT_STREAM_MAX_BUFFERED_FRAMES)
+    if first_frame:
+        audio.put_nowait(first_frame)
+    recognizing = True
+    result = UtteranceResult()
+
+    def audio_ended() -> None:
+        if result.audio_ended_at is None:
+            result.audio_ended_at = time.perf_counter()
+
+    async def pump() -> None:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                result.disconnected = True
+                break
+            if message.get("bytes"):
+                if recognizing:
+                    await audio.put(message["bytes"])
+            elif message.get("text"):
+                try:
+                    control = json.loads(message["text"])
+                except ValueError:
+                    continue
+                if control.get("type") == "stop":
+                    break
+        audio_ended()
+        if recognizing:
+            await audio.put(None)
+
+    async def frames():
+        while True:
+            try:
+                frame = await asyncio.wait_for(audio.get(), STT_STREAM_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                audio_ended()
+                return
+            if frame is None:
+                return
+            yield frame
+
+    pump_task = asyncio.create_task(pump())
+    finals = []
+    started = time.perf_counter()
+    first_result_ms = None
+    try:
+        with upstream.track("speech_stream"):
+            async for event in recognizer.stream(frames(), options):
+                if event.kind == SPEECH_END:
+                    # The recognizer takes no more audio; tell the client to stop sending
+                    recognizing = False
+                    audio_ended()
+                    await send_json({"type": "speech_end"})
+                    continue
+                if first_result_ms is None:
+                    first_result_ms = round((time.perf_counter() - started) * 1000, 1)
+                if event.kind == TRANSCRIPT_FINAL:
+                    finals.append(event.transcript.strip())
+                await send_json({
+                    "type": event.kind,
+                    "transcript": event.transcript,
+                    "stability": round(event.stability, 3),
+                })
+        recognizing = False
+        audio_ended()
+        result.final_at = time.perf_counter()
+        result.transcript = " ".join(t for t in finals if t)
+        # Unblock the reader if it was waiting for queue space
+        while not audio.empty():
+            audio.get_nowait()
+        await send_json({
+            "type": "end_of_utterance",
+            "transcript": result.transcript,
+            "first_result_ms": first_result_ms,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        })
+        if wait_for_stop:
+            # Wait for the client's stop (or disconnect) so the next utterance starts cleanly
+            await pump_task
+    except WebSocketDisconnect:
+        result.disconnected = True
+    except Exception as e:
+        logger.warning("Streaming recognition error: %s: %s", type(e).__name__, e)
+        result.failed = True
+        if result.disconnected:
+            return result
+        try:
+            await send_json({"type": "error", "detail": f"Speech-to-Text failed: {str(e)}"})
+        except Exception:
+            # The socket closed while reporting the error
+            result.disconnected = True
+    finally:
+        recognizing = False
+        pump_task.cancel()
+    return result
+
+
+@app.websocket("/speech-to-text/stream")
+async def speech_to_text_stream(websocket: WebSocket):
+    """
+    Live speech recognition over a WebSocket.
+
+    Protocol (JSON text messages, audio as binary frames):
+        client → {"type": "start", "encoding"?, "sample_rate"?, "channels"?,
+                  "language_code"?, "single_utterance"?}  (optional; audio alone also starts)
+        client → binary audio frames (e.g., MediaRecorder WebM/Opus chunks)
+        client → {"type": "stop"} to end the utterance
+        server → {"type": "interim" | "final", "transcript", "stability"}
+        server → {"type": "speech_end"} when the recognizer detects the end of speech
+        server → {"type": "end_of_utterance", "transcript", "first_result_ms", "elapsed_ms"}
+        server → {"type": "error", "detail"}
+
+    Several utterances can be sent over one connection, one after another.
+    If the encoding is not given it is probed from the first frame.
+
+    Args:
+        websocket: Incoming WebSocket connection
+    """
+    await websocket.accept()
+    recognizer = clients.get("speech_stream")
+    if recognizer.name == "google" and not PROJECT_ID:
+        await websocket.send_json({
+            "type": "error",
+            "detail": "Model not configured. Set GCLOUD_PROJECT environment variable."
+        })
+        await websocket.close()
+        return
+
+    await websocket.send_json({"type": "ready", "recognizer": recognizer.name})
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            options = {}
+            first_frame = message.get("bytes")
+            if message.get("text"):
+                try:
+                    options = json.loads(message["text"])
+                except ValueError:
+                    options = {}
+                if options.get("type") == "stop":
+                    # A stop that arrived after the utterance already ended
+                    continue
+                if options.get("type") != "start":
+                    await websocket.send_json({"type": "error", "detail": "Expected a start message or audio"})
+                    continue
+            result = await stream_utterance(websocket, recognizer, options, first_frame)
+            if result.disconnected:
+                return
+    except WebSocketDisconnect:
+        return
 
 
 @app.options("/text-to-speech")
@@ -630,89 +3627,526 @@ async def text_to_speech_options():
         status_code=200,
         headers={
             "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "POST, OPTIONS",
+            "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
             "Access-Control-Allow-Headers": "*",
         }
     )
 
 
+# --- Speech Synthesis Cache ---
+# Repeated persona answers and stock phrases are synthesized once per voice
+# and audio config, then served from memory or disk.
+TTS_CACHE_TTL = int(os.environ.get("TTS_CACHE_TTL", "86400"))
+speech_cache = SpeechCache(
+    max_entries=int(os.environ.get("TTS_CACHE_MAX_ENTRIES", "512")),
+    ttl=TTS_CACHE_TTL,
+    directory=os.environ.get("TTS_CACHE_DIR") or None
+)
+# Audio settings are part of the cache key, so changing them never serves stale audio
+TTS_AUDIO_CONFIG = {"audio_encoding": "MP3", "speaking_rate": 1.0, "pitch": 0.0}
+
+
+def parse_voice_id(voice_id: str) -> Tuple[str, str]:
+    """
+    Splits a voice id into its language code and voice name.
+
+    Args:
+        voice_id: Google Cloud TTS voice ID (e.g., en-US-Neural2-F)
+
+    Returns:
+        Tuple of (language_code, voice_name), falling back to en-US-Neural2-F
+    """
+    # Format: en-US-Neural2-F
+    parts = voice_id.split("-")
+    if len(parts) >= 4:
+        return f"{parts[0]}-{parts[1]}", voice_id
+    return "en-US", "en-US-Neural2-F"
+
+
+async def synthesize_speech(text: str, language_code: str, voice_name: str) -> bytes:
+    """
+    Calls Text-to-Speech with the shared client and TTS_AUDIO_CONFIG.
+
+    Args:
+        text: The text to convert to speech
+        language_code: Voice language code
+        voice_name: Voice name
+
+    Returns:
+        MP3 audio bytes
+
+    Raises:
+        QuotaExceededError: If the Text-to-Speech quota is exhausted
+    """
+    # Reuse the shared async Text-to-Speech client; the SDK (also needed for
+    # the request types below) is imported off the event loop
+    tts_client = await clients.aget("tts")
+    await load_in_thread(texttospeech)
+
+    async def synthesize():
+        with upstream.track("tts"):
+            return await tts_client.synthesize_speech(
+                input=texttospeech.SynthesisInput(text=text),
+                voice=texttospeech.VoiceSelectionParams(language_code=language_code, name=voice_name),
+                audio_config=texttospeech.AudioConfig(
+                    audio_encoding=texttospeech.AudioEncoding[TTS_AUDIO_CONFIG["audio_encoding"]],
+                    speaking_rate=TTS_AUDIO_CONFIG["speaking_rate"],
+                    pitch=TTS_AUDIO_CONFIG["pitch"]
+                )
+            )
+
+    response = await admission.call("tts", synthesize)
+    return response.audio_content
+
+
+async def text_to_speech(text: str, voice_id: str, if_none_match: Optional[str]) -> Response:
+    """
+    Serves speech for text, from the cache when possible.
+
+    Args:
+        text: The text to convert to speech
+        voice_id: The Google Cloud TTS voice ID
+        if_none_match: The request's If-None-Match header
+
+    Returns:
+        MP3 response with ETag and X-Cache headers, or 304 if the client's copy is current
+
+    Raises:
+        HTTPException: If synthesis fails
+    """
+    if not PROJECT_ID:
+        raise HTTPException(
+            status_code=500,
+            detail="Model not configured. Set GCLOUD_PROJECT environment variable."
+        )
+
+    language_code, voice_name = parse_voice_id(voice_id)
+    key = speech_key(text, voice_name, language_code, TTS_AUDIO_CONFIG)
+    headers = {
+        "ETag": etag_for(key),
+        "Cache-Control": f"private, max-age={TTS_CACHE_TTL}",
+    }
+    # The key determines the audio, so a matching ETag needs no lookup at all
+    if etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        audio, cache_status = await speech_cache.get_or_synthesize(
+            key, lambda: synthesize_speech(text, language_code, voice_name)
+        )
+    except QuotaExceededError as e:
+        raise quota_exceeded_exception(e)
+    except Exception as e:
+        logger.warning("Text-to-Speech error: %s", e)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Text-to-Speech failed: {str(e)}"
+        )
+
+    # Return audio as binary response
+    return Response(
+        content=audio,
+        media_type="audio/mpeg",
+        headers={
+            **headers,
+            "Content-Disposition": "attachment; filename=speech.mp3",
+            "X-Cache": cache_status,
+        }
+    )
+
+
 @app.post("/text-to-speech")
 async def text_to_speech_handler(
     text: str = Form(...),
-    voice_id: str = Form("en-US-Neural2-F")
+    voice_id: str = Form("en-US-Neural2-F"),
+    if_none_match: Optional[str] = Header(None)
 ):
     """
     Converts text to speech using Google Cloud Text-to-Speech.
 
+    Identical requests are served from the speech cache; the response ETag
+    lets clients revalidate with If-None-Match and get a 304.
+
     Args:
         text: The text to convert to speech
         voice_id: The Google Cloud TTS voice ID (e.g., en-US-Neural2-F or en-US-Neural2-D)
+        if_none_match: Optional ETag of a copy the client already has
+
+    Returns:
+        Audio file (MP3) as binary response, or 304 Not Modified
+
+    Raises:
+        HTTPException: If synthesis fails
+    """
+    return await text_to_speech(text, voice_id, if_none_match)
+
+
+@app.get("/text-to-speech")
+async def text_to_speech_get_handler(
+    text: str,
+    voice_id: str = "en-US-Neural2-F",
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    GET variant of /text-to-speech, usable directly as an <audio> source.
+
+    Browsers cache the audio and revalidate it with conditional GETs.
+
+    Args:
+        text: The text to convert to speech
+        voice_id: The Google Cloud TTS voice ID
+        if_none_match: Optional ETag of a copy the client already has
 
     Returns:
-        Audio file (MP3) as binary response
+        Audio file (MP3) as binary response, or 304 Not Modified
 
     Raises:
         HTTPException: If synthesis fails
     """
+    return await text_to_speech(text, voice_id, if_none_match)
+
+
+# Sentences synthesized at once by /text-to-speech/stream
+TTS_STREAM_PARALLELISM = int(os.environ.get("TTS_STREAM_PARALLELISM", "3"))
+TTS_SENTENCE_MIN_CHARS = int(os.environ.get("TTS_SENTENCE_MIN_CHARS", "40"))
+TTS_SENTENCE_MAX_CHARS = int(os.environ.get("TTS_SENTENCE_MAX_CHARS", "400"))
+TTS_STREAM_FAILURES = metrics.counter(
+    "persona_tts_stream_failures_total", "/text-to-speech/stream responses aborted mid-stream", ["error_type"]
+)
+
+
+@app.post("/text-to-speech/stream")
+async def text_to_speech_stream_handler(
+    text: str = Form(...),
+    voice_id: str = Form("en-US-Neural2-F")
+):
+    """
+    Streams speech for long text sentence by sentence.
+
+    The text is split into sentences that are synthesized
+    TTS_STREAM_PARALLELISM at a time, and each sentence's MP3 audio is sent
+    in order as a chunk of the response, so playback can start as soon as
+    the first sentence is ready. Sentences go through the speech cache, so
+    repeated phrases are not synthesized again.
+
+    Args:
+        text: The text to convert to speech
+        voice_id: The Google Cloud TTS voice ID (e.g., en-US-Neural2-F)
+
+    Returns:
+        Chunked MP3 audio response; the sentence count is in X-Sentence-Count.
+        If synthesis fails partway, the connection is aborted before the
+        response completes.
+
+    Raises:
+        HTTPException: If the model is not configured or the text is empty
+    """
     if not PROJECT_ID:
         raise HTTPException(
             status_code=500,
             detail="Model not configured. Set GCLOUD_PROJECT environment variable."
         )
 
-    try:
-        # Initialize Text-to-Speech client
-        tts_client = texttospeech.TextToSpeechClient()
-
-        # Set the text input
-        synthesis_input = texttospeech.SynthesisInput(text=text)
-
-        # Parse voice_id to extract language code and name
-        # Format: en-US-Neural2-F
-        parts = voice_id.split("-")
-        if len(parts) >= 4:
-            language_code = f"{parts[0]}-{parts[1]}"  # en-US
-            voice_name = voice_id  # Full voice ID
-        else:
-            # Fallback to default
-            language_code = "en-US"
-            voice_name = "en-US-Neural2-F"
+    sentences = split_sentences(text, TTS_SENTENCE_MIN_CHARS, TTS_SENTENCE_MAX_CHARS)
+    if not sentences:
+        raise HTTPException(status_code=400, detail="No text to synthesize.")
+    language_code, voice_name = parse_voice_id(voice_id)
 
-        # Build voice parameters
-        voice = texttospeech.VoiceSelectionParams(
-            language_code=language_code,
-            name=voice_name
+    async def synthesize_sentence(sentence: str) -> bytes:
+        key = speech_key(sentence, voice_name, language_code, TTS_AUDIO_CONFIG)
+        audio, _ = await speech_cache.get_or_synthesize(
+            key, lambda: synthesize_speech(sentence, language_code, voice_name)
         )
+        return audio
 
-        # Select audio format
-        audio_config = texttospeech.AudioConfig(
-            audio_encoding=texttospeech.AudioEncoding.MP3,
-            speaking_rate=1.0,
-            pitch=0.0
-        )
+    async def audio_chunks():
+        try:
+            async for audio in run_ordered(sentences, synthesize_sentence, TTS_STREAM_PARALLELISM):
+                yield audio
+        except Exception as e:
+            # The 200 and part of the audio are already sent. Re-raising aborts the
+            # connection without the final chunk, so the client sees a truncated
+            # response instead of a short but seemingly complete one.
+            TTS_STREAM_FAILURES.inc(error_type=type(e).__name__)
+            logger.warning("Text-to-Speech stream error: %s", e)
+            raise
 
-        # Perform text-to-speech synthesis
-        response = tts_client.synthesize_speech(
-            input=synthesis_input,
-            voice=voice,
-            audio_config=audio_config
-        )
+    return StreamingResponse(
+        audio_chunks(),
+        media_type="audio/mpeg",
+        headers={"X-Sentence-Count": str(len(sentences)), "Cache-Control": "no-cache"}
+    )
 
-        # Return audio as binary response
-        return Response(
-            content=response.audio_content,
-            media_type="audio/mpeg",
-            headers={
-                "Content-Disposition": "attachment; filename=speech.mp3"
-            }
+
+# --- Voice Conversations ---
+
+# Sentences synthesized at once while a voice reply is still being generated
+VOICE_TTS_PARALLELISM = int(os.environ.get("VOICE_TTS_PARALLELISM", "2"))
+# Shorter than TTS_SENTENCE_MIN_CHARS so the first spoken sentence is ready sooner
+VOICE_SENTENCE_MIN_CHARS = int(os.environ.get("VOICE_SENTENCE_MIN_CHARS", "20"))
+
+
+@dataclass
+class VoicePersona:
+    """
+    Who the user is talking to on a /voice connection.
+
+    Args:
+        system_instruction: Persona/brand preamble for the model
+        media_parts: Gemini parts attached to every turn
+        audience_summary: Persona description, used to attribute token usage
+        session_id: Server-side session to read and record history in, if any
+        history: Conversation so far when no session is used
+    """
+    system_instruction: str
+    media_parts: list
+    audience_summary: Optional[str] = None
+    session_id: Optional[str] = None
+    history: List[ChatMessage] = field(default_factory=list)
+
+
+async def voice_persona(start: dict) -> VoicePersona:
+    """
+    Builds the persona for a /voice connection from its start message.
+
+    Args:
+        start: Start message with 'session_id', or 'audience_summary' and
+               'brand_context' plus optional 'media_ids' and 'history'
+
+    Returns:
+        VoicePersona for the connection
+
+    Raises:
+        HTTPException: If the session or media is missing, or the persona is incomplete
+    """
+    if start.get("session_id"):
+        session = await load_session(start["session_id"])
+        # The same image, video and media as the session's text turns
+        media_parts, _ = await session_media_parts(session)
+        return VoicePersona(
+            system_instruction=build_system_instruction(session.audience_summary, session.brand_context),
+            media_parts=media_parts,
+            audience_summary=session.audience_summary,
+            session_id=session.session_id,
         )
 
-    except Exception as e:
-        print(f"Text-to-Speech error: {e}")
+    if not start.get("audience_summary") or not start.get("brand_context"):
         raise HTTPException(
-            status_code=500,
-            detail=f"Text-to-Speech failed: {str(e)}"
+            status_code=400,
+            detail="Start message needs session_id, or audience_summary and brand_context."
+        )
+    return VoicePersona(
+        system_instruction=build_system_instruction(start["audience_summary"], start["brand_context"]),
+        media_parts=await media_parts_for_ids(start.get("media_ids")),
+        audience_summary=start["audience_summary"],
+        history=[ChatMessage(**message) for message in start.get("history") or []],
+    )
+
+
+@STAGE_SECONDS.timed(stage="voice_turn")
+async def voice_turn(
+    send_json: Callable[[dict], Awaitable[None]],
+    send_bytes: Callable[[bytes], Awaitable[None]],
+    persona: VoicePersona,
+    utterance: UtteranceResult,
+    voice_id: str
+) -> None:
+    """
+    Answers one spoken turn: streams the reply text and speaks it sentence by sentence.
+
+    Sentences are synthesized VOICE_TTS_PARALLELISM at a time while the
+    model is still generating, and their audio is sent in order. Latencies
+    are measured from the moment the user stopped speaking.
+
+    Args:
+        send_json: Serialized JSON sender for the socket
+        send_bytes: Serialized binary sender for the socket
+        persona: Persona and history for the connection
+        utterance: The recognized utterance
+        voice_id: The Google Cloud TTS voice ID
+
+    Raises:
+        QueueFullError: If the generation queue is at capacity
+        QuotaExceededError: If an upstream quota is exhausted
+    """
+    speech_ended = utterance.audio_ended_at or utterance.final_at
+
+    def since(moment: float) -> float:
+        return round((time.perf_counter() - moment) * 1000, 1)
+
+    latencies = {"stt_ms": round((utterance.final_at - speech_ended) * 1000, 1)}
+    if persona.session_id:
+        session = await load_session(persona.session_id)
+        history = [ChatMessage.model_construct(**message) for message in session.history]
+    else:
+        history = persona.history
+    prompt_parts = [construct_conversation_prompt(utterance.transcript, history, persona.session_id)]
+    prompt_parts.extend(persona.media_parts)
+
+    language_code, voice_name = parse_voice_id(voice_id)
+    accumulator = SentenceAccumulator(VOICE_SENTENCE_MIN_CHARS, TTS_SENTENCE_MAX_CHARS)
+    reply = []
+
+    async def sentences():
+        generation_started = time.perf_counter()
+        generated = generate_text_stream(prompt_parts, persona.system_instruction, persona.audience_summary)
+        async with aclosing(generated):
+            async for text in generated:
+                if not reply:
+                    latencies["llm_first_token_ms"] = since(generation_started)
+                reply.append(text)
+                await send_json({"type": "text", "text": text})
+                for sentence in accumulator.feed(text):
+                    yield sentence
+        latencies["llm_ms"] = since(generation_started)
+        for sentence in accumulator.flush():
+            yield sentence
+
+    async def speak(sentence: str) -> Tuple[str, bytes]:
+        key = speech_key(sentence, voice_name, language_code, TTS_AUDIO_CONFIG)
+        audio, _ = await speech_cache.get_or_synthesize(
+            key, lambda: synthesize_speech(sentence, language_code, voice_name)
         )
+        return sentence, audio
+
+    index = 0
+    spoken = run_ordered_stream(sentences(), speak, VOICE_TTS_PARALLELISM)
+    async with aclosing(spoken):
+        async for sentence, audio in spoken:
+            if index == 0:
+                latencies["first_audio_ms"] = since(speech_ended)
+            await send_json({"type": "audio", "index": index, "text": sentence, "bytes": len(audio)})
+            await send_bytes(audio)
+            index += 1
+
+    agent_response = "".join(reply)
+    if persona.session_id:
+        await record_session_turn(persona.session_id, utterance.transcript, agent_response)
+    else:
+        history.append(ChatMessage(sender="user", text=utterance.transcript))
+        history.append(ChatMessage(sender="agent", text=agent_response))
+    latencies["total_ms"] = since(speech_ended)
+    await send_json({
+        "type": "done",
+        "agent_response": agent_response,
+        "sentences": index,
+        "latencies": latencies,
+    })
+
+
+@app.websocket("/voice")
+async def voice_conversation(websocket: WebSocket):
+    """
+    Spoken conversation with a persona over one WebSocket.
+
+    Each turn chains streaming recognition, streamed generation and
+    sentence-by-sentence synthesis on the server, so the reply starts
+    playing after roughly the time to the first spoken sentence instead of
+    the sum of three separate requests.
+
+    Protocol (JSON text messages, audio as binary frames):
+        client → {"type": "start", "session_id" | "audience_summary" + "brand_context",
+                  "media_ids"?, "history"?, "voice_id"?, plus the
+                  /speech-to-text/stream options} to begin each turn
+                  (persona fields are needed on the first turn only)
+        client → binary audio frames, then {"type": "stop"} (or single_utterance)
+        server → the /speech-to-text/stream transcript events, ending with end_of_utterance
+        server → {"type": "text", "text"} for each generated text delta
+        server → {"type": "audio", "index", "text", "bytes"} followed by that
+                 sentence's MP3 audio as a binary frame
+        server → {"type": "done", "agent_response", "sentences", "latencies"} where
+                 latencies has stt_ms, llm_first_token_ms, llm_ms,
+                 first_audio_ms and total_ms, measured from the end of speech
+        server → {"type": "error", "detail", "retry_after"?}
+
+    Args:
+        websocket: Incoming WebSocket connection
+    """
+    await websocket.accept()
+    recognizer = clients.get("speech_stream")
+    if not MODEL_CONFIGURED:
+        await websocket.send_json({
+            "type": "error",
+            "detail": "Model not configured. Set GCLOUD_PROJECT environment variable."
+        })
+        await websocket.close()
+        return
+
+    # Reply text and audio are sent from two tasks; keep frames from interleaving
+    send_lock = asyncio.Lock()
+
+    async def send_json(payload: dict) -> None:
+        async with send_lock:
+            await websocket.send_json(payload)
+
+    async def send_bytes(data: bytes) -> None:
+        async with send_lock:
+            await websocket.send_bytes(data)
+
+    await send_json({"type": "ready", "recognizer": recognizer.name})
+    persona = None
+    voice_id = "en-US-Neural2-F"
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if not message.get("text"):
+                # Audio still in flight from the previous turn
+                continue
+            try:
+                start = json.loads(message["text"])
+            except ValueError:
+                start = {}
+            if start.get("type") == "stop":
+                # A stop that arrived after the utterance already ended
+                continue
+            if start.get("type") != "start":
+                await send_json({"type": "error", "detail": "Expected a start message"})
+                continue
+            if start.get("session_id") or start.get("audience_summary"):
+                try:
+                    persona = await voice_persona(start)
+                except (HTTPException, ValueError) as e:
+                    await send_json({"type": "error", "detail": getattr(e, "detail", str(e))})
+                    continue
+            voice_id = start.get("voice_id") or voice_id
+            if persona is None:
+                await send_json({
+                    "type": "error",
+                    "detail": "Send a start message with session_id, or audience_summary and brand_context"
+                })
+                continue
+
+            utterance = await stream_utterance(
+                websocket, recognizer, start, wait_for_stop=False, send_json=send_json
+            )
+            if utterance.disconnected:
+                return
+            if utterance.failed:
+                continue
+            if not utterance.transcript:
+                await send_json({"type": "error", "detail": "No speech recognized"})
+                continue
+
+            try:
+                await voice_turn(send_json, send_bytes, persona, utterance, voice_id)
+            except (QueueFullError, QuotaExceededError) as e:
+                await send_json({
+                    "type": "error",
+                    "detail": "Server is busy. Please retry shortly.",
+                    "retry_after": e.retry_after,
+                })
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                logger.warning("Voice turn error: %s: %s", type(e).__name__, e)
+                await send_json({"type": "error", "detail": f"Voice turn failed: {str(e)}"})
+    except WebSocketDisconnect:
+        return
+
+
+startup_timings["import_ms"] = round((time.perf_counter() - MODULE_IMPORT_STARTED) * 1000, 1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,315 @@
+"""
+Content-addressed media store for images and videos.
+
+Each unique asset is uploaded once to a storage backend and identified by
+the SHA-256 of its bytes. Later turns reference the media id instead of
+re-uploading the file. LocalMediaBackend stands in for GCS during local
+development. Each process drops its index entries by TTL and LRU limits.
+Local assets are deleted along with them. A GCS bucket is shared by every
+instance, and sessions elsewhere may still reference its objects, so objects
+there are only ever expired by the bucket's lifecycle rule (see
+gcs-lifecycle.json, which also covers forwarded videos under uploads/).
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Callable, Optional, Tuple
+
+from caching import SingleFlight
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MediaRecord:
+    """
+    Metadata for a stored asset.
+
+    Args:
+        media_id: SHA-256 hex digest of the asset bytes
+        mime_type: MIME type the asset was uploaded with
+        size: Size in bytes
+        uri: Backend URI (gs:// for GCS, file:// for the local stand-in)
+        created_at: Unix time the asset was first stored
+        last_used: Unix time the asset was last stored or referenced
+    """
+    media_id: str
+    mime_type: str
+    size: int
+    uri: str
+    created_at: float
+    last_used: float
+
+
+class LocalMediaBackend:
+    """
+    Filesystem stand-in for object storage.
+
+    Args:
+        directory: Directory holding the assets (created if missing)
+    """
+
+    name = "local"
+    remote = False
+    # Assets are private to this host, so collection deletes them
+    lifecycle_managed = False
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, media_id: str) -> str:
+        return os.path.join(self.directory, media_id)
+
+    def put(self, media_id: str, fileobj: BinaryIO, size: int, mime_type: str) -> str:
+        """Copies an asset and writes its metadata sidecar, returning its URI."""
+        path = self._path(media_id)
+        if not os.path.exists(path):
+            tmp_path = f"{path}.tmp-{os.getpid()}"
+            with open(tmp_path, "wb") as f:
+                shutil.copyfileobj(fileobj, f)
+            os.replace(tmp_path, path)
+        with open(f"{path}.json", "w") as f:
+            json.dump({"mime_type": mime_type}, f)
+        return f"file://{path}"
+
+    def stat(self, media_id: str) -> Optional[Tuple[str, int, str]]:
+        """Returns (mime_type, size, uri) for a stored asset, or None."""
+        path = self._path(media_id)
+        try:
+            size = os.path.getsize(path)
+            with open(f"{path}.json") as f:
+                mime_type = json.load(f)["mime_type"]
+        except (OSError, ValueError, KeyError):
+            return None
+        return mime_type, size, f"file://{path}"
+
+    def read(self, media_id: str) -> bytes:
+        """Reads an asset's bytes."""
+        with open(self._path(media_id), "rb") as f:
+            return f.read()
+
+    def delete(self, media_id: str) -> None:
+        """Removes an asset and its sidecar."""
+        for path in (self._path(media_id), f"{self._path(media_id)}.json"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class GCSMediaBackend:
+    """
+    Google Cloud Storage backend; Gemini reads assets directly by gs:// URI.
+
+    Objects are never deleted by collection: the bucket is shared across
+    instances, so they expire through its lifecycle rule instead.
+
+    Args:
+        storage_client_provider: Returns the shared storage.Client
+        bucket_name: Bucket holding the assets
+        prefix: Object name prefix for media assets
+    """
+
+    name = "gcs"
+    remote = True
+    lifecycle_managed = True
+
+    def __init__(self, storage_client_provider: Callable[[], Any], bucket_name: str, prefix: str = "media/"):
+        self._storage_client_provider = storage_client_provider
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+
+    def _blob(self, media_id: str):
+        return self._storage_client_provider().bucket(self.bucket_name).blob(f"{self.prefix}{media_id}")
+
+    def put(self, media_id: str, fileobj: BinaryIO, size: int, mime_type: str) -> str:
+        """Uploads an asset unless another instance already has, returning its URI."""
+        blob = self._blob(media_id)
+        if not blob.exists():
+            blob.upload_from_file(fileobj, size=size, content_type=mime_type)
+        return f"gs://{self.bucket_name}/{blob.name}"
+
+    def stat(self, media_id: str) -> Optional[Tuple[str, int, str]]:
+        """Returns (mime_type, size, uri) for a stored asset, or None."""
+        blob = self._storage_client_provider().bucket(self.bucket_name).get_blob(f"{self.prefix}{media_id}")
+        if blob is None:
+            return None
+        return blob.content_type, blob.size, f"gs://{self.bucket_name}/{blob.name}"
+
+    def read(self, media_id: str) -> bytes:
+        """Downloads an asset's bytes."""
+        return self._blob(media_id).download_as_bytes()
+
+    def delete(self, media_id: str) -> None:
+        """Deletes an asset, ignoring ones that are already gone."""
+        try:
+            self._blob(media_id).delete()
+        except Exception as e:
+            logger.warning("Failed to delete media %s: %s", media_id, e)
+
+
+class MediaStore:
+    """
+    Deduplicating asset store with TTL and LRU garbage collection.
+
+    Collection drops entries from this process's index. Assets are also
+    deleted from the backend unless it is lifecycle_managed, in which case
+    an evicted asset is looked up in the backend again on its next use.
+
+    Args:
+        backend: LocalMediaBackend or GCSMediaBackend
+        ttl: Seconds an unreferenced asset is kept
+        max_entries: Maximum number of assets before LRU eviction
+        max_bytes: Maximum total size of assets before LRU eviction
+    """
+
+    def __init__(self, backend: Any, ttl: float, max_entries: int, max_bytes: int):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._records: "OrderedDict[str, MediaRecord]" = OrderedDict()
+        self._total_bytes = 0
+        self._flights = SingleFlight()
+        self.uploads = 0
+        self.deduplicated = 0
+        self.collected = 0
+
+    @staticmethod
+    def media_id_for(data: bytes) -> str:
+        """Returns the content hash used as a media id."""
+        return hashlib.sha256(data).hexdigest()
+
+    def _touch(self, record: MediaRecord) -> MediaRecord:
+        record.last_used = time.time()
+        self._records.move_to_end(record.media_id)
+        return record
+
+    async def put(self, data: bytes, mime_type: str) -> Tuple[MediaRecord, bool]:
+        """
+        Stores an asset unless an identical one is already stored.
+
+        Args:
+            data: Asset bytes
+            mime_type: MIME type of the asset
+
+        Returns:
+            Tuple of (MediaRecord, deduplicated) where deduplicated is True if
+            the asset was already stored
+        """
+        media_id = await asyncio.to_thread(self.media_id_for, data)
+        return await self.put_stream(lambda: io.BytesIO(data), len(data), mime_type, media_id)
+
+    async def put_stream(
+        self,
+        open_file: Callable[[], BinaryIO],
+        size: int,
+        mime_type: str,
+        media_id: str
+    ) -> Tuple[MediaRecord, bool]:
+        """
+        Stores an asset from a file object, without loading it into memory.
+
+        Args:
+            open_file: Returns a binary file object positioned at the asset's start
+            size: Size of the asset in bytes
+            mime_type: MIME type of the asset
+            media_id: SHA-256 hex digest of the asset, computed by the caller
+
+        Returns:
+            Tuple of (MediaRecord, deduplicated) where deduplicated is True if
+            the asset was already stored
+        """
+        record = self._records.get(media_id)
+        if record is not None:
+            self.deduplicated += 1
+            return self._touch(record), True
+
+        async def upload() -> MediaRecord:
+            uri = await asyncio.to_thread(self.backend.put, media_id, open_file(), size, mime_type)
+            now = time.time()
+            record = MediaRecord(media_id, mime_type, size, uri, created_at=now, last_used=now)
+            self._records[media_id] = record
+            self._total_bytes += record.size
+            self.uploads += 1
+            return record
+
+        record = await self._flights.do(media_id, upload)
+        await self.collect()
+        return record, False
+
+    async def get(self, media_id: str) -> Optional[MediaRecord]:
+        """
+        Looks up an asset, consulting the backend for ones stored by a previous process.
+
+        Args:
+            media_id: Media id returned by put()
+
+        Returns:
+            MediaRecord, or None if the asset is unknown or has been collected
+        """
+        record = self._records.get(media_id)
+        if record is not None:
+            if record.last_used + self.ttl > time.time():
+                return self._touch(record)
+            await self._evict(media_id)
+            if not self.backend.lifecycle_managed:
+                return None
+
+        if len(media_id) != 64 or any(c not in "0123456789abcdef" for c in media_id):
+            return None
+        info = await asyncio.to_thread(self.backend.stat, media_id)
+        if info is None:
+            return None
+        mime_type, size, uri = info
+        now = time.time()
+        record = MediaRecord(media_id, mime_type, size, uri, created_at=now, last_used=now)
+        self._records[media_id] = record
+        self._total_bytes += size
+        return record
+
+    async def read(self, record: MediaRecord) -> bytes:
+        """Reads an asset's bytes from the backend."""
+        return await asyncio.to_thread(self.backend.read, record.media_id)
+
+    async def _evict(self, media_id: str) -> None:
+        record = self._records.pop(media_id, None)
+        if record is None:
+            return
+        self._total_bytes -= record.size
+        self.collected += 1
+        # Other instances may still reference a shared object; its lifecycle rule expires it
+        if not self.backend.lifecycle_managed:
+            await asyncio.to_thread(self.backend.delete, media_id)
+
+    async def collect(self) -> None:
+        """Collects expired assets, then least recently used ones beyond the size limits."""
+        cutoff = time.time() - self.ttl
+        for media_id in [m for m, r in self._records.items() if r.last_used <= cutoff]:
+            await self._evict(media_id)
+        while self._records and (
+            len(self._records) > self.max_entries or self._total_bytes > self.max_bytes
+        ):
+            await self._evict(next(iter(self._records)))
+
+    def stats(self) -> dict:
+        """Store size and deduplication counters."""
+        return {
+            "backend": self.backend.name,
+            "lifecycle_managed": self.backend.lifecycle_managed,
+            "entries": len(self._records),
+            "bytes": self._total_bytes,
+            "uploads": self.uploads,
+            "deduplicated": self.deduplicated,
+            "collected": self.collected,
+        }
@@ -0,0 +1,189 @@
+"""
+Content-addressed cache for persona generations.
+
+Responses are keyed on a digest of the model name, the full prompt text and
+the bytes (or URIs) of every media part, so identical requests share one
+cached answer. Concurrent identical misses are coalesced into a single
+upstream call.
+"""
+
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, List, Optional
+
+from caching import DiskCache, SingleFlight, TTLCache
+
+
+# Request-level cache directives, modelled on HTTP Cache-Control
+CACHE_DEFAULT = "default"          # Read and write the cache
+CACHE_NO_CACHE = "no-cache"        # Skip the lookup but store the fresh answer
+CACHE_NO_STORE = "no-store"        # Bypass the cache entirely
+CACHE_ONLY_IF_CACHED = "only-if-cached"  # Never call the model; miss is an error
+CACHE_DIRECTIVES = {CACHE_DEFAULT, CACHE_NO_CACHE, CACHE_NO_STORE, CACHE_ONLY_IF_CACHED}
+
+
+class CacheMissError(Exception):
+    """Raised for an only-if-cached request that has no cached answer."""
+
+
+def part_digest(part: Any) -> bytes:
+    """
+    Digests one prompt part (text or Gemini Part).
+
+    Args:
+        part: A prompt string or a vertexai Part
+
+    Returns:
+        SHA-256 digest of the part's content
+    """
+    if isinstance(part, str):
+        return hashlib.sha256(b"text:" + part.encode()).digest()
+
+    # Part wraps a protobuf holding either inline bytes or a file URI;
+    # its deterministic serialization covers data, mime type and URI alike.
+    raw_part = getattr(part, "_raw_part", None)
+    if raw_part is not None:
+        return hashlib.sha256(b"part:" + raw_part.SerializeToString(deterministic=True)).digest()
+    return hashlib.sha256(b"repr:" + repr(part).encode()).digest()
+
+
+def content_key(model_name: str, content_parts: List[Any]) -> str:
+    """
+    Builds a stable cache key for a generation request.
+
+    Args:
+        model_name: Model that will answer the request
+        content_parts: Prompt text and media parts, in order
+
+    Returns:
+        Hex digest identifying the request
+    """
+    digest = hashlib.sha256(model_name.encode())
+    for part in content_parts:
+        digest.update(part_digest(part))
+    return digest.hexdigest()
+
+
+def has_media(content_parts: List[Any]) -> bool:
+    """Returns True if any part is not plain text."""
+    return any(not isinstance(part, str) for part in content_parts)
+
+
+class ResponseCache:
+    """
+    Two-tier (memory, optional disk) cache of generation results.
+
+    Args:
+        max_entries: Size of the in-memory LRU tier
+        ttl: Seconds a cached response stays valid
+        directory: Optional directory for the on-disk tier
+    """
+
+    def __init__(self, max_entries: int, ttl: float, directory: Optional[str] = None):
+        self.memory = TTLCache(max_entries=max_entries, ttl=ttl)
+        self.disk = DiskCache(directory, ttl=ttl) if directory else None
+        self.flights = SingleFlight()
+
+    async def key_for(self, model_name: str, content_parts: List[Any]) -> str:
+        """
+        Computes the cache key, hashing large media off the event loop.
+
+        Args:
+            model_name: Configured model the request is for
+            content_parts: Prompt text and media parts
+
+        Returns:
+            Hex digest cache key
+        """
+        if has_media(content_parts):
+            return await asyncio.to_thread(content_key, model_name, content_parts)
+        return content_key(model_name, content_parts)
+
+    async def get(self, key: str) -> Optional[dict]:
+        """
+        Looks a response up in memory, then on disk.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            Cached response dict with 'text' and 'usage', or None
+        """
+        value = self.memory.get(key)
+        if value is not None or self.disk is None:
+            return value
+
+        data = await asyncio.to_thread(self.disk.get, key)
+        if data is None:
+            return None
+        value = json.loads(data)
+        # Promote to the memory tier for subsequent hits
+        self.memory.set(key, value)
+        return value
+
+    async def set(self, key: str, value: dict) -> None:
+        """
+        Stores a response in both tiers.
+
+        Args:
+            key: Cache key
+            value: Response dict with 'text' and 'usage'
+        """
+        self.memory.set(key, value)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, key, json.dumps(value).encode())
+
+    async def get_or_generate(
+        self,
+        key: str,
+        generate: Callable[[], Awaitable[dict]],
+        directive: str = CACHE_DEFAULT
+    ) -> tuple:
+        """
+        Serves a response from cache or generates it, coalescing concurrent misses.
+
+        Args:
+            key: Cache key
+            generate: Coroutine function producing the response dict on a miss
+            directive: One of the CACHE_* request directives
+
+        Returns:
+            Tuple of (response dict, cache status) where status is
+            'HIT', 'MISS', 'COALESCED' or 'BYPASS'
+
+        Raises:
+            CacheMissError: For only-if-cached requests with no cached answer
+        """
+        if directive == CACHE_NO_STORE:
+            return await generate(), "BYPASS"
+
+        if directive != CACHE_NO_CACHE:
+            cached = await self.get(key)
+            if cached is not None:
+                return cached, "HIT"
+            if directive == CACHE_ONLY_IF_CACHED:
+                raise CacheMissError(key)
+
+        leader = False
+
+        async def generate_and_store():
+            nonlocal leader
+            leader = True
+            value = await generate()
+            if value.get("text"):
+                await self.set(key, value)
+            return value
+
+        # no-cache requests must not piggyback on an in-flight call for the same key
+        flight_key = key if directive != CACHE_NO_CACHE else f"{key}:refresh"
+        value = await self.flights.do(flight_key, generate_and_store)
+        return value, "MISS" if leader else "COALESCED"
+
+    def stats(self) -> dict:
+        """Memory, disk and coalescing counters."""
+        return {
+            "memory": self.memory.stats(),
+            "disk": self.disk.stats() if self.disk else None,
+            "coalescing": self.flights.stats(),
+        }
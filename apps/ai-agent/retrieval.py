@@ -0,0 +1,286 @@
+"""
+Retrieval over long brand and persona documents.
+
+Brand briefs and audience research can run to tens of KB, most of which has
+nothing to do with a given question. Long documents are split into
+paragraph-sized chunks and indexed once with BM25, keyed by a hash of the
+text, so every later turn that sends the same document reuses the index.
+Each turn then keeps only the chunks most relevant to the question, within
+a character budget, in document order. Short documents are used verbatim.
+"""
+
+import hashlib
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from caching import TTLCache
+from sentences import split_sentences
+
+
+# BM25 term-frequency saturation and length normalisation
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+STOPWORDS = frozenset("""
+a about above after again all also am an and any are as at be because been before being below between
+both but by can could did do does doing down during each few for from further had has have having he
+her here hers him his how i if in into is it its itself just me more most my no nor not of off on once
+only or other our ours out over own same she should so some such than that the their theirs them then
+there these they this those through to too under until up very was we were what when where which while
+who whom why will with would you your yours
+""".split())
+
+# Marks the gaps between non-adjacent chunks in a selection
+OMISSION = "\n[...]\n"
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits text into lower-case terms, dropping stopwords and plural/possessive endings.
+
+    Args:
+        text: Text to tokenize
+
+    Returns:
+        Terms in order
+    """
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        token = token.split("'", 1)[0]
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        terms.append(token)
+    return terms
+
+
+def split_chunks(text: str, chunk_chars: int) -> List[str]:
+    """
+    Splits a document into chunks of whole paragraphs of up to chunk_chars.
+
+    Paragraphs longer than chunk_chars are split at sentence boundaries.
+
+    Args:
+        text: Document text
+        chunk_chars: Target maximum chunk length
+
+    Returns:
+        Non-empty chunks in document order
+    """
+    pieces = []
+    for paragraph in PARAGRAPH_BREAK.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= chunk_chars:
+            pieces.append(paragraph)
+        else:
+            pieces.extend(split_sentences(paragraph, min_chars=1, max_chars=chunk_chars))
+
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + 2 + len(piece) > chunk_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class ChunkIndex:
+    """
+    BM25 index over the chunks of one document.
+
+    Args:
+        chunks: Document chunks in order
+    """
+
+    def __init__(self, chunks: List[str]):
+        self.chunks = chunks
+        self._lengths: List[int] = []
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        for position, chunk in enumerate(chunks):
+            counts = Counter(tokenize(chunk))
+            self._lengths.append(sum(counts.values()))
+            for term, count in counts.items():
+                self._postings.setdefault(term, []).append((position, count))
+        self._average_length = (sum(self._lengths) / len(chunks)) if chunks else 0.0
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def search(self, query: str, top_k: int) -> List[Tuple[int, float]]:
+        """
+        Ranks chunks against a query.
+
+        Args:
+            query: Question text
+            top_k: Maximum number of chunks returned
+
+        Returns:
+            (chunk position, score) pairs, best first; chunks sharing no term with the query are left out
+        """
+        scores: Dict[int, float] = {}
+        total = len(self.chunks)
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for position, count in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[position] / self._average_length)
+                scores[position] = scores.get(position, 0.0) + idf * count * (BM25_K1 + 1) / (count + norm)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:top_k]
+
+
+@dataclass
+class Selection:
+    """
+    The part of a document kept for one question.
+
+    Args:
+        text: Selected text to put in the prompt
+        chunks: Number of chunks selected (0 if the document is used verbatim)
+        total_chunks: Number of chunks in the document (0 if it was not indexed)
+        original_chars: Length of the whole document
+    """
+    text: str
+    chunks: int = 0
+    total_chunks: int = 0
+    original_chars: int = 0
+
+    @property
+    def retrieved(self) -> bool:
+        """Whether the document was cut down to relevant chunks."""
+        return self.total_chunks > 0
+
+
+class DocumentRetriever:
+    """
+    Chunks and indexes long documents once and selects relevant chunks per question.
+
+    Args:
+        enabled: Whether long documents are cut down at all
+        min_chars: Documents at most this long are always used verbatim
+        chunk_chars: Target chunk length
+        budget_chars: Maximum characters selected from one document
+        top_k: Maximum chunks selected from one document
+        max_entries: Number of document indexes kept in memory
+        ttl: Seconds an unused index is kept
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        min_chars: int = 8000,
+        chunk_chars: int = 800,
+        budget_chars: int = 4000,
+        top_k: int = 6,
+        max_entries: int = 256,
+        ttl: float = 3600
+    ):
+        self.enabled = enabled
+        self.min_chars = min_chars
+        self.chunk_chars = chunk_chars
+        self.budget_chars = budget_chars
+        self.top_k = top_k
+        self._indexes = TTLCache(max_entries=max_entries, ttl=ttl)
+        self.built = 0
+        self.selections = 0
+        self.chars_in = 0
+        self.chars_out = 0
+
+    def index_for(self, text: str) -> ChunkIndex:
+        """
+        Returns the index for a document, building it on first use.
+
+        Args:
+            text: Document text
+
+        Returns:
+            ChunkIndex over the document's chunks
+        """
+        key = hashlib.sha256(f"{self.chunk_chars}\0{text}".encode()).hexdigest()
+        index = self._indexes.get(key)
+        if index is None:
+            index = ChunkIndex(split_chunks(text, self.chunk_chars))
+            self._indexes.set(key, index)
+            self.built += 1
+        return index
+
+    def select(self, text: str, query: Optional[str]) -> Selection:
+        """
+        Keeps the chunks of a document most relevant to a question.
+
+        The document's first chunk, which usually names and summarises the
+        brand or audience, is always kept. The best-scoring chunks fill the
+        rest of the budget and are returned in document order, with gaps
+        marked. A question that matches nothing keeps the document's opening
+        chunks.
+
+        Args:
+            text: Document text
+            query: Question (and recent context) the chunks should answer
+
+        Returns:
+            Selection; the whole document if retrieval is off, the document
+            is short or there is no question
+        """
+        if not self.enabled or not query or len(text) <= self.min_chars:
+            return Selection(text, original_chars=len(text))
+
+        index = self.index_for(text)
+        if not index:
+            return Selection(text, original_chars=len(text))
+        ranked = [position for position, _ in index.search(query, self.top_k)]
+        # The lead chunk comes first; a question that matches nothing gets the opening chunks
+        candidates = [0] + ranked if ranked else range(len(index))
+        chosen = set()
+        used = 0
+        for position in candidates:
+            size = len(index.chunks[position])
+            if position in chosen or (chosen and used + size > self.budget_chars):
+                continue
+            chosen.add(position)
+            used += size
+
+        parts = []
+        previous = None
+        for position in sorted(chosen):
+            if previous is not None:
+                parts.append("\n\n" if position == previous + 1 else OMISSION)
+            parts.append(index.chunks[position])
+            previous = position
+        if previous != len(index) - 1:
+            parts.append(OMISSION)
+        selected = "".join(parts).strip("\n")
+
+        self.selections += 1
+        self.chars_in += len(text)
+        self.chars_out += len(selected)
+        return Selection(selected, len(chosen), len(index), len(text))
+
+    def stats(self) -> dict:
+        """Settings and selection counters."""
+        return {
+            "enabled": self.enabled,
+            "min_chars": self.min_chars,
+            "chunk_chars": self.chunk_chars,
+            "budget_chars": self.budget_chars,
+            "top_k": self.top_k,
+            "indexes": len(self._indexes),
+            "built": self.built,
+            "selections": self.selections,
+            "chars_in": self.chars_in,
+            "chars_out": self.chars_out,
+        }
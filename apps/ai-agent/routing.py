@@ -0,0 +1,294 @@
+"""
+Latency-aware model routing and hedged requests.
+
+Short text-only turns can be served by a faster model, while multimodal and
+long-context turns go to the pro model. Every call's latency is recorded in
+a rolling window per model. Those windows steer traffic away from a fast
+model that has become slower than the pro model, and they set the hedge
+delay: once a request has waited longer than the chosen model's latency
+percentile, a second copy goes to the hedge model (or region). The first
+answer wins and the other request is cancelled.
+"""
+
+import asyncio
+import math
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+
+# Latency kinds: whole unary generations, and time to a stream's first chunk
+KIND_GENERATE = "generate"
+KIND_STREAM = "stream_first_chunk"
+
+ROUTE_FAST = "short_text"
+ROUTE_FAST_DEGRADED = "fast_degraded"
+ROUTE_MULTIMODAL = "multimodal"
+ROUTE_LONG_CONTEXT = "long_context"
+ROUTE_DEFAULT = "default"
+
+
+class LatencyWindow:
+    """
+    Rolling window of a model's most recent successful call latencies.
+
+    Args:
+        size: Number of samples kept
+    """
+
+    def __init__(self, size: int):
+        self._samples: Deque[float] = deque(maxlen=size)
+        self.calls = 0
+        self.errors = 0
+
+    def observe(self, seconds: float) -> None:
+        """Records a successful call's latency."""
+        self.calls += 1
+        self._samples.append(seconds)
+
+    def observe_error(self) -> None:
+        """Records a failed call."""
+        self.calls += 1
+        self.errors += 1
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """
+        Nearest-rank percentile of the window.
+
+        Args:
+            percentile: Percentile between 0 and 100
+
+        Returns:
+            Latency in seconds, or None if the window is empty
+        """
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        rank = max(1, math.ceil(percentile / 100 * len(ordered)))
+        return ordered[rank - 1]
+
+    def stats(self) -> dict:
+        def ms(value: Optional[float]) -> Optional[float]:
+            return round(value * 1000, 1) if value is not None else None
+
+        return {
+            "samples": len(self._samples),
+            "calls": self.calls,
+            "errors": self.errors,
+            "p50_ms": ms(self.percentile(50)),
+            "p95_ms": ms(self.percentile(95)),
+            "p99_ms": ms(self.percentile(99)),
+        }
+
+
+@dataclass
+class RouteDecision:
+    """
+    Where a generation should go.
+
+    Args:
+        model: Model to send the request to
+        reason: Why the model was chosen (one of the ROUTE_* constants)
+        hedge_model: Model to hedge to, if hedging applies
+        hedge_after: Seconds to wait for the primary before hedging, if hedging applies
+    """
+    model: str
+    reason: str
+    hedge_model: Optional[str] = None
+    hedge_after: Optional[float] = None
+
+
+class ModelRouter:
+    """
+    Chooses a model per request from its content and recent latencies.
+
+    Args:
+        default_model: Model for multimodal, long-context and unrouted requests
+        fast_model: Optional faster model for short text-only requests
+        hedge_model: Optional model (or region) to send hedge requests to
+        fast_max_chars: Longest prompt, system instruction included, routed to the fast model
+        hedge_percentile: Latency percentile after which a request is hedged
+        min_samples: Samples a window needs before it affects routing or hedging
+        window_size: Samples kept per model and latency kind
+        probe_every: While the fast model is degraded, every Nth short turn
+                     still goes to it so its latencies stay current
+    """
+
+    def __init__(
+        self,
+        default_model: str,
+        fast_model: Optional[str] = None,
+        hedge_model: Optional[str] = None,
+        fast_max_chars: int = 4000,
+        hedge_percentile: float = 95.0,
+        min_samples: int = 20,
+        window_size: int = 200,
+        probe_every: int = 10
+    ):
+        self.default_model = default_model
+        self.fast_model = fast_model or None
+        self.hedge_model = hedge_model or None
+        self.fast_max_chars = fast_max_chars
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = max(1, min_samples)
+        self.window_size = window_size
+        self.probe_every = max(1, probe_every)
+        self._degraded_turns = 0
+        self._windows: Dict[Tuple[str, str], LatencyWindow] = {}
+        self._routes: Dict[str, int] = {}
+        self._hedges = {"sent": 0, "won": 0}
+
+    def window(self, model: str, kind: str) -> LatencyWindow:
+        """Returns the rolling window for a model and latency kind."""
+        key = (model, kind)
+        if key not in self._windows:
+            self._windows[key] = LatencyWindow(self.window_size)
+        return self._windows[key]
+
+    def _typical(self, model: str, kind: str, percentile: float) -> Optional[float]:
+        window = self._windows.get((model, kind))
+        if window is None or len(window) < self.min_samples:
+            return None
+        return window.percentile(percentile)
+
+    def route(self, content_parts: list, system_instruction: Optional[str] = None, kind: str = KIND_GENERATE) -> RouteDecision:
+        """
+        Picks the model, and the hedge if one applies, for a request.
+
+        Args:
+            content_parts: Prompt text and media parts
+            system_instruction: Persona/brand preamble, if any
+            kind: KIND_GENERATE or KIND_STREAM, selecting which latencies to consult
+
+        Returns:
+            RouteDecision
+        """
+        multimodal = any(not isinstance(part, str) for part in content_parts)
+        chars = len(system_instruction or "") + sum(len(part) for part in content_parts if isinstance(part, str))
+
+        if multimodal:
+            model, reason = self.default_model, ROUTE_MULTIMODAL
+        elif chars > self.fast_max_chars:
+            model, reason = self.default_model, ROUTE_LONG_CONTEXT
+        elif self.fast_model:
+            model, reason = self.fast_model, ROUTE_FAST
+            fast = self._typical(self.fast_model, kind, 50)
+            default = self._typical(self.default_model, kind, 50)
+            # A fast model that is currently slower than the default one is no use
+            if fast is not None and default is not None and fast > default:
+                self._degraded_turns += 1
+                if self._degraded_turns % self.probe_every:
+                    model, reason = self.default_model, ROUTE_FAST_DEGRADED
+        else:
+            model, reason = self.default_model, ROUTE_DEFAULT
+        self._routes[reason] = self._routes.get(reason, 0) + 1
+
+        decision = RouteDecision(model=model, reason=reason)
+        if self.hedge_model and self.hedge_model != model:
+            decision.hedge_after = self._typical(model, kind, self.hedge_percentile)
+            if decision.hedge_after is not None:
+                decision.hedge_model = self.hedge_model
+        return decision
+
+    def observe(self, model: str, kind: str, seconds: Optional[float]) -> None:
+        """
+        Records a call's latency, or a failure when seconds is None.
+
+        Args:
+            model: Model that was called
+            kind: KIND_GENERATE or KIND_STREAM
+            seconds: Latency of a successful call, or None if it failed
+        """
+        window = self.window(model, kind)
+        if seconds is None:
+            window.observe_error()
+        else:
+            window.observe(seconds)
+
+    def record_hedge(self, won: bool) -> None:
+        """Counts a hedge that was sent, and whether it beat the primary."""
+        self._hedges["sent"] += 1
+        if won:
+            self._hedges["won"] += 1
+
+    def stats(self) -> dict:
+        """
+        Routing configuration, route counts and rolling latencies per model.
+
+        Returns:
+            Dictionary for health reporting
+        """
+        latencies: Dict[str, dict] = {}
+        for (model, kind), window in sorted(self._windows.items()):
+            latencies.setdefault(model, {})[kind] = window.stats()
+        return {
+            "default_model": self.default_model,
+            "fast_model": self.fast_model,
+            "hedge_model": self.hedge_model,
+            "fast_max_chars": self.fast_max_chars,
+            "hedge_percentile": self.hedge_percentile,
+            "routes": dict(self._routes),
+            "hedges": dict(self._hedges),
+            "latency": latencies,
+        }
+
+
+async def race_with_hedge(
+    primary: Callable[[], Awaitable[Any]],
+    hedge: Optional[Callable[[], Awaitable[Any]]],
+    hedge_after: Optional[float],
+    discard: Optional[Callable[[Any], Any]] = None
+) -> Tuple[Any, bool, bool]:
+    """
+    Runs primary, and also hedge if primary has not finished after hedge_after seconds.
+
+    The first successful result wins and the other call is cancelled. A
+    failure only ends the race once both calls have failed, and then the
+    primary's error is raised.
+
+    Args:
+        primary: Zero-argument coroutine function for the primary call
+        hedge: Zero-argument coroutine function for the hedge call, if any
+        hedge_after: Seconds to wait before hedging; None disables the hedge
+        discard: Optional callback for a losing result that completed anyway
+                 (e.g., to release what it holds)
+
+    Returns:
+        Tuple of (result, whether a hedge was sent, whether the hedge produced the result)
+    """
+    primary_task = asyncio.ensure_future(primary())
+    if hedge is None or hedge_after is None:
+        return await primary_task, False, False
+
+    try:
+        done, _ = await asyncio.wait({primary_task}, timeout=hedge_after)
+    except BaseException:
+        primary_task.cancel()
+        raise
+    if done:
+        return primary_task.result(), False, False
+
+    hedge_task = asyncio.ensure_future(hedge())
+    tasks = (primary_task, hedge_task)
+    winner = None
+    try:
+        pending = set(tasks)
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in tasks:
+                if task in done and not task.cancelled() and task.exception() is None and winner is None:
+                    winner = task
+        if winner is None:
+            raise primary_task.exception() or hedge_task.exception()
+        return winner.result(), True, winner is hedge_task
+    finally:
+        for task in tasks:
+            if task is winner:
+                continue
+            if not task.done():
+                task.cancel()
+            elif discard is not None and not task.cancelled() and task.exception() is None:
+                discard(task.result())
@@ -0,0 +1,186 @@
+"""
+Bounded concurrency scheduler for upstream model calls.
+
+Caps the number of in-flight Gemini generations per instance and keeps a
+bounded wait queue in front of them. When the queue is full, callers are
+rejected immediately with a suggested retry delay instead of piling up
+on the event loop.
+"""
+
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Optional
+
+
+class QueueFullError(Exception):
+    """
+    Raised when the scheduler's wait queue is at capacity.
+
+    Args:
+        retry_after: Suggested number of seconds before the client retries
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Generation queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+@dataclass
+class Ticket:
+    """
+    Accounting record for a single scheduled request.
+
+    Args:
+        enqueued_at: Monotonic time the request entered the queue
+        started_at: Monotonic time the request acquired a slot
+        finished_at: Monotonic time the slot was released
+    """
+    enqueued_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    released: bool = field(default=False, repr=False)
+
+    @property
+    def queue_time(self) -> float:
+        """Seconds spent waiting for a slot."""
+        if self.started_at is None:
+            return time.monotonic() - self.enqueued_at
+        return self.started_at - self.enqueued_at
+
+    @property
+    def service_time(self) -> float:
+        """Seconds spent holding a slot."""
+        if self.started_at is None:
+            return 0.0
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return end - self.started_at
+
+
+class ConcurrencyScheduler:
+    """
+    Semaphore-backed scheduler with a bounded wait queue.
+
+    Args:
+        max_concurrency: Maximum number of requests holding a slot at once
+        max_queue: Maximum number of requests allowed to wait for a slot
+        default_retry_after: Retry-After hint used before any timings exist
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, default_retry_after: int = 5):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.max_concurrency = max_concurrency
+        self.max_queue = max(0, max_queue)
+        self.default_retry_after = default_retry_after
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._waiting = 0
+        self._active = 0
+        self._completed = 0
+        self._rejected = 0
+        self._total_queue_time = 0.0
+        self._avg_service_time: Optional[float] = None
+
+    @property
+    def active(self) -> int:
+        """Number of requests currently holding a slot."""
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        """Number of requests currently waiting for a slot."""
+        return self._waiting
+
+    def retry_after(self) -> int:
+        """
+        Estimates how long a rejected client should wait before retrying.
+
+        Returns:
+            Whole seconds, based on the average service time and queue depth
+        """
+        if self._avg_service_time is None:
+            return self.default_retry_after
+        batches = (self._waiting + self._active) / self.max_concurrency
+        return max(1, math.ceil(self._avg_service_time * max(batches, 1.0)))
+
+    async def acquire(self) -> Ticket:
+        """
+        Waits for a free slot, or rejects if the wait queue is full.
+
+        Returns:
+            Ticket that must be passed to release() when the work is done
+
+        Raises:
+            QueueFullError: If no slot is free and the queue is at capacity
+        """
+        ticket = Ticket(enqueued_at=time.monotonic())
+        if self._semaphore.locked() and self._waiting >= self.max_queue:
+            self._rejected += 1
+            raise QueueFullError(self.retry_after())
+
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+
+        ticket.started_at = time.monotonic()
+        self._active += 1
+        return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        """
+        Returns a slot to the pool and records the ticket's timings.
+
+        Args:
+            ticket: Ticket returned by acquire(); releasing twice is a no-op
+        """
+        if ticket.released:
+            return
+        ticket.released = True
+        ticket.finished_at = time.monotonic()
+        self._active -= 1
+        self._completed += 1
+        self._total_queue_time += ticket.queue_time
+
+        # Exponentially weighted average keeps the Retry-After hint current
+        service = ticket.service_time
+        if self._avg_service_time is None:
+            self._avg_service_time = service
+        else:
+            self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * service
+
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[Ticket]:
+        """Context manager wrapper around acquire() and release()."""
+        ticket = await self.acquire()
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self) -> dict:
+        """
+        Snapshot of scheduler state for health reporting.
+
+        Returns:
+            Dictionary of limits, current load and cumulative counters
+        """
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self._active,
+            "waiting": self._waiting,
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "avg_queue_time_ms": round(
+                1000 * self._total_queue_time / self._completed, 2
+            ) if self._completed else 0.0,
+            "avg_service_time_ms": round(
+                1000 * self._avg_service_time, 2
+            ) if self._avg_service_time is not None else None,
+        }
@@ -0,0 +1,123 @@
+"""
+Sentence splitting for incremental speech synthesis.
+
+Text is cut at sentence boundaries into pieces that are long enough to be
+worth a Text-to-Speech call and short enough to synthesize quickly, so the
+first audio is ready well before the whole answer is. SentenceAccumulator
+does the same for text that is still being generated.
+"""
+
+import re
+from typing import List
+
+
+# A sentence ends at ., ! or ? (or an ellipsis), optionally followed by
+# closing quotes/brackets, then whitespace
+SENTENCE_END = re.compile(r'(?<=[.!?…])["\'”’)\]]*\s+')
+
+
+def _split_long(sentence: str, max_chars: int) -> List[str]:
+    """Splits an over-long sentence at clause boundaries, then at spaces."""
+    pieces = []
+    while len(sentence) > max_chars:
+        cut = max(sentence.rfind(mark, 0, max_chars) for mark in (", ", "; ", ": ", " - "))
+        if cut <= 0:
+            cut = sentence.rfind(" ", 0, max_chars)
+        if cut <= 0:
+            cut = max_chars - 1
+        pieces.append(sentence[:cut + 1].strip())
+        sentence = sentence[cut + 1:].strip()
+    if sentence:
+        pieces.append(sentence)
+    return pieces
+
+
+def split_sentences(text: str, min_chars: int = 40, max_chars: int = 400) -> List[str]:
+    """
+    Splits text into sentence-sized pieces for synthesis.
+
+    Short sentences are merged with the following one so greetings like
+    "Hi." do not cost a call each; sentences longer than max_chars are split
+    at commas or spaces.
+
+    Args:
+        text: Text to split
+        min_chars: Pieces shorter than this are merged with the next sentence
+        max_chars: Maximum length of a piece
+
+    Returns:
+        Non-empty pieces in order
+    """
+    pieces = []
+    pending = ""
+    for sentence in SENTENCE_END.split(" ".join(text.split())):
+        if not sentence:
+            continue
+        pending = f"{pending} {sentence}".strip() if pending else sentence
+        if len(pending) >= min_chars:
+            pieces.extend(_split_long(pending, max_chars))
+            pending = ""
+    if pending:
+        if pieces and len(pieces[-1]) + len(pending) < max_chars:
+            # Fold a short tail into the last piece
+            pieces[-1] = f"{pieces[-1]} {pending}"
+        else:
+            pieces.extend(_split_long(pending, max_chars))
+    return pieces
+
+
+class SentenceAccumulator:
+    """
+    Collects streamed text and releases complete sentence pieces as they form.
+
+    Args:
+        min_chars: Pieces shorter than this wait for the next sentence
+        max_chars: Maximum length of a piece; longer runs are split at clauses
+    """
+
+    def __init__(self, min_chars: int = 40, max_chars: int = 400):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        """
+        Adds streamed text.
+
+        Args:
+            text: Next chunk of generated text
+
+        Returns:
+            Pieces completed by this chunk (possibly none), in order
+        """
+        self._buffer += text
+        pieces = []
+        while True:
+            cut = None
+            for match in SENTENCE_END.finditer(self._buffer):
+                if len(self._buffer[:match.start()].strip()) >= self.min_chars:
+                    cut = match.end()
+                    break
+            if cut is None:
+                break
+            pieces.extend(_split_long(" ".join(self._buffer[:cut].split()), self.max_chars))
+            self._buffer = self._buffer[cut:]
+
+        if len(self._buffer) > self.max_chars:
+            # A run-on sentence: release all but its unfinished tail
+            trailing_space = " " if self._buffer[-1].isspace() else ""
+            *complete, tail = _split_long(" ".join(self._buffer.split()), self.max_chars)
+            self._buffer = tail + trailing_space
+            pieces.extend(complete)
+        return pieces
+
+    def flush(self) -> List[str]:
+        """
+        Releases whatever text remains once the stream has ended.
+
+        Returns:
+            Remaining pieces, in order
+        """
+        text = " ".join(self._buffer.split())
+        self._buffer = ""
+        return _split_long(text, self.max_chars) if text else []
@@ -0,0 +1,328 @@
+"""
+Server-side conversation sessions.
+
+A session holds the persona, brand context, optional media and the running
+history, so clients only send the new turn. Storage is pluggable: an
+in-process LRU (default), SQLite for several workers on one host, or a
+Redis-compatible server for multi-instance deployments. All backends expire
+idle sessions after a TTL, and append a turn's messages atomically in the
+store itself, so concurrent turns on different workers or instances never
+overwrite each other's messages.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional
+
+from caching import TTLCache
+
+
+@dataclass
+class Session:
+    """
+    State of a single conversation.
+
+    Args:
+        session_id: Unique identifier handed to the client
+        audience_summary: Description of the persona
+        brand_context: Context about the brand
+        image_data: Optional Base64-encoded image attached to every turn
+        video_uri: Optional GCS URI of a video attached to every turn
+        media_ids: Ids of stored media attached to every turn
+        history: Previous messages as {'sender', 'text'} dicts
+        created_at: Unix time the session was created
+        updated_at: Unix time of the last turn
+    """
+    session_id: str
+    audience_summary: str
+    brand_context: str
+    image_data: Optional[str] = None
+    video_uri: Optional[str] = None
+    media_ids: List[str] = field(default_factory=list)
+    history: List[dict] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+    @classmethod
+    def new(cls, **kwargs) -> "Session":
+        """Creates a session with a fresh random id."""
+        return cls(session_id=uuid.uuid4().hex, **kwargs)
+
+    def to_json(self) -> str:
+        """Serializes the session for persistent backends."""
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, data: str) -> "Session":
+        """Restores a session serialized with to_json()."""
+        return cls(**json.loads(data))
+
+
+class SessionStore:
+    """
+    Interface for session storage backends.
+
+    Args:
+        ttl: Seconds an idle session is kept before it expires
+    """
+
+    backend = "base"
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+
+    async def get(self, session_id: str) -> Optional[Session]:
+        """Loads a session, or returns None if it is missing or expired."""
+        raise NotImplementedError
+
+    async def put(self, session: Session) -> None:
+        """Saves a session and resets its expiry."""
+        raise NotImplementedError
+
+    async def append(self, session_id: str, messages: List[dict], updated_at: float) -> bool:
+        """
+        Atomically appends messages to a session's history and resets its expiry.
+
+        Args:
+            session_id: Session identifier
+            messages: {'sender', 'text'} dicts to append, in order
+            updated_at: Unix time of the turn
+
+        Returns:
+            False if the session is missing or expired
+        """
+        raise NotImplementedError
+
+    async def delete(self, session_id: str) -> bool:
+        """Deletes a session, returning True if it existed."""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        """Releases backend resources."""
+
+    def stats(self) -> dict:
+        """Backend name and size information."""
+        return {"backend": self.backend, "ttl": self.ttl}
+
+
+class MemorySessionStore(SessionStore):
+    """
+    In-process LRU session store; sessions are lost on restart.
+
+    Args:
+        ttl: Seconds an idle session is kept
+        max_sessions: Maximum number of sessions before LRU eviction
+    """
+
+    backend = "memory"
+
+    def __init__(self, ttl: float, max_sessions: int = 10000):
+        super().__init__(ttl)
+        self._sessions = TTLCache(max_entries=max_sessions, ttl=ttl)
+
+    async def get(self, session_id: str) -> Optional[Session]:
+        return self._sessions.get(session_id)
+
+    async def put(self, session: Session) -> None:
+        self._sessions.set(session.session_id, session)
+
+    async def append(self, session_id: str, messages: List[dict], updated_at: float) -> bool:
+        # No await between the read and the write, so turns can't interleave
+        session = self._sessions.get(session_id)
+        if session is None:
+            return False
+        session.history.extend(messages)
+        session.updated_at = updated_at
+        self._sessions.set(session_id, session)
+        return True
+
+    async def delete(self, session_id: str) -> bool:
+        return self._sessions.pop(session_id) is not None
+
+    def stats(self) -> dict:
+        return dict(super().stats(), **self._sessions.stats())
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite-backed session store shared by worker processes on one host.
+
+    Args:
+        ttl: Seconds an idle session is kept
+        path: Database file path
+        purge_interval: Seconds between sweeps of expired rows
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, ttl: float, path: str, purge_interval: float = 60.0):
+        super().__init__(ttl)
+        self.path = path
+        self.purge_interval = purge_interval
+        self._last_purge = 0.0
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per worker thread; sqlite3 connections aren't thread-safe
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _get(self, session_id: str) -> Optional[Session]:
+        row = self._connect().execute(
+            "SELECT data FROM sessions WHERE session_id = ? AND expires_at > ?",
+            (session_id, time.time())
+        ).fetchone()
+        return Session.from_json(row[0]) if row else None
+
+    def _put(self, session: Session) -> None:
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, data, expires_at) VALUES (?, ?, ?)",
+                (session.session_id, session.to_json(), now + self.ttl)
+            )
+            if now - self._last_purge >= self.purge_interval:
+                self._last_purge = now
+                conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+
+    def _append(self, session_id: str, messages: List[dict], updated_at: float) -> bool:
+        conn = self._connect()
+        now = time.time()
+        # BEGIN IMMEDIATE takes the write lock before reading, so a turn on
+        # another worker waits instead of reading the same history
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT data FROM sessions WHERE session_id = ? AND expires_at > ?", (session_id, now)
+            ).fetchone()
+            if row is None:
+                conn.rollback()
+                return False
+            session = Session.from_json(row[0])
+            session.history.extend(messages)
+            session.updated_at = updated_at
+            conn.execute(
+                "UPDATE sessions SET data = ?, expires_at = ? WHERE session_id = ?",
+                (session.to_json(), now + self.ttl, session_id)
+            )
+            conn.commit()
+            return True
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def _delete(self, session_id: str) -> bool:
+        with self._connect() as conn:
+            cursor = conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            return cursor.rowcount > 0
+
+    async def get(self, session_id: str) -> Optional[Session]:
+        return await asyncio.to_thread(self._get, session_id)
+
+    async def put(self, session: Session) -> None:
+        await asyncio.to_thread(self._put, session)
+
+    async def append(self, session_id: str, messages: List[dict], updated_at: float) -> bool:
+        return await asyncio.to_thread(self._append, session_id, messages, updated_at)
+
+    async def delete(self, session_id: str) -> bool:
+        return await asyncio.to_thread(self._delete, session_id)
+
+    def stats(self) -> dict:
+        return dict(super().stats(), path=self.path)
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Redis-compatible session store for multi-instance deployments.
+
+    Requires the optional 'redis' package.
+
+    Args:
+        ttl: Seconds an idle session is kept
+        url: Redis connection URL
+        prefix: Key prefix for session entries
+    """
+
+    backend = "redis"
+
+    def __init__(self, ttl: float, url: str, prefix: str = "persona-session:"):
+        super().__init__(ttl)
+        try:
+            import redis.asyncio as redis_asyncio
+            from redis.exceptions import WatchError
+        except ImportError as e:
+            raise RuntimeError("SESSION_STORE=redis requires the 'redis' package") from e
+        self.prefix = prefix
+        self._redis = redis_asyncio.from_url(url)
+        self._watch_error = WatchError
+
+    async def get(self, session_id: str) -> Optional[Session]:
+        data = await self._redis.get(self.prefix + session_id)
+        return Session.from_json(data) if data else None
+
+    async def put(self, session: Session) -> None:
+        await self._redis.set(self.prefix + session.session_id, session.to_json(), ex=int(self.ttl))
+
+    async def append(self, session_id: str, messages: List[dict], updated_at: float) -> bool:
+        key = self.prefix + session_id
+        async with self._redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    # WATCH/MULTI: the write fails if another instance changed the session since the read
+                    await pipe.watch(key)
+                    data = await pipe.get(key)
+                    if not data:
+                        await pipe.unwatch()
+                        return False
+                    session = Session.from_json(data)
+                    session.history.extend(messages)
+                    session.updated_at = updated_at
+                    pipe.multi()
+                    pipe.set(key, session.to_json(), ex=int(self.ttl))
+                    await pipe.execute()
+                    return True
+                except self._watch_error:
+                    continue
+
+    async def delete(self, session_id: str) -> bool:
+        return bool(await self._redis.delete(self.prefix + session_id))
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+def create_session_store() -> SessionStore:
+    """
+    Builds the session store selected by environment variables.
+
+    SESSION_STORE picks the backend ('memory', 'sqlite' or 'redis'),
+    SESSION_TTL the idle expiry in seconds, and SESSION_SQLITE_PATH,
+    REDIS_URL and SESSION_MAX_ENTRIES configure the individual backends.
+
+    Returns:
+        A SessionStore instance
+    """
+    backend = os.environ.get("SESSION_STORE", "memory").lower()
+    ttl = float(os.environ.get("SESSION_TTL", "3600"))
+
+    if backend == "sqlite":
+        return SQLiteSessionStore(ttl, os.environ.get("SESSION_SQLITE_PATH", "/tmp/persona-sessions.db"))
+    if backend == "redis":
+        return RedisSessionStore(ttl, os.environ.get("REDIS_URL", "redis://localhost:6379/0"))
+    return MemorySessionStore(ttl, int(os.environ.get("SESSION_MAX_ENTRIES", "10000")))
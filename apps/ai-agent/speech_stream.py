@@ -0,0 +1,183 @@
+"""
+Streaming speech recognition for live voice input.
+
+Audio frames are forwarded to the recognizer while the user is still
+speaking, and interim and final transcripts are yielded as they arrive.
+GoogleStreamingRecognizer wraps Speech-to-Text streaming_recognize;
+FakeStreamingRecognizer turns any audio into a canned transcript so the
+WebSocket flow can be exercised locally without credentials.
+"""
+
+import asyncio
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, AsyncIterator, Awaitable, Callable
+
+from audio_probe import probe_audio
+from lazy_imports import lazy_import, load_in_thread
+
+if TYPE_CHECKING:
+    from google.cloud.speech import StreamingRecognitionConfig
+
+# Imported on the first recognition rather than at start-up
+speech = lazy_import("google.cloud.speech")
+
+
+TRANSCRIPT_INTERIM = "interim"
+TRANSCRIPT_FINAL = "final"
+# The recognizer detected the end of speech and will not accept more audio
+SPEECH_END = "speech_end"
+
+
+@dataclass
+class TranscriptEvent:
+    """
+    One update from a streaming recognizer.
+
+    Args:
+        kind: TRANSCRIPT_INTERIM, TRANSCRIPT_FINAL or SPEECH_END
+        transcript: Transcript text (empty for SPEECH_END)
+        stability: Likelihood that an interim transcript will not change (0-1)
+    """
+    kind: str
+    transcript: str = ""
+    stability: float = 0.0
+
+
+class GoogleStreamingRecognizer:
+    """
+    Streams audio to Speech-to-Text and yields interim and final transcripts.
+
+    Args:
+        client_provider: Coroutine function returning the shared SpeechAsyncClient
+        language_code: Recognition language
+    """
+
+    name = "google"
+
+    def __init__(self, client_provider: Callable[[], Awaitable[Any]], language_code: str = "en-US"):
+        self._client_provider = client_provider
+        self.language_code = language_code
+
+    def _streaming_config(self, first_frame: bytes, options: dict) -> "StreamingRecognitionConfig":
+        encoding = options.get("encoding")
+        sample_rate = options.get("sample_rate")
+        channels = options.get("channels")
+        if not encoding:
+            # Browsers send the container header in the first frame
+            audio_format = probe_audio(first_frame)
+            encoding = audio_format.encoding or "WEBM_OPUS"
+            sample_rate = sample_rate or audio_format.sample_rate or 48000
+            channels = channels or audio_format.channels
+
+        config = speech.RecognitionConfig(
+            encoding=speech.RecognitionConfig.AudioEncoding[encoding],
+            language_code=options.get("language_code") or self.language_code,
+            enable_automatic_punctuation=True,
+        )
+        if sample_rate:
+            config.sample_rate_hertz = int(sample_rate)
+        if channels and channels > 1:
+            config.audio_channel_count = int(channels)
+        return speech.StreamingRecognitionConfig(
+            config=config,
+            interim_results=True,
+            single_utterance=bool(options.get("single_utterance")),
+        )
+
+    async def stream(self, frames: AsyncIterator[bytes], options: dict) -> AsyncIterator[TranscriptEvent]:
+        """
+        Recognizes speech from audio frames as they arrive.
+
+        Args:
+            frames: Audio frames; the stream ends when the iterator does
+            options: Optional 'encoding', 'sample_rate', 'channels',
+                     'language_code' and 'single_utterance' settings; the
+                     format is probed from the first frame if not given
+
+        Yields:
+            TranscriptEvent for each interim result, final result and end of speech
+        """
+        frames = frames.__aiter__()
+        try:
+            first_frame = await frames.__anext__()
+        except StopAsyncIteration:
+            return
+        client = await self._client_provider()
+        await load_in_thread(speech)
+        streaming_config = self._streaming_config(first_frame, options)
+
+        async def requests():
+            yield speech.StreamingRecognizeRequest(streaming_config=streaming_config)
+            yield speech.StreamingRecognizeRequest(audio_content=first_frame)
+            async for frame in frames:
+                yield speech.StreamingRecognizeRequest(audio_content=frame)
+
+        end_of_utterance = speech.StreamingRecognizeResponse.SpeechEventType.END_OF_SINGLE_UTTERANCE
+        responses = await client.streaming_recognize(requests=requests())
+        async for response in responses:
+            if response.error.code:
+                raise RuntimeError(f"Streaming recognition failed: {response.error.message}")
+            if response.speech_event_type == end_of_utterance:
+                yield TranscriptEvent(kind=SPEECH_END)
+            for result in response.results:
+                if not result.alternatives:
+                    continue
+                yield TranscriptEvent(
+                    kind=TRANSCRIPT_FINAL if result.is_final else TRANSCRIPT_INTERIM,
+                    transcript=result.alternatives[0].transcript,
+                    stability=result.stability,
+                )
+
+
+class FakeStreamingRecognizer:
+    """
+    Local stand-in that reveals a canned transcript as audio arrives.
+
+    One word is revealed per bytes_per_word bytes of audio, so replaying a
+    recorded file produces a realistic sequence of interim results followed
+    by a final transcript.
+
+    Args:
+        transcript: Canned transcript (overridable per stream with 'fake_transcript')
+        bytes_per_word: Audio bytes needed to reveal one more word
+        latency: Seconds of simulated recognition latency per result
+    """
+
+    name = "fake"
+
+    def __init__(self, transcript: str, bytes_per_word: int = 4000, latency: float = 0.0):
+        self.transcript = transcript
+        self.bytes_per_word = max(1, bytes_per_word)
+        self.latency = latency
+
+    async def stream(self, frames: AsyncIterator[bytes], options: dict) -> AsyncIterator[TranscriptEvent]:
+        """
+        Yields growing interim transcripts, then the final one when audio ends.
+
+        Args:
+            frames: Audio frames; the stream ends when the iterator does
+            options: Optional 'fake_transcript' and 'single_utterance' settings
+
+        Yields:
+            TranscriptEvent for each interim result, final result and end of speech
+        """
+        words = (options.get("fake_transcript") or self.transcript).split()
+        received = 0
+        revealed = 0
+        async for frame in frames:
+            received += len(frame)
+            count = min(len(words), received // self.bytes_per_word)
+            if count > revealed:
+                revealed = count
+                await asyncio.sleep(self.latency)
+                yield TranscriptEvent(
+                    kind=TRANSCRIPT_INTERIM,
+                    transcript=" ".join(words[:revealed]),
+                    stability=revealed / len(words),
+                )
+            if options.get("single_utterance") and revealed == len(words):
+                yield TranscriptEvent(kind=SPEECH_END)
+                break
+        if received:
+            await asyncio.sleep(self.latency)
+            yield TranscriptEvent(kind=TRANSCRIPT_FINAL, transcript=" ".join(words), stability=1.0)
@@ -0,0 +1,108 @@
+"""
+Server-Sent Events helpers for streaming Gemini output to clients.
+"""
+
+import json
+from typing import Any, Callable, Mapping, Optional
+
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    # Disable proxy buffering so chunks reach the browser as they are produced
+    "X-Accel-Buffering": "no",
+}
+
+
+def format_sse(event: str, data: Any) -> str:
+    """
+    Formats a single Server-Sent Event frame.
+
+    Args:
+        event: Event name (e.g., 'chunk', 'done', 'error')
+        data: JSON-serializable payload
+
+    Returns:
+        SSE frame terminated by a blank line
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def chunk_text(chunk: Any) -> str:
+    """
+    Extracts the text of a streamed Gemini chunk.
+
+    The SDK raises ValueError from .text when a chunk carries no text
+    (e.g., the trailing chunk that only holds usage metadata).
+
+    Args:
+        chunk: A GenerationResponse yielded by a streaming call
+
+    Returns:
+        The chunk's text, or an empty string if it has none
+    """
+    try:
+        return chunk.text or ""
+    except (ValueError, AttributeError, IndexError):
+        return ""
+
+
+def usage_to_dict(usage_metadata: Any) -> Optional[dict]:
+    """
+    Converts Gemini usage metadata into a plain dictionary.
+
+    Args:
+        usage_metadata: The usage_metadata attribute of a GenerationResponse
+
+    Returns:
+        Token counts keyed by name, or None if no usage was reported
+    """
+    if usage_metadata is None:
+        return None
+    return {
+        "prompt_token_count": getattr(usage_metadata, "prompt_token_count", 0),
+        "candidates_token_count": getattr(usage_metadata, "candidates_token_count", 0),
+        "total_token_count": getattr(usage_metadata, "total_token_count", 0),
+    }
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that always runs a cleanup callback once it is done.
+
+    A body generator's own finally block only runs if the generator was
+    started, so a client that disconnects before the first frame is sent
+    would leave whatever the stream holds (a scheduler slot, a model lease,
+    an open upstream stream) held for good. on_close runs however the
+    response ends: completed, disconnected, failed or cancelled.
+
+    Args:
+        content: Async iterator producing the body
+        on_close: Called once the response is finished; must be idempotent
+        headers: Optional response headers
+        media_type: Response media type
+    """
+
+    def __init__(
+        self,
+        content: Any,
+        on_close: Callable[[], None],
+        headers: Optional[Mapping[str, str]] = None,
+        media_type: Optional[str] = None
+    ):
+        super().__init__(content, headers=headers, media_type=media_type)
+        self.on_close = on_close
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            aclose = getattr(self.body_iterator, "aclose", None)
+            try:
+                if aclose is not None:
+                    await aclose()
+            finally:
+                self.on_close()
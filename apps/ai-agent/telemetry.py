@@ -0,0 +1,430 @@
+"""
+Low-overhead metrics and logging for the request hot path.
+
+Counters, gauges and histograms live in process memory and are rendered in
+the Prometheus text exposition format on demand, so recording a sample is a
+dictionary update rather than I/O. Log records are handed to a background
+thread through a queue so a slow stderr never stalls the event loop.
+"""
+
+import bisect
+import functools
+import hashlib
+import inspect
+import logging
+import logging.handlers
+import math
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+# Upper bounds in seconds; wide enough for multi-second Gemini calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Label value used once a LabelLimiter has seen its maximum number of values
+OTHER_LABEL = "other"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """
+    Base class for a named metric with a fixed set of label names.
+
+    Args:
+        name: Metric name (e.g., persona_stage_duration_seconds)
+        documentation: HELP text
+        labelnames: Names of the labels every sample must supply
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        """Returns the metric's exposition lines, including HELP and TYPE."""
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    """Monotonically increasing count, e.g., errors or tokens."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """
+        Adds to the counter.
+
+        Args:
+            amount: Non-negative increment
+            **labels: Label values
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """Returns the current count for the given labels."""
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Metric):
+    """Value that goes up and down, e.g., calls in flight."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """Raises the gauge by amount."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        """Lowers the gauge by amount."""
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        """Sets the gauge to value."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """
+        Reads an unlabelled gauge from a callback at scrape time.
+
+        Args:
+            function: Zero-argument callable returning the current value
+        """
+        self._function = function
+
+    def value(self, **labels) -> float:
+        """Returns the current value for the given labels."""
+        if self._function is not None:
+            return self._function()
+        return self._values.get(self._key(labels), 0)
+
+    @contextmanager
+    def track(self, **labels) -> Iterator[None]:
+        """Holds the gauge one higher for the duration of the block."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        if self._function is not None:
+            lines.append(f"{self.name} {_format_value(self._function())}")
+            return lines
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values in cumulative buckets, e.g., latencies.
+
+    Args:
+        name: Metric name
+        documentation: HELP text
+        labelnames: Label names
+        buckets: Increasing bucket upper bounds; +Inf is added automatically
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (non-cumulative, last is +Inf), sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        """
+        Records one observation.
+
+        Args:
+            value: Observed value (seconds for latencies)
+            **labels: Label values
+        """
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observes the wall-clock duration of the block, even if it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def timed(self, **labels) -> Callable:
+        """
+        Decorator that observes the duration of every call to a function.
+
+        Works for both regular and async functions.
+
+        Args:
+            **labels: Label values for the observations
+        """
+        def decorator(function: Callable) -> Callable:
+            if inspect.iscoroutinefunction(function):
+                @functools.wraps(function)
+                async def async_wrapper(*args, **kwargs):
+                    with self.time(**labels):
+                        return await function(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.time(**labels):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, **labels) -> int:
+        """Returns the number of observations for the given labels."""
+        state = self._values.get(self._key(labels))
+        return sum(state[0]) if state else 0
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            items = sorted((key, (list(state[0]), state[1])) for key, state in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Creates metrics and renders them all for a scrape."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """Registers and returns a Counter."""
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        """Registers and returns a Gauge."""
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        """Registers and returns a Histogram."""
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """
+        Renders every metric in the Prometheus text exposition format (0.0.4).
+
+        Returns:
+            Exposition text ending in a newline
+        """
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class UpstreamTracker:
+    """
+    Records in-flight calls, latency and errors for calls to external services.
+
+    Args:
+        registry: Registry to create the metrics in
+        prefix: Metric name prefix (e.g., 'persona')
+    """
+
+    def __init__(self, registry: MetricsRegistry, prefix: str):
+        self.in_flight = registry.gauge(
+            f"{prefix}_upstream_in_flight", "Calls in progress to each upstream service", ["upstream"]
+        )
+        self.duration = registry.histogram(
+            f"{prefix}_upstream_duration_seconds", "Latency of upstream calls", ["upstream"]
+        )
+        self.errors = registry.counter(
+            f"{prefix}_upstream_errors_total", "Failed upstream calls by error type", ["upstream", "error_type"]
+        )
+
+    @contextmanager
+    def track(self, upstream: str) -> Iterator[None]:
+        """
+        Measures one upstream call made inside the block.
+
+        Exceptions are counted by type and re-raised; cancellation and
+        generator shutdown are not counted as errors.
+
+        Args:
+            upstream: Service name (e.g., 'gemini', 'speech', 'tts')
+        """
+        self.in_flight.inc(upstream=upstream)
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.errors.inc(upstream=upstream, error_type=type(e).__name__)
+            raise
+        finally:
+            self.duration.observe(time.perf_counter() - started, upstream=upstream)
+            self.in_flight.dec(upstream=upstream)
+
+
+class LabelLimiter:
+    """
+    Caps the number of distinct values a label can take.
+
+    Values past the limit are reported as OTHER_LABEL so free-form inputs
+    cannot grow the metrics without bound.
+
+    Args:
+        max_values: Maximum number of distinct values to keep
+    """
+
+    def __init__(self, max_values: int):
+        self.max_values = max_values
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def get(self, value: str) -> str:
+        """Returns value if it is (or can become) one of the tracked values, else OTHER_LABEL."""
+        if value in self._seen:
+            return value
+        with self._lock:
+            if len(self._seen) >= self.max_values:
+                return OTHER_LABEL
+            self._seen.add(value)
+        return value
+
+
+def audience_label(audience_summary: Optional[str], words: int = 4) -> str:
+    """
+    Turns a free-text audience description into a short, stable label.
+
+    The first few words keep the label readable and a short hash keeps
+    audiences that start the same way apart.
+
+    Args:
+        audience_summary: Persona description
+        words: Number of leading words to keep
+
+    Returns:
+        Label such as 'gen-z-urban-runners-3fa9c1', or 'none'
+    """
+    if not audience_summary:
+        return "none"
+    slug = "-".join(re.findall(r"[a-z0-9]+", audience_summary.lower())[:words])[:40]
+    digest = hashlib.sha1(audience_summary.encode()).hexdigest()[:6]
+    return f"{slug}-{digest}" if slug else digest
+
+
+def configure_logging(level: str = "INFO") -> logging.handlers.QueueListener:
+    """
+    Routes root logging through a queue drained by a background thread.
+
+    Callers only enqueue records; formatting and writing to stderr happen
+    off the event loop.
+
+    Args:
+        level: Root log level name
+
+    Returns:
+        The started QueueListener; stop() it on shutdown to flush pending records
+    """
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level.upper())
+    listener.start()
+    return listener
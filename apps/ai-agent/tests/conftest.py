@@ -0,0 +1,46 @@
+"""
+Shared test setup.
+
+The app runs against the in-process fake backends (see backends.py) with
+fast latencies and its on-disk state in a temporary directory, so the
+tests need no Google Cloud project, network or quota.
+
+Run from apps/ai-agent with: python -m pytest tests
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+STATE_DIR = tempfile.mkdtemp(prefix="persona-agent-tests-")
+
+# Must be set before main is imported: the app reads its settings at import time
+os.environ.update({
+    "BACKENDS": "fake",
+    "FAKE_GEMINI_LATENCY": "median_ms=5,p95_ms=10",
+    "FAKE_SPEECH_LATENCY": "median_ms=5,p95_ms=10",
+    "FAKE_TTS_LATENCY": "median_ms=5,p95_ms=10",
+    "FAKE_STORAGE_LATENCY": "median_ms=1,p95_ms=2",
+    "FAKE_GEMINI_CHUNK_MS": "1",
+    "FAKE_GEMINI_REPLY_WORDS": "12",
+    "FAKE_BACKEND_SEED": "7",
+    "WARMUP": "",
+    "QUOTA_STATE_PATH": os.path.join(STATE_DIR, "quota.db"),
+    "JOB_STORE_PATH": os.path.join(STATE_DIR, "jobs.db"),
+    "MEDIA_STORE_DIR": os.path.join(STATE_DIR, "media"),
+    "INGEST_SPOOL_DIR": STATE_DIR,
+})
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    """TestClient with the app's lifespan running."""
+    with TestClient(main.app) as test_client:
+        yield test_client
@@ -0,0 +1,106 @@
+"""
+Tests for request coalescing in caching.SingleFlight.
+"""
+
+import asyncio
+
+from caching import SingleFlight
+
+
+def test_concurrent_callers_share_one_execution():
+    async def scenario():
+        flights = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "answer"
+
+        results = await asyncio.gather(*[flights.do("key", work) for _ in range(5)])
+        return results, calls, flights.stats()
+
+    results, calls, stats = asyncio.run(scenario())
+    assert results == ["answer"] * 5
+    assert len(calls) == 1
+    assert stats == {"in_flight": 0, "coalesced": 4}
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    async def scenario():
+        flights = SingleFlight()
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return "answer"
+
+        leader = asyncio.create_task(flights.do("key", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.do("key", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        return leader, await follower
+
+    leader, result = asyncio.run(scenario())
+    assert leader.cancelled()
+    assert result == "answer"
+
+
+def test_work_is_cancelled_once_every_caller_is_gone():
+    async def scenario():
+        flights = SingleFlight()
+        cancelled = asyncio.Event()
+
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        callers = [asyncio.create_task(flights.do("key", work)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+
+        # A new caller starts fresh work instead of joining the cancelled one
+        async def fresh():
+            return "fresh"
+
+        return await flights.do("key", fresh), flights.stats()
+
+    result, stats = asyncio.run(scenario())
+    assert result == "fresh"
+    assert stats["in_flight"] == 0
+
+
+def test_failure_is_shared_by_every_caller():
+    async def scenario():
+        flights = SingleFlight()
+
+        async def work():
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream failed")
+
+        return await asyncio.gather(*[flights.do("key", work) for _ in range(3)], return_exceptions=True)
+
+    errors = asyncio.run(scenario())
+    assert all(isinstance(error, ValueError) for error in errors)
+
+
+def test_sequential_calls_run_again():
+    async def scenario():
+        flights = SingleFlight()
+        counter = []
+
+        async def work():
+            counter.append(1)
+            return len(counter)
+
+        return [await flights.do("key", work) for _ in range(2)]
+
+    assert asyncio.run(scenario()) == [1, 2]
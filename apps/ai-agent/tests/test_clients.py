@@ -0,0 +1,137 @@
+"""
+Tests for resolving shared clients, SDK modules and persona models off the event loop.
+"""
+
+import asyncio
+import threading
+import time
+
+from clients import ClientRegistry
+from context_cache import PersonaContextCache
+from lazy_imports import lazy_import, load_in_thread
+
+
+async def loop_stalls_during(coro) -> tuple:
+    """Awaits coro while ticking; returns (result, longest gap between ticks in seconds)."""
+    longest = 0.0
+    done = False
+
+    async def ticker() -> None:
+        nonlocal longest
+        last = time.perf_counter()
+        while not done:
+            await asyncio.sleep(0.005)
+            now = time.perf_counter()
+            longest = max(longest, now - last)
+            last = now
+
+    ticking = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)  # let the ticker start before coro runs
+    try:
+        result = await coro
+    finally:
+        done = True
+        await ticking
+    return result, longest
+
+
+def slow_factory():
+    time.sleep(0.2)  # e.g., importing and initializing an SDK
+    return object()
+
+
+def test_aget_creates_clients_in_a_worker_thread():
+    registry = ClientRegistry()
+    registry.register("slow", slow_factory)
+
+    client, stall = asyncio.run(loop_stalls_during(registry.aget("slow")))
+
+    assert stall < 0.1
+    assert asyncio.run(registry.aget("slow")) is client
+    assert registry.stats()["slow"]["created"] == 1
+
+
+def test_aget_waits_for_warm_up_without_blocking():
+    registry = ClientRegistry()
+    registry.register("slow", slow_factory)
+    warming = threading.Thread(target=registry.warm, args=(["slow"],))
+    warming.start()
+    time.sleep(0.02)  # warm-up now holds the registry lock
+
+    client, stall = asyncio.run(loop_stalls_during(registry.aget("slow")))
+    warming.join()
+
+    assert stall < 0.1
+    assert registry.get("slow") is client
+    assert registry.stats()["slow"]["created"] == 1
+
+
+def test_persona_model_is_built_off_the_loop():
+    contexts = PersonaContextCache(
+        model_factory=lambda model_name, text: slow_factory(),
+        cached_model_factory=lambda model_name, text, ttl: (slow_factory(), None),
+        delete_handle=lambda handle: None,
+        enabled=False,
+        min_chars=0,
+        ttl=60
+    )
+
+    async def acquire_twice():
+        first, stall = await loop_stalls_during(contexts.acquire("model", "You are a runner."))
+        second = await contexts.acquire("model", "You are a runner.")
+        return first, second, stall
+
+    first, second, stall = asyncio.run(acquire_twice())
+
+    assert stall < 0.1
+    assert second.model is first.model
+
+
+def test_on_loop_client_is_prepared_in_a_thread_and_built_on_the_loop():
+    registry = ClientRegistry()
+    threads = {}
+
+    def prepare():
+        threads["prepare"] = threading.current_thread()
+        time.sleep(0.2)  # e.g., importing the SDK and fetching credentials
+
+    def factory():
+        threads["factory"] = threading.current_thread()
+        asyncio.get_running_loop()  # gRPC asyncio clients need the running loop
+        return object()
+
+    registry.register("grpc", factory, prepare=prepare, on_loop=True)
+
+    async def resolve():
+        client, stall = await loop_stalls_during(registry.aget("grpc"))
+        return client, stall, await registry.aget("grpc")
+
+    client, stall, again = asyncio.run(resolve())
+
+    assert stall < 0.1
+    assert again is client
+    assert threads["prepare"] is not threading.main_thread()
+    assert threads["factory"] is threading.main_thread()
+    assert registry.stats()["grpc"]["created"] == 1
+
+
+def test_warm_only_prepares_on_loop_clients():
+    registry = ClientRegistry()
+    prepared = []
+    registry.register("grpc", lambda: asyncio.get_running_loop(), prepare=lambda: prepared.append(True), on_loop=True)
+
+    registry.warm(["grpc"])
+
+    assert prepared == [True]
+    assert registry.stats()["grpc"]["open"] is False
+
+
+def test_load_in_thread_imports_off_the_loop(tmp_path, monkeypatch):
+    (tmp_path / "slow_sdk_for_tests.py").write_text("import time\ntime.sleep(0.2)\nVALUE = 42\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    module = lazy_import("slow_sdk_for_tests")
+
+    _, stall = asyncio.run(loop_stalls_during(load_in_thread(module)))
+
+    assert stall < 0.1
+    assert module.loaded and module.VALUE == 42
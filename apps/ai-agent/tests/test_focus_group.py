@@ -0,0 +1,48 @@
+"""
+Tests for the media shared by focus group cells.
+"""
+
+import base64
+import io
+
+from PIL import Image
+
+import main
+from backends import FakeBackends
+from media_store import GCSMediaBackend, MediaStore
+
+
+def png_data_url() -> str:
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 24), (40, 120, 200)).save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def test_creative_image_is_stored_once_and_referenced_with_a_remote_store(client, monkeypatch):
+    storage_client = FakeBackends.from_env({"FAKE_STORAGE_LATENCY": "median_ms=1,p95_ms=2"}).storage_client()
+    store = MediaStore(
+        GCSMediaBackend(lambda: storage_client, bucket_name="media-bucket"),
+        ttl=3600, max_entries=10, max_bytes=10 ** 9
+    )
+    monkeypatch.setattr(main, "media_store", store)
+    image_data = png_data_url()
+
+    async def build_twice():
+        creative = main.FocusGroupCreative(image_data=image_data)
+        return await main.creative_media_parts(creative), await main.creative_media_parts(creative)
+
+    first, second = client.portal.call(build_twice)
+
+    assert store.stats()["entries"] == 1
+    for parts in (first, second):
+        assert len(parts) == 1
+        file_data = parts[0].to_dict()["file_data"]
+        assert file_data["file_uri"].startswith("gs://media-bucket/")
+        assert file_data["mime_type"].startswith("image/")
+
+
+def test_creative_image_is_sent_inline_with_a_local_store(client):
+    parts = client.portal.call(main.creative_media_parts, main.FocusGroupCreative(image_data=png_data_url()))
+
+    assert len(parts) == 1
+    assert parts[0].to_dict()["inline_data"]["mime_type"].startswith("image/")
@@ -0,0 +1,75 @@
+"""
+Tests for token-budgeted conversation prompts in history.HistoryBuilder.
+"""
+
+from types import SimpleNamespace
+
+from history import HistoryBuilder
+
+
+def conversation(label: str, turns: int) -> list:
+    """A conversation whose user turns are generic and whose answers are unique to label."""
+    messages = [SimpleNamespace(sender="user", text="Hi there!")]
+    for index in range(turns):
+        messages.append(SimpleNamespace(sender="agent", text=f"{label} secret answer {index}. " + "word " * 40))
+        messages.append(SimpleNamespace(sender="user", text="Tell me more. " + "word " * 40))
+    return messages
+
+
+def small_builder() -> HistoryBuilder:
+    return HistoryBuilder(token_budget=300, min_recent_messages=4, summary_token_budget=100)
+
+
+def test_stateless_conversations_sharing_an_opening_do_not_share_summaries():
+    builder = small_builder()
+    builder.build("Next?", conversation("PERSONA-A", 10))
+
+    prompt = builder.build("Next?", conversation("PERSONA-B", 10))
+
+    assert "--- Summary of Earlier Conversation ---" in prompt
+    assert "PERSONA-A" not in prompt
+    assert "PERSONA-B" in prompt
+
+
+def test_stateless_summary_is_reused_as_the_conversation_grows():
+    builder = small_builder()
+    history = conversation("PERSONA-A", 12)
+    builder.build("Next?", history[:17])
+
+    prompt = builder.build("Next?", history)
+
+    assert builder.stats()["summary_reuses"] == 1
+    assert prompt == small_builder().build("Next?", history)
+
+
+def test_edited_history_rebuilds_the_summary():
+    builder = small_builder()
+    history = conversation("PERSONA-A", 10)
+    builder.build("Next?", history)
+
+    edited = list(history)
+    edited[3] = SimpleNamespace(sender="agent", text="EDITED answer. " + "word " * 40)
+    prompt = builder.build("Next?", edited + conversation("PERSONA-A", 11)[-2:])
+
+    assert builder.stats()["summary_rebuilds"] == 2
+    assert "PERSONA-A secret answer 1." not in prompt
+
+
+def test_session_summary_is_cached_per_conversation_id():
+    builder = small_builder()
+    history = conversation("PERSONA-A", 12)
+    builder.build("Next?", history[:17], conversation_id="session-1")
+    builder.build("Next?", history, conversation_id="session-1")
+    prompt = builder.build("Next?", conversation("PERSONA-B", 12), conversation_id="session-2")
+
+    assert builder.stats()["summary_reuses"] == 1
+    assert "PERSONA-A" not in prompt
+
+
+def test_short_history_is_kept_verbatim():
+    history = conversation("PERSONA-A", 1)
+    prompt = HistoryBuilder(token_budget=10000).build("Next?", history)
+
+    assert "Summary" not in prompt
+    assert prompt.endswith("User: Next?\nAgent: ")
+    assert all(message.text in prompt for message in history)
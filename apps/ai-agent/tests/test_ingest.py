@@ -0,0 +1,91 @@
+"""
+Tests for the request body cap on upload routes.
+"""
+
+import main
+
+BOUNDARY = b"persona-test-boundary"
+
+
+def multipart_scope(path: str, headers: list) -> dict:
+    """Builds the scope of a multipart POST for calling the ASGI app directly."""
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"content-type", b"multipart/form-data; boundary=" + BOUNDARY),
+            (b"host", b"testserver"),
+            *headers,
+        ],
+        "client": ("testclient", 50000),
+        "server": ("testserver", 80),
+    }
+
+
+def audio_part_chunks(chunk_size: int):
+    """An endless multipart audio part, chunk by chunk."""
+    yield (
+        b"--" + BOUNDARY + b"\r\n"
+        b'Content-Disposition: form-data; name="audio"; filename="a.webm"\r\n'
+        b"Content-Type: audio/webm\r\n\r\n"
+    )
+    while True:
+        yield b"\0" * chunk_size
+
+
+def call_app(client, scope: dict, chunk_size: int) -> tuple:
+    """Runs one request, returning (status, bytes of body received by the app)."""
+    chunks = audio_part_chunks(chunk_size)
+    received = 0
+    sent = []
+
+    async def run() -> None:
+        async def receive() -> dict:
+            nonlocal received
+            body = next(chunks)
+            received += len(body)
+            return {"type": "http.request", "body": body, "more_body": True}
+
+        async def send(message: dict) -> None:
+            sent.append(message)
+
+        await main.app(scope, receive, send)
+
+    client.portal.call(run)
+    return sent[0]["status"], received
+
+
+def test_declared_oversized_body_is_rejected_unread(client):
+    limit = main.AUDIO_UPLOAD_LIMIT.max_bytes + main.FORM_OVERHEAD_BYTES
+    scope = multipart_scope("/speech-to-text", [(b"content-length", str(limit + 1).encode())])
+
+    status, received = call_app(client, scope, 64 * 1024)
+
+    assert status == 413
+    assert received == 0
+
+
+def test_chunked_oversized_body_is_cut_off(client):
+    limit = main.AUDIO_UPLOAD_LIMIT.max_bytes + main.FORM_OVERHEAD_BYTES
+    chunk_size = 256 * 1024
+
+    status, received = call_app(client, multipart_scope("/speech-to-text", []), chunk_size)
+
+    assert status == 413
+    assert limit < received <= limit + chunk_size + 1024
+
+
+def test_upload_within_limit_passes(client):
+    response = client.post(
+        "/media",
+        files={"file": ("clip.mp4", b"\0" * 2048, "video/mp4")},
+    )
+
+    assert response.status_code == 200
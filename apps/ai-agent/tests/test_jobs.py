@@ -0,0 +1,109 @@
+"""
+Tests for job callback delivery and callback URL validation.
+"""
+
+import http.server
+import threading
+
+import pytest
+
+import main
+from jobs import CallbackAddressError, is_public_address, post_callback
+
+
+@pytest.fixture
+def receiver():
+    """Local HTTP server recording POST paths; /redirect answers 302 to /landing."""
+    hits = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            hits.append(self.path)
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path == "/redirect":
+                self.send_response(302)
+                self.send_header("Location", "/landing")
+            else:
+                self.send_response(204)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", hits
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("address, public", [
+    ("8.8.8.8", True),
+    ("2001:4860:4860::8888", True),
+    ("127.0.0.1", False),
+    ("10.1.2.3", False),
+    ("172.16.0.1", False),
+    ("192.168.1.1", False),
+    ("169.254.169.254", False),
+    ("100.64.0.1", False),
+    ("0.0.0.0", False),
+    ("::1", False),
+    ("fe80::1%eth0", False),
+    ("fd00::1", False),
+    ("::ffff:127.0.0.1", False),
+    ("224.0.0.1", False),
+])
+def test_public_addresses(address, public):
+    assert is_public_address(address) is public
+
+
+def test_callback_to_loopback_is_refused(receiver):
+    url, hits = receiver
+
+    with pytest.raises(CallbackAddressError):
+        post_callback(f"{url}/done", {"job_id": "j1"}, timeout=5)
+    assert hits == []
+
+
+def test_callback_redirect_is_not_followed(receiver):
+    url, hits = receiver
+
+    assert post_callback(f"{url}/done", {"job_id": "j1"}, timeout=5, allow_private=True) == 204
+    assert post_callback(f"{url}/redirect", {"job_id": "j1"}, timeout=5, allow_private=True) == 302
+    assert hits == ["/done", "/redirect"]
+
+
+def job_request(callback_url: str) -> dict:
+    return {
+        "user_prompt": "Would you buy this?",
+        "brand_context": "A bike brand",
+        "audience_summary": "Commuters in their thirties",
+        "callback_url": callback_url,
+    }
+
+
+def test_callbacks_are_refused_without_allowed_hosts(client, monkeypatch):
+    monkeypatch.setattr(main, "JOB_CALLBACK_HOSTS", set())
+
+    response = client.post("/chat/jobs", json=job_request("https://hooks.example.com/done"))
+
+    assert response.status_code == 400
+    assert "JOB_CALLBACK_HOSTS" in response.json()["detail"]
+
+
+def test_callback_host_must_be_listed(client, monkeypatch):
+    monkeypatch.setattr(main, "JOB_CALLBACK_HOSTS", {"hooks.example.com"})
+
+    response = client.post("/chat/jobs", json=job_request("https://evil.example.net/done"))
+
+    assert response.status_code == 400
+
+
+def test_listed_host_resolving_to_private_address_is_refused(client, monkeypatch):
+    monkeypatch.setattr(main, "JOB_CALLBACK_HOSTS", {"localhost", "169.254.169.254"})
+
+    for url in ("http://localhost:8080/done", "http://169.254.169.254/latest/meta-data"):
+        response = client.post("/chat/jobs", json=job_request(url))
+        assert response.status_code == 400, url
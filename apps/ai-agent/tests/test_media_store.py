@@ -0,0 +1,61 @@
+"""
+Tests for garbage collection in media_store.MediaStore.
+"""
+
+import asyncio
+import os
+
+from backends import FakeBackends
+from media_store import GCSMediaBackend, LocalMediaBackend, MediaStore
+
+
+def gcs_backend() -> GCSMediaBackend:
+    fakes = FakeBackends.from_env({"FAKE_STORAGE_LATENCY": "median_ms=1,p95_ms=2"})
+    storage_client = fakes.storage_client()
+    return GCSMediaBackend(lambda: storage_client, bucket_name="media-bucket")
+
+
+def test_gcs_collection_only_drops_index_entries():
+    backend = gcs_backend()
+    store = MediaStore(backend, ttl=3600, max_entries=1, max_bytes=10 ** 9)
+
+    async def scenario():
+        first, _ = await store.put(b"first asset", "image/png")
+        await store.put(b"second asset", "image/png")
+        evicted = store.stats()["entries"]
+        # Another instance (or a session) still resolves the evicted id from the bucket
+        return first, evicted, await store.get(first.media_id)
+
+    first, entries_after_eviction, found = asyncio.run(scenario())
+    assert entries_after_eviction == 1
+    assert store.collected >= 1
+    assert backend.stat(first.media_id) is not None
+    assert found is not None and found.uri == first.uri
+
+
+def test_gcs_expired_entry_is_looked_up_again():
+    backend = gcs_backend()
+    store = MediaStore(backend, ttl=0.01, max_entries=10, max_bytes=10 ** 9)
+
+    async def scenario():
+        record, _ = await store.put(b"asset", "video/mp4")
+        await asyncio.sleep(0.02)
+        return record, await store.get(record.media_id)
+
+    record, found = asyncio.run(scenario())
+    assert found is not None and found.media_id == record.media_id
+    assert backend.stat(record.media_id) is not None
+
+
+def test_local_collection_deletes_assets(tmp_path):
+    backend = LocalMediaBackend(str(tmp_path))
+    store = MediaStore(backend, ttl=3600, max_entries=1, max_bytes=10 ** 9)
+
+    async def scenario():
+        first, _ = await store.put(b"first asset", "image/png")
+        await store.put(b"second asset", "image/png")
+        return first, await store.get(first.media_id)
+
+    first, found = asyncio.run(scenario())
+    assert found is None
+    assert not os.path.exists(os.path.join(tmp_path, first.media_id))
@@ -0,0 +1,36 @@
+"""
+Tests for the response cache around routed generations.
+"""
+
+import asyncio
+import itertools
+
+import main
+from response_cache import ResponseCache
+from routing import RouteDecision
+
+
+def test_identical_requests_share_a_key_across_routed_models(client, monkeypatch):
+    monkeypatch.setattr(main, "response_cache", ResponseCache(max_entries=16, ttl=60))
+    # Probe and latency routing send identical requests to different models
+    models = itertools.cycle(["gemini-fast", "gemini-default"])
+    monkeypatch.setattr(
+        main, "route_generation",
+        lambda content_parts, system_instruction, kind: RouteDecision(model=next(models), reason="test")
+    )
+
+    async def generate_three():
+        first = await main.run_generation(["Would you buy this?"], system_instruction="You are a cyclist.")
+        together = await asyncio.gather(*[
+            main.run_generation(["Is it too pricey?"], system_instruction="You are a cyclist.") for _ in range(2)
+        ])
+        again = await main.run_generation(["Would you buy this?"], system_instruction="You are a cyclist.")
+        return first, together, again
+
+    first, together, again = client.portal.call(generate_three)
+
+    assert again.cache_status == "HIT"
+    assert again.text == first.text
+    assert again.model_name == first.model_name
+    assert together[0].text == together[1].text
+    assert main.response_cache.flights.stats()["coalesced"] == 1
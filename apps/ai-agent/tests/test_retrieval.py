@@ -0,0 +1,47 @@
+"""
+Tests for how retrieval shapes the persona/brand system instruction.
+"""
+
+import main
+
+TOPICS = {
+    "pricing": "The price is premium but a discount bundle runs every spring sale.",
+    "packaging": "Every box uses recycled cardboard and the packaging is plastic free.",
+    "social": "Creators post trail runs on TikTok and the community shares videos.",
+}
+
+
+def long_brief(repeats: int = 60) -> str:
+    sections = [f"[{topic}] {text}" for _ in range(repeats) for topic, text in TOPICS.items()]
+    return "\n\n".join(sections)
+
+
+def test_retrieval_trims_preambles_that_are_not_context_cached(monkeypatch):
+    monkeypatch.setattr(main.persona_contexts, "enabled", False)
+    brief = long_brief()
+
+    pricing = main.build_system_instruction("Trail runners", brief, "Is the price fair?")
+    packaging = main.build_system_instruction("Trail runners", brief, "Do you like the recycled box?")
+
+    assert len(pricing) < len(main.build_system_instruction("Trail runners", brief))
+    assert pricing != packaging
+
+
+def test_context_cached_preamble_stays_whole_and_stable(monkeypatch):
+    monkeypatch.setattr(main.persona_contexts, "enabled", True)
+    monkeypatch.setattr(main.persona_contexts, "min_chars", 1000)
+    brief = long_brief()
+    full = main.build_system_instruction("Trail runners", brief)
+
+    for question in ("Is the price fair?", "Do you like the recycled box?", "Would TikTok win you over?"):
+        assert main.build_system_instruction("Trail runners", brief, question) == full
+
+
+def test_short_preamble_below_cache_threshold_still_uses_retrieval(monkeypatch):
+    monkeypatch.setattr(main.persona_contexts, "enabled", True)
+    monkeypatch.setattr(main.persona_contexts, "min_chars", 10_000_000)
+    brief = long_brief()
+
+    trimmed = main.build_system_instruction("Trail runners", brief, "Is the price fair?")
+
+    assert len(trimmed) < len(main.build_system_instruction("Trail runners", brief))
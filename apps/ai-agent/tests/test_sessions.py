@@ -0,0 +1,61 @@
+"""
+Tests for atomic history appends in the session stores.
+"""
+
+import asyncio
+import os
+
+from sessions import MemorySessionStore, Session, SQLiteSessionStore
+
+
+def turn(worker: int, index: int) -> list:
+    return [
+        {"sender": "user", "text": f"question {worker}-{index}"},
+        {"sender": "agent", "text": f"answer {worker}-{index}"},
+    ]
+
+
+def test_sqlite_appends_from_several_workers_keep_every_turn(tmp_path):
+    path = os.path.join(tmp_path, "sessions.db")
+    # Two stores on one file stand in for two worker processes
+    workers = [SQLiteSessionStore(ttl=60, path=path), SQLiteSessionStore(ttl=60, path=path)]
+
+    async def scenario() -> Session:
+        session = Session.new(audience_summary="Runners", brand_context="Shoes")
+        await workers[0].put(session)
+        await asyncio.gather(*[
+            store.append(session.session_id, turn(worker, index), float(index))
+            for index in range(20)
+            for worker, store in enumerate(workers)
+        ])
+        return await workers[1].get(session.session_id)
+
+    session = asyncio.run(scenario())
+    assert len(session.history) == 80
+    for worker in range(2):
+        for index in range(20):
+            position = session.history.index({"sender": "user", "text": f"question {worker}-{index}"})
+            assert session.history[position + 1] == {"sender": "agent", "text": f"answer {worker}-{index}"}
+
+
+def test_append_to_missing_session_returns_false(tmp_path):
+    stores = [MemorySessionStore(ttl=60), SQLiteSessionStore(ttl=60, path=os.path.join(tmp_path, "s.db"))]
+
+    async def scenario() -> list:
+        return [await store.append("missing", turn(0, 0), 0.0) for store in stores]
+
+    assert asyncio.run(scenario()) == [False, False]
+
+
+def test_memory_append_updates_history_and_timestamp():
+    store = MemorySessionStore(ttl=60)
+
+    async def scenario() -> Session:
+        session = Session.new(audience_summary="Runners", brand_context="Shoes")
+        await store.put(session)
+        await asyncio.gather(*[store.append(session.session_id, turn(0, index), 123.0) for index in range(5)])
+        return await store.get(session.session_id)
+
+    session = asyncio.run(scenario())
+    assert len(session.history) == 10
+    assert session.updated_at == 123.0
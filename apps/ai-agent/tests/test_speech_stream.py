@@ -0,0 +1,122 @@
+"""
+Tests for the /speech-to-text/stream WebSocket with the fake recognizer.
+"""
+
+import time
+
+import main
+
+WORD_BYTES = 4000  # STT_FAKE_BYTES_PER_WORD default: one word per frame below
+
+
+def receive_until(websocket, kind: str) -> list:
+    """Receives messages up to and including the first one of the given type."""
+    messages = []
+    while True:
+        message = websocket.receive_json()
+        messages.append(message)
+        if message["type"] == kind:
+            return messages
+
+
+def wait_for_gauge(upstream: str, value: int, timeout: float = 2.0) -> int:
+    """Polls the upstream in-flight gauge until it reaches value or the timeout passes."""
+    deadline = time.monotonic() + timeout
+    while main.upstream.in_flight.value(upstream=upstream) != value and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return main.upstream.in_flight.value(upstream=upstream)
+
+
+def send_words(websocket, count: int) -> None:
+    for _ in range(count):
+        websocket.send_bytes(b"\0" * WORD_BYTES)
+
+
+def test_interim_and_final_transcripts(client):
+    with client.websocket_connect("/speech-to-text/stream") as websocket:
+        assert websocket.receive_json() == {"type": "ready", "recognizer": "fake"}
+        websocket.send_json({"type": "start", "fake_transcript": "too pricey for me"})
+        send_words(websocket, 4)
+        websocket.send_json({"type": "stop"})
+
+        messages = receive_until(websocket, "end_of_utterance")
+
+    interim = [m["transcript"] for m in messages if m["type"] == "interim"]
+    assert interim == ["too", "too pricey", "too pricey for", "too pricey for me"]
+    finals = [m for m in messages if m["type"] == "final"]
+    assert [m["transcript"] for m in finals] == ["too pricey for me"]
+    assert finals[0]["stability"] == 1.0
+    end = messages[-1]
+    assert end["transcript"] == "too pricey for me"
+    assert end["first_result_ms"] is not None
+    assert main.upstream.in_flight.value(upstream="speech_stream") == 0
+
+
+def test_utterances_follow_each_other_on_one_connection(client):
+    with client.websocket_connect("/speech-to-text/stream") as websocket:
+        websocket.receive_json()
+        for transcript in ("first answer", "second answer"):
+            websocket.send_json({"type": "start", "fake_transcript": transcript})
+            send_words(websocket, 2)
+            websocket.send_json({"type": "stop"})
+            assert receive_until(websocket, "end_of_utterance")[-1]["transcript"] == transcript
+
+
+def test_single_utterance_reports_speech_end(client):
+    with client.websocket_connect("/speech-to-text/stream") as websocket:
+        websocket.receive_json()
+        websocket.send_json({"type": "start", "fake_transcript": "sounds good", "single_utterance": True})
+        send_words(websocket, 2)
+
+        messages = receive_until(websocket, "end_of_utterance")
+        websocket.send_json({"type": "stop"})
+
+    kinds = [m["type"] for m in messages]
+    assert "speech_end" in kinds
+    assert kinds.index("speech_end") < kinds.index("final")
+    assert messages[-1]["transcript"] == "sounds good"
+
+
+def test_idle_timeout_ends_the_utterance(client, monkeypatch):
+    monkeypatch.setattr(main, "STT_STREAM_IDLE_TIMEOUT", 0.05)
+    with client.websocket_connect("/speech-to-text/stream") as websocket:
+        websocket.receive_json()
+        websocket.send_json({"type": "start", "fake_transcript": "then it went quiet"})
+        send_words(websocket, 2)
+
+        # No stop message: the utterance ends once the audio stops arriving
+        messages = receive_until(websocket, "end_of_utterance")
+        assert messages[-1]["transcript"] == "then it went quiet"
+
+        # The stop that eventually arrives is taken and the next utterance starts cleanly
+        websocket.send_json({"type": "stop"})
+        websocket.send_json({"type": "start", "fake_transcript": "next one"})
+        send_words(websocket, 2)
+        websocket.send_json({"type": "stop"})
+        assert receive_until(websocket, "end_of_utterance")[-1]["transcript"] == "next one"
+
+
+def test_disconnect_mid_utterance_releases_the_stream(client):
+    with client.websocket_connect("/speech-to-text/stream") as websocket:
+        websocket.receive_json()
+        websocket.send_json({"type": "start", "fake_transcript": "I was about to say"})
+        send_words(websocket, 1)
+        assert websocket.receive_json()["type"] == "interim"
+        # Leaving the block closes the socket; the handler then winds down on the app's loop
+
+    assert wait_for_gauge("speech_stream", 0) == 0
+
+
+def test_unexpected_text_message_is_reported(client):
+    with client.websocket_connect("/speech-to-text/stream") as websocket:
+        websocket.receive_json()
+        websocket.send_text("hello")
+        assert websocket.receive_json() == {"type": "error", "detail": "Expected a start message or audio"}
+
+
+def test_health_reports_the_backend_without_building_the_recognizer(client):
+    before = main.clients.stats()["speech_stream"]
+    health = client.get("/health").json()
+
+    assert health["speech_stream_backend"] == "fake"
+    assert main.clients.stats()["speech_stream"] == before
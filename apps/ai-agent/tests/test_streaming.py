@@ -0,0 +1,119 @@
+"""
+Tests for SSE streaming from /chat.
+"""
+
+import asyncio
+import json
+from contextlib import aclosing
+
+import main
+
+
+def sse_events(body: str) -> list:
+    """Parses an SSE body into (event, data) pairs."""
+    events = []
+    for frame in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in frame.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def chat_body(prompt: str) -> dict:
+    return {
+        "user_prompt": prompt,
+        "audience_summary": "Commuters in their thirties",
+        "brand_context": "A bike brand",
+        "stream": True,
+        "cache_control": "no-store",
+    }
+
+
+def test_stream_relays_chunks_and_releases_slot(client):
+    response = client.post("/chat", json=chat_body("What do you think of the frame?"))
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = sse_events(response.text)
+    assert events[-1][0] == "done"
+    chunks = "".join(data["text"] for event, data in events if event == "chunk")
+    assert chunks == events[-1][1]["agent_response"]
+    assert main.generation_scheduler.active == 0
+
+
+def asgi_request(path: str, body: bytes) -> tuple:
+    """Builds the scope and message list of a JSON POST for calling the ASGI app directly."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"host", b"testserver")],
+        "client": ("testclient", 50000),
+        "server": ("testserver", 80),
+    }
+    return scope, [{"type": "http.request", "body": body, "more_body": False}]
+
+
+def test_disconnect_before_first_frame_releases_slot(client):
+    """A client gone before the body starts must not keep its scheduler slot."""
+    body = json.dumps(chat_body("Would you ride it to work?")).encode()
+    completed = main.generation_scheduler.stats()["completed"]
+    sent = []
+
+    async def dropped_request() -> None:
+        scope, messages = asgi_request("/chat", body)
+
+        async def receive() -> dict:
+            if messages:
+                return messages.pop(0)
+            await asyncio.sleep(0.01)
+            return {"type": "http.disconnect"}
+
+        async def send(message: dict) -> None:
+            sent.append(message)
+            if message["type"] == "http.response.start":
+                # A stalled socket: the client leaves before the headers are written
+                await asyncio.sleep(1)
+
+        await main.app(scope, receive, send)
+
+    for _ in range(3):
+        client.portal.call(dropped_request)
+
+    assert not any(message.get("body") for message in sent)
+    assert main.generation_scheduler.active == 0
+    assert main.generation_scheduler.stats()["completed"] == completed + 3
+    assert main.upstream.in_flight.value(upstream="gemini_stream") == 0
+
+
+def test_abandoned_text_stream_releases_slot_and_lease(client):
+    """generate_text_stream consumers that stop early release what the stream holds."""
+    async def read_first_chunk() -> str:
+        async with aclosing(main.generate_text_stream(["Describe your commute."], "You are a cyclist.")) as stream:
+            async for text in stream:
+                return text
+
+    assert client.portal.call(read_first_chunk)
+    assert main.generation_scheduler.active == 0
+    assert main.persona_contexts.stats()["leased"] == 0
+    assert main.upstream.in_flight.value(upstream="gemini_stream") == 0
+
+
+def test_unconsumed_generation_stream_close_releases_everything(client):
+    async def open_and_close() -> None:
+        decision = main.route_generation(["Hello"], None, main.KIND_STREAM)
+        stream = await main.open_generation_stream(decision, ["Hello"])
+        assert main.generation_scheduler.active == 1
+        stream.close()
+        stream.close()
+        # Let the upstream stream's aclose() run
+        await asyncio.sleep(0)
+
+    client.portal.call(open_and_close)
+    assert main.generation_scheduler.active == 0
+    assert main.upstream.in_flight.value(upstream="gemini_stream") == 0
@@ -0,0 +1,46 @@
+"""
+Tests for sentence-pipelined /text-to-speech/stream.
+"""
+
+import pytest
+
+import main
+
+SENTENCES = [
+    "The trail shoe feels light and the grip is excellent on wet rock.",
+    "I would still wait for a discount before buying a second pair though.",
+    "The recycled packaging is a nice touch that my friends would notice.",
+]
+
+
+def test_stream_returns_every_sentence(client):
+    response = client.post("/text-to-speech/stream", data={"text": " ".join(SENTENCES)})
+
+    assert response.status_code == 200
+    assert response.headers["x-sentence-count"] == str(len(SENTENCES))
+    assert response.content
+
+
+def test_failure_mid_stream_aborts_the_response(client, monkeypatch):
+    synthesize = main.synthesize_speech
+
+    async def failing_synthesize(text: str, language_code: str, voice_name: str) -> bytes:
+        if text == SENTENCES[1]:
+            raise RuntimeError("synthesis unavailable")
+        return await synthesize(text, language_code, voice_name)
+
+    monkeypatch.setattr(main, "synthesize_speech", failing_synthesize)
+    failures = main.TTS_STREAM_FAILURES.value(error_type="RuntimeError")
+
+    # The error propagates out of the response instead of ending it cleanly,
+    # which a real server turns into an aborted connection
+    with pytest.raises(Exception) as raised:
+        client.post("/text-to-speech/stream", data={"text": " ".join(SENTENCES), "voice_id": "en-GB-Neural2-A"})
+    # Starlette's task group may wrap the error in an ExceptionGroup
+    if isinstance(raised.value, BaseExceptionGroup):
+        assert raised.group_contains(RuntimeError, match="synthesis unavailable")
+    else:
+        assert isinstance(raised.value, RuntimeError)
+
+    assert main.TTS_STREAM_FAILURES.value(error_type="RuntimeError") == failures + 1
+    assert "persona_tts_stream_failures_total" in client.get("/metrics").text
@@ -0,0 +1,69 @@
+"""
+Tests for /generate-upload-url(s) against the local fake signer.
+"""
+
+from urllib.parse import urlparse
+
+import main
+from signing import LocalFakeSigner
+
+
+def signer() -> LocalFakeSigner:
+    fake_signer = main.clients.get("signer")
+    assert isinstance(fake_signer, LocalFakeSigner)
+    return fake_signer
+
+
+def test_single_url_verifies_for_its_content_type(client):
+    response = client.post("/generate-upload-url", json={"filename": "ad.mov", "content_type": "video/quicktime"})
+
+    assert response.status_code == 200
+    upload = response.json()
+    assert upload["blob_name"].endswith(".mov")
+    assert upload["gcs_uri"] == f"gs://{main.UPLOAD_BUCKET}/{upload['blob_name']}"
+    assert signer().verify(upload["upload_url"], "video/quicktime")
+    assert not signer().verify(upload["upload_url"], "video/mp4")
+
+
+def test_tampered_url_does_not_verify(client):
+    upload = client.post("/generate-upload-url", json={"filename": "ad.mp4", "content_type": "video/mp4"}).json()
+
+    other_blob = upload["upload_url"].replace(upload["blob_name"], "someone-else.mp4")
+    assert not signer().verify(other_blob, "video/mp4")
+
+
+def test_batch_urls_are_unique_and_in_request_order(client):
+    files = [
+        {"filename": "first.mp4", "content_type": "video/mp4"},
+        {"filename": "second.webm", "content_type": "video/webm"},
+        {"filename": "third", "content_type": "video/mp4"},
+    ]
+    response = client.post("/generate-upload-urls", json={"files": files})
+
+    assert response.status_code == 200
+    uploads = response.json()["uploads"]
+    assert [upload["blob_name"].rsplit(".", 1)[1] for upload in uploads] == ["mp4", "webm", "mp4"]
+    assert len({upload["blob_name"] for upload in uploads}) == 3
+    for file, upload in zip(files, uploads):
+        assert signer().verify(upload["upload_url"], file["content_type"])
+
+
+def test_batch_rejects_empty_and_oversized_requests(client):
+    assert client.post("/generate-upload-urls", json={"files": []}).status_code == 400
+    too_many = [{"filename": f"{i}.mp4", "content_type": "video/mp4"} for i in range(main.MAX_BATCH_UPLOAD_URLS + 1)]
+    assert client.post("/generate-upload-urls", json={"files": too_many}).status_code == 400
+
+
+def test_fake_gcs_accepts_signed_upload(client):
+    upload = client.post("/generate-upload-url", json={"filename": "ad.mp4", "content_type": "video/mp4"}).json()
+    url = urlparse(upload["upload_url"])
+    path = f"{url.path}?{url.query}"
+
+    rejected = client.put(path, content=b"video bytes", headers={"Content-Type": "video/webm"})
+    assert rejected.status_code == 403
+
+    accepted = client.put(path, content=b"video bytes", headers={"Content-Type": "video/mp4"})
+    assert accepted.status_code == 200
+    blob = main.clients.get("storage").bucket(main.UPLOAD_BUCKET).get_blob(upload["blob_name"])
+    assert blob is not None
+    assert blob.download_as_bytes() == b"video bytes"
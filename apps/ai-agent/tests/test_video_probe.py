@@ -0,0 +1,59 @@
+"""
+Tests for MP4 duration probing, including fragmented MP4.
+"""
+
+import io
+import struct
+
+from video_probe import probe_video
+from video_segments import VideoSegment
+
+
+def box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def mvhd(timescale: int, duration: int, version: int = 0) -> bytes:
+    if version == 1:
+        times = struct.pack(">QQIQ", 0, 0, timescale, duration)
+    else:
+        times = struct.pack(">IIII", 0, 0, timescale, duration)
+    return box(b"mvhd", bytes([version, 0, 0, 0]) + times + b"\0" * 80)
+
+
+def mehd(duration: int, version: int = 0) -> bytes:
+    value = struct.pack(">Q" if version == 1 else ">I", duration)
+    return box(b"mehd", bytes([version, 0, 0, 0]) + value)
+
+
+def mp4(*moov_children: bytes, fragments: int = 0) -> io.BytesIO:
+    ftyp = box(b"ftyp", b"isom\0\0\2\0isomiso6mp41")
+    moov = box(b"moov", b"".join(moov_children))
+    # Fragmented files follow the moov with moof/mdat pairs
+    media = b"".join(box(b"moof", b"\0" * 16) + box(b"mdat", b"\0" * 64) for _ in range(fragments))
+    return io.BytesIO(ftyp + moov + media)
+
+
+def test_progressive_mp4_duration():
+    assert probe_video(mp4(mvhd(1000, 42_500))).duration == 42.5
+    assert probe_video(mp4(mvhd(90_000, 90_000 * 3, version=1))).duration == 3.0
+
+
+def test_fragmented_mp4_without_mehd_has_unknown_duration():
+    for duration in (0, 0xFFFFFFFF):
+        result = probe_video(mp4(mvhd(1000, duration), box(b"mvex", b""), fragments=3))
+
+        assert result.container == "mp4"
+        assert result.duration is None
+    assert probe_video(mp4(mvhd(1000, 0xFFFFFFFFFFFFFFFF, version=1), fragments=1)).duration is None
+
+
+def test_fragmented_mp4_duration_from_mehd():
+    assert probe_video(mp4(mvhd(1000, 0), box(b"mvex", mehd(61_000)), fragments=2)).duration == 61.0
+    assert probe_video(mp4(mvhd(600, 0), box(b"mvex", mehd(600 * 12, version=1)), fragments=2)).duration == 12.0
+
+
+def test_segment_of_fragmented_mp4_is_not_rejected():
+    duration = probe_video(mp4(mvhd(1000, 0), fragments=3)).duration
+
+    assert VideoSegment(10.0, 20.0, None).within(duration) == VideoSegment(10.0, 20.0, None)
@@ -0,0 +1,52 @@
+"""
+Tests for /voice conversations started from a session.
+"""
+
+import base64
+import io
+import json
+
+from PIL import Image
+
+import main
+
+
+def png_data_url() -> str:
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 24), (200, 40, 40)).save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def test_voice_session_turn_includes_the_session_image(client, monkeypatch):
+    session = client.post("/sessions", json={
+        "audience_summary": "Commuters in their thirties",
+        "brand_context": "A bike brand",
+        "image_data": png_data_url(),
+    }).json()
+    personas = []
+    voice_persona = main.voice_persona
+
+    async def recording_voice_persona(start: dict):
+        persona = await voice_persona(start)
+        personas.append(persona)
+        return persona
+
+    monkeypatch.setattr(main, "voice_persona", recording_voice_persona)
+
+    with client.websocket_connect("/voice") as websocket:
+        assert websocket.receive_json()["type"] == "ready"
+        websocket.send_json({"type": "start", "session_id": session["session_id"], "fake_transcript": "nice ad"})
+        websocket.send_bytes(b"\0" * 8000)
+        websocket.send_json({"type": "stop"})
+        while True:
+            frame = websocket.receive()
+            if frame.get("text") is None:
+                continue  # a sentence's MP3 audio
+            message = json.loads(frame["text"])
+            assert message["type"] != "error", message
+            if message["type"] == "done":
+                break
+
+    media_parts = personas[0].media_parts
+    assert len(media_parts) == 1
+    assert media_parts[0].to_dict()["inline_data"]["mime_type"].startswith("image/")
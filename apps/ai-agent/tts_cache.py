@@ -0,0 +1,141 @@
+"""
+Content-addressed cache of synthesized speech.
+
+Audio is keyed by a hash of (text, voice, audio config), held in a memory
+LRU tier and an optional on-disk tier, and concurrent identical syntheses
+share one Text-to-Speech call. Because the key fully determines the audio,
+it doubles as a strong ETag for conditional requests.
+"""
+
+import asyncio
+import hashlib
+import json
+from typing import Awaitable, Callable, Optional, Tuple
+
+from caching import DiskCache, SingleFlight, TTLCache
+
+
+def speech_key(text: str, voice_name: str, language_code: str, audio_config: dict) -> str:
+    """
+    Hashes a synthesis request into a cache key.
+
+    Args:
+        text: Text to synthesize
+        voice_name: Voice name (e.g., en-US-Neural2-F)
+        language_code: Voice language code
+        audio_config: Audio settings (encoding, speaking rate, pitch, ...)
+
+    Returns:
+        Hex digest identifying the audio
+    """
+    payload = json.dumps(
+        {"text": text, "voice": voice_name, "language": language_code, "audio": audio_config},
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def etag_for(key: str) -> str:
+    """Returns the strong ETag for a speech cache key."""
+    return f'"{key}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Checks an If-None-Match header against an ETag.
+
+    Args:
+        if_none_match: Header value (may list several tags, or be '*')
+        etag: Current ETag
+
+    Returns:
+        True if the client's copy is current
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+class SpeechCache:
+    """
+    Two-tier (memory, optional disk) cache of synthesized audio.
+
+    Args:
+        max_entries: Size of the in-memory LRU tier
+        ttl: Seconds cached audio stays valid; 0 disables expiry
+        directory: Optional directory for the on-disk tier
+    """
+
+    def __init__(self, max_entries: int, ttl: float, directory: Optional[str] = None):
+        self.ttl = ttl
+        self.memory = TTLCache(max_entries=max_entries, ttl=ttl)
+        self.disk = DiskCache(directory, ttl=ttl) if directory else None
+        self.flights = SingleFlight()
+        self.syntheses = 0
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """
+        Looks audio up in memory, then on disk.
+
+        Args:
+            key: Cache key from speech_key()
+
+        Returns:
+            Cached audio bytes, or None
+        """
+        audio = self.memory.get(key)
+        if audio is not None or self.disk is None:
+            return audio
+
+        audio = await asyncio.to_thread(self.disk.get, key)
+        if audio is not None:
+            # Promote to the memory tier for subsequent hits
+            self.memory.set(key, audio)
+        return audio
+
+    async def get_or_synthesize(
+        self,
+        key: str,
+        synthesize: Callable[[], Awaitable[bytes]]
+    ) -> Tuple[bytes, str]:
+        """
+        Serves audio from cache or synthesizes it, coalescing concurrent misses.
+
+        Args:
+            key: Cache key from speech_key()
+            synthesize: Coroutine function producing the audio on a miss
+
+        Returns:
+            Tuple of (audio bytes, cache status) where status is 'HIT',
+            'MISS' or 'COALESCED'
+        """
+        audio = await self.get(key)
+        if audio is not None:
+            return audio, "HIT"
+
+        leader = False
+
+        async def synthesize_and_store() -> bytes:
+            nonlocal leader
+            leader = True
+            audio = await synthesize()
+            self.syntheses += 1
+            if audio:
+                self.memory.set(key, audio)
+                if self.disk is not None:
+                    await asyncio.to_thread(self.disk.set, key, audio)
+            return audio
+
+        audio = await self.flights.do(key, synthesize_and_store)
+        return audio, "MISS" if leader else "COALESCED"
+
+    def stats(self) -> dict:
+        """Memory, disk and coalescing counters."""
+        return {
+            "syntheses": self.syntheses,
+            "memory": self.memory.stats(),
+            "disk": self.disk.stats() if self.disk else None,
+            "coalescing": self.flights.stats(),
+        }
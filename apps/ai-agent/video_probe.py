@@ -0,0 +1,244 @@
+"""
+Local video container probe.
+
+Reads only the headers of an MP4/QuickTime/3GPP, WebM/Matroska, AVI, FLV,
+MPEG or WMV file to learn its container and, where the header records it,
+its duration. The container sets the MIME type sent to Gemini instead of
+assuming video/mp4, and the duration lets segment offsets be checked before
+any tokens are spent. Files are read through seek() and read(), so an MP4
+whose index sits at the end of the file costs a few small reads, not a
+download of the whole file.
+"""
+
+import logging
+import os
+import struct
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from audio_probe import ebml_elements
+
+
+logger = logging.getLogger(__name__)
+
+
+# Bytes read from the start of the file for every container but MP4
+HEAD_BYTES = 65536
+
+# MP4 major brands that mean QuickTime or 3GPP rather than plain MP4
+QUICKTIME_BRANDS = (b"qt  ",)
+THREE_GPP_BRANDS = (b"3gp", b"3gg", b"3gs")
+# Top-level atoms a QuickTime file may start with when it has no ftyp
+QUICKTIME_ATOMS = (b"moov", b"mdat", b"wide", b"free", b"skip", b"pnot")
+
+# Matroska element ids the probe needs
+MKV_EBML_HEADER = 0x1A45DFA3
+MKV_EBML_DOC_TYPE = 0x4282
+MKV_SEGMENT = 0x18538067
+MKV_INFO = 0x1549A966
+MKV_TIMESTAMP_SCALE = 0x2AD7B1
+MKV_DURATION = 0x4489
+MKV_CLUSTER = 0x1F43B675
+
+ASF_HEADER_GUID = bytes.fromhex("3026b2758e66cf11a6d900aa0062ce6c")
+
+# MIME types use the names Gemini accepts where it lists the container
+CONTAINER_MIME_TYPES = {
+    "mp4": "video/mp4",
+    "mov": "video/quicktime",
+    "3gp": "video/3gpp",
+    "webm": "video/webm",
+    "mkv": "video/x-matroska",
+    "avi": "video/x-msvideo",
+    "flv": "video/x-flv",
+    "mpeg": "video/mpeg",
+    "wmv": "video/wmv",
+}
+
+
+@dataclass
+class VideoFormat:
+    """
+    What the probe learned about a video file.
+
+    Args:
+        container: One of the CONTAINER_MIME_TYPES keys, or 'unknown'
+        duration: Duration in seconds, if the header records it
+    """
+    container: str = "unknown"
+    duration: Optional[float] = None
+
+    @property
+    def mime_type(self) -> Optional[str]:
+        """MIME type for the container, or None if it was not recognised."""
+        return CONTAINER_MIME_TYPES.get(self.container)
+
+
+def _mp4_boxes(fileobj: BinaryIO, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """Yields (box type, payload start, payload end) for boxes between start and end."""
+    pos = start
+    while pos + 8 <= end:
+        fileobj.seek(pos)
+        header = fileobj.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack(">I4s", header)
+        header_size = 8
+        if size == 1:
+            large = fileobj.read(8)
+            if len(large) < 8:
+                return
+            size = struct.unpack(">Q", large)[0]
+            header_size = 16
+        elif size == 0:
+            # The box runs to the end of the file
+            size = end - pos
+        if size < header_size:
+            raise ValueError(f"invalid size for MP4 box {box_type!r}")
+        yield box_type, pos + header_size, min(pos + size, end)
+        pos += size
+
+
+def _mp4_length(header: bytes, offset: int, wide: bool) -> int:
+    """Reads a 32- or 64-bit duration field; all ones means unknown and reads as 0."""
+    value = struct.unpack_from(">Q" if wide else ">I", header, offset)[0]
+    return 0 if value == (0xFFFFFFFFFFFFFFFF if wide else 0xFFFFFFFF) else value
+
+
+def _mp4_duration(fileobj: BinaryIO, start: int, end: int) -> Optional[float]:
+    """
+    Reads the movie duration from the boxes inside a moov box.
+
+    Fragmented MP4 (fMP4, as written by MediaRecorder and DASH/HLS
+    packagers) leaves the mvhd duration at 0, or all ones, because the
+    samples live in later fragments. The total is then taken from the
+    optional mvex/mehd box, and is otherwise unknown.
+    """
+    timescale = 0
+    duration = 0
+    fragment_duration = 0
+    for box_type, payload_start, payload_end in _mp4_boxes(fileobj, start, end):
+        if box_type == b"mvhd":
+            fileobj.seek(payload_start)
+            header = fileobj.read(32)
+            if header[:1] == b"\x01":
+                timescale = struct.unpack_from(">I", header, 20)[0]
+                duration = _mp4_length(header, 24, wide=True)
+            else:
+                timescale = struct.unpack_from(">I", header, 12)[0]
+                duration = _mp4_length(header, 16, wide=False)
+        elif box_type == b"mvex":
+            for child_type, child_start, _ in _mp4_boxes(fileobj, payload_start, payload_end):
+                if child_type == b"mehd":
+                    fileobj.seek(child_start)
+                    header = fileobj.read(12)
+                    fragment_duration = _mp4_length(header, 4, wide=header[:1] == b"\x01")
+    duration = duration or fragment_duration
+    return duration / timescale if timescale and duration else None
+
+
+def _probe_mp4(fileobj: BinaryIO, head: bytes, size: int) -> VideoFormat:
+    result = VideoFormat(container="mp4")
+    if head[4:8] == b"ftyp":
+        brand = head[8:12]
+        if brand in QUICKTIME_BRANDS:
+            result.container = "mov"
+        elif brand.startswith(THREE_GPP_BRANDS):
+            result.container = "3gp"
+    else:
+        result.container = "mov"
+    try:
+        for box_type, payload_start, payload_end in _mp4_boxes(fileobj, 0, size):
+            if box_type == b"moov":
+                result.duration = _mp4_duration(fileobj, payload_start, payload_end)
+                break
+    except (ValueError, struct.error) as e:
+        # The container is still known from the first box
+        logger.info("MP4 duration probe failed: %s", e)
+    return result
+
+
+def _probe_matroska(head: bytes) -> VideoFormat:
+    result = VideoFormat(container="mkv")
+    try:
+        _read_matroska_header(head, result)
+    except (ValueError, struct.error) as e:
+        # Live recordings are often cut short or have no duration at all
+        logger.info("Matroska duration probe failed: %s", e)
+    return result
+
+
+def _read_matroska_header(head: bytes, result: VideoFormat) -> None:
+    """Fills in the document type and duration from a Matroska file's headers."""
+    for element_id, payload_start, payload_end in ebml_elements(head, 0, len(head)):
+        if element_id == MKV_EBML_HEADER:
+            for child_id, child_start, child_end in ebml_elements(head, payload_start, payload_end):
+                if child_id == MKV_EBML_DOC_TYPE and head[child_start:child_end].rstrip(b"\0") == b"webm":
+                    result.container = "webm"
+        elif element_id == MKV_SEGMENT:
+            scale = 1_000_000
+            duration = None
+            for child_id, child_start, child_end in ebml_elements(head, payload_start, payload_end):
+                if child_id == MKV_CLUSTER:
+                    # Media data starts here; the headers are over
+                    break
+                if child_id != MKV_INFO:
+                    continue
+                for info_id, info_start, info_end in ebml_elements(head, child_start, child_end):
+                    payload = head[info_start:info_end]
+                    if info_id == MKV_TIMESTAMP_SCALE:
+                        scale = int.from_bytes(payload, "big") or scale
+                    elif info_id == MKV_DURATION and len(payload) in (4, 8):
+                        duration = struct.unpack(">f" if len(payload) == 4 else ">d", payload)[0]
+                break
+            if duration is not None:
+                # Duration is in units of the timestamp scale, which is in nanoseconds
+                result.duration = duration * scale / 1e9
+            return
+
+
+def _probe_avi(head: bytes) -> VideoFormat:
+    result = VideoFormat(container="avi")
+    # RIFF header, then the hdrl list whose first chunk is the main AVI header
+    if head[12:16] == b"LIST" and head[20:24] == b"hdrl" and head[24:28] == b"avih" and len(head) >= 32 + 20:
+        micro_seconds_per_frame = struct.unpack_from("<I", head, 32)[0]
+        total_frames = struct.unpack_from("<I", head, 48)[0]
+        if micro_seconds_per_frame and total_frames:
+            result.duration = micro_seconds_per_frame * total_frames / 1e6
+    return result
+
+
+def probe_video(fileobj: BinaryIO) -> VideoFormat:
+    """
+    Identifies a video's container and, where recorded, its duration.
+
+    Only the headers are parsed; malformed or unrecognised files return a
+    VideoFormat whose container is 'unknown'.
+
+    Args:
+        fileobj: Seekable binary file positioned anywhere (e.g., an upload's
+                 spool file or a ranged reader over object storage)
+
+    Returns:
+        VideoFormat describing the file
+    """
+    try:
+        size = fileobj.seek(0, os.SEEK_END)
+        fileobj.seek(0)
+        head = fileobj.read(HEAD_BYTES)
+        if head[4:8] == b"ftyp" or head[4:8] in QUICKTIME_ATOMS:
+            return _probe_mp4(fileobj, head, size)
+        if head.startswith(b"\x1a\x45\xdf\xa3"):
+            return _probe_matroska(head)
+        if head.startswith(b"RIFF") and head[8:12] == b"AVI ":
+            return _probe_avi(head)
+        if head.startswith(b"FLV"):
+            return VideoFormat(container="flv")
+        if head.startswith(b"\x00\x00\x01\xba") or (len(head) > 188 and head[0] == 0x47 and head[188] == 0x47):
+            # MPEG program or transport stream
+            return VideoFormat(container="mpeg")
+        if head.startswith(ASF_HEADER_GUID):
+            return VideoFormat(container="wmv")
+    except (ValueError, struct.error, IndexError) as e:
+        logger.info("Video probe failed: %s", e)
+    return VideoFormat()
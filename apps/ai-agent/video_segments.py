@@ -0,0 +1,374 @@
+"""
+Request-level video segments and locally cut clips of them.
+
+A segment narrows a video to [start, end) seconds and can set the frame
+rate Gemini samples it at. Uploaded videos are cut to the segment locally
+with ffmpeg, so only the clip is stored and sent to the model. Clips are
+stored in the media store under an id derived from (source hash, range), so
+a repeat question about the same scene reuses the clip from any instance
+instead of cutting again. Videos that cannot be cut (no ffmpeg, a container
+ffmpeg cannot copy, or a video only known by URI) keep their full length and
+the offsets are sent to Gemini as video metadata instead.
+
+Requires the optional 'ffmpeg' binary; without it no clips are cut.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Callable, Optional, Tuple
+
+from caching import SingleFlight
+from video_probe import VideoFormat
+
+
+logger = logging.getLogger(__name__)
+
+
+# Gemini samples 1 frame per second by default and accepts rates up to this
+MAX_FPS = 24.0
+
+# Cut modes: stream copy from the keyframe at or before start (fast), or re-encode (exact)
+MODE_COPY = "copy"
+MODE_REENCODE = "reencode"
+
+# ffmpeg muxer and MIME type of a stream-copied clip, by source container
+COPY_MUXERS = {
+    "mp4": ("mp4", "video/mp4"),
+    "mov": ("mov", "video/quicktime"),
+    "3gp": ("3gp", "video/3gpp"),
+    "webm": ("webm", "video/webm"),
+}
+REENCODE_MUXER = ("mp4", "video/mp4")
+
+OFFSET_PATTERN = re.compile(r"^(?:(?:(\d+):)?(\d+):)?(\d+(?:\.\d+)?)s?$")
+
+
+def parse_offset(value: Any) -> Optional[float]:
+    """
+    Parses a video offset given as seconds or as [hh:]mm:ss.
+
+    Args:
+        value: Number of seconds, or a string such as '12.5', '90s', '1:30' or '01:02:03.5'
+
+    Returns:
+        Offset in seconds, or None if value is empty
+
+    Raises:
+        ValueError: If value is not a valid offset
+    """
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+    else:
+        match = OFFSET_PATTERN.match(value.strip())
+        if match is None:
+            raise ValueError(f"Invalid video offset: {value!r}")
+        hours, minutes, secs = match.groups()
+        seconds = int(hours or 0) * 3600 + int(minutes or 0) * 60 + float(secs)
+    if seconds < 0:
+        raise ValueError(f"Video offsets cannot be negative: {value!r}")
+    return seconds
+
+
+@dataclass(frozen=True)
+class VideoSegment:
+    """
+    The part of a video a request is about.
+
+    Args:
+        start: Offset in seconds where the segment starts
+        end: Offset in seconds where it ends, or None for the end of the video
+        fps: Frames per second for Gemini to sample, or None for its default
+    """
+    start: float = 0.0
+    end: Optional[float] = None
+    fps: Optional[float] = None
+
+    @property
+    def trimmed(self) -> bool:
+        """Whether the segment is shorter than the whole video."""
+        return self.start > 0 or self.end is not None
+
+    def within(self, duration: Optional[float]) -> "VideoSegment":
+        """
+        Fits the segment to a video of the given length.
+
+        Args:
+            duration: Video duration in seconds, or None if unknown
+
+        Returns:
+            The segment with an end past the video dropped
+
+        Raises:
+            ValueError: If the segment starts after the video ends
+        """
+        if duration is None:
+            return self
+        if self.start >= duration:
+            raise ValueError(f"Video segment starts at {self.start:g}s but the video is {duration:.1f}s long")
+        if self.end is not None and self.end >= duration:
+            return VideoSegment(self.start, None, self.fps)
+        return self
+
+    def describe(self) -> str:
+        """Short form for headers and logs, e.g. '10-25s' or '0-end@0.5fps'."""
+        end = f"{self.end:g}s" if self.end is not None else "end"
+        label = f"{self.start:g}-{end}"
+        return f"{label}@{self.fps:g}fps" if self.fps is not None else label
+
+
+def segment_from_request(start: Any, end: Any, fps: Any) -> Optional[VideoSegment]:
+    """
+    Builds a segment from request fields.
+
+    Args:
+        start: Start offset (see parse_offset), if any
+        end: End offset (see parse_offset), if any
+        fps: Sampling frame rate, if any
+
+    Returns:
+        VideoSegment, or None if no field was set
+
+    Raises:
+        ValueError: If a field is invalid or the end is not after the start
+    """
+    start_seconds = parse_offset(start)
+    end_seconds = parse_offset(end)
+    if fps is not None and not (isinstance(fps, str) and not fps.strip()):
+        try:
+            fps = float(fps)
+        except ValueError:
+            raise ValueError(f"Invalid video frame rate: {fps!r}")
+        if not 0 < fps <= MAX_FPS:
+            raise ValueError(f"Video frame rate must be above 0 and at most {MAX_FPS:g}")
+    else:
+        fps = None
+    if start_seconds is None and end_seconds is None and fps is None:
+        return None
+    start_seconds = start_seconds or 0.0
+    if end_seconds is not None and end_seconds <= start_seconds:
+        raise ValueError("Video segment end must be after its start")
+    return VideoSegment(start_seconds, end_seconds, fps)
+
+
+def segment_media_id(source_id: str, segment: VideoSegment, mode: str) -> str:
+    """
+    Derives the media id a clip of a source video is stored under.
+
+    The frame rate is not part of the id: it only affects how Gemini samples
+    the clip, not the clip itself.
+
+    Args:
+        source_id: Media id (content hash) of the source video
+        segment: Segment the clip covers
+        mode: Cut mode the clip was made with
+
+    Returns:
+        Hex digest identifying the clip
+    """
+    end = f"{segment.end:g}" if segment.end is not None else ""
+    return hashlib.sha256(f"segment\0{source_id}\0{segment.start:g}\0{end}\0{mode}".encode()).hexdigest()
+
+
+@dataclass
+class CutClip:
+    """
+    A clip cut into a temporary file.
+
+    Args:
+        path: Temporary file holding the clip
+        size: Size in bytes
+        mime_type: MIME type of the clip
+    """
+    path: str
+    size: int
+    mime_type: str
+    _file: Optional[BinaryIO] = None
+
+    def open(self) -> BinaryIO:
+        """Opens the clip for reading; discard() closes it."""
+        self._file = open(self.path, "rb")
+        return self._file
+
+    def discard(self) -> None:
+        """Closes and deletes the temporary file."""
+        if self._file is not None:
+            self._file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class SegmentCutter:
+    """
+    Cuts uploaded videos to a segment and keeps the clips in the media store.
+
+    Args:
+        store: MediaStore the clips are kept in
+        enabled: Whether clips are cut at all
+        ffmpeg_path: ffmpeg executable; looked up on PATH if None
+        mode: MODE_COPY or MODE_REENCODE
+        workers: ffmpeg processes allowed to run at once
+        timeout: Seconds one cut may take before it is abandoned
+        spool_dir: Directory for temporary files (system default if None)
+    """
+
+    def __init__(
+        self,
+        store: Any,
+        enabled: bool = True,
+        ffmpeg_path: Optional[str] = None,
+        mode: str = MODE_COPY,
+        workers: int = 2,
+        timeout: float = 120.0,
+        spool_dir: Optional[str] = None
+    ):
+        if mode not in (MODE_COPY, MODE_REENCODE):
+            raise ValueError(f"Unsupported segment cut mode: {mode}")
+        self._store = store
+        self.ffmpeg_path = ffmpeg_path or shutil.which("ffmpeg")
+        self.available = self.ffmpeg_path is not None
+        self.enabled = enabled and self.available
+        if enabled and not self.available:
+            logger.warning("Video segment cutting disabled: ffmpeg was not found")
+        self.mode = mode
+        self.timeout = timeout
+        self.spool_dir = spool_dir
+        self._workers = max(1, workers)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._flights = SingleFlight()
+        self.cut = 0
+        self.reused = 0
+        self.failed = 0
+        self.too_large = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _muxer(self, video_format: VideoFormat) -> Optional[Tuple[str, str]]:
+        if self.mode == MODE_REENCODE:
+            return REENCODE_MUXER
+        return COPY_MUXERS.get(video_format.container)
+
+    def can_cut(self, video_format: VideoFormat, segment: VideoSegment) -> bool:
+        """Whether a clip of this video can be cut locally."""
+        return self.enabled and segment.trimmed and self._muxer(video_format) is not None
+
+    def _cut(self, open_source: Callable[[], BinaryIO], video_format: VideoFormat, segment: VideoSegment) -> CutClip:
+        """Copies the source to a temporary file and runs ffmpeg on it (runs in the worker pool)."""
+        muxer, mime_type = self._muxer(video_format)
+        with tempfile.NamedTemporaryFile(dir=self.spool_dir, suffix=".src") as source:
+            # ffmpeg needs a seekable file: MP4 indexes are often at the end
+            shutil.copyfileobj(open_source(), source)
+            source.flush()
+            fd, out_path = tempfile.mkstemp(dir=self.spool_dir, suffix=f".{muxer}")
+            os.close(fd)
+            command = [self.ffmpeg_path, "-nostdin", "-v", "error", "-y", "-ss", f"{segment.start:.3f}", "-i", source.name]
+            if segment.end is not None:
+                command += ["-t", f"{segment.end - segment.start:.3f}"]
+            command += ["-map", "0:v:0", "-map", "0:a:0?", "-map_metadata", "-1"]
+            if self.mode == MODE_REENCODE:
+                command += ["-c:v", "libx264", "-preset", "veryfast", "-crf", "23", "-c:a", "aac"]
+            else:
+                command += ["-c", "copy", "-avoid_negative_ts", "make_zero"]
+            if muxer in ("mp4", "mov", "3gp"):
+                command += ["-movflags", "+faststart"]
+            command += ["-f", muxer, out_path]
+            try:
+                subprocess.run(command, check=True, capture_output=True, timeout=self.timeout)
+            except BaseException:
+                os.remove(out_path)
+                raise
+        return CutClip(out_path, os.path.getsize(out_path), mime_type)
+
+    async def derive(
+        self,
+        source_id: str,
+        open_source: Callable[[], BinaryIO],
+        source_size: int,
+        video_format: VideoFormat,
+        segment: VideoSegment,
+        max_bytes: Optional[int] = None
+    ) -> Optional[Tuple[Any, bool]]:
+        """
+        Returns the stored clip of a segment, cutting it on first use.
+
+        Concurrent requests for the same clip share one cut. Cuts that fail
+        or produce a clip above max_bytes return None, and the caller sends
+        the whole video with offsets instead.
+
+        Args:
+            source_id: Media id (content hash) of the source video
+            open_source: Returns a binary file object positioned at the start of the source
+            source_size: Size of the source in bytes
+            video_format: Probed format of the source
+            segment: Segment to cut
+            max_bytes: Largest clip worth storing, if limited
+
+        Returns:
+            Tuple of (MediaRecord of the clip, reused), or None if no clip could be made
+        """
+        media_id = segment_media_id(source_id, segment, self.mode)
+        record = await self._store.get(media_id)
+        if record is not None:
+            self.reused += 1
+            return record, True
+
+        async def cut_and_store() -> Optional[Any]:
+            loop = asyncio.get_running_loop()
+            try:
+                clip = await loop.run_in_executor(self._pool(), self._cut, open_source, video_format, segment)
+            except Exception as e:
+                detail = e.stderr.decode(errors="replace").strip() if isinstance(e, subprocess.CalledProcessError) else e
+                logger.info("Cutting video segment %s failed, sending offsets: %s", segment.describe(), detail)
+                self.failed += 1
+                return None
+            try:
+                if max_bytes is not None and clip.size > max_bytes:
+                    self.too_large += 1
+                    return None
+                record, _ = await self._store.put_stream(clip.open, clip.size, clip.mime_type, media_id)
+            finally:
+                await asyncio.to_thread(clip.discard)
+            self.cut += 1
+            self.bytes_in += source_size
+            self.bytes_out += clip.size
+            return record
+
+        record = await self._flights.do(media_id, cut_and_store)
+        return (record, False) if record is not None else None
+
+    def _pool(self) -> ThreadPoolExecutor:
+        """The worker pool, started on first use (and again after close)."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="segment")
+        return self._executor
+
+    def close(self) -> None:
+        """Shuts down the worker pool; a later call starts a fresh one."""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        """Settings and cutting counters."""
+        return {
+            "enabled": self.enabled,
+            "available": self.available,
+            "mode": self.mode,
+            "cut": self.cut,
+            "reused": self.reused,
+            "failed": self.failed,
+            "too_large": self.too_large,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+        }